@@ -3,11 +3,16 @@ import streamlit as st
 from ui_components.navigation import load_user_settings
 from utils.env_loader import load_environment_variables
 from utils.error_handlers import handle_error
+from utils.hierarchy_manager import start_hierarchy_listener
+from utils.prompt_manager import start_database_initialization, start_prompt_cache_listener
 from views.main_page import main_page_app
 from views.statistics_page import usage_statistics_ui
 from views.prompt_management_page import prompt_management_ui
 
 load_environment_variables()
+start_database_initialization()
+start_prompt_cache_listener()
+start_hierarchy_listener()
 
 st.set_page_config(
     page_title="診療情報提供書作成アプリ",
@@ -0,0 +1,171 @@
+import asyncio
+import threading
+import time
+import weakref
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from database.db import (
+    DatabaseManager, database_connection_string, is_sqlite_url, normalize_database_url
+)
+from database.pool_metrics import InstrumentedAsyncQueuePool, instrument_pool
+from database.query_log import instrument_queries
+from database.sqlite_backend import configure_sqlite_connections
+from database.unit_of_work import AsyncUnitOfWork
+from utils.config import (
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE,
+    DB_POOL_PING_IDLE_SECONDS, DB_POOL_SLOW_CHECKOUT_MS, DB_SLOW_QUERY_EXPLAIN_TIMEOUT_MS, DB_STREAM_FETCH_SIZE,
+    DATABASE_REPLICA_URL, DB_REPLICA_POOL_SIZE, DB_REPLICA_MAX_OVERFLOW, DB_REPLICA_POOL_TIMEOUT,
+    DB_SQLITE_BUSY_TIMEOUT_MS
+)
+from utils.exceptions import DatabaseError
+
+# 同期のドライバー名から、同じ接続先を開く非同期のドライバー名へ
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+
+def async_database_url(connection_string):
+    url = make_url(connection_string)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise DatabaseError(f"非同期の接続に対応していないデータベースです: {backend}")
+
+    url = url.set(drivername=ASYNC_DRIVERS[backend])
+    if "sslmode" in url.query:
+        # asyncpg は sslmode ではなく ssl で同じ値を受け取る
+        query = dict(url.query)
+        query["ssl"] = query.pop("sslmode")
+        url = url.set(query=query)
+    return url
+
+
+def create_async_instrumented_engine(connection_string, pool_size, max_overflow, pool_timeout, database="primary"):
+    url = async_database_url(connection_string)
+    if is_sqlite_url(connection_string):
+        engine = create_async_engine(
+            url,
+            poolclass=InstrumentedAsyncQueuePool,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=pool_timeout,
+            connect_args={"timeout": DB_SQLITE_BUSY_TIMEOUT_MS / 1000}
+        )
+        configure_sqlite_connections(engine.sync_engine, DB_SQLITE_BUSY_TIMEOUT_MS)
+    else:
+        engine = create_async_engine(
+            url,
+            poolclass=InstrumentedAsyncQueuePool,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=pool_timeout,
+            pool_recycle=DB_POOL_RECYCLE
+        )
+    instrument_pool(engine.sync_engine, DB_POOL_PING_IDLE_SECONDS, DB_POOL_SLOW_CHECKOUT_MS / 1000)
+    instrument_queries(engine.sync_engine, DatabaseManager.slow_query_log(), database,
+                       DB_SLOW_QUERY_EXPLAIN_TIMEOUT_MS, capture_plans=False)
+    return engine
+
+
+class AsyncDatabaseManager:
+    """DatabaseManager の非同期版。非同期の生成処理の中で、イベントループを止めずにDBを読み書きする
+
+    非同期のエンジンの接続は作成したイベントループでしか使えないため、イベントループごとに1つ作る。
+    レプリカに接続できない状態は DatabaseManager と共有する。
+    """
+
+    _init_lock = threading.Lock()
+    _instances = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def get_instance(cls):
+        loop = asyncio.get_running_loop()
+        instance = cls._instances.get(loop)
+        if instance is None:
+            with cls._init_lock:
+                instance = cls._instances.get(loop)
+                if instance is None:
+                    instance = cls._instances[loop] = AsyncDatabaseManager()
+        return instance
+
+    def __init__(self):
+        connection_string = database_connection_string()
+        try:
+            self._engine = create_async_instrumented_engine(
+                connection_string, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT
+            )
+        except Exception as e:
+            raise DatabaseError(f"非同期のデータベース接続の作成に失敗しました: {str(e)}")
+        self._session_factory = async_sessionmaker(bind=self._engine, expire_on_commit=False)
+
+        self._replica_engine = None
+        self._replica_session_factory = None
+        if DATABASE_REPLICA_URL:
+            self._replica_engine = create_async_instrumented_engine(
+                normalize_database_url(DATABASE_REPLICA_URL), DB_REPLICA_POOL_SIZE, DB_REPLICA_MAX_OVERFLOW,
+                DB_REPLICA_POOL_TIMEOUT, "replica"
+            )
+            self._replica_session_factory = async_sessionmaker(bind=self._replica_engine, expire_on_commit=False)
+
+    def get_engine(self):
+        return self._engine
+
+    def dialect_name(self):
+        return self._engine.dialect.name
+
+    def pool_metrics(self):
+        engines = (("primary", self._engine), ("replica", self._replica_engine))
+        return {name: engine.pool.metrics.snapshot(engine.pool)
+                for name, engine in engines
+                if engine is not None and getattr(engine.pool, "metrics", None) is not None}
+
+    def get_session(self, replica=False):
+        if replica and self._replica_session_factory is not None:
+            return self._replica_session_factory()
+        return self._session_factory()
+
+    def replica_available(self):
+        return self._replica_session_factory is not None and time.monotonic() >= DatabaseManager._replica_retry_at
+
+    @staticmethod
+    def mark_replica_unhealthy(error):
+        DatabaseManager.mark_replica_unhealthy(error)
+
+    async def dispose(self):
+        # イベントループを閉じる前に呼び、接続をすべて閉じる
+        for engine in (self._engine, self._replica_engine):
+            if engine is not None:
+                await engine.dispose()
+
+    def unit_of_work(self, analytic=False):
+        return AsyncUnitOfWork(self, analytic)
+
+    async def execute_query(self, query, params=None, fetch=True, analytic=False):
+        async with self.unit_of_work(analytic) as uow:
+            return await uow.execute_query(query, params, fetch)
+
+    async def query_frame(self, query, params=None, analytic=False):
+        async with self.unit_of_work(analytic) as uow:
+            return await uow.query_frame(query, params)
+
+    async def execute_in_transaction(self, statements):
+        async with self.unit_of_work() as uow:
+            return await uow.execute_in_transaction(statements)
+
+    async def fetch(self, query, params=None, row_type=None, analytic=False):
+        async with self.unit_of_work(analytic) as uow:
+            return await uow.fetch(query, params, row_type)
+
+    async def scalar(self, query, params=None, analytic=False):
+        async with self.unit_of_work(analytic) as uow:
+            return await uow.scalar(query, params)
+
+    async def stream_query(self, query, params=None, batch_size=DB_STREAM_FETCH_SIZE, analytic=False):
+        async with self.unit_of_work(analytic) as uow:
+            async for rows in uow.stream_query(query, params, batch_size):
+                yield rows
+
+    async def stream_frames(self, query, params=None, batch_size=DB_STREAM_FETCH_SIZE, analytic=False):
+        async with self.unit_of_work(analytic) as uow:
+            async for frame in uow.stream_frames(query, params, batch_size):
+                yield frame
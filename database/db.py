@@ -1,67 +1,120 @@
 import os
+import threading
+import time
 
+import pandas as pd
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import QueuePool
 
+from database.pool_metrics import InstrumentedQueuePool, instrument_pool
+from database.query_log import SlowQueryLog, instrument_queries
+from database.sqlite_backend import create_sqlite_engine
+from database.unit_of_work import UnitOfWork, compile_statement, is_connection_error
 from utils.config import (
     POSTGRES_HOST, POSTGRES_PORT, POSTGRES_USER,
     POSTGRES_PASSWORD, POSTGRES_DB, POSTGRES_SSL,
-    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE,
+    DB_POOL_PING_IDLE_SECONDS, DB_POOL_SLOW_CHECKOUT_MS,
+    DB_SLOW_QUERY_MS, DB_SLOW_QUERY_EXPLAIN_SAMPLE_RATE, DB_SLOW_QUERY_EXPLAIN_INTERVAL,
+    DB_SLOW_QUERY_EXPLAIN_TIMEOUT_MS, DB_SLOW_QUERY_TOP_N, DB_STREAM_FETCH_SIZE,
+    DATABASE_REPLICA_URL, DB_REPLICA_POOL_SIZE, DB_REPLICA_MAX_OVERFLOW, DB_REPLICA_POOL_TIMEOUT,
+    DB_REPLICA_RETRY_INTERVAL, DB_SQLITE_BUSY_TIMEOUT_MS
 )
 from utils.exceptions import DatabaseError
 
 
+def is_sqlite_url(database_url):
+    return database_url.startswith("sqlite:")
+
+
+def normalize_database_url(database_url):
+    if is_sqlite_url(database_url):
+        return database_url
+
+    if database_url.startswith("postgres://"):
+        database_url = database_url.replace("postgres://", "postgresql://", 1)
+
+    if "sslmode=" not in database_url:
+        separator = "&" if "?" in database_url else "?"
+        database_url += f"{separator}sslmode=require"
+
+    return database_url
+
+
+def database_connection_string():
+    database_url = os.environ.get("DATABASE_URL")
+
+    if database_url:
+        try:
+            return normalize_database_url(database_url)
+
+        except Exception as e:
+            raise DatabaseError(f"DATABASE_URLの解析に失敗しました: {str(e)}")
+
+    if not all([POSTGRES_HOST, POSTGRES_PORT, POSTGRES_USER, POSTGRES_PASSWORD, POSTGRES_DB]):
+        raise DatabaseError(
+            "PostgreSQL接続情報が設定されていません。環境変数または設定ファイルを確認してください。")
+
+    connection_string = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
+
+    if POSTGRES_SSL:
+        connection_string += f"?sslmode={POSTGRES_SSL}"
+
+    return connection_string
+
+
+def create_instrumented_engine(connection_string, pool_size, max_overflow, pool_timeout, database="primary"):
+    if is_sqlite_url(connection_string):
+        # PostgreSQL のサーバーを置かない1台構成用。ファイル1つに保存する
+        engine = create_sqlite_engine(
+            connection_string, InstrumentedQueuePool, pool_size, max_overflow, pool_timeout,
+            DB_SQLITE_BUSY_TIMEOUT_MS
+        )
+    else:
+        engine = create_engine(
+            connection_string,
+            poolclass=InstrumentedQueuePool,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=pool_timeout,
+            pool_recycle=DB_POOL_RECYCLE
+        )
+    instrument_pool(engine, DB_POOL_PING_IDLE_SECONDS, DB_POOL_SLOW_CHECKOUT_MS / 1000)
+    instrument_queries(engine, DatabaseManager.slow_query_log(), database, DB_SLOW_QUERY_EXPLAIN_TIMEOUT_MS)
+    return engine
+
+
 class DatabaseManager:
+    # 画面のスレッドと書き込みスレッドが同時に初めて呼び出しても、エンジンを1つだけ作る
+    _init_lock = threading.RLock()
     _instance = None
     _engine = None
     _session_factory = None
+    _replica_engine = None
+    _replica_session_factory = None
+    _slow_query_log = None
+    # レプリカに接続できなかった場合に、この時刻 (time.monotonic) までは主DBだけを使う
+    _replica_retry_at = 0.0
 
     @classmethod
     def get_instance(cls):
         if cls._instance is None:
-            cls._instance = DatabaseManager()
+            with cls._init_lock:
+                if cls._instance is None:
+                    cls._instance = DatabaseManager()
         return cls._instance
 
     def __init__(self):
-        if DatabaseManager._engine is not None:
-            return
-
-        database_url = os.environ.get("DATABASE_URL")
-
-        if database_url:
-            try:
-                if database_url.startswith("postgres://"):
-                    database_url = database_url.replace("postgres://", "postgresql://", 1)
-
-                if "?" in database_url:
-                    database_url += "&sslmode=require"
-                else:
-                    database_url += "?sslmode=require"
-
-                connection_string = database_url
-
-            except Exception as e:
-                raise DatabaseError(f"DATABASE_URLの解析に失敗しました: {str(e)}")
-        else:
-            if not all([POSTGRES_HOST, POSTGRES_PORT, POSTGRES_USER, POSTGRES_PASSWORD, POSTGRES_DB]):
-                raise DatabaseError(
-                    "PostgreSQL接続情報が設定されていません。環境変数または設定ファイルを確認してください。")
-
-            connection_string = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
+        with DatabaseManager._init_lock:
+            if DatabaseManager._engine is None:
+                self._init_engines()
 
-            if POSTGRES_SSL:
-                connection_string += f"?sslmode={POSTGRES_SSL}"
+    def _init_engines(self):
+        connection_string = database_connection_string()
 
         try:
-            DatabaseManager._engine = create_engine(
-                connection_string,
-                poolclass=QueuePool,
-                pool_pre_ping=True,
-                pool_size=DB_POOL_SIZE,
-                max_overflow=DB_MAX_OVERFLOW,
-                pool_timeout=DB_POOL_TIMEOUT,
-                pool_recycle=DB_POOL_RECYCLE
+            DatabaseManager._engine = create_instrumented_engine(
+                connection_string, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT
             )
 
             DatabaseManager._session_factory = sessionmaker(bind=DatabaseManager._engine)
@@ -72,20 +125,104 @@ class DatabaseManager:
         except Exception as e:
             raise DatabaseError(f"PostgreSQLへの接続に失敗しました: {str(e)}")
 
+        if DATABASE_REPLICA_URL:
+            DatabaseManager._init_replica(normalize_database_url(DATABASE_REPLICA_URL))
+
+    @staticmethod
+    def _init_replica(connection_string):
+        # 統計画面などの重い読み取り用。主DBとは別のプールにして、書き込みや設定の読み取りを待たせない
+        try:
+            DatabaseManager._replica_engine = create_instrumented_engine(
+                connection_string, DB_REPLICA_POOL_SIZE, DB_REPLICA_MAX_OVERFLOW, DB_REPLICA_POOL_TIMEOUT, "replica"
+            )
+            DatabaseManager._replica_session_factory = sessionmaker(bind=DatabaseManager._replica_engine)
+
+            with DatabaseManager._replica_engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+        except Exception as e:
+            # レプリカに接続できなくても起動は続け、主DBで読み取る
+            DatabaseManager.mark_replica_unhealthy(e)
+
     @staticmethod
     def get_engine():
         return DatabaseManager._engine
 
     @staticmethod
-    def get_session():
+    def dialect_name():
+        # "postgresql" または "sqlite"。リポジトリは方言ごとのSQLを選ぶのに使う
+        return DatabaseManager._engine.dialect.name
+
+    @staticmethod
+    def pool_metrics():
+        # 接続プールごとの利用状況。プールの枯渇で DB_POOL_TIMEOUT に達する前に兆候を見るために使う
+        engines = (("primary", DatabaseManager._engine), ("replica", DatabaseManager._replica_engine))
+        return {name: engine.pool.metrics.snapshot(engine.pool)
+                for name, engine in engines
+                if engine is not None and getattr(engine.pool, "metrics", None) is not None}
+
+    @staticmethod
+    def slow_query_log():
+        # 主DB・レプリカの両方の文を、接続先と値を除いたSQLごとに集計する
+        with DatabaseManager._init_lock:
+            if DatabaseManager._slow_query_log is None:
+                DatabaseManager._slow_query_log = SlowQueryLog(
+                    DB_SLOW_QUERY_MS / 1000, DB_SLOW_QUERY_EXPLAIN_SAMPLE_RATE, DB_SLOW_QUERY_EXPLAIN_INTERVAL
+                )
+            return DatabaseManager._slow_query_log
+
+    @staticmethod
+    def slow_queries(limit=DB_SLOW_QUERY_TOP_N, order_by="total_ms"):
+        return DatabaseManager.slow_query_log().top(limit, order_by)
+
+    @staticmethod
+    def get_session(replica=False):
+        if replica and DatabaseManager._replica_session_factory is not None:
+            return DatabaseManager._replica_session_factory()
         if DatabaseManager._session_factory is None:
             raise DatabaseError("データベース接続が初期化されていません")
         return DatabaseManager._session_factory()
 
-    def execute_query(self, query, params=None, fetch=True):
-        session = self.get_session()
+    @staticmethod
+    def replica_available():
+        return (DatabaseManager._replica_session_factory is not None
+                and time.monotonic() >= DatabaseManager._replica_retry_at)
+
+    @staticmethod
+    def mark_replica_unhealthy(error):
+        DatabaseManager._replica_retry_at = time.monotonic() + DB_REPLICA_RETRY_INTERVAL
+        print(f"レプリカに接続できないため、{DB_REPLICA_RETRY_INTERVAL}秒間は主DBで読み取ります: {str(error)}")
+
+    def _run_session(self, work, analytic=False):
+        # analytic=True の読み取りはレプリカで実行し、レプリカに接続できない場合は主DBで実行し直す
+        if analytic and self.replica_available():
+            try:
+                return work(self.get_session(replica=True))
+            except DatabaseError as e:
+                if not is_connection_error(e.__cause__):
+                    raise
+                self.mark_replica_unhealthy(e.__cause__)
+        return work(self.get_session())
+
+    def get_dedicated_connection(self):
+        # LISTEN用にプールから切り離した専用接続を返す
+        connection = self.get_engine().raw_connection()
+        dbapi_connection = connection.driver_connection
+        connection.detach()
+        dbapi_connection.autocommit = True
+        return dbapi_connection
+
+    def unit_of_work(self, analytic=False):
+        # with の中の文を1つの接続・1つのトランザクションで実行する
+        return UnitOfWork(self, analytic)
+
+    def execute_query(self, query, params=None, fetch=True, analytic=False):
+        # analytic=True は統計画面・出力などの重い読み取り。レプリカがあればレプリカで実行する
+        return self._run_session(lambda session: self._execute_query(session, query, params, fetch), analytic)
+
+    @staticmethod
+    def _execute_query(session, query, params, fetch):
         try:
-            result = session.execute(text(query), params or {})
+            result = session.execute(compile_statement(query), params or {})
             if fetch:
                 data = []
                 for row in result:
@@ -97,10 +234,53 @@ class DatabaseManager:
             return None
         except Exception as e:
             session.rollback()
-            raise DatabaseError(f"クエリ実行中にエラーが発生しました: {str(e)}")
+            raise DatabaseError(f"クエリ実行中にエラーが発生しました: {str(e)}") from e
         finally:
             session.close()
 
+    def query_frame(self, query, params=None, analytic=False):
+        return self._run_session(lambda session: self._query_frame(session, query, params), analytic)
+
+    @staticmethod
+    def _query_frame(session, query, params):
+        # 行ごとに辞書を作らず、結果をそのまま列形式の DataFrame にする
+        try:
+            result = session.execute(compile_statement(query), params or {})
+            frame = pd.DataFrame.from_records(result.fetchall(), columns=list(result.keys()))
+            session.commit()
+            return frame
+        except Exception as e:
+            session.rollback()
+            raise DatabaseError(f"クエリ実行中にエラーが発生しました: {str(e)}") from e
+        finally:
+            session.close()
+
+    def stream_query(self, query, params=None, batch_size=DB_STREAM_FETCH_SIZE, analytic=False):
+        # 出力・アーカイブなど件数の多い読み取り用。読み終えるか途中でやめるまで1つの接続を使い続ける
+        with self.unit_of_work(analytic) as uow:
+            yield from uow.stream_query(query, params, batch_size)
+
+    def stream_frames(self, query, params=None, batch_size=DB_STREAM_FETCH_SIZE, analytic=False):
+        with self.unit_of_work(analytic) as uow:
+            yield from uow.stream_frames(query, params, batch_size)
+
+    def execute_in_transaction(self, statements):
+        # (query, params) の組を1トランザクションで順に実行し、文ごとの結果行を返す
+        with self.unit_of_work() as uow:
+            return uow.execute_in_transaction(statements)
+
+    def fetch(self, query, params=None, row_type=None, analytic=False):
+        with self.unit_of_work(analytic) as uow:
+            return uow.fetch(query, params, row_type)
+
+    def scalar(self, query, params=None, analytic=False):
+        with self.unit_of_work(analytic) as uow:
+            return uow.scalar(query, params)
+
+
+def is_sqlite(db_manager):
+    return db_manager.dialect_name() == "sqlite"
+
 
 def get_usage_collection():
     try:
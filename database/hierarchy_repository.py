@@ -0,0 +1,200 @@
+from database.db import DatabaseManager, is_sqlite
+from database.sqlite_backend import SET_METADATA_SQL, current_value_sql, next_value_sql
+
+HIERARCHY_CHANNEL = "hierarchy_changed"
+
+HIERARCHY_SEED_VERSION_KEY = "hierarchy_seed_version"
+
+LOAD_ALL_SQL = """
+    SELECT v.version AS hierarchy_version, h.kind, h.department, h.name, h.purpose
+    FROM (SELECT CASE WHEN is_called THEN last_value ELSE 0 END AS version FROM hierarchy_version_seq) v
+    LEFT JOIN (
+        SELECT 'department' AS kind, NULL AS department, name, NULL AS purpose, display_order
+        FROM departments
+        UNION ALL
+        SELECT 'doctor', department, name, NULL, display_order
+        FROM doctors
+        UNION ALL
+        SELECT 'document_type', NULL, name, purpose, display_order
+        FROM document_types
+    ) h ON TRUE
+    ORDER BY h.kind, h.department, h.name <> 'default', h.display_order, h.name
+"""
+
+VERSION_SQL = "SELECT CASE WHEN is_called THEN last_value ELSE 0 END AS version FROM hierarchy_version_seq"
+
+# 診療科・医師・文書名を1文で登録する。既存の行は並び順を保ったまま残し、新しい行は末尾に追加する
+# 診療科には必ず医師共通 (default) の行を作る
+IMPORT_SQL = """
+    WITH input AS (
+        SELECT department, doctor, ord
+        FROM unnest(CAST(:departments AS TEXT[]), CAST(:doctors AS TEXT[]))
+             WITH ORDINALITY AS i(department, doctor, ord)
+    ),
+    department_input AS (
+        SELECT department, MIN(ord) AS ord
+        FROM input
+        GROUP BY department
+    ),
+    new_departments AS (
+        INSERT INTO departments (name, display_order)
+        SELECT department, (SELECT COALESCE(MAX(display_order), 0) FROM departments) + ord
+        FROM department_input
+        ON CONFLICT (name) DO NOTHING
+        RETURNING name
+    ),
+    doctor_input AS (
+        SELECT DISTINCT ON (department, doctor) department, doctor, ord
+        FROM (
+            SELECT department, 'default' AS doctor, 0 AS ord FROM department_input
+            UNION ALL
+            SELECT department, doctor, ord FROM input
+        ) d
+        ORDER BY department, doctor, ord
+    ),
+    new_doctors AS (
+        INSERT INTO doctors (department, name, display_order)
+        SELECT department, doctor,
+               CASE WHEN doctor = 'default' THEN 0
+                    ELSE (SELECT COALESCE(MAX(display_order), 0) FROM doctors) + ord
+               END
+        FROM doctor_input
+        ON CONFLICT (department, name) DO NOTHING
+        RETURNING name
+    ),
+    new_document_types AS (
+        INSERT INTO document_types AS t (name, purpose, display_order)
+        SELECT name, purpose, (SELECT COALESCE(MAX(display_order), 0) FROM document_types) + ord
+        FROM unnest(CAST(:document_types AS TEXT[]), CAST(:purposes AS TEXT[]))
+             WITH ORDINALITY AS i(name, purpose, ord)
+        ON CONFLICT (name) DO UPDATE
+        SET purpose = EXCLUDED.purpose,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE EXCLUDED.purpose IS NOT NULL AND t.purpose IS DISTINCT FROM EXCLUDED.purpose
+        RETURNING name
+    ),
+    marker AS (
+        INSERT INTO app_metadata (key, value)
+        SELECT :seed_version_key, CAST(:seed_version AS TEXT)
+        WHERE CAST(:seed_version AS TEXT) IS NOT NULL
+        ON CONFLICT (key) DO UPDATE
+        SET value = EXCLUDED.value,
+            updated_at = CURRENT_TIMESTAMP
+    ),
+    changes AS (
+        SELECT (SELECT COUNT(*) FROM new_departments)
+             + (SELECT COUNT(*) FROM new_doctors)
+             + (SELECT COUNT(*) FROM new_document_types) AS changed
+    )
+    SELECT c.changed, n.version
+    FROM changes c
+    LEFT JOIN LATERAL (
+        SELECT v.version, pg_notify(:channel, v.version::TEXT)
+        FROM (SELECT nextval('hierarchy_version_seq') AS version) v
+        WHERE c.changed > 0
+    ) n ON TRUE
+"""
+
+SEED_VERSION_SQL = "SELECT value FROM app_metadata WHERE key = :seed_version_key"
+
+# SQLite 用。登録は行ごとの文に分け、同じトランザクションで順に実行する
+SQLITE_VERSION_SQL = current_value_sql("hierarchy_version_seq")
+
+SQLITE_NEXT_VERSION_SQL = next_value_sql("hierarchy_version_seq")
+
+SQLITE_LOAD_ALL_SQL = LOAD_ALL_SQL.replace(f"({VERSION_SQL})", f"({SQLITE_VERSION_SQL})")
+
+SQLITE_MAX_ORDER_SQL = """
+    SELECT (SELECT COALESCE(MAX(display_order), 0) FROM departments) AS departments,
+           (SELECT COALESCE(MAX(display_order), 0) FROM doctors) AS doctors,
+           (SELECT COALESCE(MAX(display_order), 0) FROM document_types) AS document_types
+"""
+
+SQLITE_INSERT_DEPARTMENT_SQL = """
+    INSERT INTO departments (name, display_order) VALUES (:name, :display_order)
+    ON CONFLICT (name) DO NOTHING
+    RETURNING name
+"""
+
+SQLITE_INSERT_DOCTOR_SQL = """
+    INSERT INTO doctors (department, name, display_order) VALUES (:department, :name, :display_order)
+    ON CONFLICT (department, name) DO NOTHING
+    RETURNING name
+"""
+
+SQLITE_UPSERT_DOCUMENT_TYPE_SQL = """
+    INSERT INTO document_types AS t (name, purpose, display_order) VALUES (:name, :purpose, :display_order)
+    ON CONFLICT (name) DO UPDATE
+    SET purpose = excluded.purpose,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE excluded.purpose IS NOT NULL AND t.purpose IS NOT excluded.purpose
+    RETURNING name
+"""
+
+
+class HierarchyRepository:
+    def __init__(self, db_manager=None):
+        self.db_manager = db_manager or DatabaseManager.get_instance()
+        self.sqlite = is_sqlite(self.db_manager)
+
+    def load_all(self):
+        rows = self.db_manager.execute_query(SQLITE_LOAD_ALL_SQL if self.sqlite else LOAD_ALL_SQL)
+        version = rows[0]["hierarchy_version"] if rows else 0
+        return version, [row for row in rows if row.get("kind") is not None]
+
+    def current_version(self):
+        rows = self.db_manager.execute_query(SQLITE_VERSION_SQL if self.sqlite else VERSION_SQL)
+        return rows[0]["version"] if rows else 0
+
+    def bulk_import(self, doctors=(), document_types=(), seed_version=None):
+        # doctors は (診療科, 医師名)、document_types は (文書名, 紹介目的) の組
+        doctors = list(doctors)
+        document_types = list(document_types)
+        if self.sqlite:
+            return self._bulk_import_sqlite(doctors, document_types, seed_version)
+        rows = self.db_manager.execute_query(IMPORT_SQL, {
+            "channel": HIERARCHY_CHANNEL,
+            "departments": [department for department, _ in doctors],
+            "doctors": [doctor for _, doctor in doctors],
+            "document_types": [name for name, _ in document_types],
+            "purposes": [purpose for _, purpose in document_types],
+            "seed_version_key": HIERARCHY_SEED_VERSION_KEY,
+            "seed_version": seed_version
+        })
+        return rows[0]["changed"] if rows else 0
+
+    def _bulk_import_sqlite(self, doctors, document_types, seed_version):
+        # IMPORT_SQL と同じ並び順になるよう、既存の最大値に入力での順番 (1始まり) を足す
+        department_orders = {}
+        doctor_orders = {}
+        for position, (department, doctor) in enumerate(doctors, start=1):
+            department_orders.setdefault(department, position)
+            doctor_orders.setdefault((department, "default"), 0)
+            doctor_orders.setdefault((department, doctor), position)
+
+        with self.db_manager.unit_of_work() as uow:
+            base = uow.execute_query(SQLITE_MAX_ORDER_SQL)[0]
+            changed = 0
+            for department, position in department_orders.items():
+                changed += len(uow.execute_query(SQLITE_INSERT_DEPARTMENT_SQL, {
+                    "name": department, "display_order": base["departments"] + position
+                }))
+            for (department, doctor), position in doctor_orders.items():
+                changed += len(uow.execute_query(SQLITE_INSERT_DOCTOR_SQL, {
+                    "department": department, "name": doctor,
+                    "display_order": 0 if doctor == "default" else base["doctors"] + position
+                }))
+            for position, (name, purpose) in enumerate(document_types, start=1):
+                changed += len(uow.execute_query(SQLITE_UPSERT_DOCUMENT_TYPE_SQL, {
+                    "name": name, "purpose": purpose, "display_order": base["document_types"] + position
+                }))
+            if seed_version is not None:
+                uow.execute_query(SET_METADATA_SQL, {"key": HIERARCHY_SEED_VERSION_KEY, "value": seed_version},
+                                  fetch=False)
+            if changed:
+                uow.execute_query(SQLITE_NEXT_VERSION_SQL)
+        return changed
+
+    def get_seed_version(self):
+        rows = self.db_manager.execute_query(SEED_VERSION_SQL, {"seed_version_key": HIERARCHY_SEED_VERSION_KEY})
+        return rows[0]["value"] if rows else None
@@ -0,0 +1,123 @@
+import select
+import threading
+
+from database.db import DatabaseManager, is_sqlite
+from utils.config import DB_NOTIFY_POLL_INTERVAL
+
+SELECT_TIMEOUT = 5
+
+
+class NotificationListener:
+    def __init__(self, poll_interval=30, heartbeat_interval=60):
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self._handlers = {}
+        self._version_checks = []
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._connection = None
+
+    def subscribe(self, channel, handler, version_check=None):
+        with self._lock:
+            self._handlers.setdefault(channel, []).append(handler)
+            if version_check is not None:
+                self._version_checks.append(version_check)
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name="db-notification-listener", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop_event.set()
+        self._close_connection()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def is_connected(self):
+        return self._connection is not None
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                # SQLite には通知がないため、バージョン確認だけで変更を反映する
+                if not is_sqlite(DatabaseManager.get_instance()):
+                    self._listen()
+            except Exception as e:
+                print(f"通知リスナーの接続が切断されました: {str(e)}")
+            finally:
+                self._close_connection()
+
+            # 接続が切れている間はバージョン確認で変更を取りこぼさないようにする
+            self._run_version_checks()
+            self._stop_event.wait(self.poll_interval)
+
+    def _listen(self):
+        connection = DatabaseManager.get_instance().get_dedicated_connection()
+        self._connection = connection
+        cursor = connection.cursor()
+        listening = set()
+
+        idle_seconds = 0
+        while not self._stop_event.is_set():
+            # 起動後に追加された購読も同じ接続で受信する
+            channels = [channel for channel in list(self._handlers) if channel not in listening]
+            if channels:
+                for channel in channels:
+                    cursor.execute(f"LISTEN {channel}")
+                    listening.add(channel)
+                # LISTEN開始前に発生した変更を反映する
+                self._run_version_checks()
+
+            readable, _, _ = select.select([connection], [], [], SELECT_TIMEOUT)
+            if not readable:
+                idle_seconds += SELECT_TIMEOUT
+                if idle_seconds >= self.heartbeat_interval:
+                    cursor.execute("SELECT 1")
+                    idle_seconds = 0
+                continue
+
+            idle_seconds = 0
+            connection.poll()
+            while connection.notifies:
+                notification = connection.notifies.pop(0)
+                self._dispatch(notification.channel, notification.payload)
+
+    def _dispatch(self, channel, payload):
+        for handler in self._handlers.get(channel, []):
+            try:
+                handler(payload)
+            except Exception as e:
+                print(f"通知の処理中にエラーが発生しました ({channel}): {str(e)}")
+
+    def _run_version_checks(self):
+        for version_check in list(self._version_checks):
+            try:
+                version_check()
+            except Exception as e:
+                print(f"バージョン確認中にエラーが発生しました: {str(e)}")
+
+    def _close_connection(self):
+        connection = self._connection
+        self._connection = None
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def get_notification_listener():
+    global _listener
+    with _listener_lock:
+        if _listener is None:
+            _listener = NotificationListener(poll_interval=DB_NOTIFY_POLL_INTERVAL)
+        return _listener
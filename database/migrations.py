@@ -0,0 +1,290 @@
+from sqlalchemy import text
+
+from utils.model_catalog import model_family_sql
+
+# 同時に起動した複数のプロセスが同じマイグレーションを重ねて実行しないためのロックキー
+MIGRATION_LOCK_ID = 8_250_610
+
+SCHEMA_VERSION_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description VARCHAR(200) NOT NULL,
+        applied_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+MIGRATION_LOCK_SQL = "SELECT pg_advisory_xact_lock(:lock_id)"
+
+CURRENT_VERSION_SQL = "SELECT COALESCE(MAX(version), 0) AS version FROM schema_version"
+
+RECORD_VERSION_SQL = "INSERT INTO schema_version (version, description) VALUES (:version, :description)"
+
+# 統計画面の絞り込みに使う summary_usage のインデックス。パーティション化の際にも作り直す
+USAGE_INDEX_SQL = [
+    # 期間の絞り込みと日付順の一覧。集計に使う列を含め、表を読まずに集計できるようにする
+    """
+    CREATE INDEX IF NOT EXISTS summary_usage_date_idx ON summary_usage (date)
+    INCLUDE (department, doctor, document_types, model_detail,
+             input_tokens, output_tokens, total_tokens, processing_time)
+    """,
+    "CREATE INDEX IF NOT EXISTS summary_usage_document_types_date_idx ON summary_usage (document_types, date)",
+    # model_detail ILIKE '%...%' の部分一致。pg_trgm を入れられないサーバーでは作らない
+    """
+    DO $$
+    BEGIN
+        IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm') THEN
+            CREATE EXTENSION IF NOT EXISTS pg_trgm;
+            CREATE INDEX IF NOT EXISTS summary_usage_model_detail_trgm_idx
+            ON summary_usage USING GIN (model_detail gin_trgm_ops);
+        END IF;
+    END $$
+    """,
+]
+
+# 月の区画は日本時間の月初で区切り、summary_usage_YYYYMM の名前で作る
+CREATE_PARTITION_FUNCTION_SQL = """
+    CREATE OR REPLACE FUNCTION create_summary_usage_partition(target_month DATE) RETURNS BOOLEAN AS $$
+    DECLARE
+        month_start DATE := date_trunc('month', target_month)::date;
+        partition_name TEXT := 'summary_usage_' || to_char(month_start, 'YYYYMM');
+    BEGIN
+        IF to_regclass(partition_name) IS NOT NULL THEN
+            RETURN FALSE;
+        END IF;
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF summary_usage FOR VALUES FROM (%L) TO (%L)',
+            partition_name,
+            month_start::timestamp AT TIME ZONE 'Asia/Tokyo',
+            (month_start + INTERVAL '1 month')::timestamp AT TIME ZONE 'Asia/Tokyo'
+        );
+        RETURN TRUE;
+    END
+    $$ LANGUAGE plpgsql
+"""
+
+ENSURE_PARTITIONS_FUNCTION_SQL = """
+    CREATE OR REPLACE FUNCTION ensure_summary_usage_partitions(months_ahead INTEGER) RETURNS INTEGER AS $$
+    DECLARE
+        this_month DATE := date_trunc('month', now() AT TIME ZONE 'Asia/Tokyo')::date;
+        created INTEGER := 0;
+    BEGIN
+        FOR i IN 0..months_ahead LOOP
+            IF create_summary_usage_partition((this_month + make_interval(months => i))::date) THEN
+                created := created + 1;
+            END IF;
+        END LOOP;
+        RETURN created;
+    END
+    $$ LANGUAGE plpgsql
+"""
+
+# 既存の summary_usage を月ごとのパーティションに移し替える。すでに移し替え済みなら何もしない
+# 日時のない旧データは1970年1月の区画に入れ、保存期間の処理でアーカイブされるようにする
+PARTITION_SUMMARY_USAGE_SQL = """
+    DO $$
+    DECLARE
+        month DATE;
+    BEGIN
+        IF (SELECT relkind FROM pg_class WHERE oid = 'summary_usage'::regclass) = 'p' THEN
+            RETURN;
+        END IF;
+
+        ALTER TABLE summary_usage RENAME TO summary_usage_legacy;
+        ALTER INDEX summary_usage_pkey RENAME TO summary_usage_legacy_pkey;
+        DROP INDEX IF EXISTS summary_usage_event_id_key;
+        DROP INDEX IF EXISTS summary_usage_date_idx;
+        DROP INDEX IF EXISTS summary_usage_document_types_date_idx;
+        DROP INDEX IF EXISTS summary_usage_model_detail_trgm_idx;
+        ALTER SEQUENCE summary_usage_id_seq OWNED BY NONE;
+
+        CREATE TABLE summary_usage (
+            id INTEGER NOT NULL DEFAULT nextval('summary_usage_id_seq'),
+            date TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            app_type VARCHAR(50),
+            document_types VARCHAR(100),
+            model_detail VARCHAR(100),
+            department VARCHAR(100),
+            doctor VARCHAR(100),
+            input_tokens INTEGER,
+            output_tokens INTEGER,
+            total_tokens INTEGER,
+            processing_time INTEGER,
+            event_id UUID,
+            PRIMARY KEY (id, date)
+        ) PARTITION BY RANGE (date);
+        ALTER SEQUENCE summary_usage_id_seq OWNED BY summary_usage.id;
+
+        FOR month IN
+            SELECT DISTINCT date_trunc('month', COALESCE(date, to_timestamp(0)) AT TIME ZONE 'Asia/Tokyo')::date
+            FROM summary_usage_legacy
+        LOOP
+            PERFORM create_summary_usage_partition(month);
+        END LOOP;
+
+        INSERT INTO summary_usage (id, date, app_type, document_types, model_detail, department, doctor,
+                                   input_tokens, output_tokens, total_tokens, processing_time, event_id)
+        SELECT id, COALESCE(date, to_timestamp(0)), app_type, document_types, model_detail, department, doctor,
+               input_tokens, output_tokens, total_tokens, processing_time, event_id
+        FROM summary_usage_legacy;
+
+        DROP TABLE summary_usage_legacy;
+    END
+    $$
+"""
+
+# 再送の重複を除く一意制約。パーティションのキーを含める必要がある
+USAGE_EVENT_ID_INDEX_SQL = """
+    CREATE UNIQUE INDEX IF NOT EXISTS summary_usage_event_id_key ON summary_usage (event_id, date)
+"""
+
+# 日本時間の日 × 診療科 × 医師 × 文書名 × モデル分類 ごとの集計。文書名のない行は空文字で持つ
+USAGE_DAILY_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS summary_usage_daily (
+        day DATE NOT NULL,
+        department VARCHAR(100) NOT NULL,
+        doctor VARCHAR(100) NOT NULL,
+        document_types VARCHAR(100) NOT NULL,
+        model_family VARCHAR(50) NOT NULL,
+        count BIGINT NOT NULL,
+        input_tokens BIGINT NOT NULL,
+        output_tokens BIGINT NOT NULL,
+        total_tokens BIGINT NOT NULL,
+        processing_time BIGINT NOT NULL,
+        PRIMARY KEY (day, department, doctor, document_types, model_family)
+    )
+"""
+
+# モデルの分類を列として持ち、絞り込みを等号とインデックスで行えるようにする
+# 既存の行は登録時と同じ分類で埋め、部分一致用のトライグラムインデックスは使わなくなるので削除する
+USAGE_MODEL_FAMILY_SQL = [
+    "ALTER TABLE summary_usage ADD COLUMN IF NOT EXISTS model_family VARCHAR(50)",
+    f"UPDATE summary_usage SET model_family = {model_family_sql('model_detail')} WHERE model_family IS NULL",
+    "ALTER TABLE summary_usage ALTER COLUMN model_family SET NOT NULL",
+    "CREATE INDEX IF NOT EXISTS summary_usage_model_family_date_idx ON summary_usage (model_family, date, id)",
+    "DROP INDEX IF EXISTS summary_usage_model_detail_trgm_idx",
+]
+
+# 失敗・時間切れも記録して失敗率を求められるようにし、処理時間は秒の小数で持つ
+USAGE_STATUS_SQL = [
+    "ALTER TABLE summary_usage ADD COLUMN IF NOT EXISTS status VARCHAR(20) NOT NULL DEFAULT 'success'",
+    "ALTER TABLE summary_usage ALTER COLUMN processing_time TYPE DOUBLE PRECISION",
+    "ALTER TABLE summary_usage_daily ALTER COLUMN processing_time TYPE DOUBLE PRECISION",
+    # 状態と分類も含め、統計画面の集計を表を読まずに行えるようにする
+    "DROP INDEX IF EXISTS summary_usage_date_id_idx",
+    """
+    CREATE INDEX IF NOT EXISTS summary_usage_date_id_idx ON summary_usage (date, id)
+    INCLUDE (department, doctor, document_types, model_detail, model_family, status,
+             input_tokens, output_tokens, total_tokens, processing_time)
+    """,
+]
+
+# 日本時間の日ごとに、最後に行が登録されたときの番号を持つ。統計画面のキャッシュの有効性の確認に使う
+USAGE_VERSIONS_SQL = [
+    "CREATE SEQUENCE IF NOT EXISTS usage_version_seq",
+    """
+    CREATE TABLE IF NOT EXISTS summary_usage_versions (
+        day DATE PRIMARY KEY,
+        version BIGINT NOT NULL
+    )
+    """,
+]
+
+# 作成の開始・モデル呼び出しの開始・終了の時刻。同時実行数と待ち時間の集計に使う
+USAGE_TIMESTAMPS_SQL = [
+    "ALTER TABLE summary_usage ADD COLUMN IF NOT EXISTS started_at TIMESTAMP WITH TIME ZONE",
+    "ALTER TABLE summary_usage ADD COLUMN IF NOT EXISTS model_started_at TIMESTAMP WITH TIME ZONE",
+    "ALTER TABLE summary_usage ADD COLUMN IF NOT EXISTS finished_at TIMESTAMP WITH TIME ZONE",
+]
+
+# 区画のない月の行 (再送や日付をまたいだ遅延登録) を受ける既定の区画
+USAGE_DEFAULT_PARTITION_SQL = "CREATE TABLE IF NOT EXISTS summary_usage_default PARTITION OF summary_usage DEFAULT"
+
+# 既定の区画に同じ月の行があると区画を作れないため、単独の表として作って行を移してから接続する
+CREATE_PARTITION_MOVING_DEFAULT_FUNCTION_SQL = """
+    CREATE OR REPLACE FUNCTION create_summary_usage_partition(target_month DATE) RETURNS BOOLEAN AS $$
+    DECLARE
+        month_start DATE := date_trunc('month', target_month)::date;
+        partition_name TEXT := 'summary_usage_' || to_char(month_start, 'YYYYMM');
+        range_start TIMESTAMP WITH TIME ZONE := month_start::timestamp AT TIME ZONE 'Asia/Tokyo';
+        range_end TIMESTAMP WITH TIME ZONE := (month_start + INTERVAL '1 month')::timestamp AT TIME ZONE 'Asia/Tokyo';
+    BEGIN
+        IF to_regclass(partition_name) IS NOT NULL THEN
+            RETURN FALSE;
+        END IF;
+        IF to_regclass('summary_usage_default') IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF summary_usage FOR VALUES FROM (%L) TO (%L)',
+                partition_name, range_start, range_end
+            );
+            RETURN TRUE;
+        END IF;
+        EXECUTE format('CREATE TABLE %I (LIKE summary_usage INCLUDING DEFAULTS)', partition_name);
+        EXECUTE format(
+            'WITH moved AS (DELETE FROM summary_usage_default WHERE date >= %L AND date < %L RETURNING *) '
+            'INSERT INTO %I SELECT * FROM moved',
+            range_start, range_end, partition_name
+        );
+        EXECUTE format(
+            'ALTER TABLE summary_usage ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+            partition_name, range_start, range_end
+        );
+        RETURN TRUE;
+    END
+    $$ LANGUAGE plpgsql
+"""
+
+# (バージョン, 説明, SQL) の順に並べ、適用済みのものは変更せず末尾に追加していく
+MIGRATIONS = [
+    (1, "統計画面の絞り込み用インデックス", USAGE_INDEX_SQL),
+    (2, "プロンプト本文の参照元を引くインデックス", [
+        "CREATE INDEX IF NOT EXISTS prompts_content_hash_idx ON prompts (content_hash)",
+    ]),
+    (3, "summary_usage の月単位パーティション化", [
+        CREATE_PARTITION_FUNCTION_SQL,
+        ENSURE_PARTITIONS_FUNCTION_SQL,
+        PARTITION_SUMMARY_USAGE_SQL,
+        USAGE_EVENT_ID_INDEX_SQL,
+        *USAGE_INDEX_SQL,
+        "SELECT ensure_summary_usage_partitions(3)",
+    ]),
+    (4, "使用状況の日次集計テーブル", [
+        USAGE_DAILY_TABLE_SQL,
+    ]),
+    (5, "明細のページ送り用に日時のインデックスへ id を加える", [
+        """
+        CREATE INDEX IF NOT EXISTS summary_usage_date_id_idx ON summary_usage (date, id)
+        INCLUDE (department, doctor, document_types, model_detail,
+                 input_tokens, output_tokens, total_tokens, processing_time)
+        """,
+        "DROP INDEX IF EXISTS summary_usage_date_idx",
+    ]),
+    (6, "summary_usage にモデルの分類を持たせる", USAGE_MODEL_FAMILY_SQL),
+    (7, "summary_usage に結果の状態と小数の処理時間を持たせる", USAGE_STATUS_SQL),
+    (8, "使用状況の日ごとの更新番号", USAGE_VERSIONS_SQL),
+    (9, "summary_usage に作成の開始・終了時刻を持たせる", USAGE_TIMESTAMPS_SQL),
+    (10, "summary_usage の既定の区画", [
+        USAGE_DEFAULT_PARTITION_SQL,
+        CREATE_PARTITION_MOVING_DEFAULT_FUNCTION_SQL,
+    ]),
+]
+
+
+def latest_version():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def apply_migrations(conn):
+    # 呼び出し元のトランザクション内で未適用のものだけを順に適用し、適用したバージョンを返す
+    conn.execute(text(SCHEMA_VERSION_TABLE_SQL))
+    conn.execute(text(MIGRATION_LOCK_SQL), {"lock_id": MIGRATION_LOCK_ID})
+    current = conn.execute(text(CURRENT_VERSION_SQL)).scalar() or 0
+
+    applied = []
+    for version, description, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        for statement in statements:
+            conn.execute(text(statement))
+        conn.execute(text(RECORD_VERSION_SQL), {"version": version, "description": description})
+        applied.append(version)
+    return applied
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, UniqueConstraint, ForeignKey, CHAR, Uuid, Float
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
 
@@ -22,6 +22,14 @@ class AppSetting(Base):
     )
 
 
+class PromptContent(Base):
+    __tablename__ = 'prompt_contents'
+
+    content_hash = Column(CHAR(64), primary_key=True)
+    content = Column(Text, nullable=False)
+    created_at = Column(DateTime(timezone=True), default=func.now())
+
+
 class Prompt(Base):
     __tablename__ = 'prompts'
 
@@ -29,24 +37,86 @@ class Prompt(Base):
     department = Column(String(100), nullable=False)
     document_type = Column(String(100), nullable=False)
     doctor = Column(String(100), nullable=False)
-    content = Column(Text, nullable=False)
+    content = Column(Text)
+    content_hash = Column(CHAR(64), ForeignKey('prompt_contents.content_hash'))
+    selected_model = Column(String(50))
+    is_default = Column(Boolean, default=False)
+    created_at = Column(DateTime(timezone=True), default=func.now())
+    updated_at = Column(DateTime(timezone=True), default=func.now(), onupdate=func.now())
+
+
+class PromptResolution(Base):
+    __tablename__ = 'prompt_resolutions'
+
+    department = Column(String(100), primary_key=True)
+    document_type = Column(String(100), primary_key=True)
+    doctor = Column(String(100), primary_key=True)
+    prompt_id = Column(Integer, nullable=False)
+    content_hash = Column(CHAR(64), ForeignKey('prompt_contents.content_hash'))
     selected_model = Column(String(50))
     is_default = Column(Boolean, default=False)
+    inherited = Column(Boolean, default=False)
+    resolved_at = Column(DateTime(timezone=True), default=func.now())
+
+
+class Department(Base):
+    __tablename__ = 'departments'
+
+    name = Column(String(100), primary_key=True)
+    display_order = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), default=func.now())
+    updated_at = Column(DateTime(timezone=True), default=func.now(), onupdate=func.now())
+
+
+class Doctor(Base):
+    __tablename__ = 'doctors'
+
+    department = Column(String(100), ForeignKey('departments.name', ondelete='CASCADE'), primary_key=True)
+    name = Column(String(100), primary_key=True)
+    display_order = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), default=func.now())
+    updated_at = Column(DateTime(timezone=True), default=func.now(), onupdate=func.now())
+
+
+class DocumentType(Base):
+    __tablename__ = 'document_types'
+
+    name = Column(String(100), primary_key=True)
+    purpose = Column(String(100))
+    display_order = Column(Integer, nullable=False, default=0)
     created_at = Column(DateTime(timezone=True), default=func.now())
     updated_at = Column(DateTime(timezone=True), default=func.now(), onupdate=func.now())
 
 
 class SummaryUsage(Base):
     __tablename__ = 'summary_usage'
+    __table_args__ = (
+        UniqueConstraint('event_id', 'date', name='summary_usage_event_id_key'),
+        {'postgresql_partition_by': 'RANGE (date)'},
+    )
 
     id = Column(Integer, primary_key=True)
-    date = Column(DateTime(timezone=True), default=func.now())
+    date = Column(DateTime(timezone=True), primary_key=True, default=func.now())
     app_type = Column(String(50))
     document_types = Column(String(100))
     model_detail = Column(String(100))
+    model_family = Column(String(50), nullable=False)
     department = Column(String(100))
     doctor = Column(String(100))
     input_tokens = Column(Integer)
     output_tokens = Column(Integer)
     total_tokens = Column(Integer)
-    processing_time = Column(Integer)
+    processing_time = Column(Float)
+    status = Column(String(20), nullable=False, default='success')
+    started_at = Column(DateTime(timezone=True))
+    model_started_at = Column(DateTime(timezone=True))
+    finished_at = Column(DateTime(timezone=True))
+    event_id = Column(Uuid)
+
+
+class AppMetadata(Base):
+    __tablename__ = 'app_metadata'
+
+    key = Column(String(100), primary_key=True)
+    value = Column(Text)
+    updated_at = Column(DateTime(timezone=True), default=func.now(), onupdate=func.now())
@@ -0,0 +1,168 @@
+import bisect
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+# チェックアウトの待ち時間の区切り (秒)。この区切りごとの件数で飽和の兆候を見る
+WAIT_BUCKETS = (0.001, 0.01, 0.1, 1.0)
+
+# 待ち時間が長いチェックアウトを知らせる間隔 (秒)。同じ知らせを繰り返し出さない
+SLOW_CHECKOUT_REPORT_INTERVAL = 60
+
+
+class PoolMetrics:
+    """接続プールのチェックアウト数・待ち時間・オーバーフロー・無効化・生存確認の集計"""
+
+    def __init__(self, slow_checkout_seconds=1.0, clock=time.perf_counter):
+        self.slow_checkout_seconds = slow_checkout_seconds
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._last_slow_report = None
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.wait_buckets = [0] * (len(WAIT_BUCKETS) + 1)
+        self.slow_checkouts = 0
+        self.peak_checked_out = 0
+        self.overflow_checkouts = 0
+        self.peak_overflow = 0
+        self.invalidations = 0
+        self.pings = 0
+        self.ping_failures = 0
+        self.ping_seconds_total = 0.0
+
+    def record_checkout(self, wait_seconds, checked_out, overflow):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_seconds_total += wait_seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, wait_seconds)
+            self.wait_buckets[bisect.bisect_left(WAIT_BUCKETS, wait_seconds)] += 1
+            self.peak_checked_out = max(self.peak_checked_out, checked_out)
+            if overflow > 0:
+                self.overflow_checkouts += 1
+                self.peak_overflow = max(self.peak_overflow, overflow)
+            slow = wait_seconds >= self.slow_checkout_seconds
+            if slow:
+                self.slow_checkouts += 1
+            report = slow and self._should_report()
+        if report:
+            print(f"接続プールの空きを{wait_seconds:.2f}秒待ちました (使用中 {checked_out} / オーバーフロー {overflow})")
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def record_invalidation(self):
+        with self._lock:
+            self.invalidations += 1
+
+    def record_ping(self, seconds, failed=False):
+        with self._lock:
+            self.pings += 1
+            self.ping_seconds_total += seconds
+            if failed:
+                self.ping_failures += 1
+
+    def _should_report(self):
+        now = self.clock()
+        if self._last_slow_report is not None and now - self._last_slow_report < SLOW_CHECKOUT_REPORT_INTERVAL:
+            return False
+        self._last_slow_report = now
+        return True
+
+    def snapshot(self, pool):
+        with self._lock:
+            return {
+                "pool_size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "overflow": max(pool.overflow(), 0),
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_ms_avg": self.wait_seconds_total / self.checkouts * 1000 if self.checkouts else 0.0,
+                "wait_ms_max": self.wait_seconds_max * 1000,
+                "wait_buckets": dict(zip(wait_bucket_labels(), self.wait_buckets)),
+                "slow_checkouts": self.slow_checkouts,
+                "peak_checked_out": self.peak_checked_out,
+                "overflow_checkouts": self.overflow_checkouts,
+                "peak_overflow": self.peak_overflow,
+                "invalidations": self.invalidations,
+                "pings": self.pings,
+                "ping_failures": self.ping_failures,
+                "ping_ms_avg": self.ping_seconds_total / self.pings * 1000 if self.pings else 0.0,
+                "pings_skipped": self.checkouts - self.pings,
+            }
+
+
+def wait_bucket_labels():
+    labels = [f"<={int(bound * 1000)}ms" for bound in WAIT_BUCKETS]
+    return labels + [f">{int(WAIT_BUCKETS[-1] * 1000)}ms"]
+
+
+class InstrumentedQueuePool(QueuePool):
+    """チェックアウトにかかった時間を PoolMetrics に記録する QueuePool"""
+
+    metrics = None
+
+    def connect(self):
+        if self.metrics is None:
+            return super().connect()
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            self.metrics.record_timeout()
+            raise
+        self.metrics.record_checkout(time.perf_counter() - started, self.checkedout(), self.overflow())
+        return connection
+
+    def recreate(self):
+        # dispose などで作り直したプールにも同じ集計を引き継ぐ
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+def instrument_pool(engine, ping_idle_seconds, slow_checkout_seconds=1.0):
+    # 毎回のチェックアウトで生存確認をせず、一定時間使われなかった接続だけを確認する
+    metrics = PoolMetrics(slow_checkout_seconds)
+    engine.pool.metrics = metrics
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        connection_record.info["checked_in_at"] = time.monotonic()
+
+    @event.listens_for(engine, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        if connection_record is not None:
+            connection_record.info["checked_in_at"] = time.monotonic()
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        idle = time.monotonic() - connection_record.info.get("checked_in_at", 0.0)
+        if idle < ping_idle_seconds:
+            return
+        started = time.perf_counter()
+        try:
+            engine.dialect.do_ping(dbapi_connection)
+        except Exception as e:
+            metrics.record_ping(time.perf_counter() - started, failed=True)
+            # プールはこの接続を捨て、新しい接続でチェックアウトをやり直す
+            raise exc.DisconnectionError(str(e)) from e
+        metrics.record_ping(time.perf_counter() - started)
+
+    @event.listens_for(engine, "invalidate")
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        metrics.record_invalidation()
+
+    @event.listens_for(engine, "soft_invalidate")
+    def on_soft_invalidate(dbapi_connection, connection_record, exception):
+        metrics.record_invalidation()
+
+    return metrics
+
+
+class InstrumentedAsyncQueuePool(InstrumentedQueuePool, AsyncAdaptedQueuePool):
+    """非同期のエンジン用。空きの待ち合わせをイベントループ上で行い、同じ集計を記録する"""
@@ -0,0 +1,509 @@
+import hashlib
+
+from database.db import DatabaseManager, is_sqlite
+from database.sqlite_backend import SET_METADATA_SQL, current_value_sql, next_value_sql
+from utils.constants import DEFAULT_DOCUMENT_TYPE
+
+PROMPT_CHANNEL = "prompts_changed"
+
+GLOBAL_DEFAULT_KEY = ("default", DEFAULT_DOCUMENT_TYPE, "default")
+
+RESOLVED_COLUMNS = """
+    r.prompt_id AS id, r.department, r.document_type, r.doctor, c.content, r.content_hash,
+    r.selected_model, r.is_default, r.inherited
+"""
+
+
+def _scope_filter(alias):
+    # 変更されたキーと、そのキーから本文を継承しうる行を表す条件
+    return f"""
+        (CAST(:scope_document_type AS VARCHAR) IS NULL OR {alias}.document_type = :scope_document_type)
+        AND ({alias}.department = :scope_department OR (:scope_department = 'default' AND :scope_doctor = 'default'))
+        AND ({alias}.doctor = :scope_doctor OR :scope_doctor = 'default')
+    """
+
+
+RESOLVE_SQL = f"""
+    SELECT {RESOLVED_COLUMNS}
+    FROM prompt_resolutions r
+    JOIN prompt_contents c ON c.content_hash = r.content_hash
+    WHERE (r.document_type = :document_type AND r.department = :department AND r.doctor IN (:doctor, 'default'))
+       OR (r.document_type = :document_type AND r.department = 'default' AND r.doctor = 'default')
+       OR (r.document_type = :default_document_type AND r.department = 'default' AND r.doctor = 'default' AND r.is_default)
+    ORDER BY CASE
+                 WHEN r.document_type = :document_type AND r.department = :department AND r.doctor = :doctor THEN 0
+                 WHEN r.document_type = :document_type AND r.department = :department THEN 1
+                 WHEN r.document_type = :document_type THEN 2
+                 ELSE 3
+             END
+    LIMIT 1
+"""
+
+LOAD_ALL_SQL = f"""
+    SELECT v.version AS cache_version, s.*
+    FROM (SELECT CASE WHEN is_called THEN last_value ELSE 0 END AS version FROM prompt_version_seq) v
+    LEFT JOIN (
+        SELECT {RESOLVED_COLUMNS}
+        FROM prompt_resolutions r
+        JOIN prompt_contents c ON c.content_hash = r.content_hash
+    ) s ON TRUE
+"""
+
+LOAD_SCOPE_SQL = f"""
+    SELECT {RESOLVED_COLUMNS}
+    FROM prompt_resolutions r
+    JOIN prompt_contents c ON c.content_hash = r.content_hash
+    WHERE {_scope_filter("r")}
+"""
+
+VERSION_SQL = "SELECT CASE WHEN is_called THEN last_value ELSE 0 END AS version FROM prompt_version_seq"
+
+# 継承を解決した結果を範囲内で再計算し、削除されたキーの解決結果も取り除く
+REFRESH_RESOLUTIONS_SQL = f"""
+    WITH removed AS (
+        DELETE FROM prompt_resolutions r
+        WHERE {_scope_filter("r")}
+          AND NOT EXISTS (
+              SELECT 1 FROM prompts p
+              WHERE p.department = r.department AND p.document_type = r.document_type AND p.doctor = r.doctor
+          )
+    )
+    INSERT INTO prompt_resolutions AS r
+        (department, document_type, doctor, prompt_id, content_hash, selected_model, is_default, inherited)
+    SELECT p.department, p.document_type, p.doctor, p.id,
+           COALESCE(p.content_hash, d.content_hash, b.content_hash, g.content_hash),
+           COALESCE(p.selected_model, d.selected_model, b.selected_model, g.selected_model),
+           COALESCE(p.is_default, FALSE),
+           p.content_hash IS NULL
+    FROM prompts p
+    LEFT JOIN prompts d
+        ON p.doctor <> 'default'
+       AND d.department = p.department AND d.document_type = p.document_type AND d.doctor = 'default'
+    LEFT JOIN prompts b
+        ON p.department <> 'default'
+       AND b.department = 'default' AND b.document_type = p.document_type AND b.doctor = 'default'
+    LEFT JOIN prompts g
+        ON g.department = 'default' AND g.document_type = :default_document_type AND g.doctor = 'default'
+       AND g.is_default
+    WHERE {_scope_filter("p")}
+    ON CONFLICT (department, document_type, doctor) DO UPDATE
+    SET prompt_id = EXCLUDED.prompt_id,
+        content_hash = EXCLUDED.content_hash,
+        selected_model = EXCLUDED.selected_model,
+        is_default = EXCLUDED.is_default,
+        inherited = EXCLUDED.inherited,
+        resolved_at = CURRENT_TIMESTAMP
+    WHERE (r.prompt_id, r.content_hash, r.selected_model, r.is_default, r.inherited)
+          IS DISTINCT FROM
+          (EXCLUDED.prompt_id, EXCLUDED.content_hash, EXCLUDED.selected_model, EXCLUDED.is_default, EXCLUDED.inherited)
+"""
+
+# 変更通知はバージョン採番と同じ文で送り、コミットされた書き込みだけが配信されるようにする
+# 親の解決結果と同じ本文・モデルは保存せず、親の変更に追従させる
+UPSERT_SQL = """
+    WITH body AS (
+        INSERT INTO prompt_contents (content_hash, content)
+        VALUES (:content_hash, :content)
+        ON CONFLICT (content_hash) DO NOTHING
+    ),
+    parent AS (
+        SELECT r.content_hash, r.selected_model
+        FROM prompt_resolutions r
+        WHERE (r.department, r.document_type, r.doctor) IN (
+                  (:department, :document_type, 'default'),
+                  ('default', :document_type, 'default'),
+                  ('default', :default_document_type, 'default'))
+          AND (r.department, r.document_type, r.doctor) <> (:department, :document_type, :doctor)
+          AND (r.document_type = :document_type OR r.is_default)
+        ORDER BY CASE
+                     WHEN r.department = :department AND r.document_type = :document_type THEN 0
+                     WHEN r.document_type = :document_type THEN 1
+                     ELSE 2
+                 END
+        LIMIT 1
+    ),
+    changed AS (
+        INSERT INTO prompts (department, document_type, doctor, content_hash, selected_model, is_default)
+        SELECT :department, :document_type, :doctor,
+               CASE WHEN parent.content_hash = :content_hash THEN NULL ELSE :content_hash END,
+               CASE WHEN parent.selected_model = :selected_model THEN NULL ELSE :selected_model END,
+               :is_default
+        FROM (SELECT 1) one
+        LEFT JOIN parent ON TRUE
+        ON CONFLICT (department, document_type, doctor) DO UPDATE
+        SET content_hash = EXCLUDED.content_hash,
+            selected_model = EXCLUDED.selected_model,
+            content = NULL,
+            updated_at = CURRENT_TIMESTAMP
+        RETURNING id, department, document_type, doctor, (xmax = 0) AS inserted,
+                  nextval('prompt_version_seq') AS version
+    )
+    SELECT changed.id, changed.inserted, changed.version
+    FROM changed
+    CROSS JOIN LATERAL (
+        SELECT pg_notify(:channel, json_build_object(
+            'department', changed.department,
+            'document_type', changed.document_type,
+            'doctor', changed.doctor,
+            'version', changed.version)::TEXT)
+    ) n
+"""
+
+DELETE_SQL = """
+    WITH changed AS (
+        DELETE FROM prompts
+        WHERE department = :department AND document_type = :document_type AND doctor = :doctor
+        RETURNING id, department, document_type, doctor, nextval('prompt_version_seq') AS version
+    )
+    SELECT changed.id, changed.version
+    FROM changed
+    CROSS JOIN LATERAL (
+        SELECT pg_notify(:channel, json_build_object(
+            'department', changed.department,
+            'document_type', changed.document_type,
+            'doctor', changed.doctor,
+            'version', changed.version)::TEXT)
+    ) n
+"""
+
+ENSURE_DEFAULT_SQL = """
+    WITH body AS (
+        INSERT INTO prompt_contents (content_hash, content)
+        VALUES (:content_hash, :content)
+        ON CONFLICT (content_hash) DO NOTHING
+    ),
+    changed AS (
+        INSERT INTO prompts (department, document_type, doctor, content_hash, is_default)
+        VALUES ('default', :document_type, 'default', :content_hash, TRUE)
+        ON CONFLICT (department, document_type, doctor) DO UPDATE
+        SET is_default = TRUE,
+            content_hash = COALESCE(prompts.content_hash, EXCLUDED.content_hash)
+        WHERE NOT prompts.is_default OR prompts.content_hash IS NULL
+        RETURNING id, department, document_type, doctor, nextval('prompt_version_seq') AS version
+    )
+    SELECT changed.id, changed.version
+    FROM changed
+    CROSS JOIN LATERAL (
+        SELECT pg_notify(:channel, json_build_object(
+            'department', changed.department,
+            'document_type', changed.document_type,
+            'doctor', changed.doctor,
+            'version', changed.version)::TEXT)
+    ) n
+"""
+
+# 診療科×医師×文書名の組み合わせを1文で登録し、登録済みのシードバージョンも記録する
+# 本文は持たせず、親のプロンプトを継承させる
+SEED_MATRIX_SQL = """
+    WITH seed AS (
+        INSERT INTO prompts (department, document_type, doctor, is_default)
+        SELECT m.department, t.document_type, m.doctor, FALSE
+        FROM unnest(CAST(:departments AS TEXT[]), CAST(:doctors AS TEXT[])) AS m(department, doctor)
+        CROSS JOIN unnest(CAST(:document_types AS TEXT[])) AS t(document_type)
+        ON CONFLICT (department, document_type, doctor) DO NOTHING
+        RETURNING id
+    ),
+    marker AS (
+        INSERT INTO app_metadata (key, value)
+        VALUES (:seed_version_key, :seed_version)
+        ON CONFLICT (key) DO UPDATE
+        SET value = EXCLUDED.value,
+            updated_at = CURRENT_TIMESTAMP
+    )
+    SELECT s.inserted, n.version
+    FROM (SELECT COUNT(*) AS inserted FROM seed) s
+    LEFT JOIN LATERAL (
+        SELECT v.version, pg_notify(:channel, json_build_object(
+            'department', NULL, 'document_type', NULL, 'doctor', NULL, 'version', v.version)::TEXT)
+        FROM (SELECT nextval('prompt_version_seq') AS version) v
+        WHERE s.inserted > 0
+    ) n ON TRUE
+"""
+
+SEED_VERSION_SQL = "SELECT value FROM app_metadata WHERE key = :seed_version_key"
+
+SEED_VERSION_KEY = "prompt_seed_version"
+
+# SQLite 用。文の中で書き込みを重ねられないため、同じトランザクションで順に実行する
+# 通知は送らず、同じプロセスのキャッシュは呼び出し元が無効にする
+SQLITE_VERSION_SQL = current_value_sql("prompt_version_seq")
+
+SQLITE_NEXT_VERSION_SQL = next_value_sql("prompt_version_seq")
+
+SQLITE_LOAD_ALL_SQL = f"""
+    SELECT v.version AS cache_version, s.*
+    FROM ({SQLITE_VERSION_SQL}) v
+    LEFT JOIN (
+        SELECT {RESOLVED_COLUMNS}
+        FROM prompt_resolutions r
+        JOIN prompt_contents c ON c.content_hash = r.content_hash
+    ) s ON TRUE
+"""
+
+SQLITE_REMOVE_RESOLUTIONS_SQL = f"""
+    DELETE FROM prompt_resolutions
+    WHERE {_scope_filter("prompt_resolutions")}
+      AND NOT EXISTS (
+          SELECT 1 FROM prompts p
+          WHERE p.department = prompt_resolutions.department
+            AND p.document_type = prompt_resolutions.document_type
+            AND p.doctor = prompt_resolutions.doctor
+      )
+"""
+
+SQLITE_REFRESH_RESOLUTIONS_SQL = f"""
+    INSERT INTO prompt_resolutions AS r
+        (department, document_type, doctor, prompt_id, content_hash, selected_model, is_default, inherited)
+    SELECT p.department, p.document_type, p.doctor, p.id,
+           COALESCE(p.content_hash, d.content_hash, b.content_hash, g.content_hash),
+           COALESCE(p.selected_model, d.selected_model, b.selected_model, g.selected_model),
+           COALESCE(p.is_default, FALSE),
+           p.content_hash IS NULL
+    FROM prompts p
+    LEFT JOIN prompts d
+        ON p.doctor <> 'default'
+       AND d.department = p.department AND d.document_type = p.document_type AND d.doctor = 'default'
+    LEFT JOIN prompts b
+        ON p.department <> 'default'
+       AND b.department = 'default' AND b.document_type = p.document_type AND b.doctor = 'default'
+    LEFT JOIN prompts g
+        ON g.department = 'default' AND g.document_type = :default_document_type AND g.doctor = 'default'
+       AND g.is_default
+    WHERE {_scope_filter("p")}
+    ON CONFLICT (department, document_type, doctor) DO UPDATE
+    SET prompt_id = excluded.prompt_id,
+        content_hash = excluded.content_hash,
+        selected_model = excluded.selected_model,
+        is_default = excluded.is_default,
+        inherited = excluded.inherited,
+        resolved_at = CURRENT_TIMESTAMP
+    WHERE NOT (r.prompt_id IS excluded.prompt_id AND r.content_hash IS excluded.content_hash
+               AND r.selected_model IS excluded.selected_model AND r.is_default IS excluded.is_default
+               AND r.inherited IS excluded.inherited)
+"""
+
+SQLITE_STORE_CONTENT_SQL = """
+    INSERT INTO prompt_contents (content_hash, content) VALUES (:content_hash, :content)
+    ON CONFLICT (content_hash) DO NOTHING
+"""
+
+SQLITE_PROMPT_EXISTS_SQL = """
+    SELECT id FROM prompts WHERE department = :department AND document_type = :document_type AND doctor = :doctor
+"""
+
+SQLITE_UPSERT_SQL = """
+    WITH parent AS (
+        SELECT r.content_hash, r.selected_model
+        FROM prompt_resolutions r
+        WHERE r.doctor = 'default'
+          AND ((r.department = :department AND r.document_type = :document_type)
+               OR (r.department = 'default' AND r.document_type = :document_type)
+               OR (r.department = 'default' AND r.document_type = :default_document_type))
+          AND NOT (r.department = :department AND r.document_type = :document_type AND r.doctor = :doctor)
+          AND (r.document_type = :document_type OR r.is_default)
+        ORDER BY CASE
+                     WHEN r.department = :department AND r.document_type = :document_type THEN 0
+                     WHEN r.document_type = :document_type THEN 1
+                     ELSE 2
+                 END
+        LIMIT 1
+    )
+    INSERT INTO prompts (department, document_type, doctor, content_hash, selected_model, is_default)
+    SELECT :department, :document_type, :doctor,
+           CASE WHEN parent.content_hash = :content_hash THEN NULL ELSE :content_hash END,
+           CASE WHEN parent.selected_model = :selected_model THEN NULL ELSE :selected_model END,
+           :is_default
+    FROM (SELECT 1) one
+    LEFT JOIN parent ON TRUE
+    WHERE TRUE
+    ON CONFLICT (department, document_type, doctor) DO UPDATE
+    SET content_hash = excluded.content_hash,
+        selected_model = excluded.selected_model,
+        content = NULL,
+        updated_at = CURRENT_TIMESTAMP
+    RETURNING id
+"""
+
+SQLITE_DELETE_SQL = """
+    DELETE FROM prompts
+    WHERE department = :department AND document_type = :document_type AND doctor = :doctor
+    RETURNING id
+"""
+
+SQLITE_ENSURE_DEFAULT_SQL = """
+    INSERT INTO prompts (department, document_type, doctor, content_hash, is_default)
+    VALUES ('default', :document_type, 'default', :content_hash, TRUE)
+    ON CONFLICT (department, document_type, doctor) DO UPDATE
+    SET is_default = TRUE,
+        content_hash = COALESCE(prompts.content_hash, excluded.content_hash)
+    WHERE NOT prompts.is_default OR prompts.content_hash IS NULL
+    RETURNING id
+"""
+
+SQLITE_SEED_PROMPT_SQL = """
+    INSERT INTO prompts (department, document_type, doctor, is_default)
+    VALUES (:department, :document_type, :doctor, FALSE)
+    ON CONFLICT (department, document_type, doctor) DO NOTHING
+    RETURNING id
+"""
+
+
+def compute_content_hash(content):
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def resolution_scope(department, document_type, doctor):
+    # 全体のデフォルトプロンプトはすべての行の継承元になる
+    if (department, document_type, doctor) == GLOBAL_DEFAULT_KEY:
+        document_type = None
+    return {"scope_department": department, "scope_document_type": document_type, "scope_doctor": doctor}
+
+
+def in_resolution_scope(key, department, document_type, doctor):
+    key_department, key_document_type, key_doctor = key
+    if (department, document_type, doctor) != GLOBAL_DEFAULT_KEY and key_document_type != document_type:
+        return False
+    if key_department != department and not (department == "default" and doctor == "default"):
+        return False
+    return key_doctor == doctor or doctor == "default"
+
+
+class PromptRepository:
+    def __init__(self, db_manager=None):
+        self.db_manager = db_manager or DatabaseManager.get_instance()
+        self.sqlite = is_sqlite(self.db_manager)
+
+    def resolve(self, department, document_type, doctor):
+        rows = self.db_manager.execute_query(RESOLVE_SQL, {
+            "department": department,
+            "document_type": document_type,
+            "doctor": doctor,
+            "default_document_type": DEFAULT_DOCUMENT_TYPE
+        })
+        return rows[0] if rows else None
+
+    def load_scope(self, department, document_type, doctor):
+        return self.db_manager.execute_query(LOAD_SCOPE_SQL, resolution_scope(department, document_type, doctor))
+
+    def load_all(self):
+        rows = self.db_manager.execute_query(SQLITE_LOAD_ALL_SQL if self.sqlite else LOAD_ALL_SQL)
+        version = rows[0]["cache_version"] if rows else 0
+        prompts = []
+        for row in rows:
+            if row.get("id") is None:
+                continue
+            prompt = dict(row)
+            prompt.pop("cache_version", None)
+            prompts.append(prompt)
+        return version, prompts
+
+    def current_version(self):
+        rows = self.db_manager.execute_query(SQLITE_VERSION_SQL if self.sqlite else VERSION_SQL)
+        return rows[0]["version"] if rows else 0
+
+    def upsert(self, department, document_type, doctor, content, selected_model=None, is_default=False):
+        params = {
+            "channel": PROMPT_CHANNEL,
+            "department": department,
+            "document_type": document_type,
+            "doctor": doctor,
+            "content": content,
+            "content_hash": compute_content_hash(content),
+            "selected_model": selected_model,
+            "is_default": is_default,
+            "default_document_type": DEFAULT_DOCUMENT_TYPE
+        }
+        scope = resolution_scope(department, document_type, doctor)
+        if self.sqlite:
+            def upsert_rows(uow):
+                uow.execute_query(SQLITE_STORE_CONTENT_SQL, params, fetch=False)
+                existing = uow.execute_query(SQLITE_PROMPT_EXISTS_SQL, params)
+                uow.execute_query(SQLITE_UPSERT_SQL, params)
+                return [{"inserted": not existing}]
+
+            rows = self._write_sqlite(upsert_rows, scope)
+        else:
+            rows = self._write(UPSERT_SQL, params, scope)
+        return bool(rows and rows[0]["inserted"])
+
+    def delete(self, department, document_type, doctor):
+        params = {
+            "channel": PROMPT_CHANNEL,
+            "department": department,
+            "document_type": document_type,
+            "doctor": doctor
+        }
+        scope = resolution_scope(department, document_type, doctor)
+        if self.sqlite:
+            rows = self._write_sqlite(lambda uow: uow.execute_query(SQLITE_DELETE_SQL, params), scope)
+        else:
+            rows = self._write(DELETE_SQL, params, scope)
+        return len(rows)
+
+    def ensure_default(self, content, document_type=DEFAULT_DOCUMENT_TYPE):
+        params = {
+            "channel": PROMPT_CHANNEL,
+            "document_type": document_type,
+            "content": content,
+            "content_hash": compute_content_hash(content)
+        }
+        scope = resolution_scope("default", document_type, "default")
+        if self.sqlite:
+            def ensure_rows(uow):
+                uow.execute_query(SQLITE_STORE_CONTENT_SQL, params, fetch=False)
+                return uow.execute_query(SQLITE_ENSURE_DEFAULT_SQL, params)
+
+            rows = self._write_sqlite(ensure_rows, scope)
+        else:
+            rows = self._write(ENSURE_DEFAULT_SQL, params, scope)
+        return bool(rows)
+
+    def get_seed_version(self):
+        rows = self.db_manager.execute_query(SEED_VERSION_SQL, {"seed_version_key": SEED_VERSION_KEY})
+        return rows[0]["value"] if rows else None
+
+    def seed_matrix(self, departments, doctors, document_types, seed_version):
+        if self.sqlite:
+            return self._seed_matrix_sqlite(departments, doctors, document_types, seed_version)
+        rows = self._write(SEED_MATRIX_SQL, {
+            "channel": PROMPT_CHANNEL,
+            "departments": list(departments),
+            "doctors": list(doctors),
+            "document_types": list(document_types),
+            "seed_version_key": SEED_VERSION_KEY,
+            "seed_version": seed_version
+        }, resolution_scope(*GLOBAL_DEFAULT_KEY))
+        return rows[0]["inserted"] if rows else 0
+
+    def _seed_matrix_sqlite(self, departments, doctors, document_types, seed_version):
+        def seed_rows(uow):
+            inserted = 0
+            for department, doctor in zip(departments, doctors):
+                for document_type in document_types:
+                    inserted += len(uow.execute_query(SQLITE_SEED_PROMPT_SQL, {
+                        "department": department, "document_type": document_type, "doctor": doctor
+                    }))
+            uow.execute_query(SET_METADATA_SQL, {"key": SEED_VERSION_KEY, "value": seed_version}, fetch=False)
+            return [{"inserted": inserted}] if inserted else []
+
+        rows = self._write_sqlite(seed_rows, resolution_scope(*GLOBAL_DEFAULT_KEY))
+        return rows[0]["inserted"] if rows else 0
+
+    def _write(self, query, params, scope):
+        # 書き込みと解決結果の更新を同じトランザクションで行い、通知はコミット後に配信される
+        results = self.db_manager.execute_in_transaction([
+            (query, params),
+            (REFRESH_RESOLUTIONS_SQL, {**scope, "default_document_type": DEFAULT_DOCUMENT_TYPE})
+        ])
+        return results[0]
+
+    def _write_sqlite(self, write, scope):
+        # write(uow) は変更した行を返す。変更があればバージョンを進め、解決結果も同じトランザクションで更新する
+        with self.db_manager.unit_of_work() as uow:
+            rows = write(uow)
+            if rows:
+                uow.execute_query(SQLITE_NEXT_VERSION_SQL)
+            params = {**scope, "default_document_type": DEFAULT_DOCUMENT_TYPE}
+            uow.execute_query(SQLITE_REMOVE_RESOLUTIONS_SQL, params, fetch=False)
+            uow.execute_query(SQLITE_REFRESH_RESOLUTIONS_SQL, params, fetch=False)
+        return rows
@@ -0,0 +1,188 @@
+import bisect
+import random
+import re
+import threading
+import time
+from functools import lru_cache
+
+from sqlalchemy import event
+
+# 実行時間の区切り (秒)。文ごとにこの区切りごとの件数を数える
+LATENCY_BUCKETS = (0.01, 0.1, 0.5, 1.0, 5.0)
+
+# 集計する文の数の上限。超えた分は1つにまとめ、動的に組み立てた文で記録が増え続けないようにする
+MAX_STATEMENTS = 500
+OTHER_STATEMENTS = "(その他のクエリ)"
+
+# 実行計画を取る文。ANALYZE は文を実際に実行するため、読み取りだけを対象にしてロールバックする
+EXPLAIN_PREFIXES = {"postgresql": "EXPLAIN (ANALYZE, BUFFERS) "}
+READ_ONLY_STATEMENT = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE)
+WRITE_KEYWORD = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE)\b", re.IGNORECASE)
+# SELECT でも2回目の実行で番号を進める・通知を重ねて送る・ロックを取る関数
+SIDE_EFFECT_FUNCTION = re.compile(r"\b(nextval|setval|pg_notify|pg_advisory\w*|pg_try_advisory\w*)\s*\(",
+                                  re.IGNORECASE)
+
+# この実行オプションを False にした接続の文は記録しない (実行計画の取得そのものなど)
+LOG_OPTION = "slow_query_log"
+
+# 文字列・数値・バインド変数を ? にそろえ、値だけが違う文を同じ文として数える
+LITERALS = re.compile(r"'(?:[^']|'')*'|%\(\w+\)s|(?<![:\w]):\w+|\$\d+|\b\d+(?:\.\d+)?\b|\?")
+VALUE_LISTS = re.compile(r"\?(?:\s*,\s*\?)+")
+WHITESPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=1024)
+def normalize_sql(statement):
+    normalized = LITERALS.sub("?", statement)
+    normalized = WHITESPACE.sub(" ", normalized).strip()
+    return VALUE_LISTS.sub("?", normalized)
+
+
+def is_explainable(statement):
+    normalized = normalize_sql(statement)
+    return (bool(READ_ONLY_STATEMENT.match(normalized)) and not WRITE_KEYWORD.search(normalized)
+            and not SIDE_EFFECT_FUNCTION.search(normalized))
+
+
+class StatementStats:
+    def __init__(self):
+        self.calls = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.slow_calls = 0
+        self.last_explain = None
+        self.plan = None
+        self.plan_seconds = None
+
+    def percentile(self, fraction):
+        # 区切りごとの件数からの概算。該当する区切りの上限を返し、最後の区切りは最大値を返す
+        target = fraction * self.calls
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max_seconds)
+        return self.max_seconds
+
+
+class SlowQueryLog:
+    """文ごと (値を除いたSQLごと) の実行時間の分布と、遅かった文の実行計画"""
+
+    def __init__(self, slow_seconds, sample_rate, explain_interval, clock=time.monotonic, sample=random.random):
+        self.slow_seconds = slow_seconds
+        self.sample_rate = sample_rate
+        self.explain_interval = explain_interval
+        self.clock = clock
+        self.sample = sample
+        self._lock = threading.Lock()
+        self._statements = {}
+
+    def record(self, database, statement, seconds, explainable=False):
+        # 実行計画を取るべき場合はその文の集計キーを返す。取得は抽出し、同じ文では一定間隔を空ける
+        normalized = normalize_sql(statement)
+        with self._lock:
+            key = (database, normalized)
+            stats = self._statements.get(key)
+            if stats is None:
+                if len(self._statements) >= MAX_STATEMENTS:
+                    key = (database, OTHER_STATEMENTS)
+                    explainable = False
+                stats = self._statements.setdefault(key, StatementStats())
+            stats.calls += 1
+            stats.total_seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            stats.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            if seconds < self.slow_seconds:
+                return None
+            stats.slow_calls += 1
+            if not explainable or self.sample() >= self.sample_rate:
+                return None
+            now = self.clock()
+            if stats.last_explain is not None and now - stats.last_explain < self.explain_interval:
+                return None
+            stats.last_explain = now
+            return key
+
+    def record_plan(self, key, plan, seconds):
+        with self._lock:
+            stats = self._statements.get(key)
+            if stats is not None:
+                stats.plan = plan
+                stats.plan_seconds = seconds
+
+    def top(self, limit, order_by="total_ms"):
+        with self._lock:
+            rows = [{
+                "database": database,
+                "statement": statement,
+                "calls": stats.calls,
+                "slow_calls": stats.slow_calls,
+                "total_ms": stats.total_seconds * 1000,
+                "mean_ms": stats.total_seconds / stats.calls * 1000,
+                "p50_ms": stats.percentile(0.5) * 1000,
+                "p95_ms": stats.percentile(0.95) * 1000,
+                "max_ms": stats.max_seconds * 1000,
+                "buckets": dict(zip(latency_bucket_labels(), stats.buckets)),
+                "plan": stats.plan,
+                "plan_ms": stats.plan_seconds * 1000 if stats.plan_seconds is not None else None,
+            } for (database, statement), stats in self._statements.items()]
+        rows.sort(key=lambda row: row[order_by], reverse=True)
+        return rows[:limit]
+
+    def reset(self):
+        with self._lock:
+            self._statements.clear()
+
+
+def latency_bucket_labels():
+    labels = [f"<={int(bound * 1000)}ms" for bound in LATENCY_BUCKETS]
+    return labels + [f">{int(LATENCY_BUCKETS[-1] * 1000)}ms"]
+
+
+def capture_plan(engine, log, key, statement, parameters, seconds, explain_timeout_ms):
+    prefix = EXPLAIN_PREFIXES[engine.dialect.name]
+    try:
+        with engine.connect() as conn:
+            conn.execution_options(**{LOG_OPTION: False})
+            transaction = conn.begin()
+            try:
+                # ANALYZE で遅い文をもう一度実行するため、時間の上限を決めて結果は必ず取り消す
+                conn.exec_driver_sql(f"SET LOCAL statement_timeout = {int(explain_timeout_ms)}")
+                rows = conn.exec_driver_sql(prefix + statement, parameters).fetchall()
+            finally:
+                transaction.rollback()
+        plan = "\n".join(row[0] for row in rows)
+    except Exception as e:
+        plan = f"実行計画を取得できませんでした: {str(e)}"
+    log.record_plan(key, plan, seconds)
+    print(f"遅いクエリ ({seconds * 1000:.0f}ms, {key[0]}): {key[1]}\n{plan}")
+
+
+def instrument_queries(engine, log, database, explain_timeout_ms, capture_plans=True):
+    # カーソルでの実行ごとに時間を測るので、execute_query 以外の経路 (unit of work・出力など) も記録される
+    # 非同期のエンジン (sync_engine を渡す) は別スレッドから接続できないため capture_plans=False にする
+    explain = capture_plans and engine.dialect.name in EXPLAIN_PREFIXES
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def on_before_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._query_started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def on_after_execute(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_query_started", None)
+        if started is None or not context.execution_options.get(LOG_OPTION, True):
+            return
+        seconds = time.perf_counter() - started
+        explainable = explain and not executemany and is_explainable(statement)
+        key = log.record(database, statement, seconds, explainable)
+        if key is not None:
+            # 実行計画の取得で画面の応答を待たせないよう、別スレッドで取る
+            threading.Thread(
+                target=capture_plan,
+                args=(engine, log, key, statement, parameters, seconds, explain_timeout_ms),
+                daemon=True
+            ).start()
+
+    return log
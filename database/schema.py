@@ -1,15 +1,71 @@
+import datetime
+import threading
 import time
+from contextlib import contextmanager
 
 from sqlalchemy import text
 
-from database.db import DatabaseManager
+from database.db import DatabaseManager, is_sqlite
+from database.hierarchy_repository import HIERARCHY_SEED_VERSION_KEY
+from database.migrations import MIGRATION_LOCK_ID, apply_migrations, latest_version
+from database.prompt_repository import REFRESH_RESOLUTIONS_SQL, GLOBAL_DEFAULT_KEY, SEED_VERSION_KEY, resolution_scope
+from database.sqlite_backend import create_sqlite_tables
+from database.unit_of_work import is_connection_error
+from database.usage_partitions import ENSURE_PARTITIONS_SQL, JST, partition_name
+from utils.config import DB_INIT_TIMEOUT_SECONDS, USAGE_PARTITION_MONTHS_AHEAD
+from utils.constants import DEFAULT_DOCUMENT_TYPE
 from utils.exceptions import DatabaseError
 
+# 本文を直接持つ旧形式の行を prompt_contents へ移し、親と同じ本文の行は継承に切り替える
+MIGRATE_PROMPT_CONTENTS_SQL = """
+    WITH legacy AS (
+        SELECT id, department, document_type, doctor, content, is_default,
+               encode(sha256(convert_to(content, 'UTF8')), 'hex') AS content_hash
+        FROM prompts
+        WHERE content IS NOT NULL
+    ),
+    stored AS (
+        INSERT INTO prompt_contents (content_hash, content)
+        SELECT DISTINCT content_hash, content FROM legacy
+        ON CONFLICT (content_hash) DO NOTHING
+    )
+    UPDATE prompts p
+    SET content_hash = CASE
+            WHEN l.is_default THEN l.content_hash
+            WHEN l.content_hash = COALESCE(
+                (SELECT COALESCE(d.content_hash, encode(sha256(convert_to(d.content, 'UTF8')), 'hex'))
+                 FROM prompts d
+                 WHERE l.doctor <> 'default' AND d.department = l.department
+                   AND d.document_type = l.document_type AND d.doctor = 'default'),
+                (SELECT COALESCE(b.content_hash, encode(sha256(convert_to(b.content, 'UTF8')), 'hex'))
+                 FROM prompts b
+                 WHERE l.department <> 'default' AND b.department = 'default'
+                   AND b.document_type = l.document_type AND b.doctor = 'default'),
+                (SELECT COALESCE(g.content_hash, encode(sha256(convert_to(g.content, 'UTF8')), 'hex'))
+                 FROM prompts g
+                 WHERE g.department = 'default' AND g.document_type = :default_document_type
+                   AND g.doctor = 'default' AND g.is_default)
+            ) THEN NULL
+            ELSE l.content_hash
+        END,
+        content = NULL
+    FROM legacy l
+    WHERE p.id = l.id
+"""
+
 
 def create_tables():
     db_manager = DatabaseManager.get_instance()
     engine = db_manager.get_engine()
 
+    if is_sqlite(db_manager):
+        # 旧形式からの移行やパーティションはないため、最新の形の表をそのまま作る
+        try:
+            create_sqlite_tables(engine)
+            return True
+        except Exception as e:
+            raise DatabaseError(f"テーブル作成中にエラーが発生しました: {str(e)}")
+
     app_settings_table = """
         CREATE TABLE IF NOT EXISTS app_settings (
             id SERIAL PRIMARY KEY,
@@ -24,13 +80,23 @@ def create_tables():
         )
     """
 
+    prompt_contents_table = """
+        CREATE TABLE IF NOT EXISTS prompt_contents (
+            content_hash CHAR(64) PRIMARY KEY,
+            content TEXT NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        )
+    """
+
+    # content は旧形式の列で、起動時に prompt_contents へ移される
     prompts_table = """
         CREATE TABLE IF NOT EXISTS prompts (
             id SERIAL PRIMARY KEY,
             department VARCHAR(100) NOT NULL,
             document_type VARCHAR(100) NOT NULL,
             doctor VARCHAR(100) NOT NULL,
-            content TEXT NOT NULL,
+            content TEXT,
+            content_hash CHAR(64) REFERENCES prompt_contents (content_hash),
             selected_model VARCHAR(50),
             is_default BOOLEAN DEFAULT FALSE,
             created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
@@ -39,6 +105,28 @@ def create_tables():
         )
     """
 
+    prompts_content_hash_column = """
+        ALTER TABLE prompts
+        ADD COLUMN IF NOT EXISTS content_hash CHAR(64) REFERENCES prompt_contents (content_hash)
+    """
+
+    prompts_content_nullable = "ALTER TABLE prompts ALTER COLUMN content DROP NOT NULL"
+
+    prompt_resolutions_table = """
+        CREATE TABLE IF NOT EXISTS prompt_resolutions (
+            department VARCHAR(100) NOT NULL,
+            document_type VARCHAR(100) NOT NULL,
+            doctor VARCHAR(100) NOT NULL,
+            prompt_id INTEGER NOT NULL,
+            content_hash CHAR(64) REFERENCES prompt_contents (content_hash),
+            selected_model VARCHAR(50),
+            is_default BOOLEAN DEFAULT FALSE,
+            inherited BOOLEAN DEFAULT FALSE,
+            resolved_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (department, document_type, doctor)
+        )
+    """
+
     summary_usage_table = """
         CREATE TABLE IF NOT EXISTS summary_usage (
             id SERIAL PRIMARY KEY,
@@ -55,31 +143,196 @@ def create_tables():
         )
     """
 
+    # 再送しても二重に登録されないよう、使用状況ごとに一意のIDを持たせる
+    summary_usage_event_id_column = "ALTER TABLE summary_usage ADD COLUMN IF NOT EXISTS event_id UUID"
+
+    summary_usage_event_id_index = """
+        CREATE UNIQUE INDEX IF NOT EXISTS summary_usage_event_id_key ON summary_usage (event_id, date)
+    """
+
+    app_metadata_table = """
+        CREATE TABLE IF NOT EXISTS app_metadata (
+            key VARCHAR(100) PRIMARY KEY,
+            value TEXT,
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        )
+    """
+
+    prompt_version_sequence = "CREATE SEQUENCE IF NOT EXISTS prompt_version_seq"
+
+    departments_table = """
+        CREATE TABLE IF NOT EXISTS departments (
+            name VARCHAR(100) PRIMARY KEY,
+            display_order INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        )
+    """
+
+    doctors_table = """
+        CREATE TABLE IF NOT EXISTS doctors (
+            department VARCHAR(100) NOT NULL REFERENCES departments (name) ON DELETE CASCADE,
+            name VARCHAR(100) NOT NULL,
+            display_order INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (department, name)
+        )
+    """
+
+    document_types_table = """
+        CREATE TABLE IF NOT EXISTS document_types (
+            name VARCHAR(100) PRIMARY KEY,
+            purpose VARCHAR(100),
+            display_order INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        )
+    """
+
+    hierarchy_version_sequence = "CREATE SEQUENCE IF NOT EXISTS hierarchy_version_seq"
+
     try:
         with engine.begin() as conn:
             conn.execute(text(app_settings_table))
+            conn.execute(text(prompt_contents_table))
             conn.execute(text(prompts_table))
+            conn.execute(text(prompts_content_hash_column))
+            conn.execute(text(prompts_content_nullable))
+            conn.execute(text(prompt_resolutions_table))
             conn.execute(text(summary_usage_table))
+            conn.execute(text(summary_usage_event_id_column))
+            conn.execute(text(summary_usage_event_id_index))
+            conn.execute(text(app_metadata_table))
+            conn.execute(text(prompt_version_sequence))
+            conn.execute(text(departments_table))
+            conn.execute(text(doctors_table))
+            conn.execute(text(document_types_table))
+            conn.execute(text(hierarchy_version_sequence))
+
+            migrated = conn.execute(text(MIGRATE_PROMPT_CONTENTS_SQL),
+                                    {"default_document_type": DEFAULT_DOCUMENT_TYPE})
+            if migrated.rowcount:
+                conn.execute(text(REFRESH_RESOLUTIONS_SQL), {
+                    **resolution_scope(*GLOBAL_DEFAULT_KEY),
+                    "default_document_type": DEFAULT_DOCUMENT_TYPE
+                })
+
+            applied = apply_migrations(conn)
+            if applied:
+                print(f"スキーマを更新しました: {applied}")
+
+            # 起動のたびに先の月の区画を用意しておく
+            conn.execute(text(ENSURE_PARTITIONS_SQL), {"months_ahead": USAGE_PARTITION_MONTHS_AHEAD})
         return True
     except Exception as e:
         raise DatabaseError(f"テーブル作成中にエラーが発生しました: {str(e)}")
 
 
-def initialize_database():
-    max_retries = 5
-    retry_count = 0
-    last_error = None
+# 起動時に1回で確かめる状態。スキーマ・初期データのバージョンと、先の月の区画が作られているか
+SCHEMA_STATE_SQL = """
+    SELECT (SELECT COALESCE(MAX(version), 0) FROM schema_version) AS schema_version,
+           (SELECT value FROM app_metadata WHERE key = :prompt_seed_key) AS prompt_seed_version,
+           (SELECT value FROM app_metadata WHERE key = :hierarchy_seed_key) AS hierarchy_seed_version,
+           to_regclass(:last_partition) IS NOT NULL AS partitions_ready
+"""
+
+SQLITE_SCHEMA_STATE_SQL = """
+    SELECT (SELECT COALESCE(MAX(version), 0) FROM schema_version) AS schema_version,
+           (SELECT value FROM app_metadata WHERE key = :prompt_seed_key) AS prompt_seed_version,
+           (SELECT value FROM app_metadata WHERE key = :hierarchy_seed_key) AS hierarchy_seed_version,
+           TRUE AS partitions_ready
+"""
+
+# apply_migrations のトランザクション内のロックとは別のキー。同じキーでは自分の接続どうしで待ち合ってしまう
+INITIALIZE_LOCK_ID = MIGRATION_LOCK_ID + 1
+
+TRY_INITIALIZE_LOCK_SQL = "SELECT pg_try_advisory_lock(:lock_id) AS locked"
 
-    while retry_count < max_retries:
+INITIALIZE_UNLOCK_SQL = "SELECT pg_advisory_unlock(:lock_id)"
+
+LOCK_POLL_INTERVAL = 0.5
+INITIAL_RETRY_DELAY = 0.5
+MAX_RETRY_DELAY = 5
+
+_initialize_lock = threading.Lock()
+
+
+def last_partition_name(months_ahead=USAGE_PARTITION_MONTHS_AHEAD, today=None):
+    today = today or datetime.datetime.now(JST).date()
+    month_index = today.year * 12 + today.month - 1 + months_ahead
+    return partition_name(datetime.date(month_index // 12, month_index % 12 + 1, 1))
+
+
+def read_schema_state(db_manager):
+    # 初回の起動で schema_version などがまだない場合は None を返す
+    query = SQLITE_SCHEMA_STATE_SQL if is_sqlite(db_manager) else SCHEMA_STATE_SQL
+    try:
+        rows = db_manager.execute_query(query, {
+            "prompt_seed_key": SEED_VERSION_KEY,
+            "hierarchy_seed_key": HIERARCHY_SEED_VERSION_KEY,
+            "last_partition": last_partition_name()
+        })
+    except DatabaseError as e:
+        if is_connection_error(e.__cause__):
+            raise
+        return None
+    return rows[0] if rows else None
+
+
+def schema_is_current(state, seed_versions):
+    # seed_versions は {"prompt_seed_version": ..., "hierarchy_seed_version": ...} の期待する値
+    return (state is not None
+            and state["schema_version"] >= latest_version()
+            and bool(state["partitions_ready"])
+            and all(state[key] == value for key, value in seed_versions.items()))
+
+
+@contextmanager
+def initialization_lock(db_manager, deadline):
+    # 複数のプロセスが同時に起動しても、DDLと初期データの登録は1つのプロセスだけが行う
+    with _initialize_lock:
+        if is_sqlite(db_manager):
+            yield
+            return
+
+        with db_manager.get_engine().connect() as conn:
+            params = {"lock_id": INITIALIZE_LOCK_ID}
+            while not conn.execute(text(TRY_INITIALIZE_LOCK_SQL), params).scalar():
+                if time.monotonic() >= deadline:
+                    raise DatabaseError("ほかのプロセスによるデータベースの初期化が終わりませんでした")
+                time.sleep(LOCK_POLL_INTERVAL)
+            try:
+                yield
+            finally:
+                conn.execute(text(INITIALIZE_UNLOCK_SQL), params)
+
+
+def initialize_database(seed_versions=None, seed=None, timeout=DB_INIT_TIMEOUT_SECONDS):
+    # スキーマと初期データが最新なら1回の問い合わせで終える。違う場合だけロックを取ってDDLと seed() を実行する
+    # 失敗した場合は間隔を延ばしながら再試行し、合計で timeout 秒を超えたら諦める
+    seed_versions = seed_versions or {}
+    deadline = time.monotonic() + timeout
+    delay = INITIAL_RETRY_DELAY
+
+    while True:
         try:
-            create_tables()
+            db_manager = DatabaseManager.get_instance()
+            if schema_is_current(read_schema_state(db_manager), seed_versions):
+                return False
+            with initialization_lock(db_manager, deadline):
+                # ロックを待つ間にほかのプロセスが初期化を終えていれば何もしない
+                if schema_is_current(read_schema_state(db_manager), seed_versions):
+                    return False
+                create_tables()
+                if seed is not None:
+                    seed()
             return True
         except Exception as e:
-            last_error = e
-            retry_count += 1
-            wait_time = 2 ** retry_count  # 指数バックオフ
-            print(f"データベース初期化に失敗しました（試行 {retry_count}/{max_retries}）: {str(e)}")
-            print(f"{wait_time}秒後に再試行します...")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise DatabaseError(f"データベースの初期化に失敗しました: {str(e)}")
+            wait_time = min(delay, remaining)
+            print(f"データベース初期化に失敗しました。{wait_time:.1f}秒後に再試行します: {str(e)}")
             time.sleep(wait_time)
-
-    raise DatabaseError(f"データベースの初期化に失敗しました: {str(last_error)}")
+            delay = min(delay * 2, MAX_RETRY_DELAY)
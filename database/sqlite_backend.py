@@ -0,0 +1,219 @@
+import datetime
+import sqlite3
+import uuid
+
+from sqlalchemy import create_engine, event, text
+
+from database.migrations import SCHEMA_VERSION_TABLE_SQL, latest_version
+
+# 日時は UTC の ISO 形式の文字列で持ち、文字列の比較で前後を判定できるようにする
+sqlite3.register_adapter(
+    datetime.datetime,
+    lambda value: (value.astimezone(datetime.timezone.utc) if value.tzinfo else value).isoformat(sep=" ")
+)
+sqlite3.register_adapter(datetime.date, lambda value: value.isoformat())
+sqlite3.register_adapter(uuid.UUID, str)
+
+# PostgreSQL のシーケンスの代わり。名前ごとに最後に採番した値を持つ
+SEQUENCES_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS sequences (
+        name VARCHAR(100) PRIMARY KEY,
+        value INTEGER NOT NULL
+    )
+"""
+
+
+def next_value_sql(sequence):
+    return f"""
+        INSERT INTO sequences (name, value) VALUES ('{sequence}', 1)
+        ON CONFLICT (name) DO UPDATE SET value = value + 1
+        RETURNING value AS version
+    """
+
+
+def current_value_sql(sequence):
+    return f"SELECT COALESCE((SELECT value FROM sequences WHERE name = '{sequence}'), 0) AS version"
+
+
+SET_METADATA_SQL = """
+    INSERT INTO app_metadata (key, value) VALUES (:key, :value)
+    ON CONFLICT (key) DO UPDATE
+    SET value = excluded.value,
+        updated_at = CURRENT_TIMESTAMP
+"""
+
+# PostgreSQL でマイグレーションを最後まで適用したときと同じ表。パーティション・拡張機能は使わない
+TABLES_SQL = [
+    SEQUENCES_TABLE_SQL,
+    SCHEMA_VERSION_TABLE_SQL,
+    """
+    CREATE TABLE IF NOT EXISTS app_settings (
+        id INTEGER PRIMARY KEY,
+        setting_id VARCHAR(100) NOT NULL,
+        app_type VARCHAR(50) NOT NULL,
+        selected_department VARCHAR(100),
+        selected_model VARCHAR(50),
+        selected_document_type VARCHAR(100),
+        selected_doctor VARCHAR(100),
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        CONSTRAINT unique_setting_per_app UNIQUE (setting_id, app_type)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS prompt_contents (
+        content_hash CHAR(64) PRIMARY KEY,
+        content TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS prompts (
+        id INTEGER PRIMARY KEY,
+        department VARCHAR(100) NOT NULL,
+        document_type VARCHAR(100) NOT NULL,
+        doctor VARCHAR(100) NOT NULL,
+        content TEXT,
+        content_hash CHAR(64) REFERENCES prompt_contents (content_hash),
+        selected_model VARCHAR(50),
+        is_default BOOLEAN DEFAULT FALSE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        CONSTRAINT unique_prompt UNIQUE (department, document_type, doctor)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS prompts_content_hash_idx ON prompts (content_hash)",
+    """
+    CREATE TABLE IF NOT EXISTS prompt_resolutions (
+        department VARCHAR(100) NOT NULL,
+        document_type VARCHAR(100) NOT NULL,
+        doctor VARCHAR(100) NOT NULL,
+        prompt_id INTEGER NOT NULL,
+        content_hash CHAR(64) REFERENCES prompt_contents (content_hash),
+        selected_model VARCHAR(50),
+        is_default BOOLEAN DEFAULT FALSE,
+        inherited BOOLEAN DEFAULT FALSE,
+        resolved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (department, document_type, doctor)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS summary_usage (
+        id INTEGER PRIMARY KEY,
+        date TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        app_type VARCHAR(50),
+        document_types VARCHAR(100),
+        model_detail VARCHAR(100),
+        model_family VARCHAR(50) NOT NULL,
+        department VARCHAR(100),
+        doctor VARCHAR(100),
+        input_tokens INTEGER,
+        output_tokens INTEGER,
+        total_tokens INTEGER,
+        processing_time DOUBLE PRECISION,
+        status VARCHAR(20) NOT NULL DEFAULT 'success',
+        started_at TIMESTAMP,
+        model_started_at TIMESTAMP,
+        finished_at TIMESTAMP,
+        event_id VARCHAR(36)
+    )
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS summary_usage_event_id_key ON summary_usage (event_id, date)",
+    "CREATE INDEX IF NOT EXISTS summary_usage_date_id_idx ON summary_usage (date, id)",
+    "CREATE INDEX IF NOT EXISTS summary_usage_document_types_date_idx ON summary_usage (document_types, date)",
+    "CREATE INDEX IF NOT EXISTS summary_usage_model_family_date_idx ON summary_usage (model_family, date, id)",
+    """
+    CREATE TABLE IF NOT EXISTS summary_usage_daily (
+        day DATE NOT NULL,
+        department VARCHAR(100) NOT NULL,
+        doctor VARCHAR(100) NOT NULL,
+        document_types VARCHAR(100) NOT NULL,
+        model_family VARCHAR(50) NOT NULL,
+        count BIGINT NOT NULL,
+        input_tokens BIGINT NOT NULL,
+        output_tokens BIGINT NOT NULL,
+        total_tokens BIGINT NOT NULL,
+        processing_time DOUBLE PRECISION NOT NULL,
+        PRIMARY KEY (day, department, doctor, document_types, model_family)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS summary_usage_versions (
+        day DATE PRIMARY KEY,
+        version BIGINT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS app_metadata (
+        key VARCHAR(100) PRIMARY KEY,
+        value TEXT,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS departments (
+        name VARCHAR(100) PRIMARY KEY,
+        display_order INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS doctors (
+        department VARCHAR(100) NOT NULL REFERENCES departments (name) ON DELETE CASCADE,
+        name VARCHAR(100) NOT NULL,
+        display_order INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (department, name)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS document_types (
+        name VARCHAR(100) PRIMARY KEY,
+        purpose VARCHAR(100),
+        display_order INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+]
+
+RECORD_SCHEMA_VERSION_SQL = """
+    INSERT INTO schema_version (version, description) VALUES (:version, 'SQLite のスキーマ')
+    ON CONFLICT (version) DO NOTHING
+"""
+
+
+def create_sqlite_engine(database_url, poolclass, pool_size, max_overflow, pool_timeout, busy_timeout_ms):
+    # 画面と書き込みスレッドで接続を使い回すため、作成したスレッド以外からの利用を許す
+    engine = create_engine(
+        database_url,
+        poolclass=poolclass,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=pool_timeout,
+        connect_args={"check_same_thread": False, "timeout": busy_timeout_ms / 1000}
+    )
+    return configure_sqlite_connections(engine, busy_timeout_ms)
+
+
+def configure_sqlite_connections(engine, busy_timeout_ms):
+    # 非同期のエンジンでは engine.sync_engine を渡す
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        # WAL にして読み取りと書き込みが互いを待たないようにする。外部キーは接続ごとに有効にする
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.execute(f"PRAGMA busy_timeout={int(busy_timeout_ms)}")
+        cursor.close()
+
+    return engine
+
+
+def create_sqlite_tables(engine):
+    with engine.begin() as conn:
+        for statement in TABLES_SQL:
+            conn.execute(text(statement))
+        conn.execute(text(RECORD_SCHEMA_VERSION_SQL), {"version": latest_version()})
@@ -0,0 +1,247 @@
+from contextlib import nullcontext
+from functools import lru_cache
+
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from utils.config import DB_STREAM_FETCH_SIZE
+from utils.exceptions import DatabaseError
+
+
+@lru_cache(maxsize=512)
+def compile_statement(query):
+    # 同じSQL文字列の text() を使い回し、バインド変数の解析を実行のたびに行わない
+    return text(query)
+
+
+def is_connection_error(error):
+    # 接続できない・接続が切れた場合。SQLの誤りや時間切れは主DBでも同じく失敗するので含めない
+    return isinstance(error, DBAPIError) and (error.connection_invalidated or error.statement is None)
+
+
+class UnitOfWork:
+    """1つの接続・1つのトランザクションで複数の文を実行する。with を正常に抜けたときにコミットする
+
+    analytic=True の場合はレプリカ (接続できなければ主DB) で開き、analytic の読み取りだけをこの中で実行する。
+    それ以外の文 (日次集計の更新など) は DatabaseManager に渡し、別のトランザクションで実行する。
+    """
+
+    def __init__(self, db_manager, analytic=False):
+        self.db_manager = db_manager
+        self.analytic = analytic
+        self.session = None
+
+    def __enter__(self):
+        self.session = self._begin()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.session.commit()
+            else:
+                self.session.rollback()
+        finally:
+            self.session.close()
+            self.session = None
+        return False
+
+    def _begin(self):
+        if self.analytic and self.db_manager.replica_available():
+            session = self.db_manager.get_session(replica=True)
+            try:
+                # ここで接続を確保し、レプリカに接続できない場合は最初の文の前に主DBへ切り替える
+                session.connection()
+                return session
+            except DBAPIError as e:
+                session.close()
+                if not is_connection_error(e):
+                    raise DatabaseError(f"クエリ実行中にエラーが発生しました: {str(e)}") from e
+                self.db_manager.mark_replica_unhealthy(e)
+        return self.db_manager.get_session()
+
+    def dialect_name(self):
+        return self.db_manager.dialect_name()
+
+    def unit_of_work(self, analytic=False):
+        # すでに開いている unit of work の中では、同じトランザクションをそのまま使う
+        return nullcontext(self)
+
+    def _delegates(self, analytic):
+        return self.analytic and not analytic
+
+    def _execute(self, query, params):
+        try:
+            return self.session.execute(compile_statement(query), params or {})
+        except Exception as e:
+            raise DatabaseError(f"クエリ実行中にエラーが発生しました: {str(e)}") from e
+
+    def execute_query(self, query, params=None, fetch=True, analytic=False):
+        if self._delegates(analytic):
+            return self.db_manager.execute_query(query, params, fetch)
+        result = self._execute(query, params)
+        if not fetch:
+            return None
+        return [dict(row._mapping) for row in result]
+
+    def query_frame(self, query, params=None, analytic=False):
+        if self._delegates(analytic):
+            return self.db_manager.query_frame(query, params)
+        result = self._execute(query, params)
+        return pd.DataFrame.from_records(result.fetchall(), columns=list(result.keys()))
+
+    def stream_query(self, query, params=None, batch_size=DB_STREAM_FETCH_SIZE, analytic=False):
+        # サーバー側カーソルで batch_size 件ずつ取り出し、結果の全件をメモリに載せない
+        if self._delegates(analytic):
+            yield from self.db_manager.stream_query(query, params, batch_size)
+            return
+        for columns, rows in self._stream(query, params, batch_size):
+            yield [dict(zip(columns, row)) for row in rows]
+
+    def stream_frames(self, query, params=None, batch_size=DB_STREAM_FETCH_SIZE, analytic=False):
+        if self._delegates(analytic):
+            yield from self.db_manager.stream_frames(query, params, batch_size)
+            return
+        for columns, rows in self._stream(query, params, batch_size):
+            yield pd.DataFrame.from_records(rows, columns=columns)
+
+    def _stream(self, query, params, batch_size):
+        try:
+            # stream_results で PostgreSQL では名前付きカーソルになり、batch_size 件ずつサーバーから受け取る
+            result = self.session.execute(compile_statement(query), params or {}, execution_options={
+                "stream_results": True, "max_row_buffer": batch_size
+            })
+            columns = list(result.keys())
+            for rows in result.partitions(batch_size):
+                yield columns, rows
+        except Exception as e:
+            raise DatabaseError(f"クエリ実行中にエラーが発生しました: {str(e)}") from e
+
+    def execute_in_transaction(self, statements):
+        results = []
+        for query, params in statements:
+            result = self._execute(query, params)
+            results.append([dict(row._mapping) for row in result] if result.returns_rows else [])
+        return results
+
+    def fetch(self, query, params=None, row_type=None):
+        # row_type を渡した場合はその型 (NamedTuple・dataclass など) の行、省略した場合は列名で触れる Row を返す
+        result = self._execute(query, params)
+        if row_type is None:
+            return result.all()
+        return [row_type(**row._mapping) for row in result]
+
+    def scalar(self, query, params=None):
+        return self._execute(query, params).scalar()
+
+
+class AsyncUnitOfWork:
+    """UnitOfWork の非同期版。async with を正常に抜けたときにコミットする
+
+    文の実行・取り出しは await で行い、待つ間はイベントループがほかの処理を進める。
+    """
+
+    def __init__(self, db_manager, analytic=False):
+        self.db_manager = db_manager
+        self.analytic = analytic
+        self.session = None
+
+    async def __aenter__(self):
+        self.session = await self._begin()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                await self.session.commit()
+            else:
+                await self.session.rollback()
+        finally:
+            await self.session.close()
+            self.session = None
+        return False
+
+    async def _begin(self):
+        if self.analytic and self.db_manager.replica_available():
+            session = self.db_manager.get_session(replica=True)
+            try:
+                await session.connection()
+                return session
+            except DBAPIError as e:
+                await session.close()
+                if not is_connection_error(e):
+                    raise DatabaseError(f"クエリ実行中にエラーが発生しました: {str(e)}") from e
+                self.db_manager.mark_replica_unhealthy(e)
+        return self.db_manager.get_session()
+
+    def dialect_name(self):
+        return self.db_manager.dialect_name()
+
+    def unit_of_work(self, analytic=False):
+        return nullcontext(self)
+
+    def _delegates(self, analytic):
+        return self.analytic and not analytic
+
+    async def _execute(self, query, params):
+        try:
+            return await self.session.execute(compile_statement(query), params or {})
+        except Exception as e:
+            raise DatabaseError(f"クエリ実行中にエラーが発生しました: {str(e)}") from e
+
+    async def execute_query(self, query, params=None, fetch=True, analytic=False):
+        if self._delegates(analytic):
+            return await self.db_manager.execute_query(query, params, fetch)
+        result = await self._execute(query, params)
+        if not fetch:
+            return None
+        return [dict(row._mapping) for row in result]
+
+    async def query_frame(self, query, params=None, analytic=False):
+        if self._delegates(analytic):
+            return await self.db_manager.query_frame(query, params)
+        result = await self._execute(query, params)
+        return pd.DataFrame.from_records(result.fetchall(), columns=list(result.keys()))
+
+    async def execute_in_transaction(self, statements):
+        results = []
+        for query, params in statements:
+            result = await self._execute(query, params)
+            results.append([dict(row._mapping) for row in result] if result.returns_rows else [])
+        return results
+
+    async def fetch(self, query, params=None, row_type=None):
+        result = await self._execute(query, params)
+        if row_type is None:
+            return result.all()
+        return [row_type(**row._mapping) for row in result]
+
+    async def scalar(self, query, params=None):
+        return (await self._execute(query, params)).scalar()
+
+    async def stream_query(self, query, params=None, batch_size=DB_STREAM_FETCH_SIZE, analytic=False):
+        if self._delegates(analytic):
+            async for rows in self.db_manager.stream_query(query, params, batch_size):
+                yield rows
+            return
+        async for columns, rows in self._stream(query, params, batch_size):
+            yield [dict(zip(columns, row)) for row in rows]
+
+    async def stream_frames(self, query, params=None, batch_size=DB_STREAM_FETCH_SIZE, analytic=False):
+        if self._delegates(analytic):
+            async for frame in self.db_manager.stream_frames(query, params, batch_size):
+                yield frame
+            return
+        async for columns, rows in self._stream(query, params, batch_size):
+            yield pd.DataFrame.from_records(rows, columns=columns)
+
+    async def _stream(self, query, params, batch_size):
+        try:
+            result = await self.session.stream(compile_statement(query), params or {},
+                                               execution_options={"max_row_buffer": batch_size})
+            columns = list(result.keys())
+            async for rows in result.partitions(batch_size):
+                yield columns, rows
+        except Exception as e:
+            raise DatabaseError(f"クエリ実行中にエラーが発生しました: {str(e)}") from e
@@ -0,0 +1,114 @@
+import datetime
+import os
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+import pytz
+
+from utils.constants import MODEL_MAPPING, DEFAULT_MODEL_FAMILY
+
+JST = pytz.timezone('Asia/Tokyo')
+
+ARCHIVE_SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("date", pa.timestamp("us", tz="UTC")),
+    ("app_type", pa.string()),
+    ("document_types", pa.string()),
+    ("model_detail", pa.string()),
+    ("model_family", pa.string()),
+    ("department", pa.string()),
+    ("doctor", pa.string()),
+    ("input_tokens", pa.int64()),
+    ("output_tokens", pa.int64()),
+    ("total_tokens", pa.int64()),
+    ("processing_time", pa.float64()),
+    ("status", pa.string()),
+    ("started_at", pa.timestamp("us", tz="UTC")),
+    ("model_started_at", pa.timestamp("us", tz="UTC")),
+    ("finished_at", pa.timestamp("us", tz="UTC")),
+    ("event_id", pa.string()),
+])
+
+
+class UsageArchive:
+    """DBから切り離した summary_usage の区画を月ごとの Parquet ファイルとして保管する"""
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+
+    def path_for(self, name):
+        return os.path.join(self.directory, f"{name}.parquet")
+
+    def exists(self, name):
+        return os.path.exists(self.path_for(name))
+
+    def write_partition(self, name, batches):
+        # batches は行のリストの並び。1つずつ行グループとして書き、区画の全件をメモリに載せない
+        # 書き終えたファイルだけが読まれるよう、読み込み対象外の名前で書いてから置き換える
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path_for(name)
+        temp_path = os.path.join(self.directory, f".{name}.parquet.tmp")
+        with pq.ParquetWriter(temp_path, ARCHIVE_SCHEMA, compression="zstd") as writer:
+            for rows in batches:
+                writer.write_table(pa.Table.from_pylist(
+                    [{**row, "event_id": str(row["event_id"]) if row.get("event_id") else None} for row in rows],
+                    schema=ARCHIVE_SCHEMA
+                ))
+        with open(temp_path, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+        return path
+
+    def read(self, start_datetime, end_datetime, model_family=None, document_type=None, columns=None, before=None):
+        # 期間・モデル・文書名の絞り込みは統計画面のSQLと同じ条件で行う
+        if not os.path.isdir(self.directory):
+            table = ARCHIVE_SCHEMA.empty_table()
+            return table.select(columns) if columns else table
+
+        dataset = ds.dataset(self.directory, format="parquet", schema=ARCHIVE_SCHEMA,
+                             filesystem=pafs.LocalFileSystem(use_mmap=True))
+        family = _model_family()
+        # 明細に出すのは作成できた行だけ。status 列を持たない古いファイルはすべて作成できた行
+        condition = ((ds.field("date") >= _timestamp(start_datetime))
+                     & (ds.field("date") <= _timestamp(end_datetime))
+                     & (pc.coalesce(ds.field("status"), pa.scalar("success")) == "success"))
+
+        if model_family:
+            condition &= family == model_family
+
+        if document_type == "不明":
+            condition &= ds.field("document_types").is_null()
+        elif document_type:
+            condition &= ds.field("document_types") == document_type
+
+        if before is not None:
+            # (date, id) の降順で before より後ろの行
+            before_date, before_id = _timestamp(before[0]), before[1]
+            condition &= ((ds.field("date") < before_date)
+                          | ((ds.field("date") == before_date) & (ds.field("id") < before_id)))
+
+        projection = {name: family if name == "model_family" else ds.field(name)
+                      for name in (columns or ARCHIVE_SCHEMA.names)}
+        return dataset.to_table(columns=projection, filter=condition)
+
+
+def _model_family():
+    # model_family 列を持たない古いファイルは、登録時と同じ分類を model_detail から求める
+    classified = pa.scalar(DEFAULT_MODEL_FAMILY)
+    for name, config in reversed(list(MODEL_MAPPING.items())):
+        matched = pc.match_substring(ds.field("model_detail"), config["pattern"], ignore_case=True)
+        if config["exclude"]:
+            matched = pc.and_kleene(matched, pc.invert(
+                pc.match_substring(ds.field("model_detail"), config["exclude"], ignore_case=True)
+            ))
+        classified = pc.if_else(pc.coalesce(matched, pa.scalar(False)), pa.scalar(name), classified)
+    return pc.coalesce(ds.field("model_family"), classified)
+
+
+def _timestamp(value):
+    if value.tzinfo is None:
+        value = JST.localize(value)
+    return pa.scalar(value.astimezone(datetime.timezone.utc), type=ARCHIVE_SCHEMA.field("date").type)
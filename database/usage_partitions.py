@@ -0,0 +1,98 @@
+import datetime
+import re
+
+import pytz
+
+from database.db import DatabaseManager, is_sqlite
+from utils.config import DB_STREAM_FETCH_SIZE
+
+JST = pytz.timezone('Asia/Tokyo')
+
+PARTITION_NAME_PATTERN = re.compile(r"^summary_usage_(\d{4})(\d{2})$")
+
+ENSURE_PARTITIONS_SQL = "SELECT ensure_summary_usage_partitions(:months_ahead) AS created"
+
+# 接続中の区画と、切り離したまま削除されていない区画を1回で取得する
+LIST_PARTITIONS_SQL = """
+    SELECT c.relname AS name, i.inhparent IS NOT NULL AS attached
+    FROM pg_class c
+    LEFT JOIN pg_inherits i ON i.inhrelid = c.oid AND i.inhparent = 'summary_usage'::regclass
+    WHERE c.relkind = 'r'
+      AND c.relnamespace = (SELECT relnamespace FROM pg_class WHERE oid = 'summary_usage'::regclass)
+      AND c.relname ~ '^summary_usage_[0-9]{6}$'
+    ORDER BY c.relname
+"""
+
+# アーカイブした月に遅れて登録された行は既定の区画に入る。書き出した行だけを id で削除する
+LATE_ROW_IDS_SQL = "SELECT id FROM summary_usage_default WHERE date < :before ORDER BY id"
+
+LATE_ROWS_SQL = "SELECT * FROM summary_usage_default WHERE id = ANY(CAST(:ids AS INTEGER[])) ORDER BY date, id"
+
+DELETE_LATE_ROWS_SQL = "DELETE FROM summary_usage_default WHERE id = ANY(CAST(:ids AS INTEGER[]))"
+
+
+def partition_name(month):
+    return f"summary_usage_{month:%Y%m}"
+
+
+def partition_month(name):
+    match = PARTITION_NAME_PATTERN.match(name)
+    if not match:
+        raise ValueError(f"summary_usage の区画名ではありません: {name}")
+    return datetime.date(int(match.group(1)), int(match.group(2)), 1)
+
+
+def partition_start(name):
+    month = partition_month(name)
+    return JST.localize(datetime.datetime.combine(month, datetime.time.min))
+
+
+class UsagePartitionRepository:
+    def __init__(self, db_manager=None):
+        self.db_manager = db_manager or DatabaseManager.get_instance()
+        # SQLite の summary_usage は区画を持たないので、区画の作成・一覧・アーカイブは何もしない
+        self.sqlite = is_sqlite(self.db_manager)
+
+    def ensure_partitions(self, months_ahead):
+        if self.sqlite:
+            return 0
+        rows = self.db_manager.execute_query(ENSURE_PARTITIONS_SQL, {"months_ahead": months_ahead})
+        return rows[0]["created"] if rows else 0
+
+    def list_partitions(self, analytic=False):
+        # (区画名, 接続中かどうか) を古い月から順に返す
+        if self.sqlite:
+            return []
+        rows = self.db_manager.execute_query(LIST_PARTITIONS_SQL, analytic=analytic)
+        return [(row["name"], row["attached"]) for row in rows]
+
+    def hot_start(self, analytic=False):
+        # DBに残っている最も古い月の月初。これより前はアーカイブから読む
+        attached = [name for name, is_attached in self.list_partitions(analytic) if is_attached]
+        return partition_start(attached[0]) if attached else None
+
+    def detach(self, name):
+        partition_month(name)
+        self.db_manager.execute_query(f"ALTER TABLE summary_usage DETACH PARTITION {name}", fetch=False)
+
+    def fetch_rows(self, name, batch_size=DB_STREAM_FETCH_SIZE):
+        # 区画の行を batch_size 件ずつのリストで返す。区画が大きくても全件をメモリに載せない
+        partition_month(name)
+        return self.db_manager.stream_query(f"SELECT * FROM {name} ORDER BY date, id", batch_size=batch_size)
+
+    def drop(self, name):
+        partition_month(name)
+        self.db_manager.execute_query(f"DROP TABLE IF EXISTS {name}", fetch=False)
+
+    def late_row_ids(self, before):
+        # before より前の日時で既定の区画に入っている行の id
+        if self.sqlite:
+            return []
+        rows = self.db_manager.execute_query(LATE_ROW_IDS_SQL, {"before": before})
+        return [row["id"] for row in rows]
+
+    def fetch_late_rows(self, ids, batch_size=DB_STREAM_FETCH_SIZE):
+        return self.db_manager.stream_query(LATE_ROWS_SQL, {"ids": ids}, batch_size=batch_size)
+
+    def delete_late_rows(self, ids):
+        self.db_manager.execute_query(DELETE_LATE_ROWS_SQL, {"ids": ids}, fetch=False)
@@ -0,0 +1,145 @@
+import datetime
+from functools import lru_cache
+
+import pytz
+
+from database.db import DatabaseManager, is_sqlite
+from database.sqlite_backend import next_value_sql
+from database.usage_rollups import ROLLUP_THROUGH_KEY
+from utils.model_catalog import classify_model
+
+JST = pytz.timezone('Asia/Tokyo')
+
+USAGE_COLUMNS = (
+    ("date", "TIMESTAMPTZ"),
+    ("app_type", "VARCHAR"),
+    ("document_types", "VARCHAR"),
+    ("model_detail", "VARCHAR"),
+    ("model_family", "VARCHAR"),
+    ("department", "VARCHAR"),
+    ("doctor", "VARCHAR"),
+    ("input_tokens", "INTEGER"),
+    ("output_tokens", "INTEGER"),
+    ("total_tokens", "INTEGER"),
+    ("processing_time", "DOUBLE PRECISION"),
+    ("status", "VARCHAR"),
+    ("started_at", "TIMESTAMPTZ"),
+    ("model_started_at", "TIMESTAMPTZ"),
+    ("finished_at", "TIMESTAMPTZ"),
+    ("event_id", "UUID"),
+)
+
+# 列ごとの配列を1回で渡し、複数行を1文で登録する。登録済みの event_id は再送されても無視する
+# 日次集計が済んだ日の行が後から届いた場合は、集計済みの日を戻して次回の集計でその日から集計し直す
+# 行が登録された日の更新番号を進め、その日を含む統計画面のキャッシュを使わないようにする
+INSERT_MANY_SQL = f"""
+    WITH inserted AS (
+        INSERT INTO summary_usage ({", ".join(name for name, _ in USAGE_COLUMNS)})
+        SELECT *
+        FROM unnest({", ".join(f"CAST(:{name} AS {sql_type}[])" for name, sql_type in USAGE_COLUMNS)})
+        ON CONFLICT (event_id, date) DO NOTHING
+        RETURNING date
+    ),
+    reopened AS (
+        UPDATE app_metadata
+        SET value = (SELECT (MIN(date AT TIME ZONE 'Asia/Tokyo')::date - 1)::text FROM inserted),
+            updated_at = CURRENT_TIMESTAMP
+        WHERE key = :rollup_key
+          AND value::date >= (SELECT MIN(date AT TIME ZONE 'Asia/Tokyo')::date FROM inserted)
+    ),
+    bumped AS (
+        INSERT INTO summary_usage_versions (day, version)
+        SELECT day, nextval('usage_version_seq')
+        FROM (SELECT DISTINCT (date AT TIME ZONE 'Asia/Tokyo')::date AS day FROM inserted) d
+        ON CONFLICT (day) DO UPDATE
+        SET version = EXCLUDED.version
+    )
+    SELECT COUNT(*) AS inserted FROM inserted
+"""
+
+# SQLite 用。配列を渡せないため複数行の VALUES で登録し、登録できた行の日から集計済みの日と更新番号を更新する
+# 1文のバインド変数の数の上限を超えないよう、この行数ごとに分ける
+SQLITE_INSERT_CHUNK_SIZE = 500
+
+
+@lru_cache(maxsize=64)
+def sqlite_insert_sql(row_count):
+    values = ", ".join(f"({', '.join(f':{name}_{index}' for name, _ in USAGE_COLUMNS)})" for index in range(row_count))
+    return f"""
+        INSERT INTO summary_usage ({", ".join(name for name, _ in USAGE_COLUMNS)})
+        VALUES {values}
+        ON CONFLICT (event_id, date) DO NOTHING
+        RETURNING date
+    """
+
+
+SQLITE_REOPEN_ROLLUP_SQL = """
+    UPDATE app_metadata
+    SET value = :through,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE key = :rollup_key AND value >= :first_day
+"""
+
+SQLITE_NEXT_USAGE_VERSION_SQL = next_value_sql("usage_version_seq")
+
+SQLITE_BUMP_VERSION_SQL = """
+    INSERT INTO summary_usage_versions (day, version) VALUES (:day, :version)
+    ON CONFLICT (day) DO UPDATE
+    SET version = excluded.version
+"""
+
+RANGE_VERSION_SQL = """
+    SELECT COALESCE(MAX(version), 0) AS version
+    FROM summary_usage_versions
+    WHERE day BETWEEN :start_day AND :end_day
+"""
+
+
+class UsageRepository:
+    def __init__(self, db_manager=None):
+        self.db_manager = db_manager or DatabaseManager.get_instance()
+        self.sqlite = is_sqlite(self.db_manager)
+
+    def insert_many(self, rows):
+        if not rows:
+            return 0
+        # model_family・status を持たない行 (旧形式の一時保存ファイルなど) はここで補う
+        rows = [{**row,
+                 "model_family": row.get("model_family") or classify_model(row.get("model_detail")),
+                 "status": row.get("status") or "success"}
+                for row in rows]
+        if self.sqlite:
+            return self._insert_many_sqlite(rows)
+        params = {name: [row.get(name) for row in rows] for name, _ in USAGE_COLUMNS}
+        result = self.db_manager.execute_query(INSERT_MANY_SQL, {**params, "rollup_key": ROLLUP_THROUGH_KEY})
+        return result[0]["inserted"] if result else 0
+
+    def _insert_many_sqlite(self, rows):
+        with self.db_manager.unit_of_work() as uow:
+            dates = []
+            for offset in range(0, len(rows), SQLITE_INSERT_CHUNK_SIZE):
+                chunk = rows[offset:offset + SQLITE_INSERT_CHUNK_SIZE]
+                params = {f"{name}_{index}": row.get(name)
+                          for index, row in enumerate(chunk) for name, _ in USAGE_COLUMNS}
+                dates += [row["date"] for row in uow.execute_query(sqlite_insert_sql(len(chunk)), params)]
+            if not dates:
+                return 0
+            # 日時は UTC の ISO 形式の文字列で保存されている
+            days = {datetime.datetime.fromisoformat(date).astimezone(JST).date() for date in dates}
+            first_day = min(days)
+            uow.execute_query(SQLITE_REOPEN_ROLLUP_SQL, {
+                "rollup_key": ROLLUP_THROUGH_KEY,
+                "first_day": first_day.isoformat(),
+                "through": (first_day - datetime.timedelta(days=1)).isoformat()
+            }, fetch=False)
+            for day in sorted(days):
+                version = uow.execute_query(SQLITE_NEXT_USAGE_VERSION_SQL)[0]["version"]
+                uow.execute_query(SQLITE_BUMP_VERSION_SQL, {"day": day, "version": version}, fetch=False)
+        return len(dates)
+
+    def range_version(self, start_day, end_day):
+        # 期間内のいずれかの日に行が登録されると大きくなる番号
+        # 集計と同じDBで確認し、レプリカの反映が遅れている間は古い集計のまま使い回す
+        rows = self.db_manager.execute_query(RANGE_VERSION_SQL, {"start_day": start_day, "end_day": end_day},
+                                             analytic=True)
+        return rows[0]["version"] if rows else 0
@@ -0,0 +1,174 @@
+from database.db import DatabaseManager, is_sqlite
+
+# 集計済みの最終日 (日本時間)。これより後の日は summary_usage の行から集計する
+ROLLUP_THROUGH_KEY = "usage_rollup_through"
+
+# アーカイブした月の翌月初 (日本時間)。これより前の日の行はDBに残っていないので、日次集計を集計し直さない
+ROLLUP_FROZEN_BEFORE_KEY = "usage_rollup_frozen_before"
+
+
+ROLLUP_STATE_SQL = """
+    SELECT GREATEST(
+               COALESCE((SELECT value::date FROM app_metadata WHERE key = :rollup_key), DATE '-infinity'),
+               (SELECT value::date - 1 FROM app_metadata WHERE key = :frozen_key)
+           ) AS through
+"""
+
+# 集計済みの翌日から昨日までの作成できた行を日単位で集計し直し、集計済みの日を進める
+# 集計中に過去の日の行が追加されて集計済みの日が戻された場合は、日を進めずに次回集計し直す
+# アーカイブした月の日は、遅れて登録された行だけで集計し直さないよう集計済みとして扱う
+REFRESH_ROLLUPS_SQL = """
+    WITH state AS (
+        SELECT GREATEST(
+                   COALESCE(
+                       (SELECT value::date FROM app_metadata WHERE key = :rollup_key),
+                       (SELECT MIN(date AT TIME ZONE 'Asia/Tokyo')::date - 1 FROM summary_usage)
+                   ),
+                   (SELECT value::date - 1 FROM app_metadata WHERE key = :frozen_key)
+               ) AS through,
+               (SELECT value FROM app_metadata WHERE key = :rollup_key) AS marker,
+               (now() AT TIME ZONE 'Asia/Tokyo')::date - 1 AS target
+    ),
+    rolled AS (
+        INSERT INTO summary_usage_daily AS d (day, department, doctor, document_types, model_family,
+                                              count, input_tokens, output_tokens, total_tokens, processing_time)
+        SELECT (u.date AT TIME ZONE 'Asia/Tokyo')::date,
+               COALESCE(u.department, 'default'),
+               COALESCE(u.doctor, 'default'),
+               COALESCE(u.document_types, ''),
+               u.model_family,
+               COUNT(*),
+               COALESCE(SUM(u.input_tokens), 0),
+               COALESCE(SUM(u.output_tokens), 0),
+               COALESCE(SUM(u.total_tokens), 0),
+               COALESCE(SUM(u.processing_time), 0)
+        FROM summary_usage u, state s
+        WHERE s.through < s.target
+          AND u.status = 'success'
+          AND u.date >= (s.through + 1)::timestamp AT TIME ZONE 'Asia/Tokyo'
+          AND u.date < (s.target + 1)::timestamp AT TIME ZONE 'Asia/Tokyo'
+        GROUP BY 1, 2, 3, 4, 5
+        ON CONFLICT (day, department, doctor, document_types, model_family) DO UPDATE
+        SET count = EXCLUDED.count,
+            input_tokens = EXCLUDED.input_tokens,
+            output_tokens = EXCLUDED.output_tokens,
+            total_tokens = EXCLUDED.total_tokens,
+            processing_time = EXCLUDED.processing_time
+        RETURNING 1
+    ),
+    marker AS (
+        INSERT INTO app_metadata AS m (key, value)
+        SELECT :rollup_key, s.target::text
+        FROM state s
+        WHERE s.target IS NOT NULL AND (s.through IS NULL OR s.through < s.target)
+        ON CONFLICT (key) DO UPDATE
+        SET value = EXCLUDED.value,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE m.value IS NOT DISTINCT FROM (SELECT marker FROM state)
+    )
+    SELECT (SELECT COUNT(*) FROM rolled) AS rolled, target AS through
+    FROM state
+"""
+
+# 区画を切り離す前に、その月より前の日の日次集計を確定させる。保持期間を延ばしても前には戻さない
+FREEZE_ROLLUPS_SQL = """
+    INSERT INTO app_metadata AS m (key, value)
+    VALUES (:frozen_key, :before)
+    ON CONFLICT (key) DO UPDATE
+    SET value = EXCLUDED.value,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE m.value::date < EXCLUDED.value::date
+"""
+
+# 集計済みの日は日次集計から、それより後 (今日を含む) は summary_usage の行から集計して合わせる
+# 合計 (is_total) と診療科・医師・文書名ごとの集計を GROUPING SETS で同時に求める
+SUMMARY_QUERY = """
+    WITH rollup_state AS ({rollup_state}),
+    combined AS (
+        SELECT department, doctor, NULLIF(document_types, '') AS document_types,
+               count, input_tokens, output_tokens, total_tokens, processing_time
+        FROM summary_usage_daily
+        WHERE day BETWEEN :start_day AND :end_day
+          AND day <= (SELECT through FROM rollup_state)
+          AND {rollup_clause}
+        UNION ALL
+        SELECT COALESCE(department, 'default'), COALESCE(doctor, 'default'), document_types,
+               1, input_tokens, output_tokens, total_tokens, processing_time
+        FROM summary_usage
+        WHERE date >= (SELECT (through + 1)::timestamp AT TIME ZONE 'Asia/Tokyo' FROM rollup_state)
+          AND {where_clause}
+    )
+    SELECT
+        GROUPING(department, doctor, document_types) <> 0 as is_total,
+        department,
+        doctor,
+        document_types,
+        COALESCE(SUM(count), 0) as count,
+        SUM(input_tokens) as input_tokens,
+        SUM(output_tokens) as output_tokens,
+        SUM(total_tokens) as total_tokens,
+        SUM(processing_time) as processing_time
+    FROM combined
+    GROUP BY GROUPING SETS ((department, doctor, document_types), ())
+    ORDER BY is_total DESC, count DESC
+"""
+
+
+# SQLite 用。日次集計は行わず、GROUPING SETS の代わりに合計の行を UNION ALL で加える
+SQLITE_SUMMARY_QUERY = """
+    WITH combined AS (
+        SELECT COALESCE(department, 'default') AS department, COALESCE(doctor, 'default') AS doctor,
+               document_types, input_tokens, output_tokens, total_tokens, processing_time
+        FROM summary_usage
+        WHERE {where_clause}
+    )
+    SELECT FALSE AS is_total, department, doctor, document_types,
+           COUNT(*) AS count,
+           SUM(input_tokens) AS input_tokens,
+           SUM(output_tokens) AS output_tokens,
+           SUM(total_tokens) AS total_tokens,
+           SUM(processing_time) AS processing_time
+    FROM combined
+    GROUP BY department, doctor, document_types
+    UNION ALL
+    SELECT TRUE, NULL, NULL, NULL, COUNT(*), SUM(input_tokens), SUM(output_tokens), SUM(total_tokens),
+           SUM(processing_time)
+    FROM combined
+    ORDER BY is_total DESC, count DESC
+"""
+
+
+def build_summary_query(where_clause, rollup_clause):
+    return SUMMARY_QUERY.format(rollup_state=ROLLUP_STATE_SQL, where_clause=where_clause,
+                                rollup_clause=rollup_clause)
+
+
+class UsageRollupRepository:
+    def __init__(self, db_manager=None):
+        self.db_manager = db_manager or DatabaseManager.get_instance()
+        self.sqlite = is_sqlite(self.db_manager)
+
+    def refresh(self):
+        if self.sqlite:
+            # 1台で動かす規模では summary_usage から直接集計するので、日次集計は作らない
+            return 0
+        rows = self.db_manager.execute_query(REFRESH_ROLLUPS_SQL, {
+            "rollup_key": ROLLUP_THROUGH_KEY, "frozen_key": ROLLUP_FROZEN_BEFORE_KEY
+        })
+        return rows[0]["rolled"] if rows else 0
+
+    def freeze(self, before):
+        # before (日本時間の日付) より前の日は、遅れて行が登録されても日次集計を変えない
+        if self.sqlite:
+            return
+        self.db_manager.execute_query(FREEZE_ROLLUPS_SQL, {
+            "frozen_key": ROLLUP_FROZEN_BEFORE_KEY, "before": before.isoformat()
+        }, fetch=False)
+
+    def summarize(self, where_clause, rollup_clause, params):
+        if self.sqlite:
+            return self.db_manager.execute_query(SQLITE_SUMMARY_QUERY.format(where_clause=where_clause), params,
+                                                 analytic=True)
+        return self.db_manager.execute_query(build_summary_query(where_clause, rollup_clause),
+                                             {**params, "rollup_key": ROLLUP_THROUGH_KEY,
+                                              "frozen_key": ROLLUP_FROZEN_BEFORE_KEY}, analytic=True)
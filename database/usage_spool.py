@@ -0,0 +1,117 @@
+import datetime
+import json
+import os
+import threading
+import time
+
+# JSON では文字列になるため、読み戻すときに日時へ戻す列
+DATETIME_FIELDS = ("date", "started_at", "model_started_at", "finished_at")
+
+
+def encode_row(row):
+    return json.dumps(row, ensure_ascii=False, default=_encode_value)
+
+
+def decode_row(line):
+    row = json.loads(line)
+    for name in DATETIME_FIELDS:
+        if row.get(name):
+            row[name] = datetime.datetime.fromisoformat(row[name])
+    return row
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return str(value)
+
+
+class UsageSpool:
+    """DBに書き込めなかった使用状況を1行1件のJSONで追記しておくファイル"""
+
+    def __init__(self, path, fsync_interval_ms=1000):
+        self.path = path
+        self.replay_path = f"{path}.replaying"
+        self.fsync_interval = fsync_interval_ms / 1000
+        self._lock = threading.Lock()
+        self._file = None
+        self._dirty = False
+        self._last_sync = 0.0
+
+    def append(self, rows, sync=True):
+        # fsync はまとめて行い、sync=False の追記は次の sync() か一定時間後の追記で確定する
+        if not rows:
+            return 0
+        data = "".join(encode_row(row) + "\n" for row in rows)
+        with self._lock:
+            if self._file is None:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(data)
+            self._file.flush()
+            self._dirty = True
+            if sync or time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync_locked()
+        return len(rows)
+
+    def sync(self):
+        with self._lock:
+            self._sync_locked()
+
+    def _sync_locked(self):
+        if self._file is None or not self._dirty:
+            return
+        os.fsync(self._file.fileno())
+        self._dirty = False
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            self._sync_locked()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def has_pending(self):
+        return os.path.exists(self.replay_path) or os.path.exists(self.path)
+
+    def replay(self, repository, batch_size=500):
+        # 追記中のファイルを付け替えてから読み込むので、再送中も新しい行は別ファイルに書ける
+        # 途中で失敗した場合は付け替えたファイルを残し、次回 event_id で重複を除いて再送する
+        with self._lock:
+            if not os.path.exists(self.replay_path):
+                if not os.path.exists(self.path):
+                    return 0
+                self._sync_locked()
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                os.replace(self.path, self.replay_path)
+
+        replayed = 0
+        batch = []
+        for row in self._read_rows(self.replay_path):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                replayed += repository.insert_many(batch)
+                batch = []
+        if batch:
+            replayed += repository.insert_many(batch)
+
+        os.remove(self.replay_path)
+        return replayed
+
+    @staticmethod
+    def _read_rows(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield decode_row(line)
+                except ValueError:
+                    # 書き込み途中で止まった末尾の行は読み飛ばす
+                    print(f"使用状況の退避ファイルに読み込めない行があります: {line[:100]}")
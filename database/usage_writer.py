@@ -0,0 +1,187 @@
+import atexit
+import queue
+import threading
+import time
+
+from database.usage_repository import UsageRepository
+from database.usage_spool import UsageSpool
+from utils.config import USAGE_WRITER_QUEUE_SIZE, USAGE_WRITER_BATCH_SIZE, USAGE_WRITER_FLUSH_INTERVAL_MS, \
+    USAGE_SPOOL_PATH, USAGE_SPOOL_FSYNC_INTERVAL_MS, USAGE_SPOOL_REPLAY_INTERVAL_MS
+
+
+class UsageWriter:
+    def __init__(self, max_queue_size=1000, batch_size=100, flush_interval_ms=1000, repository=None,
+                 spool=None, replay_interval_ms=30000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.replay_interval = replay_interval_ms / 1000
+        self._repository = repository
+        self._spool = spool
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._next_replay = 0.0
+        self._metrics = {
+            "enqueued": 0,
+            "written": 0,
+            "overflowed": 0,
+            "failed": 0,
+            "spooled": 0,
+            "replayed": 0,
+            "lost": 0,
+            "batches": 0,
+            "max_queue_depth": 0,
+            "last_flush_ms": None,
+            "last_error": None,
+        }
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name="usage-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, row):
+        # 画面の処理を待たせないよう、キューが満杯なら待たずに退避ファイルへ書き出す
+        if self._stop_event.is_set():
+            self._flush([row])
+            return True
+
+        self.start()
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            with self._lock:
+                self._metrics["overflowed"] += 1
+            return self._spool_rows([row], sync=False)
+
+        with self._lock:
+            self._metrics["enqueued"] += 1
+            self._metrics["max_queue_depth"] = max(self._metrics["max_queue_depth"], self._queue.qsize())
+        return True
+
+    def stop(self, timeout=10):
+        # 終了時はキューに残った行を書き込んでから止める
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self._spool is not None:
+            self._spool.close()
+
+    def metrics(self):
+        with self._lock:
+            return dict(self._metrics, queue_depth=self._queue.qsize())
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while not (self._stop_event.is_set() and self._queue.empty()):
+            timeout = self.flush_interval if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+            except queue.Empty:
+                self._idle()
+
+            if not batch:
+                continue
+            full = len(batch) >= self.batch_size
+            expired = time.monotonic() >= deadline
+            draining = self._stop_event.is_set() and self._queue.empty()
+            if full or expired or draining:
+                if self._flush(batch):
+                    self._replay(force=True)
+                batch, deadline = [], None
+
+        if batch:
+            self._flush(batch)
+
+    def _get_repository(self):
+        if self._repository is None:
+            self._repository = UsageRepository()
+        return self._repository
+
+    def _flush(self, batch):
+        start = time.perf_counter()
+        try:
+            self._get_repository().insert_many(batch)
+        except Exception as e:
+            print(f"使用状況の保存に失敗しました ({len(batch)}件): {str(e)}")
+            with self._lock:
+                self._metrics["failed"] += len(batch)
+                self._metrics["last_error"] = str(e)
+            self._spool_rows(batch)
+            return False
+
+        with self._lock:
+            self._metrics["written"] += len(batch)
+            self._metrics["batches"] += 1
+            self._metrics["last_flush_ms"] = (time.perf_counter() - start) * 1000
+        return True
+
+    def _spool_rows(self, rows, sync=True):
+        try:
+            if self._spool is None:
+                raise RuntimeError("退避ファイルが設定されていません")
+            self._spool.append(rows, sync=sync)
+        except Exception as e:
+            print(f"使用状況を退避できませんでした ({len(rows)}件): {str(e)}")
+            with self._lock:
+                self._metrics["lost"] += len(rows)
+                self._metrics["last_error"] = str(e)
+            return False
+
+        with self._lock:
+            self._metrics["spooled"] += len(rows)
+        return True
+
+    def _idle(self):
+        if self._spool is None:
+            return
+        try:
+            self._spool.sync()
+        except Exception as e:
+            print(f"使用状況の退避ファイルを確定できませんでした: {str(e)}")
+        self._replay()
+
+    def _replay(self, force=False):
+        # DBに書き込めた直後か、一定時間ごとに退避した行をまとめて再送する
+        if self._spool is None or (not force and time.monotonic() < self._next_replay):
+            return
+        self._next_replay = time.monotonic() + self.replay_interval
+        if not self._spool.has_pending():
+            return
+
+        try:
+            replayed = self._spool.replay(self._get_repository(), batch_size=self.batch_size)
+        except Exception as e:
+            print(f"退避した使用状況の再送に失敗しました: {str(e)}")
+            with self._lock:
+                self._metrics["last_error"] = str(e)
+            return
+
+        with self._lock:
+            self._metrics["replayed"] += replayed
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_usage_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = UsageWriter(
+                max_queue_size=USAGE_WRITER_QUEUE_SIZE,
+                batch_size=USAGE_WRITER_BATCH_SIZE,
+                flush_interval_ms=USAGE_WRITER_FLUSH_INTERVAL_MS,
+                spool=UsageSpool(USAGE_SPOOL_PATH, fsync_interval_ms=USAGE_SPOOL_FSYNC_INTERVAL_MS),
+                replay_interval_ms=USAGE_SPOOL_REPLAY_INTERVAL_MS
+            )
+            atexit.register(_writer.stop)
+        return _writer
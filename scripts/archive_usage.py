@@ -0,0 +1,29 @@
+"""
+保存期間を過ぎた summary_usage の月区画を Parquet に書き出してDBから削除し、先の月の区画を作成します。
+日次のスケジューラーから実行します。
+
+使い方:
+    DATABASE_URL=postgresql://... python -m scripts.archive_usage
+    DATABASE_URL=postgresql://... python -m scripts.archive_usage --retention-months 24
+"""
+import argparse
+
+from utils.config import USAGE_PARTITION_MONTHS_AHEAD, USAGE_RETENTION_MONTHS
+from utils.usage_retention import archive_expired_partitions, ensure_usage_partitions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="使用状況の区画の作成とアーカイブ")
+    parser.add_argument("--retention-months", type=int, default=USAGE_RETENTION_MONTHS,
+                        help="今月に加えてDBに残す月数")
+    parser.add_argument("--months-ahead", type=int, default=USAGE_PARTITION_MONTHS_AHEAD,
+                        help="先に作成しておく月数")
+    args = parser.parse_args()
+
+    created = ensure_usage_partitions(args.months_ahead)
+    archived = archive_expired_partitions(args.retention_months)
+    print(f"{created}件の区画を作成し、{len(archived)}件の区画をアーカイブしました: {', '.join(archived)}")
+
+
+if __name__ == "__main__":
+    main()
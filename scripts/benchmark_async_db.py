@@ -0,0 +1,118 @@
+"""
+同時に作成する利用者の数ごとに、DatabaseManager (スレッドで並行) と AsyncDatabaseManager
+(1つのイベントループで並行) の処理件数/秒と p95 の所要時間を比べます。
+
+1件の作成は、設定の読み取り・プロンプトの解決・AIの応答待ち (--provider-ms のスリープ)・設定の保存です。
+保存する設定はベンチマーク用の setting_id で登録し、最後に削除します。
+
+使い方:
+    DATABASE_URL=postgresql://... python -m scripts.benchmark_async_db --sessions 1 10 50 --iterations 20
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from database.async_db import AsyncDatabaseManager
+from database.db import DatabaseManager
+from database.prompt_repository import RESOLVE_SQL
+from utils.constants import DEFAULT_DOCUMENT_TYPE
+
+BENCHMARK_APP_TYPE = "benchmark"
+
+LOAD_SETTINGS_SQL = """
+    SELECT selected_department, selected_model, selected_document_type, selected_doctor
+    FROM app_settings
+    WHERE setting_id = :setting_id AND app_type = :app_type
+"""
+
+SAVE_SETTINGS_SQL = """
+    INSERT INTO app_settings (setting_id, app_type, selected_department, selected_model, updated_at)
+    VALUES (:setting_id, :app_type, 'default', 'Claude', CURRENT_TIMESTAMP)
+    ON CONFLICT (setting_id, app_type) DO UPDATE
+    SET updated_at = EXCLUDED.updated_at
+"""
+
+DELETE_SETTINGS_SQL = "DELETE FROM app_settings WHERE app_type = :app_type"
+
+RESOLVE_PARAMS = {
+    "department": "default", "document_type": DEFAULT_DOCUMENT_TYPE, "doctor": "default",
+    "default_document_type": DEFAULT_DOCUMENT_TYPE
+}
+
+
+def settings_params(session):
+    return {"setting_id": f"benchmark-{session}", "app_type": BENCHMARK_APP_TYPE}
+
+
+def generate_sync(db_manager, session, provider_seconds):
+    started = time.perf_counter()
+    db_manager.execute_query(LOAD_SETTINGS_SQL, settings_params(session))
+    db_manager.execute_query(RESOLVE_SQL, RESOLVE_PARAMS)
+    time.sleep(provider_seconds)
+    db_manager.execute_query(SAVE_SETTINGS_SQL, settings_params(session), fetch=False)
+    return time.perf_counter() - started
+
+
+async def generate_async(db_manager, session, provider_seconds):
+    started = time.perf_counter()
+    await db_manager.execute_query(LOAD_SETTINGS_SQL, settings_params(session))
+    await db_manager.execute_query(RESOLVE_SQL, RESOLVE_PARAMS)
+    await asyncio.sleep(provider_seconds)
+    await db_manager.execute_query(SAVE_SETTINGS_SQL, settings_params(session), fetch=False)
+    return time.perf_counter() - started
+
+
+def run_sync(sessions, iterations, provider_seconds):
+    db_manager = DatabaseManager.get_instance()
+
+    def worker(session):
+        return [generate_sync(db_manager, session, provider_seconds) for _ in range(iterations)]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as executor:
+        timings = [seconds for result in executor.map(worker, range(sessions)) for seconds in result]
+    return time.perf_counter() - started, timings
+
+
+async def run_async(sessions, iterations, provider_seconds):
+    db_manager = AsyncDatabaseManager.get_instance()
+
+    async def worker(session):
+        return [await generate_async(db_manager, session, provider_seconds) for _ in range(iterations)]
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*[worker(session) for session in range(sessions)])
+    elapsed = time.perf_counter() - started
+    await db_manager.dispose()
+    return elapsed, [seconds for result in results for seconds in result]
+
+
+def report(label, sessions, elapsed, timings):
+    timings = sorted(timings)
+    p95 = timings[max(int(len(timings) * 0.95) - 1, 0)]
+    print(f"{label:<8} {sessions:>8} {len(timings) / elapsed:>12.1f} {statistics.mean(timings) * 1000:>12.1f} "
+          f"{p95 * 1000:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="同期・非同期のDBアクセスの同時実行のベンチマーク")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--provider-ms", type=float, default=50, help="AIの応答待ちとして眠る時間")
+    args = parser.parse_args()
+    provider_seconds = args.provider_ms / 1000
+
+    print(f"{'方式':<8} {'同時数':>8} {'件/秒':>12} {'平均(ms)':>12} {'p95(ms)':>12}")
+    try:
+        for sessions in args.sessions:
+            report("sync", sessions, *run_sync(sessions, args.iterations, provider_seconds))
+            report("async", sessions, *asyncio.run(run_async(sessions, args.iterations, provider_seconds)))
+    finally:
+        DatabaseManager.get_instance().execute_query(DELETE_SETTINGS_SQL, {"app_type": BENCHMARK_APP_TYPE},
+                                                     fetch=False)
+
+
+if __name__ == "__main__":
+    main()
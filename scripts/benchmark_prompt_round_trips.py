@@ -0,0 +1,81 @@
+"""
+1回の文書作成で発生するプロンプト関連のDBラウンドトリップ数を計測します。
+
+使い方:
+    DATABASE_URL=postgresql://... python -m scripts.benchmark_prompt_round_trips --generations 100
+"""
+import argparse
+import time
+
+from sqlalchemy import event, text
+
+from database.db import DatabaseManager
+from utils import prompt_manager
+from utils.constants import DEFAULT_DOCUMENT_TYPE
+
+# 1回の作成で get_prompt が呼ばれる箇所
+# determine_final_model / BaseAPIClient.get_model_name / create_summary_prompt
+LOOKUPS_PER_GENERATION = 3
+
+
+class RoundTripCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+
+def legacy_get_prompt(db_manager, department, document_type, doctor):
+    # 変更前の get_prompt と同じ2段階のSELECT
+    prompt = db_manager.execute_query(
+        "SELECT * FROM prompts WHERE department = :department AND document_type = :document_type AND doctor = :doctor",
+        {"department": department, "document_type": document_type, "doctor": doctor}
+    )
+    if not prompt:
+        prompt = db_manager.execute_query(
+            "SELECT * FROM prompts WHERE department = 'default' AND document_type = :document_type "
+            "AND doctor = 'default' AND is_default = true",
+            {"document_type": DEFAULT_DOCUMENT_TYPE}
+        )
+    return prompt[0] if prompt else None
+
+
+def run(label, lookup, counter, generations, key):
+    counter.count = 0
+    start = time.perf_counter()
+    for _ in range(generations):
+        for _ in range(LOOKUPS_PER_GENERATION):
+            lookup(*key)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {counter.count / generations:>8.2f} {elapsed / generations * 1000:>12.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="プロンプト取得のラウンドトリップ数ベンチマーク")
+    parser.add_argument("--generations", type=int, default=100)
+    parser.add_argument("--department", default="眼科")
+    parser.add_argument("--document-type", default="返書")
+    parser.add_argument("--doctor", default="存在しない医師")
+    args = parser.parse_args()
+
+    db_manager = DatabaseManager.get_instance()
+    with db_manager.get_engine().connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+    counter = RoundTripCounter(db_manager.get_engine())
+    repository = prompt_manager.get_prompt_repository()
+    key = (args.department, args.document_type, args.doctor)
+
+    print(f"{'方式':<28} {'往復/作成':>8} {'ms/作成':>12}")
+    run("変更前 (2段階SELECT)", lambda *k: legacy_get_prompt(db_manager, *k), counter, args.generations, key)
+    run("リポジトリ (1文で解決)", repository.resolve, counter, args.generations, key)
+
+    prompt_manager.invalidate_prompt_cache()
+    run("キャッシュ (初回読み込み)", prompt_manager.get_prompt, counter, 1, key)
+    run("キャッシュ (読み込み済み)", prompt_manager.get_prompt, counter, args.generations, key)
+
+
+if __name__ == "__main__":
+    main()
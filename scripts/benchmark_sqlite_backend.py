@@ -0,0 +1,105 @@
+"""
+プロンプトと使用状況の読み書きにかかる時間を PostgreSQL と SQLite で比べます。
+
+PostgreSQL には作成済みのスキーマを使い、ベンチマーク用に登録した行は最後に削除します。
+SQLite は一時ファイルに表を作って計測します。
+
+使い方:
+    python -m scripts.benchmark_sqlite_backend --postgres-url postgresql://... --iterations 200
+"""
+import argparse
+import datetime
+import os
+import statistics
+import tempfile
+import time
+import uuid
+
+import pytz
+
+from database.db import DatabaseManager
+from database.prompt_repository import PromptRepository
+from database.sqlite_backend import create_sqlite_tables
+from database.usage_repository import UsageRepository
+from utils.constants import DEFAULT_DOCUMENT_TYPE
+
+JST = pytz.timezone('Asia/Tokyo')
+
+BENCHMARK_DEPARTMENT = "ベンチマーク"
+BENCHMARK_APP_TYPE = "benchmark"
+
+
+def connect(database_url):
+    # DatabaseManager は1プロセスに1つの接続先を持つため、接続先ごとに作り直す
+    if DatabaseManager._engine is not None:
+        DatabaseManager._engine.dispose()
+    DatabaseManager._instance = None
+    DatabaseManager._engine = None
+    DatabaseManager._session_factory = None
+    os.environ["DATABASE_URL"] = database_url
+    return DatabaseManager.get_instance()
+
+
+def usage_rows(count):
+    now = datetime.datetime.now(JST)
+    return [{
+        "date": now, "app_type": BENCHMARK_APP_TYPE, "document_types": DEFAULT_DOCUMENT_TYPE,
+        "model_detail": "claude-sonnet", "department": BENCHMARK_DEPARTMENT, "doctor": "default",
+        "input_tokens": 1000, "output_tokens": 500, "total_tokens": 1500, "processing_time": 1.0,
+        "started_at": now, "model_started_at": now, "finished_at": now, "event_id": str(uuid.uuid4())
+    } for _ in range(count)]
+
+
+def measure(operation, iterations):
+    timings = []
+    for index in range(iterations):
+        start = time.perf_counter()
+        operation(index)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return statistics.mean(timings), timings[int(len(timings) * 0.95) - 1]
+
+
+def run(label, db_manager, iterations, batch_size):
+    prompts = PromptRepository(db_manager)
+    usage = UsageRepository(db_manager)
+    prompts.upsert(BENCHMARK_DEPARTMENT, DEFAULT_DOCUMENT_TYPE, "default", "ベンチマーク用の指示")
+
+    results = [
+        ("プロンプトの解決", measure(
+            lambda i: prompts.resolve(BENCHMARK_DEPARTMENT, DEFAULT_DOCUMENT_TYPE, "default"), iterations)),
+        ("プロンプトの更新", measure(
+            lambda i: prompts.upsert(BENCHMARK_DEPARTMENT, DEFAULT_DOCUMENT_TYPE, "default", f"指示 {i}"),
+            iterations)),
+        ("使用状況の登録 (1件)", measure(lambda i: usage.insert_many(usage_rows(1)), iterations)),
+        (f"使用状況の登録 ({batch_size}件)", measure(
+            lambda i: usage.insert_many(usage_rows(batch_size)), max(iterations // 10, 1))),
+    ]
+    for name, (mean_ms, p95_ms) in results:
+        print(f"{label:<12} {name:<24} {mean_ms:>10.3f} {p95_ms:>10.3f}")
+
+    prompts.delete(BENCHMARK_DEPARTMENT, DEFAULT_DOCUMENT_TYPE, "default")
+    db_manager.execute_query("DELETE FROM summary_usage WHERE app_type = :app_type",
+                             {"app_type": BENCHMARK_APP_TYPE}, fetch=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PostgreSQL と SQLite の読み書きのベンチマーク")
+    parser.add_argument("--postgres-url", default=os.environ.get("DATABASE_URL"))
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+
+    print(f"{'DB':<12} {'処理':<24} {'平均(ms)':>10} {'p95(ms)':>10}")
+    if args.postgres_url:
+        run("PostgreSQL", connect(args.postgres_url), args.iterations, args.batch_size)
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_manager = connect(f"sqlite:///{os.path.join(directory, 'benchmark.db')}")
+        create_sqlite_tables(db_manager.get_engine())
+        run("SQLite", db_manager, args.iterations, args.batch_size)
+        db_manager.get_engine().dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+統計画面の明細を st.dataframe に渡す表にするまでの時間を、変更前の行ごとの処理と比べます。
+既定では合成した行で比べ、--from-db を付けると summary_usage から読み込むところから比べます。
+
+使い方:
+    python -m scripts.benchmark_statistics_render --rows 100000
+    DATABASE_URL=postgresql://... python -m scripts.benchmark_statistics_render --rows 100000 --from-db
+"""
+import argparse
+import datetime
+import random
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pytz
+
+from services.statistics_service import RECORD_COLUMNS, RECORDS_PAGE_QUERY, StatisticsFilter, format_usage_records
+from utils.constants import MODEL_MAPPING, DEFAULT_MODEL_FAMILY
+
+JST = pytz.timezone('Asia/Tokyo')
+
+
+def synthetic_rows(count):
+    start = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+    models = ["gemini-2.5-pro", "gemini-2.5-flash", "claude-3-7-sonnet"]
+    families = ["Gemini_Pro", "Gemini_Flash", "Claude"]
+    rows = []
+    for i in range(count):
+        model = i % 3
+        rows.append((
+            count - i,
+            start + datetime.timedelta(minutes=5 * (count - i)),
+            random.choice(["他院への紹介", "返書", None]),
+            models[model],
+            families[model],
+            random.choice(["default", "眼科"]),
+            random.choice(["default", "橋本義弘"]),
+            random.randint(1000, 20000),
+            random.randint(100, 2000),
+            random.uniform(1, 60),
+        ))
+    return rows
+
+
+def legacy_render(records):
+    # 変更前の usage_statistics_ui と同じ、行ごとの分類・日時変換・表示名の置き換え
+    detail_data = []
+    for record in records:
+        model_detail = str(record.get("model_detail", "")).lower()
+        model_info = DEFAULT_MODEL_FAMILY
+
+        for model_name, config in MODEL_MAPPING.items():
+            pattern = config["pattern"]
+            exclude = config["exclude"]
+
+            if pattern in model_detail:
+                if exclude and exclude in model_detail:
+                    continue
+                model_info = model_name
+                break
+
+        jst_date = record["date"].astimezone(JST) if record["date"].tzinfo else JST.localize(record["date"])
+
+        detail_data.append({
+            "作成日": jst_date.strftime("%Y/%m/%d"),
+            "文書名": record.get("document_types") or "不明",
+            "診療科": "全科共通" if record.get("department") == "default" else record.get("department"),
+            "医師名": "医師共通" if record.get("doctor") == "default" else record.get("doctor"),
+            "AIモデル": model_info,
+            "入力トークン": record["input_tokens"],
+            "出力トークン": record["output_tokens"],
+            "処理時間(秒)": round(record["processing_time"] or 0),
+        })
+    return pd.DataFrame(detail_data)
+
+
+def columnar_render(records):
+    records["date"] = pd.to_datetime(records["date"], utc=True)
+    return format_usage_records(records)
+
+
+def measure(label, load, render, repeat):
+    elapsed = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        frame = render(load())
+        # st.dataframe は受け取った表を Arrow に変換して送るので、その時間も含める
+        pa.Table.from_pandas(frame, preserve_index=False)
+        elapsed.append(time.perf_counter() - start)
+    print(f"{label:<12} {len(frame):>10} {min(elapsed) * 1000:>12.1f} {sorted(elapsed)[len(elapsed) // 2] * 1000:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="統計画面の明細の表示時間ベンチマーク")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--from-db", action="store_true", help="summary_usage から読み込むところから計測する")
+    args = parser.parse_args()
+
+    if args.from_db:
+        from database.db import DatabaseManager
+
+        db_manager = DatabaseManager.get_instance()
+        filters = StatisticsFilter(datetime.date(1970, 1, 1), datetime.date(2100, 12, 31))
+        query = RECORDS_PAGE_QUERY.format(where_clause=filters.where_clause)
+        params = {**filters.params, "limit": args.rows}
+
+        def load_rows():
+            return db_manager.execute_query(query, params)
+
+        def load_frame():
+            return db_manager.query_frame(query, params)
+    else:
+        rows = synthetic_rows(args.rows)
+
+        def load_rows():
+            return [dict(zip(RECORD_COLUMNS, row)) for row in rows]
+
+        def load_frame():
+            return pd.DataFrame.from_records(rows, columns=RECORD_COLUMNS)
+
+    print(f"{'方式':<12} {'行数':>10} {'最小(ms)':>12} {'中央値(ms)':>12}")
+    measure("行ごと", load_rows, legacy_render, args.repeat)
+    measure("列単位", load_frame, columnar_render, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+使用状況の出力で、全件を読み込んでから書き出す場合と、サーバー側カーソルで一定件数ずつ
+読みながら書き出す場合の所要時間と最大メモリ使用量を比べます。
+
+ベンチマーク用の行を summary_usage に登録し、最後に削除します。
+
+使い方:
+    DATABASE_URL=postgresql://... python -m scripts.benchmark_streaming_export --rows 200000
+"""
+import argparse
+import datetime
+import os
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+import pytz
+
+from database.db import DatabaseManager
+from services.statistics_service import (
+    RECORDS_QUERY, StatisticsFilter, export_usage_records, write_records_csv
+)
+
+JST = pytz.timezone('Asia/Tokyo')
+
+BENCHMARK_DOCUMENT_TYPE = "ベンチマーク"
+
+INSERT_ROWS_SQL = """
+    INSERT INTO summary_usage (date, app_type, document_types, model_detail, model_family, department, doctor,
+                               input_tokens, output_tokens, total_tokens, processing_time, event_id)
+    SELECT :start + i * INTERVAL '1 second', 'benchmark', :document_type, 'claude-sonnet', 'Claude', '内科',
+           'default', 1000, 500, 1500, 1.5, gen_random_uuid()
+    FROM generate_series(1, :rows) AS i
+"""
+
+DELETE_ROWS_SQL = "DELETE FROM summary_usage WHERE document_types = :document_type"
+
+
+def export_materialized(filters, path, db_manager):
+    # 変更前の方式に相当する。全件を1つの DataFrame に読み込んでから書き出す
+    query = RECORDS_QUERY.format(where_clause=filters.where_clause)
+    records = db_manager.query_frame(query, filters.params, analytic=True)
+    records["date"] = pd.to_datetime(records["date"], utc=True)
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        return write_records_csv([records], f)
+
+
+def measure(label, export, filters, db_manager):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "usage.csv")
+        tracemalloc.start()
+        start = time.perf_counter()
+        written = export(filters, path, db_manager)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    print(f"{label:<24} {written:>10} {elapsed:>10.2f} {peak / 1024 / 1024:>14.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="使用状況の出力のメモリ使用量のベンチマーク")
+    parser.add_argument("--rows", type=int, default=200000)
+    args = parser.parse_args()
+
+    db_manager = DatabaseManager.get_instance()
+    start = datetime.datetime.now(JST).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    db_manager.execute_query(INSERT_ROWS_SQL, {
+        "start": start, "rows": args.rows, "document_type": BENCHMARK_DOCUMENT_TYPE
+    }, fetch=False)
+
+    filters = StatisticsFilter(start.date(), datetime.datetime.now(JST).date() + datetime.timedelta(days=31),
+                               selected_document_type=BENCHMARK_DOCUMENT_TYPE)
+    try:
+        print(f"{'方式':<24} {'件数':>10} {'秒':>10} {'最大メモリ(MB)':>14}")
+        measure("全件を読み込む", export_materialized, filters, db_manager)
+        measure("サーバー側カーソル", lambda f, p, db: export_usage_records(f, "CSV", p, db), filters, db_manager)
+    finally:
+        db_manager.execute_query(DELETE_ROWS_SQL, {"document_type": BENCHMARK_DOCUMENT_TYPE}, fetch=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+複数の文を別々に実行した場合と、1つの unit of work で実行した場合の
+チェックアウト数・コミット数・所要時間を比べます。
+
+使い方:
+    DATABASE_URL=postgresql://... python -m scripts.benchmark_unit_of_work --repeat 200
+"""
+import argparse
+import time
+
+from sqlalchemy import event, text
+
+from database.db import DatabaseManager
+
+# 統計ページの1回の表示と同じく、同じ期間に対して続けて実行する読み取り
+READ_STATEMENTS = [
+    "SELECT COUNT(*) AS count FROM summary_usage WHERE date >= NOW() - INTERVAL '7 days'",
+    "SELECT COALESCE(SUM(input_tokens), 0) AS tokens FROM summary_usage WHERE date >= NOW() - INTERVAL '7 days'",
+    "SELECT model_family, COUNT(*) AS count FROM summary_usage "
+    "WHERE date >= NOW() - INTERVAL '7 days' GROUP BY model_family",
+    "SELECT document_types, COUNT(*) AS count FROM summary_usage "
+    "WHERE date >= NOW() - INTERVAL '7 days' GROUP BY document_types",
+]
+
+
+class TransactionCounter:
+    def __init__(self, engine):
+        self.commits = 0
+        self.statements = 0
+        event.listen(engine, "commit", self._on_commit)
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_commit(self, conn):
+        self.commits += 1
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements += 1
+
+    def reset(self):
+        self.commits = 0
+        self.statements = 0
+
+
+def checkouts(db_manager):
+    return db_manager.pool_metrics()["primary"]["checkouts"]
+
+
+def run(label, work, db_manager, counter, repeat):
+    counter.reset()
+    before = checkouts(db_manager)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        work()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<24} {(checkouts(db_manager) - before) / repeat:>10.2f} {counter.commits / repeat:>8.2f} "
+          f"{counter.statements / repeat:>6.2f} {elapsed / repeat * 1000:>10.3f}")
+
+
+def separate(db_manager):
+    for query in READ_STATEMENTS:
+        db_manager.execute_query(query)
+
+
+def batched(db_manager):
+    with db_manager.unit_of_work() as uow:
+        for query in READ_STATEMENTS:
+            uow.execute_query(query)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="unit of work のラウンドトリップ・コミット数ベンチマーク")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    db_manager = DatabaseManager.get_instance()
+    with db_manager.get_engine().connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+    counter = TransactionCounter(db_manager.get_engine())
+    print(f"{'方式':<24} {'チェックアウト':>10} {'コミット':>8} {'文':>6} {'ms/回':>10}")
+    run("別々に実行", lambda: separate(db_manager), db_manager, counter, args.repeat)
+    run("unit of work", lambda: batched(db_manager), db_manager, counter, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
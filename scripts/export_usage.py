@@ -0,0 +1,32 @@
+"""
+summary_usage の明細を期間で絞り込み、CSV または Parquet に書き出します。
+一定件数ずつ読みながら書き出すため、全件をメモリに載せません。
+
+使い方:
+    DATABASE_URL=postgresql://... python -m scripts.export_usage --start 2025-04-01 --end 2025-06-30 --output usage.csv
+    DATABASE_URL=postgresql://... python -m scripts.export_usage --start 2025-04-01 --end 2025-06-30 \
+        --format Parquet --output usage.parquet
+"""
+import argparse
+import datetime
+
+from services.statistics_service import EXPORT_FORMATS, StatisticsFilter, export_usage_records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="使用状況の明細の書き出し")
+    parser.add_argument("--start", type=datetime.date.fromisoformat, required=True, help="開始日 (YYYY-MM-DD)")
+    parser.add_argument("--end", type=datetime.date.fromisoformat, required=True, help="終了日 (YYYY-MM-DD)")
+    parser.add_argument("--format", choices=list(EXPORT_FORMATS), default="CSV", help="出力形式")
+    parser.add_argument("--model", default="すべて", help="AIモデル")
+    parser.add_argument("--document-type", default="すべて", help="文書名")
+    parser.add_argument("--output", required=True, help="出力先のファイル")
+    args = parser.parse_args()
+
+    filters = StatisticsFilter(args.start, args.end, args.model, args.document_type)
+    written = export_usage_records(filters, args.format, args.output)
+    print(f"{written}件を {args.output} に書き出しました")
+
+
+if __name__ == "__main__":
+    main()
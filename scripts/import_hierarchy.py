@@ -0,0 +1,50 @@
+"""
+診療科・医師・文書名をCSVから一括登録します。登録済みの行はそのまま残ります。
+
+使い方:
+    DATABASE_URL=postgresql://... python -m scripts.import_hierarchy --doctors doctors.csv
+    DATABASE_URL=postgresql://... python -m scripts.import_hierarchy --document-types document_types.csv
+
+CSVの形式 (1行目は見出し):
+    doctors.csv         診療科,医師名
+    document_types.csv  文書名,紹介目的
+"""
+import argparse
+import csv
+
+from utils.hierarchy_manager import import_hierarchy
+
+
+def read_pairs(path):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        pairs = []
+        for row in reader:
+            if not row or not row[0].strip():
+                continue
+            second = row[1].strip() if len(row) > 1 and row[1].strip() else None
+            pairs.append((row[0].strip(), second))
+        return pairs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="診療科・医師・文書名の一括登録")
+    parser.add_argument("--doctors", help="診療科,医師名 のCSV")
+    parser.add_argument("--document-types", help="文書名,紹介目的 のCSV")
+    args = parser.parse_args()
+
+    if not args.doctors and not args.document_types:
+        parser.error("--doctors か --document-types を指定してください")
+
+    doctors = []
+    if args.doctors:
+        doctors = [(department, doctor or "default") for department, doctor in read_pairs(args.doctors)]
+    document_types = read_pairs(args.document_types) if args.document_types else []
+
+    changed = import_hierarchy(doctors, document_types)
+    print(f"{len(doctors)}件の医師、{len(document_types)}件の文書名を読み込み、{changed}件を登録しました")
+
+
+if __name__ == "__main__":
+    main()
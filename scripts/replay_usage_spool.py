@@ -0,0 +1,32 @@
+"""
+DBに書き込めず退避ファイルに残った使用状況を summary_usage へ再送します。
+登録済みの行は event_id で除かれるため、何度実行しても重複しません。
+
+使い方:
+    DATABASE_URL=postgresql://... python -m scripts.replay_usage_spool
+    DATABASE_URL=postgresql://... python -m scripts.replay_usage_spool --path spool/usage.jsonl
+"""
+import argparse
+
+from database.usage_repository import UsageRepository
+from database.usage_spool import UsageSpool
+from utils.config import USAGE_SPOOL_PATH
+
+
+def main():
+    parser = argparse.ArgumentParser(description="退避した使用状況の再送")
+    parser.add_argument("--path", default=USAGE_SPOOL_PATH, help="退避ファイルのパス")
+    parser.add_argument("--batch-size", type=int, default=500, help="1回の登録で送る件数")
+    args = parser.parse_args()
+
+    spool = UsageSpool(args.path)
+    if not spool.has_pending():
+        print("再送する使用状況はありません")
+        return
+
+    replayed = spool.replay(UsageRepository(), batch_size=args.batch_size)
+    print(f"{replayed}件の使用状況を再送しました")
+
+
+if __name__ == "__main__":
+    main()
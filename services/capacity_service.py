@@ -0,0 +1,184 @@
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+from database.db import DatabaseManager, is_sqlite
+from services.statistics_service import JST, StatisticsFilter, cached_statistics
+
+NANOSECONDS_PER_SECOND = 1_000_000_000
+NANOSECONDS_PER_MINUTE = 60 * NANOSECONDS_PER_SECOND
+NANOSECONDS_PER_HOUR = 60 * NANOSECONDS_PER_MINUTE
+
+WEEKDAYS = ["月", "火", "水", "木", "金", "土", "日"]
+
+# 失敗・時間切れの作成も処理枠を使うので含める。開始時刻を持たない旧データは終了時刻と処理時間から求める
+USAGE_INTERVALS_QUERY = """
+    SELECT
+        model_family,
+        COALESCE(started_at, COALESCE(finished_at, date) - COALESCE(processing_time, 0) * INTERVAL '1 second')
+            AS started_at,
+        model_started_at,
+        COALESCE(finished_at, date) AS finished_at,
+        COALESCE(input_tokens, 0) + COALESCE(output_tokens, 0) AS tokens
+    FROM summary_usage
+    WHERE {where_clause}
+"""
+
+# SQLite 用。時間の加減算をDB側で行えないため、開始時刻の補完は読んだ後に行う
+SQLITE_USAGE_INTERVALS_QUERY = """
+    SELECT
+        model_family,
+        started_at,
+        model_started_at,
+        COALESCE(finished_at, date) AS finished_at,
+        COALESCE(processing_time, 0) AS processing_time,
+        COALESCE(input_tokens, 0) + COALESCE(output_tokens, 0) AS tokens
+    FROM summary_usage
+    WHERE {where_clause}
+"""
+
+
+def get_usage_intervals(filters: StatisticsFilter, db_manager=None) -> pd.DataFrame:
+    db_manager = db_manager or DatabaseManager.get_instance()
+    sqlite = is_sqlite(db_manager)
+    query = SQLITE_USAGE_INTERVALS_QUERY if sqlite else USAGE_INTERVALS_QUERY
+    intervals = db_manager.query_frame(query.format(where_clause=filters.usage_clause), filters.params, analytic=True)
+    for column in ("started_at", "model_started_at", "finished_at"):
+        intervals[column] = pd.to_datetime(intervals[column], utc=True, format="ISO8601" if sqlite else None)
+    if sqlite:
+        estimated = intervals["finished_at"] - pd.to_timedelta(intervals.pop("processing_time"), unit="s")
+        intervals["started_at"] = intervals["started_at"].fillna(estimated)
+    return intervals
+
+
+def to_nanoseconds(values: pd.DatetimeIndex) -> np.ndarray:
+    return values.as_unit("ns").to_numpy(dtype="datetime64[ns]").view("int64")
+
+
+def concurrency_timeline(starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # 開始を +1、終了を -1 の事象として時刻順に並べ、累積和で各事象の直後の同時実行数を求める
+    # 同じ時刻では終了を先に数え、終わった直後に始まった作成を同時とはみなさない
+    times = np.concatenate([ends, starts])
+    deltas = np.concatenate([np.full(len(ends), -1, dtype=np.int64), np.ones(len(starts), dtype=np.int64)])
+    order = np.argsort(times, kind="stable")
+    return times[order], np.cumsum(deltas[order])
+
+
+def hourly_peak_concurrency(starts: np.ndarray, ends: np.ndarray) -> pd.Series:
+    # 毎時0分に増減0の事象を置いて時間ごとに区切り、1時間まるごと続いた作成もその時間の最大値に数える
+    if len(starts) == 0:
+        return pd.Series(dtype="int64")
+    first_hour = starts.min() // NANOSECONDS_PER_HOUR * NANOSECONDS_PER_HOUR
+    boundaries = np.arange(first_hour, ends.max() + 1, NANOSECONDS_PER_HOUR, dtype=np.int64)
+
+    times = np.concatenate([ends, boundaries, starts])
+    deltas = np.concatenate([np.full(len(ends), -1, dtype=np.int64),
+                             np.zeros(len(boundaries), dtype=np.int64),
+                             np.ones(len(starts), dtype=np.int64)])
+    order = np.argsort(times, kind="stable")
+    levels = np.cumsum(deltas[order])
+
+    # 時刻順なので同じ時間の事象は連続する。区切りごとの最大値をまとめて求める
+    hours = times[order] // NANOSECONDS_PER_HOUR * NANOSECONDS_PER_HOUR
+    heads = np.flatnonzero(np.r_[True, hours[1:] != hours[:-1]])
+    index = pd.to_datetime(hours[heads], utc=True).tz_convert(JST).tz_localize(None)
+    return pd.Series(np.maximum.reduceat(levels, heads), index=index)
+
+
+def peak_by_hour_of_week(hourly_peaks: pd.Series) -> pd.DataFrame:
+    # 曜日 × 時間 ごとに、期間中で最も多かった同時実行数
+    table = np.zeros((7, 24), dtype=np.int64)
+    if not hourly_peaks.empty:
+        hours = pd.DatetimeIndex(hourly_peaks.index).to_series().dt
+        peaks = hourly_peaks.groupby([hours.dayofweek.to_numpy(), hours.hour.to_numpy()]).max()
+        table[peaks.index.get_level_values(0), peaks.index.get_level_values(1)] = peaks.to_numpy()
+    return pd.DataFrame(table, index=pd.Index(WEEKDAYS), columns=pd.Index([f"{hour}時" for hour in range(24)]))
+
+
+def peak_per_minute(starts: np.ndarray, weights=None) -> float:
+    # 開始した分ごとの件数 (weights を渡した場合はその合計) の最大値
+    if len(starts) == 0:
+        return 0
+    _, minute_index = np.unique(starts // NANOSECONDS_PER_MINUTE, return_inverse=True)
+    return np.bincount(minute_index, weights=weights).max()
+
+
+def summarize_capacity(intervals: pd.DataFrame) -> pd.DataFrame:
+    # モデルごとと全体の、最大同時実行数・1分あたりの最大リクエスト数と最大トークン数
+    groups = [(family, rows) for family, rows in intervals.groupby("model_family")]
+    groups.append(("合計", intervals))
+
+    rows = []
+    for family, group in groups:
+        starts = to_nanoseconds(pd.DatetimeIndex(group["started_at"]))
+        ends = np.maximum(to_nanoseconds(pd.DatetimeIndex(group["finished_at"])), starts)
+        _, levels = concurrency_timeline(starts, ends)
+        busy_seconds = (ends - starts).sum() / NANOSECONDS_PER_SECOND
+        span_seconds = (ends.max() - starts.min()) / NANOSECONDS_PER_SECOND if len(starts) else 0
+        rows.append({
+            "model_family": family,
+            "requests": len(group),
+            "peak_concurrency": int(levels.max()) if len(levels) else 0,
+            "mean_concurrency": busy_seconds / span_seconds if span_seconds else 0.0,
+            "peak_requests_per_minute": int(peak_per_minute(starts)),
+            "peak_tokens_per_minute": int(peak_per_minute(starts, group["tokens"].to_numpy(dtype="float64"))),
+        })
+    return pd.DataFrame(rows)
+
+
+def summarize_wait_times(intervals: pd.DataFrame) -> pd.DataFrame:
+    # 作成開始からモデル呼び出しまでの待ち時間と、モデルの処理時間。記録のない旧データは含めない
+    timed = intervals.dropna(subset=["model_started_at"])
+    durations = pd.DataFrame({
+        "model_family": timed["model_family"],
+        "wait": (timed["model_started_at"] - timed["started_at"]).dt.total_seconds(),
+        "model": (timed["finished_at"] - timed["model_started_at"]).dt.total_seconds(),
+    })
+    grouped = durations.groupby("model_family")
+    sums = grouped[["wait", "model"]].sum()
+    total = sums.sum(axis=1)
+    return pd.DataFrame({
+        "requests": grouped.size(),
+        "wait_p50": grouped["wait"].median(),
+        "wait_p90": grouped["wait"].quantile(0.9),
+        "model_p50": grouped["model"].median(),
+        "model_p90": grouped["model"].quantile(0.9),
+        "wait_ratio": sums["wait"] / total.where(total > 0),
+    }).reset_index()
+
+
+def get_capacity_report(filters: StatisticsFilter, db_manager=None):
+    intervals = get_usage_intervals(filters, db_manager)
+    starts = to_nanoseconds(pd.DatetimeIndex(intervals["started_at"]))
+    ends = np.maximum(to_nanoseconds(pd.DatetimeIndex(intervals["finished_at"])), starts)
+    hourly_peaks = hourly_peak_concurrency(starts, ends)
+    return (summarize_capacity(intervals), hourly_peaks, peak_by_hour_of_week(hourly_peaks),
+            summarize_wait_times(intervals))
+
+
+def load_capacity_report(filters: StatisticsFilter, db_manager=None):
+    return cached_statistics("capacity", filters, get_capacity_report, db_manager=db_manager)
+
+
+def format_capacity_summary(capacity: pd.DataFrame) -> pd.DataFrame:
+    return pd.DataFrame({
+        "AIモデル": capacity["model_family"],
+        "件数": capacity["requests"].astype("Int64"),
+        "最大同時実行数": capacity["peak_concurrency"].astype("Int64"),
+        "平均同時実行数": capacity["mean_concurrency"].astype("Float64").round(2),
+        "最大リクエスト/分": capacity["peak_requests_per_minute"].astype("Int64"),
+        "最大トークン/分": capacity["peak_tokens_per_minute"].astype("Int64"),
+    })
+
+
+def format_wait_times(wait_times: pd.DataFrame) -> pd.DataFrame:
+    return pd.DataFrame({
+        "AIモデル": wait_times["model_family"],
+        "件数": wait_times["requests"].astype("Int64"),
+        "待ち時間p50(秒)": wait_times["wait_p50"].astype("Float64").round(2),
+        "待ち時間p90(秒)": wait_times["wait_p90"].astype("Float64").round(2),
+        "モデル処理p50(秒)": wait_times["model_p50"].astype("Float64").round(1),
+        "モデル処理p90(秒)": wait_times["model_p90"].astype("Float64").round(1),
+        "待ち時間の割合(%)": (wait_times["wait_ratio"].astype("Float64") * 100).round(1),
+    })
@@ -0,0 +1,442 @@
+import datetime
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytz
+
+from database.db import DatabaseManager, is_sqlite
+from database.usage_archive import UsageArchive, ARCHIVE_SCHEMA
+from database.usage_partitions import UsagePartitionRepository
+from database.usage_repository import UsageRepository
+from database.usage_rollups import UsageRollupRepository
+from utils.config import (USAGE_ARCHIVE_DIR, STATISTICS_PAGE_SIZE, STATISTICS_EXPORT_BATCH_SIZE,
+                          STATISTICS_CACHE_MAX_ENTRIES, STATISTICS_CACHE_TTL_SECONDS,
+                          STATISTICS_CACHE_HISTORICAL_TTL_SECONDS)
+from utils.constants import MODEL_MAPPING
+from utils.statistics_cache import StatisticsCache
+
+JST = pytz.timezone('Asia/Tokyo')
+
+RECORD_COLUMNS: List[str] = ["id", "date", "document_types", "model_detail", "model_family", "department", "doctor",
+                              "input_tokens", "output_tokens", "processing_time"]
+
+SUMMARY_COLUMNS: List[str] = ["department", "doctor", "document_types", "count",
+                               "input_tokens", "output_tokens", "total_tokens"]
+
+# (date, id) の降順に並べる。出力はこの全件をサーバー側カーソルで少しずつ読む
+RECORDS_QUERY = """
+    SELECT id, date, document_types, model_detail, model_family, department, doctor,
+           input_tokens, output_tokens, processing_time
+    FROM summary_usage
+    WHERE {where_clause}
+    ORDER BY date DESC, id DESC
+"""
+
+# 画面の1ページ分。前のページの最後の行より後ろだけを読む
+RECORDS_PAGE_QUERY = RECORDS_QUERY + "    LIMIT :limit\n"
+
+RECORDS_CURSOR_CLAUSE = "(date, id) < (:cursor_date, :cursor_id)"
+
+# 件数・トークン・明細は作成できた行だけを数え、失敗率は失敗・時間切れの行も含めて求める
+SUCCESS_CLAUSE = "status = 'success'"
+
+# モデル × 文書名ごとの処理時間のパーセンタイル・出力速度・失敗率。アーカイブ済みの月は含まない
+USAGE_METRICS_QUERY = """
+    SELECT
+        model_family,
+        document_types,
+        COUNT(*) AS requests,
+        percentile_cont(0.5) WITHIN GROUP (ORDER BY processing_time) FILTER (WHERE status = 'success') AS p50,
+        percentile_cont(0.9) WITHIN GROUP (ORDER BY processing_time) FILTER (WHERE status = 'success') AS p90,
+        percentile_cont(0.99) WITHIN GROUP (ORDER BY processing_time) FILTER (WHERE status = 'success') AS p99,
+        SUM(output_tokens) FILTER (WHERE status = 'success')
+            / NULLIF(SUM(processing_time) FILTER (WHERE status = 'success'), 0)::float8 AS output_tokens_per_second,
+        AVG((status = 'error')::int)::float8 AS error_rate,
+        AVG((status = 'timeout')::int)::float8 AS timeout_rate
+    FROM summary_usage
+    WHERE {where_clause}
+    GROUP BY model_family, document_types
+    ORDER BY model_family, document_types NULLS LAST
+"""
+
+# 日本時間の1時間または1日ごとに、モデル別の件数・処理時間・失敗率をDB側でまとめる
+USAGE_TIMESERIES_QUERY = """
+    SELECT
+        date_trunc(:bucket, date AT TIME ZONE 'Asia/Tokyo') AS bucket,
+        model_family,
+        COUNT(*) FILTER (WHERE status = 'success') AS count,
+        percentile_cont(0.5) WITHIN GROUP (ORDER BY processing_time) FILTER (WHERE status = 'success') AS p50,
+        percentile_cont(0.9) WITHIN GROUP (ORDER BY processing_time) FILTER (WHERE status = 'success') AS p90,
+        AVG((status <> 'success')::int)::float8 AS failure_rate
+    FROM summary_usage
+    WHERE {where_clause}
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+"""
+
+TIMESERIES_BUCKETS = {"1時間": "hour", "1日": "day"}
+
+# SQLite 用。パーセンタイルと日本時間での区切りをDB側で求められないため、期間内の行を読んで pandas で集計する
+SQLITE_USAGE_ROWS_QUERY = """
+    SELECT date, model_family, document_types, status, processing_time, output_tokens
+    FROM summary_usage
+    WHERE {where_clause}
+"""
+
+SQLITE_TIMESERIES_FREQUENCIES = {"hour": "h", "day": "D"}
+
+_cache_lock = threading.Lock()
+_statistics_cache = None
+
+EXPORT_FORMATS = {
+    "CSV": {"extension": "csv", "mime": "text/csv"},
+    "Parquet": {"extension": "parquet", "mime": "application/vnd.apache.parquet"},
+}
+
+
+class StatisticsFilter:
+    def __init__(self, start_date, end_date, selected_model="すべて", selected_document_type="すべて"):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.selected_model = selected_model
+        self.selected_document_type = selected_document_type
+        self.start_datetime = JST.localize(datetime.datetime.combine(start_date, datetime.time.min))
+        self.end_datetime = JST.localize(datetime.datetime.combine(end_date, datetime.time.max))
+
+        self.usage_clause, self.params = build_usage_filter(
+            self.start_datetime, self.end_datetime, selected_model, selected_document_type
+        )
+        self.where_clause = f"{self.usage_clause} AND {SUCCESS_CLAUSE}"
+        self.rollup_clause, self.rollup_params = build_rollup_filter(selected_model, selected_document_type)
+
+    @property
+    def key(self):
+        return self.start_date, self.end_date, self.selected_model, self.selected_document_type
+
+    @property
+    def model_family(self):
+        return self.selected_model if self.selected_model in MODEL_MAPPING else None
+
+    @property
+    def document_type(self):
+        return self.selected_document_type if self.selected_document_type != "すべて" else None
+
+
+def build_usage_filter(start_datetime, end_datetime, selected_model, selected_document_type):
+    query_conditions = []
+    query_params = {
+        "start_date": start_datetime,
+        "end_date": end_datetime
+    }
+
+    query_conditions.append("date >= :start_date AND date <= :end_date")
+
+    if selected_model in MODEL_MAPPING:
+        query_conditions.append("model_family = :model_family")
+        query_params["model_family"] = selected_model
+
+    if selected_document_type != "すべて":
+        if selected_document_type == "不明":
+            query_conditions.append("document_types IS NULL")
+        else:
+            query_conditions.append("document_types = :doc_type")
+            query_params["doc_type"] = selected_document_type
+
+    return " AND ".join(query_conditions), query_params
+
+
+def build_rollup_filter(selected_model, selected_document_type):
+    # 日次集計はモデル分類と文書名 (不明は空文字) を列として持つので、等号で絞り込める
+    rollup_conditions = ["TRUE"]
+    rollup_params = {}
+
+    if selected_model in MODEL_MAPPING:
+        rollup_conditions.append("model_family = :model_family")
+        rollup_params["model_family"] = selected_model
+
+    if selected_document_type != "すべて":
+        rollup_conditions.append("document_types = :rollup_doc_type")
+        rollup_params["rollup_doc_type"] = "" if selected_document_type == "不明" else selected_document_type
+
+    return " AND ".join(rollup_conditions), rollup_params
+
+
+def get_usage_summary(filters: StatisticsFilter,
+                      db_manager=None) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    # 合計と診療科・医師・文書名ごとの集計を1回のクエリで取得する
+    rollup_repository = UsageRollupRepository(db_manager or DatabaseManager.get_instance())
+    try:
+        rollup_repository.refresh()
+    except Exception as e:
+        print(f"使用状況の日次集計に失敗しました: {str(e)}")
+
+    rows = rollup_repository.summarize(filters.where_clause, filters.rollup_clause, {
+        **filters.params, **filters.rollup_params,
+        "start_day": filters.start_date, "end_day": filters.end_date
+    })
+    if rows is None:
+        return {"count": 0}, []
+
+    total = next((row for row in rows if row["is_total"]), None) or {"count": 0}
+    groups = [row for row in rows if not row["is_total"]]
+    return total, groups
+
+
+def archive_applies(filters: StatisticsFilter, db_manager=None) -> bool:
+    # DBに残っている最も古い月より前を含む期間だけ、アーカイブの Parquet を読む
+    repository = UsagePartitionRepository(db_manager or DatabaseManager.get_instance())
+    if repository.sqlite:
+        # SQLite ではアーカイブしないので、すべての行がDBにある
+        return False
+    try:
+        # 明細と同じDBで確認し、レプリカの反映待ちの間にDBとアーカイブの両方から同じ月を読まないようにする
+        hot_start = repository.hot_start(analytic=True)
+    except Exception as e:
+        print(f"使用状況の区画を確認できませんでした: {str(e)}")
+        return False
+    return hot_start is None or filters.start_datetime < hot_start
+
+
+def read_archived_records(filters: StatisticsFilter, before=None) -> pa.Table:
+    archived = UsageArchive(USAGE_ARCHIVE_DIR).read(
+        filters.start_datetime, filters.end_datetime, filters.model_family, filters.document_type,
+        columns=RECORD_COLUMNS, before=before
+    )
+    return archived.sort_by([("date", "descending"), ("id", "descending")])
+
+
+def query_records_page(filters: StatisticsFilter, cursor, limit, db_manager) -> pd.DataFrame:
+    where_clause = filters.where_clause
+    params = {**filters.params, "limit": limit}
+    if cursor is not None:
+        where_clause = f"{where_clause} AND {RECORDS_CURSOR_CLAUSE}"
+        params.update({"cursor_date": cursor[0], "cursor_id": cursor[1]})
+    records = db_manager.query_frame(RECORDS_PAGE_QUERY.format(where_clause=where_clause), params, analytic=True)
+    records["date"] = pd.to_datetime(records["date"], utc=True, format="ISO8601")
+    return records
+
+
+def read_archived_frame(filters: StatisticsFilter, before=None, limit=None) -> pd.DataFrame:
+    archived = read_archived_records(filters, before)
+    if limit is not None:
+        archived = archived.slice(0, limit)
+    return archived.to_pandas()
+
+
+def record_cursor(records: pd.DataFrame) -> Tuple[Any, int]:
+    # pd.Timestamp のままでは SQLite の日時の変換が効かないため、datetime にして渡す
+    return records["date"].iloc[-1].to_pydatetime(), int(records["id"].iloc[-1])
+
+
+def concat_records(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    frames = [frame for frame in frames if len(frame)]
+    if not frames:
+        return pd.DataFrame(columns=pd.Index(RECORD_COLUMNS))
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+
+def fetch_records_page(filters: StatisticsFilter, cursor=None, limit=STATISTICS_PAGE_SIZE,
+                       db_manager=None) -> Tuple[pd.DataFrame, Optional[Tuple[Any, int]]]:
+    # 1件多く読んで次のページがあるかを判定し、次のページの開始位置 (date, id) を返す
+    db_manager = db_manager or DatabaseManager.get_instance()
+    records = query_records_page(filters, cursor, limit + 1, db_manager)
+
+    if len(records) <= limit and archive_applies(filters, db_manager):
+        # アーカイブの行はすべてDBの行より古いので、DBの行の後ろに続ける
+        before = record_cursor(records) if len(records) else cursor
+        archived = read_archived_frame(filters, before, limit + 1 - len(records))
+        records = concat_records([records, archived])
+
+    if len(records) <= limit:
+        return records, None
+    records = records.iloc[:limit]
+    return records, record_cursor(records)
+
+
+def format_usage_records(records: pd.DataFrame) -> pd.DataFrame:
+    # 日時の変換・表示名の置き換え・丸めを列単位で行い、行ごとのループを使わない
+    # 作成日は日本時間の日付として渡し、文字列への変換は st.dataframe の列設定に任せる
+    return pd.DataFrame({
+        "作成日": pd.to_datetime(records["date"], utc=True).dt.tz_convert(JST).dt.tz_localize(None).dt.normalize(),
+        "文書名": records["document_types"].fillna("不明"),
+        "診療科": records["department"].replace("default", "全科共通"),
+        "医師名": records["doctor"].replace("default", "医師共通"),
+        "AIモデル": records["model_family"],
+        "入力トークン": records["input_tokens"].astype("Int64"),
+        "出力トークン": records["output_tokens"].astype("Int64"),
+        "処理時間(秒)": records["processing_time"].astype("Float64").round(1),
+    })
+
+
+def format_usage_summary(groups: List[Dict[str, Any]]) -> pd.DataFrame:
+    summary = pd.DataFrame(groups, columns=pd.Index(SUMMARY_COLUMNS))
+    return pd.DataFrame({
+        "文書名": summary["document_types"].fillna("不明"),
+        "診療科": summary["department"].replace("default", "全科共通"),
+        "医師名": summary["doctor"].replace("default", "医師共通"),
+        "作成件数": summary["count"].astype("Int64"),
+        "入力トークン": summary["input_tokens"].astype("Int64"),
+        "出力トークン": summary["output_tokens"].astype("Int64"),
+        "合計トークン": summary["total_tokens"].astype("Int64"),
+    })
+
+
+def query_usage_rows(filters: StatisticsFilter, db_manager) -> pd.DataFrame:
+    rows = db_manager.query_frame(SQLITE_USAGE_ROWS_QUERY.format(where_clause=filters.usage_clause), filters.params,
+                                  analytic=True)
+    rows["date"] = pd.to_datetime(rows["date"], utc=True, format="ISO8601")
+    return rows
+
+
+def aggregate_usage_rows(rows: pd.DataFrame, keys: List[str]) -> pd.DataFrame:
+    # USAGE_METRICS_QUERY・USAGE_TIMESERIES_QUERY と同じ列を求める。処理時間と出力トークンは作成できた行だけで集計する
+    succeeded = rows["status"] == "success"
+    frame = pd.DataFrame({
+        **{key: rows[key] for key in keys},
+        "processing_time": rows["processing_time"].astype("float64").where(succeeded),
+        "output_tokens": rows["output_tokens"].astype("float64").where(succeeded),
+        "succeeded": succeeded.astype("int64"),
+        "failed": (~succeeded).astype("float64"),
+        "error": (rows["status"] == "error").astype("float64"),
+        "timeout": (rows["status"] == "timeout").astype("float64"),
+    })
+    grouped = frame.groupby(keys, dropna=False)
+    sums = grouped[["output_tokens", "processing_time"]].sum()
+    sums = sums.where(sums["processing_time"] > 0)
+    return pd.DataFrame({
+        "requests": grouped.size(),
+        "count": grouped["succeeded"].sum(),
+        "p50": grouped["processing_time"].quantile(0.5),
+        "p90": grouped["processing_time"].quantile(0.9),
+        "p99": grouped["processing_time"].quantile(0.99),
+        "output_tokens_per_second": sums["output_tokens"] / sums["processing_time"],
+        "error_rate": grouped["error"].mean(),
+        "timeout_rate": grouped["timeout"].mean(),
+        "failure_rate": grouped["failed"].mean(),
+    }).reset_index()
+
+
+def get_usage_metrics(filters: StatisticsFilter, db_manager=None) -> pd.DataFrame:
+    db_manager = db_manager or DatabaseManager.get_instance()
+    if is_sqlite(db_manager):
+        metrics = aggregate_usage_rows(query_usage_rows(filters, db_manager), ["model_family", "document_types"])
+        return metrics.reindex(columns=["model_family", "document_types", "requests", "p50", "p90", "p99",
+                                        "output_tokens_per_second", "error_rate", "timeout_rate"])
+    return db_manager.query_frame(USAGE_METRICS_QUERY.format(where_clause=filters.usage_clause), filters.params,
+                                  analytic=True)
+
+
+def get_usage_timeseries(filters: StatisticsFilter, bucket="day", db_manager=None) -> pd.DataFrame:
+    if bucket not in TIMESERIES_BUCKETS.values():
+        raise ValueError(f"集計単位が正しくありません: {bucket}")
+    db_manager = db_manager or DatabaseManager.get_instance()
+    if is_sqlite(db_manager):
+        rows = query_usage_rows(filters, db_manager)
+        local_dates = pd.to_datetime(rows["date"], utc=True).dt.tz_convert(JST).dt.tz_localize(None)
+        rows["bucket"] = local_dates.dt.floor(SQLITE_TIMESERIES_FREQUENCIES[bucket])
+        timeseries = aggregate_usage_rows(rows, ["bucket", "model_family"])
+        return timeseries.reindex(columns=["bucket", "model_family", "count", "p50", "p90", "failure_rate"])
+    return db_manager.query_frame(USAGE_TIMESERIES_QUERY.format(where_clause=filters.usage_clause),
+                                  {**filters.params, "bucket": bucket}, analytic=True)
+
+
+def format_usage_metrics(metrics: pd.DataFrame) -> pd.DataFrame:
+    return pd.DataFrame({
+        "AIモデル": metrics["model_family"],
+        "文書名": metrics["document_types"].fillna("不明"),
+        "件数": metrics["requests"].astype("Int64"),
+        "p50(秒)": metrics["p50"].astype("Float64").round(1),
+        "p90(秒)": metrics["p90"].astype("Float64").round(1),
+        "p99(秒)": metrics["p99"].astype("Float64").round(1),
+        "出力トークン/秒": metrics["output_tokens_per_second"].astype("Float64").round(1),
+        "エラー率(%)": (metrics["error_rate"].astype("Float64") * 100).round(1),
+        "時間切れ率(%)": (metrics["timeout_rate"].astype("Float64") * 100).round(1),
+    })
+
+
+def pivot_usage_timeseries(timeseries: pd.DataFrame, column: str) -> pd.DataFrame:
+    # 時刻 × モデルの表にして、そのまま折れ線グラフに渡せる形にする
+    if timeseries.empty:
+        return pd.DataFrame()
+    return timeseries.pivot(index="bucket", columns="model_family", values=column).astype("float64")
+
+
+def get_statistics_cache():
+    global _statistics_cache
+    with _cache_lock:
+        if _statistics_cache is None:
+            _statistics_cache = StatisticsCache(
+                max_entries=STATISTICS_CACHE_MAX_ENTRIES,
+                ttl_seconds=STATISTICS_CACHE_TTL_SECONDS,
+                historical_ttl_seconds=STATISTICS_CACHE_HISTORICAL_TTL_SECONDS
+            )
+        return _statistics_cache
+
+
+def cached_statistics(name, filters: StatisticsFilter, compute, *args, db_manager=None):
+    # 画面の再実行のたびに同じ条件で集計し直さないよう、絞り込み条件ごとに結果を使い回す
+    db_manager = db_manager or DatabaseManager.get_instance()
+    historical = filters.end_date < datetime.datetime.now(JST).date()
+    return get_statistics_cache().get_or_compute(
+        (name, filters.key, args),
+        historical,
+        lambda: UsageRepository(db_manager).range_version(filters.start_date, filters.end_date),
+        lambda: compute(filters, *args, db_manager=db_manager)
+    )
+
+
+def load_usage_summary(filters: StatisticsFilter, db_manager=None):
+    return cached_statistics("summary", filters, get_usage_summary, db_manager=db_manager)
+
+
+def load_usage_metrics(filters: StatisticsFilter, db_manager=None):
+    return cached_statistics("metrics", filters, get_usage_metrics, db_manager=db_manager)
+
+
+def load_usage_timeseries(filters: StatisticsFilter, bucket="day", db_manager=None):
+    return cached_statistics("timeseries", filters, get_usage_timeseries, bucket, db_manager=db_manager)
+
+
+def iter_record_batches(filters: StatisticsFilter, batch_size=STATISTICS_EXPORT_BATCH_SIZE,
+                        db_manager=None) -> Iterator[pd.DataFrame]:
+    db_manager = db_manager or DatabaseManager.get_instance()
+    query = RECORDS_QUERY.format(where_clause=filters.where_clause)
+    for records in db_manager.stream_frames(query, filters.params, batch_size, analytic=True):
+        records["date"] = pd.to_datetime(records["date"], utc=True, format="ISO8601")
+        yield records
+
+    if archive_applies(filters, db_manager):
+        for batch in read_archived_records(filters).to_batches(max_chunksize=batch_size):
+            if batch.num_rows:
+                yield batch.to_pandas()
+
+
+def write_records_csv(batches, output) -> int:
+    output.write(",".join(RECORD_COLUMNS) + "\n")
+    written = 0
+    for batch in batches:
+        batch.to_csv(output, columns=RECORD_COLUMNS, header=False, index=False)
+        written += len(batch)
+    return written
+
+
+def write_records_parquet(batches, output) -> int:
+    schema = pa.schema([ARCHIVE_SCHEMA.field(name) for name in RECORD_COLUMNS])
+    written = 0
+    with pq.ParquetWriter(output, schema, compression="zstd") as writer:
+        for batch in batches:
+            writer.write_table(pa.Table.from_pandas(batch[RECORD_COLUMNS], schema=schema, preserve_index=False))
+            written += len(batch)
+    return written
+
+
+def export_usage_records(filters: StatisticsFilter, export_format: str, path: str, db_manager=None) -> int:
+    # 一定件数ずつ読みながら書き出し、全件をメモリに載せない
+    batches = iter_record_batches(filters, db_manager=db_manager)
+    if export_format == "Parquet":
+        return write_records_parquet(batches, path)
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        return write_records_csv(batches, f)
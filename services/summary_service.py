@@ -2,25 +2,35 @@ import datetime
 import queue
 import threading
 import time
-from typing import Dict, Any, Tuple
+import uuid
+from typing import Dict, Any, Optional, Tuple
 
+import anthropic
+import httpx
 import pytz
 import streamlit as st
+from google.api_core import exceptions as google_exceptions
+from google.genai import errors as genai_errors
 
-from database.db import DatabaseManager
+from database.usage_writer import get_usage_writer
 from external_service.api_factory import generate_summary
 from utils.config import (CLAUDE_API_KEY, CLAUDE_MODEL,
                           GOOGLE_CREDENTIALS_JSON, GEMINI_MODEL,
                           MAX_INPUT_TOKENS, MIN_INPUT_TOKENS,
                           MAX_TOKEN_THRESHOLD)
-from utils.constants import APP_TYPE, MESSAGES, DEFAULT_DEPARTMENT, DEFAULT_DOCUMENT_TYPE, DOCUMENT_TYPES
+from utils.constants import APP_TYPE, MESSAGES, DEFAULT_DOCUMENT_TYPE
 from utils.error_handlers import handle_error
 from utils.exceptions import APIError
+from utils.hierarchy_manager import get_hierarchy
 from utils.prompt_manager import get_prompt
 from utils.text_processor import format_output_summary, parse_output_summary
 
 JST = pytz.timezone('Asia/Tokyo')
 
+# 各プロバイダーのクライアントが時間切れで送出する例外
+TIMEOUT_ERRORS = (TimeoutError, anthropic.APITimeoutError, httpx.TimeoutException,
+                  google_exceptions.DeadlineExceeded)
+
 
 def generate_summary_task(input_text: str,
                           selected_department: str,
@@ -32,6 +42,8 @@ def generate_summary_task(input_text: str,
                           selected_document_type: str = DEFAULT_DOCUMENT_TYPE,
                           selected_doctor: str = "default",
                           model_explicitly_selected: bool = False) -> None:
+    model_detail = None
+    model_started_at = None
     try:
         normalized_dept, normalized_doc_type = normalize_selection_params(
             selected_department, selected_document_type
@@ -49,7 +61,10 @@ def generate_summary_task(input_text: str,
 
         provider, model_name = get_provider_and_model(final_model)
         validate_api_credentials_for_provider(provider)
+        model_detail = model_name if provider == "gemini" else final_model
 
+        # ここまでをモデル呼び出しの待ち時間、ここからをモデルの処理時間として分けて記録する
+        model_started_at = datetime.datetime.now(JST)
         output_summary, input_tokens, output_tokens = generate_summary(
             provider=provider,
             medical_text=input_text,
@@ -62,7 +77,6 @@ def generate_summary_task(input_text: str,
             model_name=model_name
         )
 
-        model_detail = model_name if provider == "gemini" else final_model
         output_summary = format_output_summary(output_summary)
         parsed_summary = parse_output_summary(output_summary)
 
@@ -74,16 +88,42 @@ def generate_summary_task(input_text: str,
             "output_tokens": output_tokens,
             "model_detail": model_detail,
             "model_switched": model_switched,
-            "original_model": original_model if model_switched else None
+            "original_model": original_model if model_switched else None,
+            "model_started_at": model_started_at,
+            "finished_at": datetime.datetime.now(JST)
         })
 
     except Exception as e:
         result_queue.put({
             "success": False,
-            "error": str(e)
+            "error": str(e),
+            "status": failure_status(e),
+            "model_detail": model_detail,
+            "model_started_at": model_started_at,
+            "finished_at": datetime.datetime.now(JST)
         })
 
 
+def is_timeout_error(error: BaseException) -> bool:
+    if isinstance(error, TIMEOUT_ERRORS):
+        return True
+    # Vertex AI がサーバー側の期限切れを応答で返した場合
+    return isinstance(error, genai_errors.APIError) and error.status == "DEADLINE_EXCEEDED"
+
+
+def failure_status(error: Exception) -> str:
+    # API呼び出しの時間切れは他のエラーと分けて集計する
+    # クライアントは例外を APIError に包んで送出するため、元の例外までたどって種類で判定する
+    seen = set()
+    current: Optional[BaseException] = error
+    while current is not None and id(current) not in seen:
+        if is_timeout_error(current):
+            return "timeout"
+        seen.add(id(current))
+        current = current.__cause__ or current.__context__
+    return "error"
+
+
 @handle_error
 def process_summary(input_text: str,
                     additional_info: str = "",
@@ -106,6 +146,9 @@ def process_summary(input_text: str,
         if result["success"]:
             handle_success_result(result, session_params)
         else:
+            if result.get("model_detail"):
+                # モデルの呼び出しまで進んで失敗した場合は、失敗率の集計のために記録する
+                save_usage_to_database(result, session_params)
             raise APIError(result['error'])
 
     except Exception as e:
@@ -148,7 +191,7 @@ def execute_summary_generation_with_ui(input_text: str,
                                        referral_purpose: str,
                                        current_prescription: str,
                                        session_params: Dict[str, Any]) -> Dict[str, Any]:
-    start_time = datetime.datetime.now()
+    start_time = datetime.datetime.now(JST)
     status_placeholder = st.empty()
     result_queue = queue.Queue()
 
@@ -175,10 +218,14 @@ def execute_summary_generation_with_ui(input_text: str,
     status_placeholder.empty()
     result = result_queue.get()
 
+    # 経過時間の表示を待った分を含めないよう、作成が終わった時刻で処理時間を求める
+    finished_at = result.get("finished_at") or datetime.datetime.now(JST)
+    processing_time = (finished_at - start_time).total_seconds()
+    result["started_at"] = start_time
+    result["finished_at"] = finished_at
+    result["processing_time"] = processing_time
     if result["success"]:
-        processing_time = (datetime.datetime.now() - start_time).total_seconds()
         st.session_state.summary_generation_time = processing_time
-        result["processing_time"] = processing_time
 
     return result
 
@@ -191,7 +238,7 @@ def display_progress_with_timer(thread: threading.Thread,
         placeholder.text(f"⏱️ 経過時間: {elapsed_time}秒")
         while thread.is_alive():
             time.sleep(1)
-            elapsed_time = int((datetime.datetime.now() - start_time).total_seconds())
+            elapsed_time = int((datetime.datetime.now(JST) - start_time).total_seconds())
             placeholder.text(f"⏱️ 経過時間: {elapsed_time}秒")
 
 
@@ -209,7 +256,6 @@ def handle_success_result(result: Dict[str, Any],
 def save_usage_to_database(result: Dict[str, Any],
                            session_params: Dict[str, Any]) -> None:
     try:
-        db_manager = DatabaseManager.get_instance()
         now_jst = datetime.datetime.now().astimezone(JST)
 
         usage_data = {
@@ -219,31 +265,29 @@ def save_usage_to_database(result: Dict[str, Any],
             "model_detail": result["model_detail"],
             "department": session_params["selected_department"],
             "doctor": session_params["selected_doctor"],
-            "input_tokens": result["input_tokens"],
-            "output_tokens": result["output_tokens"],
-            "total_tokens": result["input_tokens"] + result["output_tokens"],
-            "processing_time": round(result["processing_time"])
+            "input_tokens": result.get("input_tokens"),
+            "output_tokens": result.get("output_tokens"),
+            "total_tokens": (result.get("input_tokens") or 0) + (result.get("output_tokens") or 0),
+            "processing_time": result["processing_time"],
+            "status": result.get("status", "success"),
+            "started_at": result.get("started_at"),
+            "model_started_at": result.get("model_started_at"),
+            "finished_at": result.get("finished_at"),
+            "event_id": str(uuid.uuid4())
         }
 
-        query = """
-                INSERT INTO summary_usage
-                (date, app_type, document_types, model_detail, department, doctor,
-                 input_tokens, output_tokens, total_tokens, processing_time)
-                VALUES (:date, :app_type, :document_types, :model_detail, :department, :doctor,
-                        :input_tokens, :output_tokens, :total_tokens, :processing_time)
-                """
+        # 書き込みはバックグラウンドでまとめて行い、結果の表示を待たせない
+        if not get_usage_writer().submit(usage_data):
+            print("使用状況を記録できませんでした")
 
-        db_manager.execute_query(query, usage_data, fetch=False)
-
-    except Exception as db_error:
-        st.warning(f"データベース保存中にエラーが発生しました: {str(db_error)}")
+    except Exception as e:
+        print(f"使用状況の記録中にエラーが発生しました: {str(e)}")
 
 
 def normalize_selection_params(department: str,
                                document_type: str) -> Tuple[str, str]:
-    normalized_dept = department if department in DEFAULT_DEPARTMENT else "default"
-    normalized_doc_type = document_type if document_type in DOCUMENT_TYPES else DOCUMENT_TYPES[0]
-    return normalized_dept, normalized_doc_type
+    hierarchy = get_hierarchy()
+    return hierarchy.normalize_department(department), hierarchy.normalize_document_type(document_type)
 
 
 def determine_final_model(department: str,
@@ -3,7 +3,7 @@ import shutil
 import pytest
 import logging
 import tempfile
-from unittest.mock import Mock
+from unittest.mock import MagicMock, Mock
 
 
 @pytest.fixture(scope="session", autouse=True)
@@ -81,6 +81,10 @@ def mock_database_manager():
     mock = Mock()
     mock.execute_query.return_value = []
     mock.get_session.return_value = Mock()
+    # unit_of_work の中の文も同じモックで受ける
+    unit_of_work = MagicMock()
+    unit_of_work.__enter__.return_value = mock
+    mock.unit_of_work.return_value = unit_of_work
     return mock
 
 
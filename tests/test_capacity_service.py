@@ -0,0 +1,144 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from services.capacity_service import (
+    USAGE_INTERVALS_QUERY, concurrency_timeline, format_capacity_summary, format_wait_times, get_capacity_report,
+    hourly_peak_concurrency, peak_by_hour_of_week, summarize_capacity, summarize_wait_times
+)
+from services.statistics_service import StatisticsFilter
+
+UTC = datetime.timezone.utc
+
+
+def ns(hour, minute=0, second=0):
+    # 2025/06/02 (月) の日本時間 hour 時を UTC のナノ秒で表す
+    value = datetime.datetime(2025, 6, 2, hour, minute, second) - datetime.timedelta(hours=9)
+    return int(value.replace(tzinfo=UTC).timestamp()) * 1_000_000_000
+
+
+def make_intervals(*rows):
+    # (モデル, 開始, モデル呼び出し開始, 終了, トークン) の組から取得結果と同じ形の表を作る
+    frame = pd.DataFrame(rows, columns=["model_family", "started_at", "model_started_at", "finished_at", "tokens"])
+    for column in ("started_at", "model_started_at", "finished_at"):
+        frame[column] = pd.to_datetime(frame[column], utc=True)
+    return frame
+
+
+def at(hour, minute=0, second=0):
+    return pd.Timestamp(ns(hour, minute, second), tz=UTC)
+
+
+class TestConcurrencyTimeline:
+    """concurrency_timeline関数のテスト"""
+
+    def test_overlapping_intervals(self):
+        """重なった作成の数を事象ごとに求めるテスト"""
+        starts = np.array([0, 10, 20])
+        ends = np.array([30, 15, 40])
+
+        times, levels = concurrency_timeline(starts, ends)
+
+        assert times.tolist() == [0, 10, 15, 20, 30, 40]
+        assert levels.tolist() == [1, 2, 1, 2, 1, 0]
+
+    def test_end_counts_before_start(self):
+        """終わった時刻に始まった作成は同時に数えないテスト"""
+        _, levels = concurrency_timeline(np.array([0, 10]), np.array([10, 20]))
+
+        assert levels.max() == 1
+
+
+class TestHourlyPeakConcurrency:
+    """hourly_peak_concurrency関数のテスト"""
+
+    def test_long_interval_counts_in_every_hour(self):
+        """途中に事象のない時間も続いている作成を数えるテスト"""
+        starts = np.array([ns(9, 30), ns(10, 10)])
+        ends = np.array([ns(11, 30), ns(10, 20)])
+
+        peaks = hourly_peak_concurrency(starts, ends)
+
+        assert peaks.index.hour.tolist() == [9, 10, 11]
+        assert peaks.tolist() == [1, 2, 1]
+
+    def test_empty(self):
+        """作成がない場合は空を返すテスト"""
+        assert hourly_peak_concurrency(np.array([], dtype=np.int64), np.array([], dtype=np.int64)).empty
+
+
+class TestPeakByHourOfWeek:
+    """peak_by_hour_of_week関数のテスト"""
+
+    def test_takes_max_across_weeks(self):
+        """同じ曜日・時間の最大値を取るテスト"""
+        hourly_peaks = pd.Series([2, 5, 3], index=pd.to_datetime(
+            ["2025-06-02 09:00", "2025-06-09 09:00", "2025-06-03 14:00"]))
+
+        table = peak_by_hour_of_week(hourly_peaks)
+
+        assert table.shape == (7, 24)
+        assert table.loc["月", "9時"] == 5
+        assert table.loc["火", "14時"] == 3
+        assert table.loc["日", "0時"] == 0
+
+
+class TestSummaries:
+    """同時実行数と待ち時間の集計のテスト"""
+
+    def test_summarize_capacity(self):
+        """モデルごとと全体の最大同時実行数・1分あたりの最大値を求めるテスト"""
+        intervals = make_intervals(
+            ("Claude", at(9), at(9, 0, 1), at(9, 1), 100),
+            ("Claude", at(9, 0, 30), at(9, 0, 31), at(9, 2), 300),
+            ("Gemini_Pro", at(9, 0, 40), None, at(9, 3), 50),
+        )
+
+        capacity = summarize_capacity(intervals).set_index("model_family")
+
+        assert capacity.loc["Claude", "peak_concurrency"] == 2
+        assert capacity.loc["合計", "peak_concurrency"] == 3
+        assert capacity.loc["合計", "peak_requests_per_minute"] == 3
+        assert capacity.loc["合計", "peak_tokens_per_minute"] == 450
+        assert capacity.loc["Gemini_Pro", "mean_concurrency"] == 1.0
+        assert list(format_capacity_summary(capacity.reset_index()).columns)[:3] == ["AIモデル", "件数", "最大同時実行数"]
+
+    def test_summarize_wait_times(self):
+        """モデル呼び出しまでの待ち時間とモデルの処理時間を分けるテスト"""
+        intervals = make_intervals(
+            ("Claude", at(9), at(9, 0, 2), at(9, 0, 10), 100),
+            ("Claude", at(10), None, at(10, 0, 10), 100),
+        )
+
+        wait_times = summarize_wait_times(intervals)
+
+        assert wait_times["requests"].tolist() == [1]
+        assert wait_times["wait_p50"].tolist() == [2.0]
+        assert wait_times["model_p50"].tolist() == [8.0]
+        assert wait_times["wait_ratio"].tolist() == [0.2]
+        assert format_wait_times(wait_times)["待ち時間の割合(%)"].tolist() == [20.0]
+
+
+class TestGetCapacityReport:
+    """get_capacity_report関数のテスト"""
+
+    def test_report(self, mock_database_manager):
+        """失敗も含む条件で取得し、時間ごと・曜日ごとの最大値をまとめるテスト"""
+        mock_database_manager.query_frame.return_value = pd.DataFrame({
+            "model_family": ["Claude"],
+            "started_at": [datetime.datetime(2025, 6, 2, 0, 0, tzinfo=UTC)],
+            "model_started_at": [None],
+            "finished_at": [datetime.datetime(2025, 6, 2, 0, 5, tzinfo=UTC)],
+            "tokens": [10],
+        })
+        filters = StatisticsFilter(datetime.date(2025, 6, 1), datetime.date(2025, 6, 7))
+
+        capacity, hourly_peaks, hour_of_week, wait_times = get_capacity_report(filters, mock_database_manager)
+
+        query, params = mock_database_manager.query_frame.call_args[0]
+        assert query == USAGE_INTERVALS_QUERY.format(where_clause=filters.usage_clause)
+        assert params == filters.params
+        assert hourly_peaks.tolist() == [1]
+        assert hour_of_week.loc["月", "9時"] == 1
+        assert wait_times.empty
@@ -128,6 +128,19 @@ class TestEnvironmentVariables:
             assert utils.config.POSTGRES_PASSWORD == "testpass"
             assert utils.config.POSTGRES_DB == "testdb"
             assert utils.config.POSTGRES_SSL == "require"
+
+    def test_config_without_database_url(self):
+        """DATABASE_URLがなくても読み込めることのテスト"""
+        with patch.dict(os.environ), patch('dotenv.load_dotenv'):
+            os.environ.pop('DATABASE_URL', None)
+            import importlib
+            import utils.config
+            importlib.reload(utils.config)
+
+            assert utils.config.POSTGRES_HOST is None
+            assert utils.config.POSTGRES_DB is None
+
+        importlib.reload(utils.config)
     
     def test_ai_model_config(self):
         """AIモデル関連の設定テスト"""
@@ -0,0 +1,186 @@
+from unittest.mock import patch
+
+import pytest
+
+from utils import hierarchy_manager
+from utils.hierarchy_manager import (
+    HierarchyIndex,
+    build_hierarchy_index,
+    get_hierarchy,
+    invalidate_hierarchy_cache,
+    handle_hierarchy_notification,
+    add_doctor,
+    initialize_hierarchy,
+    build_hierarchy_seed,
+    compute_hierarchy_seed_version
+)
+from utils.exceptions import DatabaseError
+
+ROWS = [
+    {"kind": "department", "department": None, "name": "default", "purpose": None},
+    {"kind": "department", "department": None, "name": "眼科", "purpose": None},
+    {"kind": "doctor", "department": "default", "name": "default", "purpose": None},
+    {"kind": "doctor", "department": "眼科", "name": "default", "purpose": None},
+    {"kind": "doctor", "department": "眼科", "name": "橋本義弘", "purpose": None},
+    {"kind": "document_type", "department": None, "name": "返書", "purpose": "受診報告"},
+    {"kind": "document_type", "department": None, "name": "最終返書", "purpose": "治療経過報告"},
+]
+
+
+@pytest.fixture(autouse=True)
+def reset_hierarchy_cache():
+    """各テスト前後で階層キャッシュを破棄"""
+    invalidate_hierarchy_cache()
+    yield
+    invalidate_hierarchy_cache()
+
+
+@pytest.fixture
+def repository(mock_database_manager):
+    with patch('utils.hierarchy_manager.DatabaseManager') as mock_db_manager:
+        mock_db_manager.get_instance.return_value = mock_database_manager
+        yield mock_database_manager
+
+
+class TestHierarchyIndex:
+    """HierarchyIndexクラスのテスト"""
+
+    def test_build_index(self):
+        """行から選択肢と索引が作られるテスト"""
+        index = build_hierarchy_index(ROWS, 4)
+
+        assert index.version == 4
+        assert index.departments == ["default", "眼科"]
+        assert index.get_doctors("眼科") == ["default", "橋本義弘"]
+        assert index.document_types == ["返書", "最終返書"]
+        assert index.get_purpose("最終返書") == "治療経過報告"
+
+    def test_lookups(self):
+        """存在確認と位置の取得のテスト"""
+        index = build_hierarchy_index(ROWS, 1)
+
+        assert index.department_index("眼科") == 1
+        assert index.department_index("未登録") == 0
+        assert index.has_doctor("眼科", "橋本義弘")
+        assert not index.has_doctor("眼科", "未登録")
+        assert index.doctor_index("眼科", "橋本義弘") == 1
+        assert index.document_type_index("最終返書") == 1
+
+    def test_unknown_department_has_default_doctor(self):
+        """未登録の診療科は医師共通のみとなるテスト"""
+        index = build_hierarchy_index(ROWS, 1)
+
+        assert index.get_doctors("未登録") == ["default"]
+        assert index.has_doctor("未登録", "default")
+
+    def test_normalize(self):
+        """未登録の値が既定値に正規化されるテスト"""
+        index = build_hierarchy_index(ROWS, 1)
+
+        assert index.normalize_department("眼科") == "眼科"
+        assert index.normalize_department("未登録") == "default"
+        assert index.normalize_document_type("最終返書") == "最終返書"
+        assert index.normalize_document_type("未登録") == "返書"
+        assert HierarchyIndex(1, [], {}, [], {}).normalize_document_type("未登録") == "診療情報提供書"
+
+
+class TestHierarchyCache:
+    """階層キャッシュのテスト"""
+
+    def test_loaded_once_per_version(self, repository):
+        """2回目以降の取得でDBにアクセスしないテスト"""
+        repository.execute_query.return_value = [dict(row, hierarchy_version=2) for row in ROWS]
+
+        for _ in range(3):
+            index = get_hierarchy()
+
+        assert index.departments == ["default", "眼科"]
+        repository.execute_query.assert_called_once()
+
+    def test_falls_back_to_seed_on_error(self, repository):
+        """読み込みに失敗した場合に初期データで表示できるテスト"""
+        repository.execute_query.side_effect = DatabaseError("DB接続エラー")
+
+        index = get_hierarchy()
+
+        assert index.has_department("default")
+        assert hierarchy_manager._hierarchy_cache is None
+
+    def test_notification_invalidates_older_index(self, repository):
+        """新しいバージョンの通知でキャッシュが破棄されるテスト"""
+        repository.execute_query.return_value = [dict(row, hierarchy_version=2) for row in ROWS]
+        get_hierarchy()
+
+        handle_hierarchy_notification("2")
+        assert hierarchy_manager._hierarchy_cache is not None
+
+        handle_hierarchy_notification("3")
+        assert hierarchy_manager._hierarchy_cache is None
+
+
+class TestAddDoctor:
+    """add_doctor関数のテスト"""
+
+    def test_add_doctor_success(self, repository):
+        """医師の追加でキャッシュが破棄されるテスト"""
+        repository.execute_query.return_value = [dict(row, hierarchy_version=2) for row in ROWS]
+        get_hierarchy()
+        repository.execute_query.return_value = [{"changed": 1, "version": 3}]
+
+        success, message = add_doctor(" 眼科 ", "新任医師")
+
+        assert success is True
+        assert message == "医師を登録しました"
+        params = repository.execute_query.call_args[0][1]
+        assert params["departments"] == ["眼科"]
+        assert params["doctors"] == ["新任医師"]
+        assert hierarchy_manager._hierarchy_cache is None
+
+    def test_add_doctor_already_exists(self, repository):
+        """登録済みの医師の追加テスト"""
+        repository.execute_query.return_value = [{"changed": 0, "version": None}]
+
+        assert add_doctor("眼科", "橋本義弘") == (False, "既に登録されています")
+
+    def test_add_doctor_invalid_input(self):
+        """未入力のテスト"""
+        assert add_doctor("眼科", " ") == (False, "診療科と医師名を入力してください")
+
+    def test_add_doctor_database_error(self, repository):
+        """データベースエラーのテスト"""
+        repository.execute_query.side_effect = Exception("DB接続エラー")
+
+        success, message = add_doctor("眼科", "新任医師")
+
+        assert success is False
+        assert "DB接続エラー" in message
+
+
+class TestInitializeHierarchy:
+    """initialize_hierarchy関数のテスト"""
+
+    def test_seed_version_matches(self, repository):
+        """初期データが変わっていない場合は登録しないテスト"""
+        seed_version = compute_hierarchy_seed_version(*build_hierarchy_seed())
+        repository.execute_query.return_value = [{"value": seed_version}]
+
+        initialize_hierarchy()
+
+        repository.execute_query.assert_called_once()
+
+    def test_seed_registered_with_version(self, repository):
+        """初期データがシードバージョンと共に登録されるテスト"""
+        repository.execute_query.side_effect = [[], [{"changed": 8, "version": 1}]]
+
+        with patch('utils.hierarchy_manager.DEFAULT_DEPARTMENT', ['default', '内科']), \
+                patch('utils.hierarchy_manager.DEPARTMENT_DOCTORS_MAPPING', {'内科': ['default', '田中医師']}), \
+                patch('utils.hierarchy_manager.DOCUMENT_TYPES', ['返書']):
+            initialize_hierarchy()
+            expected_version = compute_hierarchy_seed_version(*build_hierarchy_seed())
+
+        params = repository.execute_query.call_args[0][1]
+        assert params["departments"] == ["default", "内科", "内科"]
+        assert params["doctors"] == ["default", "default", "田中医師"]
+        assert params["document_types"] == ["返書"]
+        assert params["purposes"] == ["受診報告"]
+        assert params["seed_version"] == expected_version
@@ -0,0 +1,52 @@
+from database.hierarchy_repository import HierarchyRepository, HIERARCHY_CHANNEL
+
+
+class TestHierarchyRepository:
+    """HierarchyRepositoryクラスのテスト"""
+
+    def test_load_all_returns_version_and_rows(self, mock_database_manager):
+        """バージョンと階層全体を1回で取得するテスト"""
+        mock_database_manager.execute_query.return_value = [
+            {"hierarchy_version": 3, "kind": "department", "department": None, "name": "default"},
+            {"hierarchy_version": 3, "kind": "doctor", "department": "default", "name": "default"},
+        ]
+
+        version, rows = HierarchyRepository(mock_database_manager).load_all()
+
+        assert version == 3
+        assert len(rows) == 2
+        mock_database_manager.execute_query.assert_called_once()
+
+    def test_load_all_empty_tables(self, mock_database_manager):
+        """テーブルが空の場合のテスト"""
+        mock_database_manager.execute_query.return_value = [{"hierarchy_version": 0, "kind": None}]
+
+        assert HierarchyRepository(mock_database_manager).load_all() == (0, [])
+
+    def test_bulk_import_single_statement(self, mock_database_manager):
+        """医師と文書名を配列で渡し1文で登録するテスト"""
+        mock_database_manager.execute_query.return_value = [{"changed": 4, "version": 2}]
+
+        changed = HierarchyRepository(mock_database_manager).bulk_import(
+            [("内科", "田中医師"), ("内科", "佐藤医師")], [("診断書", "診断")]
+        )
+
+        assert changed == 4
+        mock_database_manager.execute_query.assert_called_once()
+        query, params = mock_database_manager.execute_query.call_args[0]
+        assert "unnest" in query
+        assert "pg_notify" in query
+        assert params["channel"] == HIERARCHY_CHANNEL
+        assert params["departments"] == ["内科", "内科"]
+        assert params["doctors"] == ["田中医師", "佐藤医師"]
+        assert params["document_types"] == ["診断書"]
+        assert params["purposes"] == ["診断"]
+        assert params["seed_version"] is None
+
+    def test_get_seed_version(self, mock_database_manager):
+        """登録済みシードバージョンの取得テスト"""
+        mock_database_manager.execute_query.return_value = [{"value": "v1"}]
+        assert HierarchyRepository(mock_database_manager).get_seed_version() == "v1"
+
+        mock_database_manager.execute_query.return_value = []
+        assert HierarchyRepository(mock_database_manager).get_seed_version() is None
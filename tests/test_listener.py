@@ -0,0 +1,108 @@
+from types import SimpleNamespace
+from unittest.mock import Mock, patch
+
+from database.listener import NotificationListener
+
+
+class FakeConnection:
+    def __init__(self, listener, notifications):
+        self.listener = listener
+        self.pending = list(notifications)
+        self.notifies = []
+        self.cursor_mock = Mock()
+        self.closed = False
+
+    def cursor(self):
+        return self.cursor_mock
+
+    def poll(self):
+        self.notifies.extend(self.pending)
+        self.pending = []
+        self.listener._stop_event.set()
+
+    def close(self):
+        self.closed = True
+
+
+class TestNotificationListener:
+    """NotificationListenerクラスのテスト"""
+
+    def test_dispatch_calls_channel_handlers(self):
+        """チャンネルごとのハンドラーが呼ばれるテスト"""
+        listener = NotificationListener()
+        handler = Mock()
+        other = Mock()
+        listener.subscribe("prompts_changed", handler)
+        listener.subscribe("other_channel", other)
+
+        listener._dispatch("prompts_changed", "{}")
+
+        handler.assert_called_once_with("{}")
+        other.assert_not_called()
+
+    def test_dispatch_handler_error_does_not_stop_others(self):
+        """ハンドラーの例外が他のハンドラーに影響しないテスト"""
+        listener = NotificationListener()
+        failing = Mock(side_effect=Exception("処理エラー"))
+        handler = Mock()
+        listener.subscribe("prompts_changed", failing)
+        listener.subscribe("prompts_changed", handler)
+
+        listener._dispatch("prompts_changed", "{}")
+
+        handler.assert_called_once_with("{}")
+
+    @patch('database.listener.select.select')
+    @patch('database.listener.DatabaseManager')
+    def test_listen_subscribes_and_dispatches(self, mock_db_manager, mock_select):
+        """LISTEN後に受信した通知が処理されるテスト"""
+        listener = NotificationListener()
+        handler = Mock()
+        version_check = Mock()
+        listener.subscribe("prompts_changed", handler, version_check=version_check)
+
+        connection = FakeConnection(listener, [SimpleNamespace(channel="prompts_changed", payload="payload")])
+        mock_db_manager.get_instance.return_value.get_dedicated_connection.return_value = connection
+        mock_select.return_value = ([connection], [], [])
+
+        listener._listen()
+
+        connection.cursor_mock.execute.assert_called_once_with("LISTEN prompts_changed")
+        version_check.assert_called_once()
+        handler.assert_called_once_with("payload")
+
+    @patch('database.listener.DatabaseManager')
+    def test_run_falls_back_to_version_check_on_disconnect(self, mock_db_manager):
+        """接続できない場合にバージョン確認へフォールバックするテスト"""
+        listener = NotificationListener(poll_interval=0)
+        version_check = Mock(side_effect=lambda: listener._stop_event.set())
+        listener.subscribe("prompts_changed", Mock(), version_check=version_check)
+        mock_db_manager.get_instance.return_value.get_dedicated_connection.side_effect = Exception("接続失敗")
+
+        listener._run()
+
+        version_check.assert_called_once()
+        assert listener.is_connected() is False
+
+    @patch('database.listener.select.select')
+    @patch('database.listener.DatabaseManager')
+    def test_listen_picks_up_late_subscription(self, mock_db_manager, mock_select):
+        """起動後に追加された購読もLISTENされるテスト"""
+        listener = NotificationListener()
+        listener.subscribe("prompts_changed", Mock())
+        connection = FakeConnection(listener, [])
+        mock_db_manager.get_instance.return_value.get_dedicated_connection.return_value = connection
+
+        def late_subscribe(*args):
+            if len(listener._handlers) == 1:
+                listener.subscribe("hierarchy_changed", Mock())
+                return [], [], []
+            listener._stop_event.set()
+            return [], [], []
+
+        mock_select.side_effect = late_subscribe
+
+        listener._listen()
+
+        executed = [c.args[0] for c in connection.cursor_mock.execute.call_args_list]
+        assert executed == ["LISTEN prompts_changed", "LISTEN hierarchy_changed"]
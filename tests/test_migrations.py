@@ -0,0 +1,261 @@
+import datetime
+import json
+import os
+import uuid
+from unittest.mock import Mock
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from database.migrations import MIGRATIONS, apply_migrations, latest_version
+from database.usage_partitions import DELETE_LATE_ROWS_SQL, LATE_ROW_IDS_SQL, LATE_ROWS_SQL
+from database.usage_repository import INSERT_MANY_SQL, USAGE_COLUMNS
+from database.usage_rollups import (build_summary_query, FREEZE_ROLLUPS_SQL, REFRESH_ROLLUPS_SQL,
+                                    ROLLUP_FROZEN_BEFORE_KEY, ROLLUP_THROUGH_KEY)
+from services.statistics_service import RECORDS_PAGE_QUERY, USAGE_METRICS_QUERY, StatisticsFilter
+
+# 実際のPostgreSQLで実行計画を確かめる場合だけ指定する
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+ROLLUP_KEYS = {"rollup_key": ROLLUP_THROUGH_KEY, "frozen_key": ROLLUP_FROZEN_BEFORE_KEY}
+
+
+def make_connection(current_version):
+    conn = Mock()
+    conn.execute.return_value.scalar.return_value = current_version
+    return conn
+
+
+def executed_sql(conn):
+    return [str(call[0][0]) for call in conn.execute.call_args_list]
+
+
+class TestApplyMigrations:
+    """apply_migrations関数のテスト"""
+
+    def test_versions_are_ordered(self):
+        """バージョンが重複なく昇順に並んでいるテスト"""
+        versions = [version for version, _, _ in MIGRATIONS]
+        assert versions == sorted(set(versions))
+        assert latest_version() == versions[-1]
+
+    def test_applies_all_on_new_database(self):
+        """未適用のデータベースにすべて適用するテスト"""
+        conn = make_connection(0)
+
+        applied = apply_migrations(conn)
+
+        assert applied == [version for version, _, _ in MIGRATIONS]
+        statements = executed_sql(conn)
+        assert "pg_advisory_xact_lock" in statements[1]
+        assert sum("INSERT INTO schema_version" in sql for sql in statements) == len(MIGRATIONS)
+
+    def test_skips_applied_versions(self):
+        """適用済みのバージョンは実行しないテスト"""
+        conn = make_connection(latest_version())
+
+        assert apply_migrations(conn) == []
+        assert not any("CREATE INDEX" in sql for sql in executed_sql(conn))
+
+    def test_applies_only_pending(self):
+        """途中のバージョンから残りだけを適用するテスト"""
+        conn = make_connection(2)
+
+        applied = apply_migrations(conn)
+
+        assert applied == [version for version, _, _ in MIGRATIONS if version > 2]
+        assert not any("prompts_content_hash_idx" in sql for sql in executed_sql(conn))
+
+
+SUMMARY_USAGE_DDL = """
+    CREATE TABLE summary_usage (
+        id SERIAL PRIMARY KEY,
+        date TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+        app_type VARCHAR(50),
+        document_types VARCHAR(100),
+        model_detail VARCHAR(100),
+        department VARCHAR(100),
+        doctor VARCHAR(100),
+        input_tokens INTEGER,
+        output_tokens INTEGER,
+        total_tokens INTEGER,
+        processing_time INTEGER,
+        event_id UUID
+    )
+"""
+
+# 2年分・20万件。文書名とモデルは実際の利用に近い偏りを持たせる
+SYNTHETIC_ROWS_SQL = """
+    INSERT INTO summary_usage (date, app_type, document_types, model_detail, department, doctor,
+                               input_tokens, output_tokens, total_tokens, processing_time)
+    SELECT TIMESTAMPTZ '2024-01-01 00:00:00+09' + (i * INTERVAL '5 minutes'),
+           'app',
+           CASE WHEN i % 50 = 0 THEN '主治医意見書' WHEN i % 10 = 0 THEN '返書' ELSE '診療情報提供書' END,
+           CASE WHEN i % 200 = 0 THEN 'claude-3-opus' WHEN i % 3 = 0 THEN 'gemini-2.5-flash'
+                ELSE 'gemini-2.5-pro' END,
+           (ARRAY['default', '内科', '眼科', '整形外科'])[1 + i % 4],
+           'default',
+           1000, 500, 1500, 10
+    FROM generate_series(1, 200000) AS i
+"""
+
+APP_METADATA_DDL = """
+    CREATE TABLE app_metadata (
+        key VARCHAR(100) PRIMARY KEY,
+        value TEXT,
+        updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+# summary_usage に関わるマイグレーション (インデックス・パーティション化・日次集計・モデルの分類・状態)
+USAGE_MIGRATIONS = (1, 3, 4, 5, 6, 7, 8, 9, 10)
+
+PAGE_FILTERS = [
+    ("直近1週間", datetime.date(2025, 6, 1), datetime.date(2025, 6, 7), "すべて", "すべて"),
+    ("少ないモデル", datetime.date(2024, 1, 1), datetime.date(2025, 12, 31), "Claude", "すべて"),
+    ("少ない文書名", datetime.date(2024, 1, 1), datetime.date(2025, 12, 31), "すべて", "主治医意見書"),
+]
+
+
+def plan_nodes(plan):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+def usage_schema(rows_sql=None):
+    engine = create_engine(TEST_DATABASE_URL)
+    schema = f"explain_test_{uuid.uuid4().hex[:8]}"
+    with engine.connect() as conn:
+        transaction = conn.begin()
+        try:
+            conn.execute(text(f"CREATE SCHEMA {schema}"))
+            conn.execute(text(f"SET LOCAL search_path TO {schema}, public"))
+            conn.execute(text(SUMMARY_USAGE_DDL))
+            conn.execute(text(APP_METADATA_DDL))
+            if rows_sql:
+                conn.execute(text(rows_sql))
+            for version, _, statements in MIGRATIONS:
+                if version in USAGE_MIGRATIONS:
+                    for statement in statements:
+                        conn.execute(text(statement))
+            yield conn
+        finally:
+            transaction.rollback()
+    engine.dispose()
+
+
+@pytest.fixture
+def synthetic_usage():
+    for conn in usage_schema(SYNTHETIC_ROWS_SQL):
+        conn.execute(text(REFRESH_ROLLUPS_SQL), ROLLUP_KEYS)
+        conn.execute(text("ANALYZE summary_usage"))
+        conn.execute(text("ANALYZE summary_usage_daily"))
+        yield conn
+
+
+@pytest.fixture
+def partitioned_usage():
+    yield from usage_schema()
+
+
+def assert_no_seq_scan(conn, query, params, label):
+    explain = conn.execute(text("EXPLAIN (FORMAT JSON) " + query), params).scalar()
+    plan = (json.loads(explain) if isinstance(explain, str) else explain)[0]["Plan"]
+    scans = [node for node in plan_nodes(plan)
+             if node.get("Relation Name", "").startswith("summary_usage_2")
+             or node.get("Index Name", "").startswith("summary_usage_2")]
+
+    assert scans, label
+    assert all(node["Node Type"] != "Seq Scan" for node in scans), (label, query)
+
+
+@pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL が未設定")
+class TestStatisticsQueryPlans:
+    """統計画面のクエリがインデックスを使うことを実行計画で確かめるテスト"""
+
+    @pytest.mark.parametrize("label,start,end,model,document_type", PAGE_FILTERS)
+    def test_statistics_queries_avoid_seq_scan(self, synthetic_usage, label, start, end, model, document_type):
+        filters = StatisticsFilter(start, end, model, document_type)
+        params = {**filters.params, **filters.rollup_params, "start_day": start, "end_day": end,
+                  **ROLLUP_KEYS, "limit": 100}
+
+        for query in (build_summary_query(filters.where_clause, filters.rollup_clause),
+                      RECORDS_PAGE_QUERY.format(where_clause=filters.where_clause)):
+            assert_no_seq_scan(synthetic_usage, query, params, label)
+
+    # 1区画の2割以上を読む期間だけの絞り込みでは、区画を順に読むほうが速いので対象にしない
+    @pytest.mark.parametrize("label,start,end,model,document_type", PAGE_FILTERS[1:])
+    def test_metrics_query_avoids_seq_scan(self, synthetic_usage, label, start, end, model, document_type):
+        filters = StatisticsFilter(start, end, model, document_type)
+        query = USAGE_METRICS_QUERY.format(where_clause=filters.usage_clause)
+        assert_no_seq_scan(synthetic_usage, query, filters.params, label)
+
+
+INSERT_LATE_ROW_SQL = """
+    INSERT INTO summary_usage (date, app_type, document_types, model_detail, model_family, department, doctor,
+                               input_tokens, output_tokens, total_tokens, processing_time)
+    VALUES (TIMESTAMPTZ '2020-03-15 12:00:00+09', 'app', '返書', 'claude-sonnet', 'Claude', 'default', 'default',
+            1000, 500, 1500, 1.5)
+"""
+
+
+@pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL が未設定")
+class TestDefaultPartition:
+    """区画のない月の行を受ける既定の区画のテスト"""
+
+    def test_row_without_partition_goes_to_default(self, partitioned_usage):
+        """区画のない月の行も登録でき、既定の区画に入るテスト"""
+        partitioned_usage.execute(text(INSERT_LATE_ROW_SQL))
+
+        assert partitioned_usage.execute(text("SELECT COUNT(*) FROM summary_usage_default")).scalar() == 1
+
+    def test_creating_partition_moves_rows_from_default(self, partitioned_usage):
+        """既定の区画に行がある月の区画を作ると、行を新しい区画へ移すテスト"""
+        partitioned_usage.execute(text(INSERT_LATE_ROW_SQL))
+
+        created = partitioned_usage.execute(text("SELECT create_summary_usage_partition(DATE '2020-03-01')")).scalar()
+
+        assert created is True
+        assert partitioned_usage.execute(text("SELECT COUNT(*) FROM summary_usage_default")).scalar() == 0
+        assert partitioned_usage.execute(text("SELECT COUNT(*) FROM summary_usage_202003")).scalar() == 1
+        assert partitioned_usage.execute(text("SELECT COUNT(*) FROM summary_usage")).scalar() == 1
+
+    def test_late_rows_keep_archived_rollups(self, partitioned_usage):
+        """アーカイブした月に遅れて登録された行だけで、その日の日次集計を作り直さないテスト"""
+        partitioned_usage.execute(text(INSERT_LATE_ROW_SQL))
+        partitioned_usage.execute(text(INSERT_LATE_ROW_SQL))
+        partitioned_usage.execute(text("SELECT create_summary_usage_partition(DATE '2020-03-01')"))
+        partitioned_usage.execute(text(REFRESH_ROLLUPS_SQL), ROLLUP_KEYS)
+        # archive_expired_partitions と同じ順に、集計を確定させてから区画を切り離して削除する
+        partitioned_usage.execute(text(FREEZE_ROLLUPS_SQL), {"frozen_key": ROLLUP_FROZEN_BEFORE_KEY,
+                                                             "before": "2020-04-01"})
+        partitioned_usage.execute(text("ALTER TABLE summary_usage DETACH PARTITION summary_usage_202003"))
+        partitioned_usage.execute(text("DROP TABLE summary_usage_202003"))
+
+        late = {name: [None] for name, _ in USAGE_COLUMNS}
+        late.update(date=[datetime.datetime(2020, 3, 15, 3, 0, tzinfo=datetime.timezone.utc)],
+                    model_family=["Claude"], status=["success"], input_tokens=[1000], total_tokens=[1500])
+        partitioned_usage.execute(text(INSERT_MANY_SQL), {**late, "rollup_key": ROLLUP_THROUGH_KEY})
+        partitioned_usage.execute(text(REFRESH_ROLLUPS_SQL), ROLLUP_KEYS)
+
+        daily = partitioned_usage.execute(text(
+            "SELECT SUM(count) FROM summary_usage_daily WHERE day = DATE '2020-03-15'"
+        )).scalar()
+        filters = StatisticsFilter(datetime.date(2020, 3, 1), datetime.date(2020, 3, 31), "すべて", "すべて")
+        rows = partitioned_usage.execute(text(build_summary_query(filters.where_clause, filters.rollup_clause)), {
+            **filters.params, **filters.rollup_params, **ROLLUP_KEYS,
+            "start_day": filters.start_date, "end_day": filters.end_date
+        }).mappings().all()
+        late_ids = partitioned_usage.execute(text(LATE_ROW_IDS_SQL), {
+            "before": datetime.datetime(2020, 4, 1, tzinfo=datetime.timezone(datetime.timedelta(hours=9)))
+        }).scalars().all()
+
+        assert daily == 2
+        assert next(row for row in rows if row["is_total"])["count"] == 2
+        assert len(late_ids) == 1
+        late_rows = partitioned_usage.execute(text(LATE_ROWS_SQL), {"ids": late_ids}).mappings().all()
+        assert [row["total_tokens"] for row in late_rows] == [1500]
+
+        partitioned_usage.execute(text(DELETE_LATE_ROWS_SQL), {"ids": late_ids})
+        assert partitioned_usage.execute(text("SELECT COUNT(*) FROM summary_usage_default")).scalar() == 0
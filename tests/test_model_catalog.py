@@ -0,0 +1,28 @@
+from utils.model_catalog import classify_model, model_family_sql
+
+
+class TestClassifyModel:
+    """classify_model関数のテスト"""
+
+    def test_classifies_by_mapping_order(self):
+        """モデル名を MODEL_MAPPING の順で分類するテスト"""
+        assert classify_model("Gemini-2.5-Flash") == "Gemini_Flash"
+        assert classify_model("gemini-2.5-pro") == "Gemini_Pro"
+        assert classify_model("claude-3-sonnet") == "Claude"
+
+    def test_default_family(self):
+        """どれにも当てはまらない場合は既定の分類にするテスト"""
+        assert classify_model(None) == "Gemini_Pro"
+        assert classify_model("unknown") == "Gemini_Pro"
+
+
+class TestModelFamilySql:
+    """model_family_sql関数のテスト"""
+
+    def test_cases_follow_model_mapping_order(self):
+        """MODEL_MAPPING の順に判定し、最後は既定の分類にするテスト"""
+        sql = model_family_sql("model_detail")
+
+        assert sql.index("'Gemini_Pro'") < sql.index("'Gemini_Flash'") < sql.index("'Claude'")
+        assert "model_detail NOT ILIKE '%flash%'" in sql
+        assert sql.endswith("ELSE 'Gemini_Pro' END")
@@ -0,0 +1,113 @@
+import pytest
+from sqlalchemy import create_engine, exc, text
+
+from database.pool_metrics import InstrumentedQueuePool, PoolMetrics, instrument_pool
+
+
+@pytest.fixture
+def make_engine(tmp_path):
+    engines = []
+
+    def make(ping_idle_seconds=60, pool_size=2, max_overflow=1, pool_timeout=5):
+        engine = create_engine(f"sqlite:///{tmp_path / 'pool.db'}", poolclass=InstrumentedQueuePool,
+                               pool_size=pool_size, max_overflow=max_overflow, pool_timeout=pool_timeout)
+        instrument_pool(engine, ping_idle_seconds)
+        engines.append(engine)
+        return engine
+
+    yield make
+    for engine in engines:
+        engine.dispose()
+
+
+def run_query(engine):
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+
+class TestPoolMetrics:
+    """接続プールの集計のテスト"""
+
+    def test_counts_checkouts_and_skips_fresh_pings(self, make_engine):
+        """チェックアウトを数え、使われてすぐの接続は生存確認しないテスト"""
+        engine = make_engine(ping_idle_seconds=60)
+        for _ in range(3):
+            run_query(engine)
+
+        snapshot = engine.pool.metrics.snapshot(engine.pool)
+
+        assert snapshot["checkouts"] == 3
+        assert snapshot["pings"] == 0
+        assert snapshot["pings_skipped"] == 3
+        assert sum(snapshot["wait_buckets"].values()) == 3
+        assert snapshot["checked_out"] == 0
+
+    def test_pings_idle_connections(self, make_engine):
+        """一定時間使われなかった接続だけ生存確認するテスト"""
+        engine = make_engine(ping_idle_seconds=0)
+        run_query(engine)
+        run_query(engine)
+
+        snapshot = engine.pool.metrics.snapshot(engine.pool)
+        assert snapshot["pings"] == 2
+        assert snapshot["ping_failures"] == 0
+
+    def test_failed_ping_replaces_connection(self, make_engine, monkeypatch):
+        """生存確認に失敗した接続を捨て、新しい接続でやり直すテスト"""
+        engine = make_engine(ping_idle_seconds=0)
+        run_query(engine)
+        calls = []
+
+        def failing_ping(dbapi_connection):
+            calls.append(dbapi_connection)
+            if len(calls) == 1:
+                raise RuntimeError("server closed the connection")
+            return True
+
+        monkeypatch.setattr(engine.dialect, "do_ping", failing_ping)
+        run_query(engine)
+
+        snapshot = engine.pool.metrics.snapshot(engine.pool)
+        assert snapshot["ping_failures"] == 1
+        assert snapshot["invalidations"] == 1
+        assert calls[0] is not calls[1]
+
+    def test_tracks_overflow_and_timeouts(self, make_engine):
+        """オーバーフローの使用と空き待ちの時間切れを数えるテスト"""
+        engine = make_engine(pool_size=1, max_overflow=1, pool_timeout=0.1)
+        first, second = engine.connect(), engine.connect()
+        try:
+            with pytest.raises(exc.TimeoutError):
+                engine.connect()
+        finally:
+            first.close()
+            second.close()
+
+        snapshot = engine.pool.metrics.snapshot(engine.pool)
+        assert snapshot["peak_checked_out"] == 2
+        assert snapshot["peak_overflow"] == 1
+        assert snapshot["overflow_checkouts"] == 1
+        assert snapshot["timeouts"] == 1
+
+    def test_metrics_survive_dispose(self, make_engine):
+        """プールを作り直しても同じ集計を使い続けるテスト"""
+        engine = make_engine()
+        metrics = engine.pool.metrics
+        engine.dispose()
+        run_query(engine)
+
+        assert engine.pool.metrics is metrics
+        assert metrics.checkouts == 1
+
+    def test_slow_checkout_reported_once_per_interval(self, capsys):
+        """待ち時間の長いチェックアウトの知らせを間隔を空けて出すテスト"""
+        now = [0.0]
+        metrics = PoolMetrics(slow_checkout_seconds=0.5, clock=lambda: now[0])
+
+        metrics.record_checkout(0.8, 5, 1)
+        metrics.record_checkout(0.9, 5, 1)
+        now[0] = 61
+        metrics.record_checkout(0.7, 5, 1)
+
+        assert metrics.slow_checkouts == 3
+        assert capsys.readouterr().out.count("接続プールの空きを") == 2
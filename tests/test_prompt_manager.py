@@ -1,22 +1,36 @@
+import json
 import pytest
-import datetime
 from unittest.mock import patch, Mock, MagicMock
 from sqlalchemy import text
 
+from utils import prompt_manager
 from utils.prompt_manager import (
     get_prompt_collection,
-    get_current_datetime,
-    update_document,
     get_all_departments,
     get_all_prompts,
     create_or_update_prompt,
     delete_prompt,
-    insert_document,
     initialize_default_prompt,
     get_prompt,
-    initialize_database
+    get_prompt_snapshot,
+    invalidate_prompt_cache,
+    handle_prompt_notification,
+    check_prompt_version,
+    initialize_database,
+    build_prompt_seed_matrix,
+    compute_prompt_seed_version,
+    start_database_initialization
 )
 from utils.exceptions import DatabaseError, AppError
+from utils.hierarchy_manager import HierarchyIndex
+
+
+@pytest.fixture(autouse=True)
+def reset_prompt_cache():
+    """各テスト前後でプロンプトキャッシュを破棄"""
+    invalidate_prompt_cache()
+    yield
+    invalidate_prompt_cache()
 
 
 class TestGetPromptCollection:
@@ -42,90 +56,15 @@ class TestGetPromptCollection:
             get_prompt_collection()
 
 
-class TestGetCurrentDatetime:
-    """get_current_datetime関数のテスト"""
-    
-    def test_get_current_datetime(self):
-        """現在時刻の取得テスト"""
-        with patch('utils.prompt_manager.datetime') as mock_datetime:
-            mock_now = datetime.datetime(2024, 1, 1, 12, 0, 0)
-            mock_datetime.datetime.now.return_value = mock_now
-            
-            result = get_current_datetime()
-            
-            assert result == mock_now
-            mock_datetime.datetime.now.assert_called_once()
-
-
-class TestUpdateDocument:
-    """update_document関数のテスト"""
-    
-    def test_update_document_by_department(self, mock_database_manager):
-        """部署での更新テスト"""
-        query_dict = {"department": "内科"}
-        update_data = {"name": "テスト名", "content": "テスト内容"}
-        
-        with patch('utils.prompt_manager.get_prompt_collection', return_value=mock_database_manager):
-            with patch('utils.prompt_manager.get_current_datetime') as mock_datetime:
-                mock_now = datetime.datetime(2024, 1, 1, 12, 0, 0)
-                mock_datetime.return_value = mock_now
-                
-                result = update_document(mock_database_manager, query_dict, update_data)
-                
-                assert result is True
-                mock_database_manager.execute_query.assert_called_once()
-                
-                # 呼び出された引数を確認
-                call_args = mock_database_manager.execute_query.call_args
-                assert "UPDATE prompts" in call_args[0][0]
-                assert call_args[1]["fetch"] is False
-    
-    def test_update_document_by_name(self, mock_database_manager):
-        """名前での更新テスト"""
-        query_dict = {"name": "テスト部署"}
-        update_data = {"default_model": "gemini", "order_index": 1}
-        
-        with patch('utils.prompt_manager.get_prompt_collection', return_value=mock_database_manager):
-            with patch('utils.prompt_manager.get_current_datetime') as mock_datetime:
-                mock_now = datetime.datetime(2024, 1, 1, 12, 0, 0)
-                mock_datetime.return_value = mock_now
-                
-                result = update_document(mock_database_manager, query_dict, update_data)
-                
-                assert result is True
-                mock_database_manager.execute_query.assert_called_once()
-                
-                call_args = mock_database_manager.execute_query.call_args
-                assert "UPDATE departments" in call_args[0][0]
-    
-    def test_update_document_invalid_query(self, mock_database_manager):
-        """無効なクエリでの更新テスト"""
-        query_dict = {"invalid_key": "value"}
-        update_data = {"content": "テスト"}
-        
-        with patch('utils.prompt_manager.get_prompt_collection', return_value=mock_database_manager):
-            with pytest.raises(DatabaseError, match="ドキュメントの更新に失敗しました"):
-                update_document(mock_database_manager, query_dict, update_data)
-    
-    def test_update_document_database_error(self, mock_database_manager):
-        """データベースエラーのテスト"""
-        query_dict = {"department": "内科"}
-        update_data = {"content": "テスト"}
-        mock_database_manager.execute_query.side_effect = Exception("DB接続エラー")
-        
-        with patch('utils.prompt_manager.get_prompt_collection', return_value=mock_database_manager):
-            with pytest.raises(DatabaseError, match="ドキュメントの更新に失敗しました"):
-                update_document(mock_database_manager, query_dict, update_data)
-
-
 class TestGetAllDepartments:
     """get_all_departments関数のテスト"""
     
-    @patch('utils.prompt_manager.DEFAULT_DEPARTMENT', ['内科', '外科', '小児科'])
     def test_get_all_departments(self):
         """全部署の取得テスト"""
-        result = get_all_departments()
-        assert result == ['内科', '外科', '小児科']
+        index = HierarchyIndex(1, ['default', '内科', '外科', '小児科'], {}, [], {})
+        with patch('utils.prompt_manager.get_hierarchy', return_value=index):
+            result = get_all_departments()
+        assert result == ['default', '内科', '外科', '小児科']
 
 
 class TestGetAllPrompts:
@@ -161,11 +100,7 @@ class TestCreateOrUpdatePrompt:
     
     def test_create_or_update_prompt_update_existing(self, mock_database_manager):
         """既存プロンプトの更新テスト"""
-        # 既存のプロンプトが存在する場合
-        mock_database_manager.execute_query.side_effect = [
-            [{"id": 1, "content": "既存プロンプト"}],  # 既存確認クエリ
-            None  # 更新クエリ
-        ]
+        mock_database_manager.execute_in_transaction.return_value = [[{"id": 1, "inserted": False, "version": 2}], []]
         
         with patch('utils.prompt_manager.get_prompt_collection', return_value=mock_database_manager):
             success, message = create_or_update_prompt(
@@ -174,25 +109,22 @@ class TestCreateOrUpdatePrompt:
             
             assert success is True
             assert message == "プロンプトを更新しました"
-            assert mock_database_manager.execute_query.call_count == 2
+            mock_database_manager.execute_in_transaction.assert_called_once()
     
     def test_create_or_update_prompt_create_new(self, mock_database_manager):
         """新規プロンプトの作成テスト"""
-        # 既存のプロンプトが存在しない場合
-        mock_database_manager.execute_query.side_effect = [
-            [],  # 既存確認クエリ（空の結果）
-            [{"id": 1}]  # 挿入クエリ
-        ]
+        mock_database_manager.execute_in_transaction.return_value = [[{"id": 1, "inserted": True, "version": 2}], []]
         
         with patch('utils.prompt_manager.get_prompt_collection', return_value=mock_database_manager):
-            with patch('utils.prompt_manager.insert_document', return_value=1) as mock_insert:
-                success, message = create_or_update_prompt(
-                    "内科", "主治医意見書", "田中医師", "新しいプロンプト", "gemini"
-                )
-                
-                assert success is True
-                assert message == "プロンプトを新規作成しました"
-                mock_insert.assert_called_once()
+            success, message = create_or_update_prompt(
+                "内科", "主治医意見書", "田中医師", "新しいプロンプト", "gemini"
+            )
+            
+            assert success is True
+            assert message == "プロンプトを新規作成しました"
+            query, params = mock_database_manager.execute_in_transaction.call_args[0][0][0]
+            assert "ON CONFLICT (department, document_type, doctor) DO UPDATE" in query
+            assert params["selected_model"] == "gemini"
     
     def test_create_or_update_prompt_invalid_input(self):
         """無効な入力のテスト"""
@@ -203,7 +135,7 @@ class TestCreateOrUpdatePrompt:
     
     def test_create_or_update_prompt_database_error(self, mock_database_manager):
         """データベースエラーのテスト"""
-        mock_database_manager.execute_query.side_effect = DatabaseError("DB接続エラー")
+        mock_database_manager.execute_in_transaction.side_effect = DatabaseError("DB接続エラー")
         
         with patch('utils.prompt_manager.get_prompt_collection', return_value=mock_database_manager):
             success, message = create_or_update_prompt(
@@ -219,19 +151,15 @@ class TestDeletePrompt:
     
     def test_delete_prompt_success(self, mock_database_manager):
         """プロンプト削除の成功テスト"""
-        mock_session = Mock()
-        mock_result = Mock()
-        mock_result.rowcount = 1
-        mock_session.execute.return_value = mock_result
-        mock_database_manager.get_session.return_value = mock_session
+        mock_database_manager.execute_in_transaction.return_value = [[{"id": 1, "version": 2}], []]
         
         with patch('utils.prompt_manager.get_prompt_collection', return_value=mock_database_manager):
             success, message = delete_prompt("内科", "主治医意見書", "田中医師")
             
             assert success is True
             assert message == "プロンプトを削除しました"
-            mock_session.commit.assert_called_once()
-            mock_session.close.assert_called_once()
+            query = mock_database_manager.execute_in_transaction.call_args[0][0][0][0]
+            assert "DELETE FROM prompts" in query
     
     def test_delete_prompt_default_protection(self):
         """デフォルトプロンプトの削除保護テスト"""
@@ -242,87 +170,23 @@ class TestDeletePrompt:
     
     def test_delete_prompt_not_found(self, mock_database_manager):
         """存在しないプロンプトの削除テスト"""
-        mock_session = Mock()
-        mock_result = Mock()
-        mock_result.rowcount = 0
-        mock_session.execute.return_value = mock_result
-        mock_database_manager.get_session.return_value = mock_session
+        mock_database_manager.execute_in_transaction.return_value = [[], []]
         
         with patch('utils.prompt_manager.get_prompt_collection', return_value=mock_database_manager):
             success, message = delete_prompt("内科", "主治医意見書", "田中医師")
             
             assert success is False
             assert message == "プロンプトが見つかりません"
-            mock_session.rollback.assert_called_once()
 
     def test_delete_prompt_database_error(self, mock_database_manager):
         """データベースエラーのテスト"""
-        mock_session = Mock()
-        mock_session.execute.side_effect = Exception("DB接続エラー")
-        mock_database_manager.get_session.return_value = mock_session
+        mock_database_manager.execute_in_transaction.side_effect = Exception("DB接続エラー")
 
         with patch('utils.prompt_manager.get_prompt_collection', return_value=mock_database_manager):
             # AppError例外がraiseされることを期待
             with pytest.raises(AppError, match="プロンプトの削除中にエラーが発生しました"):
                 delete_prompt("内科", "主治医意見書", "田中医師")
 
-            mock_session.rollback.assert_called_once()
-            mock_session.close.assert_called_once()
-
-
-class TestInsertDocument:
-    """insert_document関数のテスト"""
-    
-    def test_insert_document_department(self, mock_database_manager):
-        """部署の挿入テスト"""
-        document = {
-            "name": "新部署",
-            "order_index": 1,
-            "default_model": "gemini"
-        }
-        mock_database_manager.execute_query.return_value = [{"id": 1}]
-        
-        with patch('utils.prompt_manager.get_current_datetime') as mock_datetime:
-            mock_now = datetime.datetime(2024, 1, 1, 12, 0, 0)
-            mock_datetime.return_value = mock_now
-            
-            result = insert_document(mock_database_manager, document)
-            
-            assert result == 1
-            mock_database_manager.execute_query.assert_called_once()
-            
-            call_args = mock_database_manager.execute_query.call_args
-            assert "INSERT INTO departments" in call_args[0][0]
-    
-    def test_insert_document_prompt(self, mock_database_manager):
-        """プロンプトの挿入テスト"""
-        document = {
-            "department": "内科",
-            "doctor": "田中医師",
-            "content": "プロンプト内容"
-        }
-        mock_database_manager.execute_query.return_value = [{"id": 1}]
-        
-        with patch('utils.prompt_manager.get_current_datetime') as mock_datetime:
-            mock_now = datetime.datetime(2024, 1, 1, 12, 0, 0)
-            mock_datetime.return_value = mock_now
-            
-            result = insert_document(mock_database_manager, document)
-            
-            assert result == 1
-            mock_database_manager.execute_query.assert_called_once()
-            
-            call_args = mock_database_manager.execute_query.call_args
-            assert "INSERT INTO prompts" in call_args[0][0]
-    
-    def test_insert_document_invalid_format(self, mock_database_manager):
-        """無効なドキュメント形式のテスト"""
-        document = {"invalid_key": "value"}
-        
-        with patch('utils.prompt_manager.get_current_datetime'):
-            with pytest.raises(DatabaseError, match="ドキュメントの挿入に失敗しました"):
-                insert_document(mock_database_manager, document)
-
 
 class TestGetPrompt:
     """get_prompt関数のテスト"""
@@ -336,7 +200,7 @@ class TestGetPrompt:
             "doctor": "田中医師",
             "content": "内科用プロンプト"
         }
-        mock_database_manager.execute_query.return_value = [expected_prompt]
+        mock_database_manager.execute_query.return_value = [dict(expected_prompt, cache_version=1)]
         
         with patch('utils.prompt_manager.get_prompt_collection', return_value=mock_database_manager):
             result = get_prompt("内科", "主治医意見書", "田中医師")
@@ -349,24 +213,37 @@ class TestGetPrompt:
         default_prompt = {
             "id": 1,
             "department": "default",
-            "document_type": "主治医意見書",
+            "document_type": "診療情報提供書",
             "doctor": "default",
-            "content": "デフォルトプロンプト"
+            "content": "デフォルトプロンプト",
+            "is_default": True
         }
         
-        # 最初のクエリは空、2番目のクエリでデフォルトを返す
-        mock_database_manager.execute_query.side_effect = [[], [default_prompt]]
+        mock_database_manager.execute_query.return_value = [dict(default_prompt, cache_version=1)]
         
         with patch('utils.prompt_manager.get_prompt_collection', return_value=mock_database_manager):
-            with patch('utils.prompt_manager.DEFAULT_DOCUMENT_TYPE', '主治医意見書'):
-                result = get_prompt("存在しない部署", "主治医意見書", "存在しない医師")
-                
-                assert result == default_prompt
-                assert mock_database_manager.execute_query.call_count == 2
+            result = get_prompt("存在しない部署", "返書", "存在しない医師")
+            
+            assert result == default_prompt
+            mock_database_manager.execute_query.assert_called_once()
+
+    def test_get_prompt_fallback_by_specificity(self, mock_database_manager):
+        """医師 → 診療科 → 全科共通の順に解決されるテスト"""
+        rows = [
+            {"id": 1, "department": "default", "document_type": "返書", "doctor": "default", "content": "全科共通"},
+            {"id": 2, "department": "眼科", "document_type": "返書", "doctor": "default", "content": "眼科共通"},
+            {"id": 3, "department": "眼科", "document_type": "返書", "doctor": "田中医師", "content": "田中医師用"},
+        ]
+        mock_database_manager.execute_query.return_value = [dict(row, cache_version=1) for row in rows]
+
+        with patch('utils.prompt_manager.get_prompt_collection', return_value=mock_database_manager):
+            assert get_prompt("眼科", "返書", "田中医師")["content"] == "田中医師用"
+            assert get_prompt("眼科", "返書", "佐藤医師")["content"] == "眼科共通"
+            assert get_prompt("内科", "返書", "佐藤医師")["content"] == "全科共通"
     
     def test_get_prompt_no_default_found(self, mock_database_manager):
         """デフォルトプロンプトも見つからない場合のテスト"""
-        mock_database_manager.execute_query.return_value = []
+        mock_database_manager.execute_query.return_value = [{"cache_version": 0, "id": None}]
         
         with patch('utils.prompt_manager.get_prompt_collection', return_value=mock_database_manager):
             result = get_prompt("存在しない部署", "存在しない文書", "存在しない医師")
@@ -382,46 +259,210 @@ class TestGetPrompt:
                 get_prompt("内科", "主治医意見書", "田中医師")
 
 
+class TestPromptCache:
+    """プロンプトキャッシュのテスト"""
+
+    def test_repeated_lookups_use_snapshot(self, mock_database_manager):
+        """2回目以降の取得でDBにアクセスしないテスト"""
+        mock_database_manager.execute_query.return_value = [
+            {"cache_version": 3, "id": 1, "department": "内科", "document_type": "主治医意見書",
+             "doctor": "田中医師", "content": "内科用"}
+        ]
+
+        with patch('utils.prompt_manager.get_prompt_collection', return_value=mock_database_manager):
+            for _ in range(3):
+                get_prompt("内科", "主治医意見書", "田中医師")
+                get_prompt("外科", "主治医意見書", "default")
+
+            mock_database_manager.execute_query.assert_called_once()
+            assert get_prompt_snapshot().version == 3
+
+    def test_invalidate_reloads_snapshot(self, mock_database_manager):
+        """無効化後に再読み込みされるテスト"""
+        mock_database_manager.execute_query.side_effect = [
+            [{"cache_version": 1, "id": None}],
+            [{"cache_version": 2, "id": None}]
+        ]
+
+        with patch('utils.prompt_manager.get_prompt_collection', return_value=mock_database_manager):
+            first = get_prompt_snapshot()
+            invalidate_prompt_cache()
+            second = get_prompt_snapshot()
+
+            assert second is not first
+            assert second.version == 2
+            assert second.prompts == {}
+
+    def test_create_or_update_prompt_invalidates_cache(self, mock_database_manager):
+        """プロンプト保存時にキャッシュが無効化され変更が通知されるテスト"""
+        mock_database_manager.execute_query.return_value = [{"cache_version": 1, "id": None}]
+        mock_database_manager.execute_in_transaction.return_value = [[{"id": 1, "inserted": True, "version": 2}], []]
+
+        with patch('utils.prompt_manager.get_prompt_collection', return_value=mock_database_manager):
+            get_prompt_snapshot()
+            create_or_update_prompt("内科", "主治医意見書", "田中医師", "新しいプロンプト")
+
+            (query, params), (refresh_query, _) = mock_database_manager.execute_in_transaction.call_args[0][0]
+            assert "pg_notify" in query
+            assert "INSERT INTO prompt_resolutions" in refresh_query
+            assert params["channel"] == "prompts_changed"
+            assert params["doctor"] == "田中医師"
+            assert prompt_manager._prompt_cache is None
+
+    def test_delete_prompt_invalidates_cache(self, mock_database_manager):
+        """プロンプト削除時にキャッシュが無効化されるテスト"""
+        mock_database_manager.execute_query.return_value = [{"cache_version": 1, "id": None}]
+        mock_database_manager.execute_in_transaction.return_value = [[{"id": 1, "version": 2}], []]
+
+        with patch('utils.prompt_manager.get_prompt_collection', return_value=mock_database_manager):
+            get_prompt_snapshot()
+            delete_prompt("内科", "主治医意見書", "田中医師")
+
+            assert prompt_manager._prompt_cache is None
+            assert "pg_notify" in mock_database_manager.execute_in_transaction.call_args[0][0][0][0]
+
+
+class TestPromptNotification:
+    """他ノードからの変更通知のテスト"""
+
+    @pytest.fixture
+    def cached_snapshot(self, mock_database_manager):
+        mock_database_manager.execute_query.return_value = [
+            {"cache_version": 5, "id": 1, "department": "内科", "document_type": "主治医意見書",
+             "doctor": "田中医師", "content": "旧内容"}
+        ]
+        with patch('utils.prompt_manager.get_prompt_collection', return_value=mock_database_manager):
+            snapshot = get_prompt_snapshot()
+        mock_database_manager.execute_query.reset_mock(side_effect=True)
+        return snapshot
+
+    def test_notification_refreshes_only_affected_entry(self, mock_database_manager, cached_snapshot):
+        """通知されたキーのみ再取得されるテスト"""
+        updated = {"department": "内科", "document_type": "主治医意見書", "doctor": "田中医師", "content": "新内容"}
+        mock_database_manager.execute_query.return_value = [updated]
+        payload = json.dumps({"department": "内科", "document_type": "主治医意見書", "doctor": "田中医師", "version": 6})
+
+        with patch('utils.prompt_manager.get_prompt_collection', return_value=mock_database_manager):
+            handle_prompt_notification(payload)
+            result = get_prompt("内科", "主治医意見書", "田中医師")
+
+        assert result["content"] == "新内容"
+        assert get_prompt_snapshot().version == 6
+        mock_database_manager.execute_query.assert_called_once()
+
+    def test_department_notification_refreshes_inheriting_entries(self, mock_database_manager):
+        """診療科の変更通知で、継承している医師のエントリも差し替えられるテスト"""
+        mock_database_manager.execute_query.return_value = [
+            {"cache_version": 5, "id": 1, "department": "内科", "document_type": "返書", "doctor": "default",
+             "content": "旧内容"},
+            {"cache_version": 5, "id": 2, "department": "内科", "document_type": "返書", "doctor": "田中医師",
+             "content": "旧内容", "inherited": True},
+            {"cache_version": 5, "id": 3, "department": "外科", "document_type": "返書", "doctor": "default",
+             "content": "外科用"},
+        ]
+        with patch('utils.prompt_manager.get_prompt_collection', return_value=mock_database_manager):
+            get_prompt_snapshot()
+
+        mock_database_manager.execute_query.return_value = [
+            {"id": 1, "department": "内科", "document_type": "返書", "doctor": "default", "content": "新内容"},
+            {"id": 2, "department": "内科", "document_type": "返書", "doctor": "田中医師", "content": "新内容",
+             "inherited": True},
+        ]
+        payload = json.dumps({"department": "内科", "document_type": "返書", "doctor": "default", "version": 6})
+
+        with patch('utils.prompt_manager.get_prompt_collection', return_value=mock_database_manager):
+            handle_prompt_notification(payload)
+
+        assert get_prompt("内科", "返書", "田中医師")["content"] == "新内容"
+        assert get_prompt("外科", "返書", "default")["content"] == "外科用"
+        params = mock_database_manager.execute_query.call_args[0][1]
+        assert params == {"scope_department": "内科", "scope_document_type": "返書", "scope_doctor": "default"}
+
+    def test_notification_removes_deleted_entry(self, mock_database_manager, cached_snapshot):
+        """削除通知でエントリが取り除かれるテスト"""
+        mock_database_manager.execute_query.return_value = []
+        payload = json.dumps({"department": "内科", "document_type": "主治医意見書", "doctor": "田中医師", "version": 6})
+
+        with patch('utils.prompt_manager.get_prompt_collection', return_value=mock_database_manager):
+            handle_prompt_notification(payload)
+
+        assert ("内科", "主治医意見書", "田中医師") not in get_prompt_snapshot().prompts
+
+    def test_notification_without_snapshot_is_ignored(self, mock_database_manager):
+        """キャッシュ未読み込み時の通知を無視するテスト"""
+        payload = json.dumps({"department": "内科", "document_type": "主治医意見書", "doctor": "田中医師", "version": 5})
+
+        with patch('utils.prompt_manager.get_prompt_collection', return_value=mock_database_manager):
+            handle_prompt_notification(payload)
+
+        mock_database_manager.execute_query.assert_not_called()
+        assert prompt_manager._prompt_cache is None
+
+    def test_notification_without_key_invalidates_all(self, mock_database_manager, cached_snapshot):
+        """キーのない通知でキャッシュ全体が無効化されるテスト"""
+        payload = json.dumps({"department": None, "document_type": None, "doctor": None, "version": 6})
+
+        handle_prompt_notification(payload)
+
+        assert prompt_manager._prompt_cache is None
+
+    def test_version_check_invalidates_when_behind(self, mock_database_manager, cached_snapshot):
+        """バージョン確認でDB側が新しい場合に無効化されるテスト"""
+        mock_database_manager.execute_query.return_value = [{"version": 7}]
+
+        with patch('utils.prompt_manager.get_prompt_collection', return_value=mock_database_manager):
+            check_prompt_version()
+
+        assert prompt_manager._prompt_cache is None
+
+    def test_version_check_keeps_current_snapshot(self, mock_database_manager, cached_snapshot):
+        """バージョンが一致する場合はキャッシュを保持するテスト"""
+        mock_database_manager.execute_query.return_value = [{"version": 5}]
+
+        with patch('utils.prompt_manager.get_prompt_collection', return_value=mock_database_manager):
+            check_prompt_version()
+
+        assert prompt_manager._prompt_cache is cached_snapshot
+
+
 class TestInitializeDefaultPrompt:
     """initialize_default_prompt関数のテスト"""
     
     def test_initialize_default_prompt_not_exists(self, mock_database_manager):
         """デフォルトプロンプトが存在しない場合のテスト"""
-        # 最初のクエリは空の結果（デフォルトプロンプトが存在しない）
-        mock_database_manager.execute_query.return_value = []
+        mock_database_manager.execute_in_transaction.return_value = [[{"id": 1, "version": 1}], []]
         
         mock_config = Mock()
         mock_config.__getitem__ = Mock(return_value={'summary': 'デフォルトプロンプト内容'})
         
         with patch('utils.prompt_manager.get_prompt_collection', return_value=mock_database_manager):
             with patch('utils.prompt_manager.get_config', return_value=mock_config):
-                with patch('utils.prompt_manager.insert_document') as mock_insert:
-                    with patch('utils.prompt_manager.DEFAULT_DOCUMENT_TYPE', '主治医意見書'):
-                        initialize_default_prompt()
-                        
-                        mock_insert.assert_called_once()
-                        insert_args = mock_insert.call_args[0][1]
-                        assert insert_args['department'] == 'default'
-                        assert insert_args['document_type'] == '主治医意見書'
-                        assert insert_args['doctor'] == 'default'
-                        assert insert_args['is_default'] is True
+                initialize_default_prompt()
+                
+                query, params = mock_database_manager.execute_in_transaction.call_args[0][0][0]
+                assert "INSERT INTO prompts" in query
+                assert "INSERT INTO prompt_contents" in query
+                assert params['document_type'] == '診療情報提供書'
+                assert params['content'] == 'デフォルトプロンプト内容'
     
     def test_initialize_default_prompt_already_exists(self, mock_database_manager):
         """デフォルトプロンプトが既に存在する場合のテスト"""
-        existing_prompt = [{"id": 1, "content": "既存プロンプト"}]
-        mock_database_manager.execute_query.return_value = existing_prompt
+        mock_database_manager.execute_in_transaction.return_value = [[], []]
+        
+        mock_config = Mock()
+        mock_config.__getitem__ = Mock(return_value={'summary': 'デフォルトプロンプト内容'})
         
         with patch('utils.prompt_manager.get_prompt_collection', return_value=mock_database_manager):
-            with patch('utils.prompt_manager.insert_document') as mock_insert:
-                with patch('utils.prompt_manager.DEFAULT_DOCUMENT_TYPE', '主治医意見書'):
+            with patch('utils.prompt_manager.get_config', return_value=mock_config):
+                with patch('utils.prompt_manager.invalidate_prompt_cache') as mock_invalidate:
                     initialize_default_prompt()
                     
-                    # insert_documentが呼ばれないことを確認
-                    mock_insert.assert_not_called()
+                    # 挿入されなかった場合はキャッシュを無効化しない
+                    mock_invalidate.assert_not_called()
     
     def test_initialize_default_prompt_error(self, mock_database_manager):
         """初期化中にエラーが発生した場合のテスト"""
-        mock_database_manager.execute_query.side_effect = Exception("DB接続エラー")
+        mock_database_manager.execute_in_transaction.side_effect = Exception("DB接続エラー")
         
         with patch('utils.prompt_manager.get_prompt_collection', return_value=mock_database_manager):
             with pytest.raises(DatabaseError, match="デフォルトプロンプトの初期化に失敗しました"):
@@ -430,49 +471,96 @@ class TestInitializeDefaultPrompt:
 
 class TestInitializeDatabase:
     """initialize_database関数のテスト"""
+
+    @pytest.fixture
+    def seed_config(self):
+        mock_config = Mock()
+        mock_config.__getitem__ = Mock(return_value={'summary': 'デフォルトプロンプト内容'})
+        with patch('utils.prompt_manager.get_config', return_value=mock_config), \
+                patch('utils.prompt_manager.initialize_hierarchy'), \
+                patch('utils.prompt_manager.DEFAULT_DEPARTMENT', ['default', '内科']), \
+                patch('utils.prompt_manager.DOCUMENT_TYPES', ['主治医意見書', '返書']), \
+                patch('utils.prompt_manager.DEPARTMENT_DOCTORS_MAPPING',
+                      {'default': ['default'], '内科': ['default', '田中医師']}):
+            yield
     
     @patch('utils.prompt_manager.init_schema')
     @patch('utils.prompt_manager.initialize_default_prompt')
-    def test_initialize_database_success(self, mock_init_default, mock_init_schema, mock_database_manager):
+    def test_initialize_database_success(self, mock_init_default, mock_init_schema,
+                                         mock_database_manager, seed_config):
         """データベース初期化の成功テスト"""
-        mock_config = Mock()
-        mock_config.__getitem__ = Mock(return_value={'summary': 'デフォルトプロンプト内容'})
-        
-        # 既存プロンプトが存在しない場合をシミュレート
-        mock_database_manager.execute_query.return_value = []
-        
+        mock_database_manager.execute_query.return_value = []  # シードバージョン未登録
+        mock_database_manager.execute_in_transaction.return_value = [[{"inserted": 6, "version": 2}], []]
+        mock_init_schema.side_effect = lambda seed_versions=None, seed=None: seed()
+
         with patch('utils.prompt_manager.get_prompt_collection', return_value=mock_database_manager):
-            with patch('utils.prompt_manager.get_config', return_value=mock_config):
-                with patch('utils.prompt_manager.DEFAULT_DEPARTMENT', ['内科']):
-                    with patch('utils.prompt_manager.DOCUMENT_TYPES', ['主治医意見書']):
-                        with patch('utils.prompt_manager.DEPARTMENT_DOCTORS_MAPPING', {'内科': ['田中医師']}):
-                            with patch('utils.prompt_manager.insert_document') as mock_insert:
-                                initialize_database()
-                                
-                                # スキーマ初期化とデフォルトプロンプト初期化が呼ばれることを確認
-                                mock_init_schema.assert_called_once()
-                                mock_init_default.assert_called_once()
-                                
-                                # 新しいプロンプトが挿入されることを確認
-                                mock_insert.assert_called()
+            initialize_database()
+            
+            mock_init_schema.assert_called_once()
+            mock_init_default.assert_called_once()
+
+            # 組み合わせ全体が1文で登録され、本文はコピーされないことを確認
+            mock_database_manager.execute_in_transaction.assert_called_once()
+            (query, params), (refresh_query, refresh_params) = \
+                mock_database_manager.execute_in_transaction.call_args[0][0]
+            assert "unnest" in query
+            assert "ON CONFLICT (department, document_type, doctor) DO NOTHING" in query
+            assert "content" not in params
+            assert params["departments"] == ['default', '内科', '内科']
+            assert params["doctors"] == ['default', 'default', '田中医師']
+            assert params["document_types"] == ['主治医意見書', '返書']
+            assert "INSERT INTO prompt_resolutions" in refresh_query
+            assert refresh_params["scope_document_type"] is None
     
     @patch('utils.prompt_manager.init_schema')
     @patch('utils.prompt_manager.initialize_default_prompt')
-    def test_initialize_database_existing_prompts(self, mock_init_default, mock_init_schema, mock_database_manager):
-        """既存プロンプトがある場合のテスト"""
-        # 既存プロンプトが存在する場合をシミュレート
-        existing_prompt = [{"id": 1, "content": "既存プロンプト"}]
-        mock_database_manager.execute_query.return_value = existing_prompt
-        
+    def test_initialize_database_seed_version_matches(self, mock_init_default, mock_init_schema,
+                                                      mock_database_manager, seed_config):
+        """シードバージョンが一致する場合は登録を省略するテスト"""
+        departments, doctors = build_prompt_seed_matrix()
+        seed_version = compute_prompt_seed_version(departments, doctors, ['主治医意見書', '返書'],
+                                                   'デフォルトプロンプト内容')
+        mock_database_manager.execute_query.return_value = [{"value": seed_version}]
+        mock_init_schema.side_effect = lambda seed_versions=None, seed=None: seed()
+
         with patch('utils.prompt_manager.get_prompt_collection', return_value=mock_database_manager):
-            with patch('utils.prompt_manager.DEFAULT_DEPARTMENT', ['内科']):
-                with patch('utils.prompt_manager.DOCUMENT_TYPES', ['主治医意見書']):
-                    with patch('utils.prompt_manager.DEPARTMENT_DOCTORS_MAPPING', {'内科': ['田中医師']}):
-                        with patch('utils.prompt_manager.insert_document') as mock_insert:
-                            initialize_database()
-                            
-                            # 既存プロンプトがあるため、新しい挿入は行われない
-                            mock_insert.assert_not_called()
+            initialize_database()
+            
+            mock_init_default.assert_not_called()
+            mock_database_manager.execute_query.assert_called_once()
+
+    @patch('utils.prompt_manager.init_schema')
+    def test_initialize_database_passes_seed_versions(self, mock_init_schema, seed_config):
+        """スキーマの確認に初期データのバージョンを渡し、一致していれば登録しないテスト"""
+        mock_init_schema.return_value = False
+
+        assert initialize_database() is False
+
+        seed_versions = mock_init_schema.call_args.kwargs["seed_versions"]
+        departments, doctors = build_prompt_seed_matrix()
+        assert seed_versions["prompt_seed_version"] == compute_prompt_seed_version(
+            departments, doctors, ['主治医意見書', '返書'], 'デフォルトプロンプト内容')
+        assert seed_versions["hierarchy_seed_version"]
+
+    @patch('utils.prompt_manager.threading.Thread')
+    def test_start_database_initialization_once(self, mock_thread, monkeypatch):
+        """初期化のスレッドをプロセスごとに1回だけ起動するテスト"""
+        monkeypatch.setattr(prompt_manager, "_database_initialization_started", False)
+
+        start_database_initialization()
+        start_database_initialization()
+
+        mock_thread.assert_called_once()
+        assert mock_thread.call_args.kwargs["daemon"]
+        mock_thread.return_value.start.assert_called_once()
+
+    def test_seed_version_changes_with_mapping(self):
+        """組み合わせが変わるとシードバージョンが変わるテスト"""
+        base = compute_prompt_seed_version(['内科'], ['default'], ['返書'], '内容')
+
+        assert base == compute_prompt_seed_version(['内科'], ['default'], ['返書'], '内容')
+        assert base != compute_prompt_seed_version(['内科', '内科'], ['default', '田中医師'], ['返書'], '内容')
+        assert base != compute_prompt_seed_version(['内科'], ['default'], ['返書'], '新しい内容')
     
     @patch('utils.prompt_manager.init_schema')
     def test_initialize_database_error(self, mock_init_schema):
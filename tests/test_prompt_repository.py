@@ -0,0 +1,143 @@
+import hashlib
+
+from database.prompt_repository import PromptRepository, PROMPT_CHANNEL, in_resolution_scope
+
+
+class TestPromptRepository:
+    """PromptRepositoryクラスのテスト"""
+
+    def test_resolve_uses_single_query(self, mock_database_manager):
+        """1回のクエリで優先度順に解決されるテスト"""
+        expected = {"id": 2, "department": "眼科", "doctor": "default", "content": "眼科共通"}
+        mock_database_manager.execute_query.return_value = [expected]
+
+        result = PromptRepository(mock_database_manager).resolve("眼科", "返書", "田中医師")
+
+        assert result == expected
+        mock_database_manager.execute_query.assert_called_once()
+        query, params = mock_database_manager.execute_query.call_args[0]
+        assert "ORDER BY CASE" in query
+        assert "LIMIT 1" in query
+        assert params == {
+            "department": "眼科",
+            "document_type": "返書",
+            "doctor": "田中医師",
+            "default_document_type": "診療情報提供書"
+        }
+
+    def test_resolve_not_found(self, mock_database_manager):
+        """該当するプロンプトがない場合のテスト"""
+        mock_database_manager.execute_query.return_value = []
+
+        assert PromptRepository(mock_database_manager).resolve("眼科", "返書", "田中医師") is None
+
+    def test_load_all_returns_version_and_rows(self, mock_database_manager):
+        """バージョンと全プロンプトを1回で取得するテスト"""
+        mock_database_manager.execute_query.return_value = [
+            {"cache_version": 4, "id": 1, "department": "default"},
+            {"cache_version": 4, "id": 2, "department": "眼科"},
+        ]
+
+        version, rows = PromptRepository(mock_database_manager).load_all()
+
+        assert version == 4
+        assert rows == [{"id": 1, "department": "default"}, {"id": 2, "department": "眼科"}]
+
+    def test_load_all_empty_table(self, mock_database_manager):
+        """プロンプトが1件もない場合のテスト"""
+        mock_database_manager.execute_query.return_value = [{"cache_version": 0, "id": None}]
+
+        assert PromptRepository(mock_database_manager).load_all() == (0, [])
+
+    def test_resolve_reads_precomputed_resolutions(self, mock_database_manager):
+        """解決済みテーブルから本文を取得するテスト"""
+        mock_database_manager.execute_query.return_value = []
+
+        PromptRepository(mock_database_manager).resolve("眼科", "返書", "田中医師")
+
+        query = mock_database_manager.execute_query.call_args[0][0]
+        assert "FROM prompt_resolutions" in query
+        assert "JOIN prompt_contents" in query
+
+    def test_upsert_stores_content_by_hash(self, mock_database_manager):
+        """本文がハッシュで保存され、解決結果も同じトランザクションで更新されるテスト"""
+        mock_database_manager.execute_in_transaction.return_value = [[{"id": 1, "inserted": True, "version": 3}], []]
+
+        inserted = PromptRepository(mock_database_manager).upsert("眼科", "返書", "default", "内容", "Claude")
+
+        assert inserted is True
+        mock_database_manager.execute_in_transaction.assert_called_once()
+        (query, params), (refresh_query, refresh_params) = mock_database_manager.execute_in_transaction.call_args[0][0]
+        assert "ON CONFLICT (department, document_type, doctor) DO UPDATE" in query
+        assert "INSERT INTO prompt_contents" in query
+        assert "pg_notify" in query
+        assert params["channel"] == PROMPT_CHANNEL
+        assert params["content"] == "内容"
+        assert params["content_hash"] == hashlib.sha256("内容".encode("utf-8")).hexdigest()
+        assert "INSERT INTO prompt_resolutions" in refresh_query
+        assert refresh_params["scope_department"] == "眼科"
+        assert refresh_params["scope_document_type"] == "返書"
+        assert refresh_params["scope_doctor"] == "default"
+
+    def test_upsert_existing_row(self, mock_database_manager):
+        """既存行の更新時にFalseを返すテスト"""
+        mock_database_manager.execute_in_transaction.return_value = [[{"id": 1, "inserted": False, "version": 3}], []]
+
+        assert PromptRepository(mock_database_manager).upsert("眼科", "返書", "default", "内容") is False
+
+    def test_delete_returns_deleted_count(self, mock_database_manager):
+        """削除件数を返すテスト"""
+        mock_database_manager.execute_in_transaction.return_value = [[{"id": 1, "version": 5}], []]
+
+        deleted = PromptRepository(mock_database_manager).delete("眼科", "返書", "default")
+
+        assert deleted == 1
+        query = mock_database_manager.execute_in_transaction.call_args[0][0][0][0]
+        assert "DELETE FROM prompts" in query
+
+    def test_ensure_default_uses_bound_parameters(self, mock_database_manager):
+        """デフォルトプロンプトの登録がバインド変数で行われ、全体の解決結果を更新するテスト"""
+        mock_database_manager.execute_in_transaction.return_value = [[], []]
+
+        created = PromptRepository(mock_database_manager).ensure_default("デフォルト内容")
+
+        assert created is False
+        (query, params), (_, refresh_params) = mock_database_manager.execute_in_transaction.call_args[0][0]
+        assert "診療情報提供書" not in query
+        assert params["document_type"] == "診療情報提供書"
+        assert params["content"] == "デフォルト内容"
+        assert refresh_params["scope_document_type"] is None
+
+    def test_seed_matrix_single_statement(self, mock_database_manager):
+        """組み合わせ全体を1文で登録し、本文を複製しないテスト"""
+        mock_database_manager.execute_in_transaction.return_value = [[{"inserted": 8, "version": 2}], []]
+
+        inserted = PromptRepository(mock_database_manager).seed_matrix(
+            ["default", "眼科"], ["default", "橋本義弘"], ["返書", "最終返書"], "v1"
+        )
+
+        assert inserted == 8
+        query, params = mock_database_manager.execute_in_transaction.call_args[0][0][0]
+        assert "CROSS JOIN unnest" in query
+        assert "INSERT INTO app_metadata" in query
+        assert "content" not in params
+        assert params["seed_version"] == "v1"
+
+    def test_in_resolution_scope(self):
+        """変更されたキーから継承する範囲の判定テスト"""
+        assert in_resolution_scope(("眼科", "返書", "橋本義弘"), "眼科", "返書", "default")
+        assert not in_resolution_scope(("外科", "返書", "default"), "眼科", "返書", "default")
+        assert not in_resolution_scope(("眼科", "返書", "佐藤"), "眼科", "返書", "橋本義弘")
+        assert in_resolution_scope(("眼科", "返書", "橋本義弘"), "default", "返書", "default")
+        assert not in_resolution_scope(("眼科", "最終返書", "default"), "default", "返書", "default")
+        assert not in_resolution_scope(("眼科", "返書", "医師共通"), "default", "返書", "医師共通")
+        assert in_resolution_scope(("眼科", "最終返書", "default"), "default", "診療情報提供書", "default")
+
+    def test_get_seed_version(self, mock_database_manager):
+        """登録済みシードバージョンの取得テスト"""
+        mock_database_manager.execute_query.return_value = [{"value": "v1"}]
+
+        assert PromptRepository(mock_database_manager).get_seed_version() == "v1"
+
+        mock_database_manager.execute_query.return_value = []
+        assert PromptRepository(mock_database_manager).get_seed_version() is None
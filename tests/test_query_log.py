@@ -0,0 +1,145 @@
+import os
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from database.query_log import (
+    MAX_STATEMENTS, OTHER_STATEMENTS, LOG_OPTION, SlowQueryLog, capture_plan, instrument_queries,
+    is_explainable, normalize_sql
+)
+
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+
+def make_log(slow_seconds=0.5, sample_rate=1.0, explain_interval=600, clock=None, sample=None):
+    return SlowQueryLog(slow_seconds, sample_rate, explain_interval,
+                        clock=clock or (lambda: 0.0), sample=sample or (lambda: 0.0))
+
+
+class TestNormalizeSql:
+    """SQLの正規化のテスト"""
+
+    def test_replaces_values_and_collapses_whitespace(self):
+        """値・バインド変数を ? にそろえ、空白をまとめるテスト"""
+        statement = """
+            SELECT * FROM summary_usage
+            WHERE date >= %(start)s AND model = 'Claude' AND input_tokens > 100
+        """
+        assert normalize_sql(statement) == (
+            "SELECT * FROM summary_usage WHERE date >= ? AND model = ? AND input_tokens > ?"
+        )
+
+    def test_keeps_casts_and_collapses_value_lists(self):
+        """型変換は残し、IN の値の並びは1つにまとめるテスト"""
+        assert normalize_sql("SELECT :a::text WHERE id IN (:id_1, :id_2, :id_3)") == (
+            "SELECT ?::text WHERE id IN (?)"
+        )
+
+    def test_is_explainable(self):
+        """読み取りの文だけ実行計画を取るテスト"""
+        assert is_explainable("SELECT 1")
+        assert is_explainable("WITH t AS (SELECT 1) SELECT * FROM t")
+        assert not is_explainable("WITH t AS (DELETE FROM a RETURNING *) SELECT * FROM t")
+        assert not is_explainable("UPDATE prompts SET content = 'SELECT'")
+
+    def test_side_effect_functions_are_not_explainable(self):
+        """SELECT でも番号・通知・ロックの関数を呼ぶ文は実行計画を取らないテスト"""
+        assert not is_explainable("SELECT v.version, pg_notify(:channel, v.version::TEXT) "
+                                  "FROM (SELECT nextval('prompt_version_seq') AS version) v")
+        assert not is_explainable("SELECT setval('usage_version_seq', 1)")
+        assert not is_explainable("SELECT pg_try_advisory_lock(:lock_id)")
+        assert not is_explainable("SELECT pg_advisory_xact_lock(8250610)")
+        assert is_explainable("SELECT version FROM summary_usage_versions WHERE day >= :start_day")
+
+
+class TestSlowQueryLog:
+    """SlowQueryLogクラスのテスト"""
+
+    def test_records_latency_per_statement(self):
+        """値だけが違う文を同じ文として集計するテスト"""
+        log = make_log()
+        log.record("primary", "SELECT * FROM prompts WHERE id = 1", 0.005)
+        log.record("primary", "SELECT * FROM prompts WHERE id = 2", 0.2)
+        log.record("replica", "SELECT * FROM prompts WHERE id = 3", 0.005)
+
+        top = log.top(10)
+
+        assert [(row["database"], row["calls"]) for row in top] == [("primary", 2), ("replica", 1)]
+        assert top[0]["buckets"]["<=10ms"] == 1
+        assert top[0]["buckets"]["<=500ms"] == 1
+        assert top[0]["max_ms"] == pytest.approx(200)
+        assert top[0]["p50_ms"] == pytest.approx(10)
+        assert top[0]["slow_calls"] == 0
+
+    def test_explain_is_sampled_and_rate_limited(self):
+        """遅い文の実行計画は抽出し、同じ文では一定間隔を空けて取るテスト"""
+        now = [0.0]
+        samples = iter([0.9, 0.0, 0.0, 0.0])
+        log = make_log(sample_rate=0.5, explain_interval=60, clock=lambda: now[0], sample=lambda: next(samples))
+
+        assert log.record("primary", "SELECT 1", 0.01, explainable=True) is None
+        assert log.record("primary", "SELECT 1", 1.0, explainable=True) is None
+        assert log.record("primary", "SELECT 1", 1.0, explainable=True) == ("primary", "SELECT ?")
+        now[0] = 30.0
+        assert log.record("primary", "SELECT 1", 1.0, explainable=True) is None
+        now[0] = 61.0
+        assert log.record("primary", "SELECT 1", 1.0, explainable=True) == ("primary", "SELECT ?")
+        assert log.top(1)[0]["slow_calls"] == 4
+
+    def test_statement_count_is_bounded(self):
+        """集計する文の数が上限に達したら、以降の文を1つにまとめるテスト"""
+        log = make_log()
+        for index in range(MAX_STATEMENTS):
+            log.record("primary", f"SELECT * FROM table_{index}", 0.001)
+
+        assert log.record("primary", "SELECT * FROM other_table", 1.0, explainable=True) is None
+        assert log.top(1, order_by="max_ms")[0]["statement"] == OTHER_STATEMENTS
+
+    def test_record_plan(self):
+        """取得した実行計画を文の集計に残すテスト"""
+        log = make_log()
+        key = log.record("primary", "SELECT 1", 1.0, explainable=True)
+
+        log.record_plan(key, "Result", 1.0)
+
+        assert log.top(1)[0]["plan"] == "Result"
+        assert log.top(1)[0]["plan_ms"] == pytest.approx(1000)
+
+
+class TestInstrumentQueries:
+    """エンジンへの計測の組み込みのテスト"""
+
+    def test_records_every_cursor_execute(self, tmp_path):
+        """エンジンで実行した文を記録し、記録しない指定の接続は除くテスト"""
+        engine = create_engine(f"sqlite:///{tmp_path / 'query.db'}")
+        log = instrument_queries(engine, make_log(slow_seconds=0), "primary", 1000)
+        with engine.connect() as conn:
+            conn.execute(text("SELECT :value"), {"value": 1})
+            conn.execute(text("SELECT :value"), {"value": 2})
+            conn.execution_options(**{LOG_OPTION: False})
+            conn.execute(text("SELECT 3"))
+        engine.dispose()
+
+        top = log.top(10)
+        assert [(row["statement"], row["calls"]) for row in top] == [("SELECT ?", 2)]
+        # PostgreSQL 以外では実行計画を取らない
+        assert top[0]["plan"] is None
+
+
+@pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL が未設定")
+class TestCapturePlan:
+    """実行計画の取得のテスト"""
+
+    def test_captures_analyze_plan_with_bound_values(self):
+        """バインド変数の値を使って EXPLAIN (ANALYZE, BUFFERS) を取るテスト"""
+        engine = create_engine(TEST_DATABASE_URL)
+        log = make_log()
+        statement = "SELECT generate_series(1, %(count)s)"
+        key = log.record("primary", statement, 1.0, explainable=True)
+
+        capture_plan(engine, log, key, statement, {"count": 10}, 1.0, 1000)
+        engine.dispose()
+
+        plan = log.top(1)[0]["plan"]
+        assert "actual time" in plan
+        assert "rows=10" in plan
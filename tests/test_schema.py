@@ -0,0 +1,132 @@
+import datetime
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from database.db import DatabaseManager
+from database.migrations import latest_version
+from database.schema import initialize_database, last_partition_name, read_schema_state
+from utils.exceptions import DatabaseError
+
+MANAGER_ATTRIBUTES = ("_instance", "_engine", "_session_factory", "_replica_engine", "_replica_session_factory")
+
+SEED_VERSIONS = {"prompt_seed_version": "p1", "hierarchy_seed_version": "h1"}
+
+
+def schema_state(**values):
+    return {"schema_version": latest_version(), "prompt_seed_version": "p1", "hierarchy_seed_version": "h1",
+            "partitions_ready": True, **values}
+
+
+@pytest.fixture
+def db_manager():
+    db_manager = MagicMock()
+    with patch('database.schema.DatabaseManager.get_instance', return_value=db_manager):
+        yield db_manager
+
+
+@pytest.fixture
+def mock_create_tables():
+    with patch('database.schema.create_tables') as mock_create_tables:
+        yield mock_create_tables
+
+
+def lock_statements(db_manager):
+    conn = db_manager.get_engine.return_value.connect.return_value.__enter__.return_value
+    return [str(call[0][0]) for call in conn.execute.call_args_list]
+
+
+class TestInitializeDatabase:
+    """initialize_database関数のテスト"""
+
+    def test_current_schema_skips_ddl(self, db_manager, mock_create_tables):
+        """スキーマと初期データが最新なら1回の問い合わせだけで終えるテスト"""
+        db_manager.execute_query.return_value = [schema_state()]
+        seed = MagicMock()
+
+        assert initialize_database(SEED_VERSIONS, seed) is False
+
+        db_manager.execute_query.assert_called_once()
+        mock_create_tables.assert_not_called()
+        seed.assert_not_called()
+        db_manager.get_engine.assert_not_called()
+
+    def test_mismatch_initializes_under_lock(self, db_manager, mock_create_tables):
+        """初期データのバージョンが違う場合はロックを取って表の作成と登録を行うテスト"""
+        db_manager.execute_query.return_value = [schema_state(prompt_seed_version="p0")]
+        seed = MagicMock()
+
+        assert initialize_database(SEED_VERSIONS, seed) is True
+
+        mock_create_tables.assert_called_once()
+        seed.assert_called_once()
+        statements = lock_statements(db_manager)
+        assert "pg_try_advisory_lock" in statements[0]
+        assert "pg_advisory_unlock" in statements[-1]
+
+    def test_rechecks_after_waiting_for_lock(self, db_manager, mock_create_tables):
+        """ロックを待つ間にほかのプロセスが初期化を終えていれば何もしないテスト"""
+        db_manager.execute_query.side_effect = [[schema_state(partitions_ready=False)], [schema_state()]]
+        seed = MagicMock()
+
+        assert initialize_database(SEED_VERSIONS, seed) is False
+
+        mock_create_tables.assert_not_called()
+        seed.assert_not_called()
+
+    def test_missing_tables_count_as_mismatch(self, db_manager, mock_create_tables):
+        """schema_version がまだない新しいデータベースでは初期化するテスト"""
+        db_manager.execute_query.side_effect = DatabaseError("relation \"schema_version\" does not exist")
+
+        assert initialize_database(SEED_VERSIONS) is True
+
+        mock_create_tables.assert_called_once()
+
+    @patch('database.schema.time')
+    def test_retries_are_bounded_by_timeout(self, mock_time, db_manager, mock_create_tables):
+        """失敗が続いた場合は間隔を延ばしながら再試行し、合計の時間で諦めるテスト"""
+        now = [0.0]
+        mock_time.monotonic.side_effect = lambda: now[0]
+        mock_time.sleep.side_effect = lambda seconds: now.__setitem__(0, now[0] + seconds)
+        db_manager.execute_query.return_value = []
+        mock_create_tables.side_effect = Exception("接続できません")
+
+        with pytest.raises(DatabaseError, match="データベースの初期化に失敗しました: 接続できません"):
+            initialize_database(SEED_VERSIONS, timeout=10)
+
+        waits = [call[0][0] for call in mock_time.sleep.call_args_list]
+        assert waits == [0.5, 1, 2, 4, 2.5]
+        assert sum(waits) == 10
+
+
+class TestSchemaState:
+    """スキーマの状態の確認のテスト"""
+
+    def test_last_partition_name(self):
+        """先の月の区画の名前を年をまたいで求めるテスト"""
+        assert last_partition_name(3, datetime.date(2026, 10, 19)) == "summary_usage_202701"
+        assert last_partition_name(0, datetime.date(2026, 12, 1)) == "summary_usage_202612"
+
+    def test_sqlite_initializes_once(self, tmp_path, monkeypatch):
+        """SQLite では初回だけ表を作り、2回目は状態の確認だけで終えるテスト"""
+        monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'medidocs.db'}")
+        saved = {name: getattr(DatabaseManager, name) for name in MANAGER_ATTRIBUTES}
+        for name in MANAGER_ATTRIBUTES:
+            setattr(DatabaseManager, name, None)
+        try:
+            db_manager = DatabaseManager.get_instance()
+            assert read_schema_state(db_manager) is None
+
+            def seed():
+                db_manager.execute_query("INSERT INTO app_metadata (key, value) VALUES ('prompt_seed_version', 'p1')",
+                                         fetch=False)
+                db_manager.execute_query(
+                    "INSERT INTO app_metadata (key, value) VALUES ('hierarchy_seed_version', 'h1')", fetch=False)
+
+            assert initialize_database(SEED_VERSIONS, seed) is True
+            assert read_schema_state(db_manager)["schema_version"] == latest_version()
+            assert initialize_database(SEED_VERSIONS, seed) is False
+        finally:
+            DatabaseManager.get_instance().get_engine().dispose()
+            for name, value in saved.items():
+                setattr(DatabaseManager, name, value)
@@ -0,0 +1,262 @@
+import datetime
+import threading
+import uuid
+
+import pytest
+import pytz
+from sqlalchemy import text
+
+from database.db import DatabaseManager
+from database.hierarchy_repository import HierarchyRepository
+from database.prompt_repository import PromptRepository
+from database.schema import create_tables
+from database.usage_repository import UsageRepository
+from database.usage_partitions import UsagePartitionRepository
+from database.usage_rollups import ROLLUP_THROUGH_KEY
+from services.capacity_service import get_capacity_report
+from services.statistics_service import (
+    StatisticsFilter, archive_applies, fetch_records_page, get_usage_metrics, get_usage_summary, get_usage_timeseries
+)
+from utils.constants import DEFAULT_DOCUMENT_TYPE
+
+JST = pytz.timezone('Asia/Tokyo')
+
+MANAGER_ATTRIBUTES = ("_instance", "_engine", "_session_factory", "_replica_engine", "_replica_session_factory")
+
+
+@pytest.fixture
+def sqlite_manager(tmp_path, monkeypatch):
+    """SQLite のファイルに接続した DatabaseManager"""
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'medidocs.db'}")
+    saved = {name: getattr(DatabaseManager, name) for name in MANAGER_ATTRIBUTES}
+    for name in MANAGER_ATTRIBUTES:
+        setattr(DatabaseManager, name, None)
+
+    db_manager = DatabaseManager.get_instance()
+    create_tables()
+    yield db_manager
+
+    db_manager.get_engine().dispose()
+    for name, value in saved.items():
+        setattr(DatabaseManager, name, value)
+
+
+def usage_row(date, **values):
+    return {
+        "date": date, "app_type": "test", "document_types": "退院時サマリ", "model_detail": "claude-sonnet",
+        "department": "眼科", "doctor": "default", "input_tokens": 100, "output_tokens": 50,
+        "total_tokens": 150, "processing_time": 1.5, "event_id": str(uuid.uuid4()), **values
+    }
+
+
+class TestSQLiteEngine:
+    """SQLite のエンジン設定のテスト"""
+
+    def test_wal_and_foreign_keys(self, sqlite_manager):
+        """WAL と外部キーが有効な接続をプールから返すテスト"""
+        with sqlite_manager.get_engine().connect() as conn:
+            assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+            assert conn.execute(text("PRAGMA foreign_keys")).scalar() == 1
+
+        assert sqlite_manager.dialect_name() == "sqlite"
+        assert sqlite_manager.pool_metrics()["primary"]["checkouts"] >= 1
+
+    def test_create_tables_is_idempotent(self, sqlite_manager):
+        """表の作成を繰り返しても失敗しないテスト"""
+        assert create_tables()
+        assert sqlite_manager.scalar("SELECT COUNT(*) FROM schema_version") == 1
+
+
+class TestSQLitePromptRepository:
+    """SQLite での PromptRepository のテスト"""
+
+    def test_prompt_lifecycle(self, sqlite_manager):
+        """作成・継承・更新・削除とバージョンの採番のテスト"""
+        repository = PromptRepository(sqlite_manager)
+        assert repository.current_version() == 0
+
+        assert repository.ensure_default("全体の指示")
+        assert repository.upsert("眼科", DEFAULT_DOCUMENT_TYPE, "default", "眼科の指示")
+        assert repository.upsert("眼科", DEFAULT_DOCUMENT_TYPE, "橋本義弘", "眼科の指示")
+        assert not repository.upsert("眼科", DEFAULT_DOCUMENT_TYPE, "default", "眼科の新しい指示")
+
+        doctor = repository.resolve("眼科", DEFAULT_DOCUMENT_TYPE, "橋本義弘")
+        assert doctor["content"] == "眼科の新しい指示"
+        assert doctor["inherited"]
+
+        version, prompts = repository.load_all()
+        assert version == repository.current_version() == 4
+        assert len(prompts) == 3
+
+        assert repository.delete("眼科", DEFAULT_DOCUMENT_TYPE, "橋本義弘") == 1
+        assert repository.delete("眼科", DEFAULT_DOCUMENT_TYPE, "橋本義弘") == 0
+        assert repository.resolve("眼科", DEFAULT_DOCUMENT_TYPE, "橋本義弘")["doctor"] == "default"
+        assert len(repository.load_all()[1]) == 2
+
+    def test_seed_matrix(self, sqlite_manager):
+        """診療科×医師×文書名の組み合わせを登録し、シードバージョンを記録するテスト"""
+        repository = PromptRepository(sqlite_manager)
+        repository.ensure_default("全体の指示")
+
+        inserted = repository.seed_matrix(["眼科", "眼科"], ["default", "橋本義弘"], ["他院への紹介", "返書"], "v1")
+
+        assert inserted == 4
+        assert repository.get_seed_version() == "v1"
+        assert repository.seed_matrix(["眼科"], ["default"], ["返書"], "v2") == 0
+        assert repository.get_seed_version() == "v2"
+        assert repository.resolve("眼科", "返書", "橋本義弘")["content"] == "全体の指示"
+
+
+class TestSQLiteHierarchyRepository:
+    """SQLite での HierarchyRepository のテスト"""
+
+    def test_bulk_import(self, sqlite_manager):
+        """診療科・医師・文書名を並び順を保って登録するテスト"""
+        repository = HierarchyRepository(sqlite_manager)
+
+        changed = repository.bulk_import([("眼科", "橋本義弘"), ("整形外科", "default")],
+                                         [("他院への紹介", "紹介"), ("返書", None)], seed_version="v1")
+
+        assert changed == 7
+        version, rows = repository.load_all()
+        assert version == 1
+        doctors = [(row["department"], row["name"]) for row in rows if row["kind"] == "doctor"]
+        assert doctors == [("整形外科", "default"), ("眼科", "default"), ("眼科", "橋本義弘")]
+        assert repository.get_seed_version() == "v1"
+
+        assert repository.bulk_import([("眼科", "橋本義弘")], [("返書", None)]) == 0
+        assert repository.bulk_import(document_types=[("返書", "返信")]) == 1
+        assert repository.current_version() == 2
+
+
+class TestSQLiteUsageRepository:
+    """SQLite での UsageRepository のテスト"""
+
+    def test_insert_many_skips_duplicates(self, sqlite_manager):
+        """登録済みの event_id を無視し、登録した日の更新番号を進めるテスト"""
+        repository = UsageRepository(sqlite_manager)
+        now = datetime.datetime(2026, 10, 19, 9, 0, tzinfo=JST)
+        rows = [usage_row(now), usage_row(now - datetime.timedelta(days=1))]
+
+        assert repository.insert_many(rows) == 2
+        assert repository.insert_many(rows) == 0
+
+        assert sqlite_manager.scalar("SELECT model_family FROM summary_usage LIMIT 1") == "Claude"
+        assert repository.range_version(now.date(), now.date()) == 2
+        assert repository.range_version(datetime.date(2026, 10, 1), datetime.date(2026, 10, 17)) == 0
+
+    def test_late_rows_reopen_rollup(self, sqlite_manager):
+        """集計済みの日の行が届いた場合に集計済みの日を戻すテスト"""
+        sqlite_manager.execute_query("INSERT INTO app_metadata (key, value) VALUES (:key, '2026-10-18')",
+                                     {"key": ROLLUP_THROUGH_KEY}, fetch=False)
+
+        UsageRepository(sqlite_manager).insert_many([usage_row(datetime.datetime(2026, 10, 16, 23, 0, tzinfo=JST))])
+
+        through = sqlite_manager.scalar("SELECT value FROM app_metadata WHERE key = :key", {"key": ROLLUP_THROUGH_KEY})
+        assert through == "2026-10-15"
+
+    def test_concurrent_writers(self, sqlite_manager):
+        """複数のスレッドから同時に登録できるテスト"""
+        repository = UsageRepository(sqlite_manager)
+        now = datetime.datetime.now(JST)
+        errors = []
+
+        def write():
+            try:
+                for _ in range(10):
+                    repository.insert_many([usage_row(now)])
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=write) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        assert sqlite_manager.scalar("SELECT COUNT(*) FROM summary_usage") == 40
+
+
+class TestSQLiteStatistics:
+    """SQLite での統計画面の集計のテスト"""
+
+    @pytest.fixture
+    def usage(self, sqlite_manager):
+        now = datetime.datetime(2026, 10, 19, 9, 30, tzinfo=JST)
+        UsageRepository(sqlite_manager).insert_many([
+            usage_row(now, processing_time=2.0, started_at=now - datetime.timedelta(seconds=2), finished_at=now),
+            usage_row(now, processing_time=4.0, department="内科"),
+            usage_row(now - datetime.timedelta(days=1), processing_time=30.0, status="timeout"),
+            usage_row(now - datetime.timedelta(days=1), document_types=None, model_detail="gemini-2.5-pro"),
+        ])
+        return StatisticsFilter(datetime.date(2026, 10, 1), datetime.date(2026, 10, 19))
+
+    def test_usage_summary(self, sqlite_manager, usage):
+        """日次集計を使わずに合計と診療科・医師・文書名ごとの集計を求めるテスト"""
+        total, groups = get_usage_summary(usage, sqlite_manager)
+
+        assert total["count"] == 3
+        assert total["input_tokens"] == 300
+        assert {(group["department"], group["document_types"], group["count"]) for group in groups} == {
+            ("内科", "退院時サマリ", 1), ("眼科", None, 1), ("眼科", "退院時サマリ", 1)
+        }
+
+    def test_records_skip_archive(self, sqlite_manager, usage):
+        """区画とアーカイブを確認せずにDBの行だけを返すテスト"""
+        records, cursor = fetch_records_page(usage, db_manager=sqlite_manager)
+
+        assert UsagePartitionRepository(sqlite_manager).list_partitions() == []
+        assert archive_applies(usage, sqlite_manager) is False
+        assert len(records) == 3
+        assert cursor is None
+
+    def test_records_pages_with_cursor(self, sqlite_manager, usage):
+        """次のページを前のページの最後の行から読み、行の重複も抜けもないテスト"""
+        # 同じ日時の行と、マイクロ秒のある行・ない行を混ぜる
+        start = datetime.datetime(2026, 10, 10, 9, 0, tzinfo=JST)
+        UsageRepository(sqlite_manager).insert_many(
+            [usage_row(start) for _ in range(3)]
+            + [usage_row(start + datetime.timedelta(minutes=i, microseconds=i * 1000)) for i in range(5)]
+        )
+        expected = sqlite_manager.execute_query(
+            "SELECT id FROM summary_usage WHERE status = 'success' ORDER BY date DESC, id DESC"
+        )
+
+        pages = []
+        cursor = None
+        while True:
+            records, cursor = fetch_records_page(usage, cursor, limit=3, db_manager=sqlite_manager)
+            pages.append(records["id"].tolist())
+            if cursor is None:
+                break
+
+        assert len(pages) == 4
+        assert [record_id for page in pages for record_id in page] == [row["id"] for row in expected]
+
+    def test_usage_metrics(self, sqlite_manager, usage):
+        """処理時間のパーセンタイルと失敗率を求めるテスト"""
+        metrics = get_usage_metrics(usage, sqlite_manager).set_index("model_family")
+
+        assert metrics.loc["Claude", "requests"] == 3
+        assert metrics.loc["Claude", "p50"] == 3.0
+        assert metrics.loc["Claude", "timeout_rate"] == pytest.approx(1 / 3)
+        assert metrics.loc["Claude", "output_tokens_per_second"] == pytest.approx(100 / 6)
+
+    def test_usage_timeseries(self, sqlite_manager, usage):
+        """日本時間の日ごとに区切って集計するテスト"""
+        timeseries = get_usage_timeseries(usage, "day", sqlite_manager)
+        claude = timeseries[timeseries["model_family"] == "Claude"]
+
+        assert claude["bucket"].tolist() == [datetime.datetime(2026, 10, 18), datetime.datetime(2026, 10, 19)]
+        assert claude["count"].tolist() == [0, 2]
+        assert claude["failure_rate"].tolist() == [1.0, 0.0]
+
+    def test_capacity_report(self, sqlite_manager, usage):
+        """開始時刻のない行は終了時刻と処理時間から補って同時実行数を求めるテスト"""
+        capacity, hourly_peaks, _, _ = get_capacity_report(usage, sqlite_manager)
+
+        total = capacity.set_index("model_family").loc["合計"]
+        assert total["requests"] == 4
+        assert total["peak_concurrency"] == 2
+        assert hourly_peaks.max() == 2
@@ -0,0 +1,70 @@
+from unittest.mock import Mock
+
+from utils.statistics_cache import StatisticsCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_cache(clock, max_entries=10):
+    return StatisticsCache(max_entries=max_entries, ttl_seconds=60, historical_ttl_seconds=3600, clock=clock)
+
+
+class TestStatisticsCache:
+    """StatisticsCacheクラスのテスト"""
+
+    def test_reuses_until_version_changes(self):
+        """期間内の更新番号が変わるまで結果を使い回すテスト"""
+        cache = make_cache(FakeClock())
+        load_version = Mock(side_effect=[1, 1, 2])
+        compute = Mock(side_effect=["first", "second"])
+
+        assert cache.get_or_compute("key", False, load_version, compute) == "first"
+        assert cache.get_or_compute("key", False, load_version, compute) == "first"
+        assert cache.get_or_compute("key", False, load_version, compute) == "second"
+        assert compute.call_count == 2
+        assert (cache.hits, cache.misses) == (1, 2)
+
+    def test_historical_checks_version_with_long_ttl(self):
+        """過去の期間も更新番号を確認し、番号が同じなら長い有効期限で使うテスト"""
+        clock = FakeClock()
+        cache = make_cache(clock)
+        load_version = Mock(side_effect=[1, 1, 2, 2])
+        compute = Mock(side_effect=["first", "second", "third"])
+
+        cache.get_or_compute("key", True, load_version, compute)
+        clock.now = 3000
+        assert cache.get_or_compute("key", True, load_version, compute) == "first"
+
+        # 再送で過去の日に行が登録された場合は有効期限内でも計算し直す
+        assert cache.get_or_compute("key", True, load_version, compute) == "second"
+
+        clock.now = 6601
+        assert cache.get_or_compute("key", True, load_version, compute) == "third"
+        assert load_version.call_count == 4
+
+    def test_current_range_expires(self):
+        """今日を含む期間は番号が同じでも有効期限で計算し直すテスト"""
+        clock = FakeClock()
+        cache = make_cache(clock)
+        compute = Mock(side_effect=["first", "second"])
+
+        cache.get_or_compute("key", False, lambda: 1, compute)
+        clock.now = 61
+        assert cache.get_or_compute("key", False, lambda: 1, compute) == "second"
+
+    def test_evicts_least_recently_used(self):
+        """上限を超えた場合は最も使われていない結果から捨てるテスト"""
+        cache = make_cache(FakeClock(), max_entries=2)
+        cache.get_or_compute("a", True, lambda: 1, lambda: "a")
+        cache.get_or_compute("b", True, lambda: 1, lambda: "b")
+        cache.get_or_compute("a", True, lambda: 1, lambda: "a2")
+        cache.get_or_compute("c", True, lambda: 1, lambda: "c")
+
+        assert cache.get_or_compute("a", True, lambda: 1, lambda: "a3") == "a"
+        assert cache.get_or_compute("b", True, lambda: 1, lambda: "b2") == "b2"
@@ -0,0 +1,293 @@
+import csv
+import datetime
+from unittest.mock import Mock, patch
+
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from database.usage_archive import UsageArchive
+from services.statistics_service import (
+    JST, RECORDS_CURSOR_CLAUSE, StatisticsFilter, cached_statistics, export_usage_records, get_statistics_cache, fetch_records_page, format_usage_metrics,
+    format_usage_records, format_usage_summary, get_usage_metrics, get_usage_summary, get_usage_timeseries,
+    iter_record_batches, pivot_usage_timeseries
+)
+
+
+def make_record(i, hour=None):
+    return {
+        "id": i,
+        "date": datetime.datetime(2025, 6, 1, hour if hour is not None else i % 24, 0, tzinfo=datetime.timezone.utc),
+        "document_types": "診療情報提供書",
+        "model_detail": "claude-3-sonnet",
+        "model_family": "Claude",
+        "department": "内科",
+        "doctor": "default",
+        "input_tokens": 100,
+        "output_tokens": 50,
+        "processing_time": 3,
+    }
+
+
+def make_frame(*records):
+    return pd.DataFrame(list(records))
+
+
+def make_filters(model="すべて", document_type="すべて"):
+    return StatisticsFilter(datetime.date(2025, 6, 1), datetime.date(2025, 6, 7), model, document_type)
+
+
+class TestStatisticsFilter:
+    """StatisticsFilterクラスのテスト"""
+
+    def test_builds_usage_and_rollup_filters(self):
+        """期間を日本時間で扱い、明細と日次集計の条件を作るテスト"""
+        filters = make_filters("Gemini_Flash", "不明")
+
+        assert filters.start_datetime.isoformat() == "2025-06-01T00:00:00+09:00"
+        assert "model_family = :model_family" in filters.where_clause
+        assert "ILIKE" not in filters.where_clause
+        assert "status = 'success'" in filters.where_clause
+        assert "status" not in filters.usage_clause
+        assert "document_types IS NULL" in filters.where_clause
+        assert filters.rollup_params == {"model_family": "Gemini_Flash", "rollup_doc_type": ""}
+        assert filters.model_family == "Gemini_Flash"
+        assert filters.document_type == "不明"
+
+
+class TestGetUsageSummary:
+    """get_usage_summary関数のテスト"""
+
+    def test_splits_total_and_groups(self, mock_database_manager):
+        """GROUPING SETS の合計行と集計行を分けるテスト"""
+        mock_database_manager.execute_query.side_effect = [
+            [{"rolled": 0, "through": None}],
+            [
+                {"is_total": True, "department": None, "count": 5, "input_tokens": 500},
+                {"is_total": False, "department": "内科", "count": 3, "input_tokens": 300},
+                {"is_total": False, "department": "外科", "count": 2, "input_tokens": 200},
+            ],
+        ]
+
+        total, groups = get_usage_summary(make_filters(), mock_database_manager)
+
+        assert total["count"] == 5
+        assert [group["department"] for group in groups] == ["内科", "外科"]
+        query, params = mock_database_manager.execute_query.call_args[0]
+        assert "GROUPING SETS" in query
+        assert params["start_day"] == datetime.date(2025, 6, 1)
+
+    def test_no_rows(self, mock_database_manager):
+        """該当がない場合は件数0の合計を返すテスト"""
+        mock_database_manager.execute_query.side_effect = [[{"rolled": 0, "through": None}], []]
+
+        total, groups = get_usage_summary(make_filters(), mock_database_manager)
+
+        assert total == {"count": 0}
+        assert groups == []
+
+
+class TestFetchRecordsPage:
+    """fetch_records_page関数のテスト"""
+
+    @patch("services.statistics_service.archive_applies", return_value=False)
+    def test_first_page_with_more(self, mock_archive_applies, mock_database_manager):
+        """1件多く読み、次のページの開始位置を返すテスト"""
+        mock_database_manager.query_frame.return_value = make_frame(*[make_record(i) for i in range(4)])
+
+        records, cursor = fetch_records_page(make_filters(), limit=3, db_manager=mock_database_manager)
+
+        assert records["id"].tolist() == [0, 1, 2]
+        assert cursor == (records["date"].iloc[-1], 2)
+        query, params = mock_database_manager.query_frame.call_args[0]
+        assert RECORDS_CURSOR_CLAUSE not in query
+        assert params["limit"] == 4
+        assert mock_database_manager.query_frame.call_args.kwargs == {"analytic": True}
+
+    @patch("services.statistics_service.archive_applies", return_value=False)
+    def test_next_page_uses_cursor(self, mock_archive_applies, mock_database_manager):
+        """2ページ目以降は (date, id) の位置より後ろを読むテスト"""
+        cursor = (make_record(5)["date"], 5)
+        mock_database_manager.query_frame.return_value = make_frame(make_record(6))
+
+        records, next_cursor = fetch_records_page(make_filters(), cursor, limit=3,
+                                                  db_manager=mock_database_manager)
+
+        assert len(records) == 1
+        assert next_cursor is None
+        query, params = mock_database_manager.query_frame.call_args[0]
+        assert RECORDS_CURSOR_CLAUSE in query
+        assert (params["cursor_date"], params["cursor_id"]) == cursor
+
+    @patch("services.statistics_service.archive_applies", return_value=True)
+    def test_continues_into_archive(self, mock_archive_applies, mock_database_manager, tmp_path):
+        """DBの行が足りない場合はアーカイブの古い行で埋めるテスト"""
+        UsageArchive(str(tmp_path)).write_partition("summary_usage_202506", [[
+            {**make_record(i, hour=i), "app_type": "app", "total_tokens": 150, "event_id": None} for i in range(3)
+        ]])
+        mock_database_manager.query_frame.return_value = make_frame(make_record(10, hour=20))
+
+        with patch("services.statistics_service.USAGE_ARCHIVE_DIR", str(tmp_path)):
+            records, cursor = fetch_records_page(make_filters(), limit=3, db_manager=mock_database_manager)
+
+        assert records["id"].tolist() == [10, 2, 1]
+        assert cursor == (records["date"].iloc[-1], 1)
+
+
+class TestFormatUsage:
+    """format_usage_records関数とformat_usage_summary関数のテスト"""
+
+    def test_format_records(self):
+        """日時を日本時間の日付にし、表示名の置き換えと丸めを列単位で行うテスト"""
+        records = make_frame(
+            {**make_record(1, hour=16), "department": "default", "processing_time": 2.6},
+            {**make_record(2, hour=1), "department": "眼科", "doctor": "橋本", "document_types": None},
+        )
+
+        formatted = format_usage_records(records)
+
+        assert formatted["作成日"].dt.strftime("%Y/%m/%d").tolist() == ["2025/06/02", "2025/06/01"]
+        assert formatted["文書名"].tolist() == ["診療情報提供書", "不明"]
+        assert formatted["診療科"].tolist() == ["全科共通", "眼科"]
+        assert formatted["医師名"].tolist() == ["医師共通", "橋本"]
+        assert formatted["処理時間(秒)"].tolist() == [2.6, 3.0]
+
+    def test_format_empty_records(self):
+        """明細がない場合も列を持つ表を返すテスト"""
+        formatted = format_usage_records(pd.DataFrame(columns=list(make_record(0))))
+        assert formatted.empty
+        assert "作成日" in formatted.columns
+
+    def test_format_summary(self):
+        """集計行の表示名を置き換えるテスト"""
+        formatted = format_usage_summary([
+            {"department": "default", "doctor": "default", "document_types": None, "count": 2,
+             "input_tokens": 10, "output_tokens": 5, "total_tokens": 15},
+        ])
+
+        assert formatted.iloc[0].to_dict() == {
+            "文書名": "不明", "診療科": "全科共通", "医師名": "医師共通", "作成件数": 2,
+            "入力トークン": 10, "出力トークン": 5, "合計トークン": 15,
+        }
+
+
+class TestCachedStatistics:
+    """cached_statistics関数のテスト"""
+
+    def setup_method(self):
+        get_statistics_cache().clear()
+
+    def test_current_range_checks_version(self, mock_database_manager):
+        """今日を含む期間は期間内の更新番号を確認してから使い回すテスト"""
+        today = datetime.datetime.now(JST).date()
+        filters = StatisticsFilter(today - datetime.timedelta(days=7), today)
+        mock_database_manager.execute_query.return_value = [{"version": 5}]
+        compute = Mock(return_value="result")
+
+        assert cached_statistics("test", filters, compute, db_manager=mock_database_manager) == "result"
+        assert cached_statistics("test", filters, compute, db_manager=mock_database_manager) == "result"
+
+        compute.assert_called_once_with(filters, db_manager=mock_database_manager)
+        query, params = mock_database_manager.execute_query.call_args[0]
+        assert "summary_usage_versions" in query
+        assert params == {"start_day": filters.start_date, "end_day": today}
+
+    def test_historical_range_checks_version(self, mock_database_manager):
+        """過去の期間も更新番号を確認し、再送で行が増えた場合は計算し直すテスト"""
+        mock_database_manager.execute_query.side_effect = [[{"version": 5}], [{"version": 5}], [{"version": 6}]]
+        compute = Mock(side_effect=["first", "second"])
+
+        assert cached_statistics("test", make_filters(), compute, "day", db_manager=mock_database_manager) == "first"
+        assert cached_statistics("test", make_filters(), compute, "day", db_manager=mock_database_manager) == "first"
+        assert cached_statistics("test", make_filters(), compute, "day", db_manager=mock_database_manager) == "second"
+
+        assert mock_database_manager.execute_query.call_count == 3
+
+
+class TestUsageMetrics:
+    """処理時間・失敗率の集計のテスト"""
+
+    def test_metrics_include_failures(self, mock_database_manager):
+        """失敗の行も含めた条件でパーセンタイルと失敗率を求めるテスト"""
+        mock_database_manager.query_frame.return_value = pd.DataFrame([{
+            "model_family": "Claude", "document_types": None, "requests": 10, "p50": 4.25, "p90": 9.0,
+            "p99": 12.34, "output_tokens_per_second": 52.5, "error_rate": 0.1, "timeout_rate": 0.0,
+        }])
+
+        metrics = get_usage_metrics(make_filters("Claude"), mock_database_manager)
+
+        query, params = mock_database_manager.query_frame.call_args[0]
+        assert "percentile_cont(0.99)" in query
+        assert "status = 'success'" not in query.split("WHERE")[-1]
+        assert params["model_family"] == "Claude"
+        assert mock_database_manager.query_frame.call_args.kwargs == {"analytic": True}
+        formatted = format_usage_metrics(metrics).iloc[0].to_dict()
+        assert formatted["文書名"] == "不明"
+        assert formatted["p99(秒)"] == 12.3
+        assert formatted["エラー率(%)"] == 10.0
+
+    def test_timeseries_bucket(self, mock_database_manager):
+        """集計単位をDBに渡し、時刻 × モデルの表にするテスト"""
+        mock_database_manager.query_frame.return_value = pd.DataFrame([
+            {"bucket": datetime.datetime(2025, 6, 1), "model_family": "Claude", "count": 3, "p50": 4.0},
+            {"bucket": datetime.datetime(2025, 6, 1), "model_family": "Gemini_Pro", "count": 5, "p50": 2.0},
+        ])
+
+        timeseries = get_usage_timeseries(make_filters(), "hour", mock_database_manager)
+
+        _, params = mock_database_manager.query_frame.call_args[0]
+        assert params["bucket"] == "hour"
+        assert pivot_usage_timeseries(timeseries, "count").loc[datetime.datetime(2025, 6, 1)].to_dict() == {
+            "Claude": 3.0, "Gemini_Pro": 5.0
+        }
+
+    def test_timeseries_rejects_unknown_bucket(self, mock_database_manager):
+        """集計単位以外の値をSQLに渡さないテスト"""
+        with pytest.raises(ValueError):
+            get_usage_timeseries(make_filters(), "week; DROP TABLE prompts", mock_database_manager)
+        mock_database_manager.query_frame.assert_not_called()
+
+
+class TestExportUsageRecords:
+    """iter_record_batches関数とexport_usage_records関数のテスト"""
+
+    @patch("services.statistics_service.archive_applies", return_value=False)
+    def test_streams_batches(self, mock_archive_applies, mock_database_manager):
+        """1つのクエリの結果を一定件数ずつ読むテスト"""
+        mock_database_manager.stream_frames.return_value = iter([
+            make_frame(make_record(0), make_record(1)),
+            make_frame(make_record(2)),
+        ])
+
+        batches = list(iter_record_batches(make_filters(), batch_size=2, db_manager=mock_database_manager))
+
+        assert [len(batch) for batch in batches] == [2, 1]
+        query, params, batch_size = mock_database_manager.stream_frames.call_args[0]
+        assert "LIMIT" not in query
+        assert batch_size == 2
+        assert mock_database_manager.stream_frames.call_args.kwargs["analytic"]
+
+    @patch("services.statistics_service.archive_applies", return_value=False)
+    def test_export_csv(self, mock_archive_applies, mock_database_manager, tmp_path):
+        """CSVをヘッダー付きで書き出すテスト"""
+        mock_database_manager.stream_frames.return_value = iter([make_frame(*[make_record(i) for i in range(3)])])
+        path = tmp_path / "usage.csv"
+
+        assert export_usage_records(make_filters(), "CSV", str(path), mock_database_manager) == 3
+
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            rows = list(csv.DictReader(f))
+        assert len(rows) == 3
+        assert rows[0]["document_types"] == "診療情報提供書"
+
+    @patch("services.statistics_service.archive_applies", return_value=False)
+    def test_export_parquet(self, mock_archive_applies, mock_database_manager, tmp_path):
+        """Parquetを書き出すテスト"""
+        mock_database_manager.stream_frames.return_value = iter([make_frame(*[make_record(i) for i in range(3)])])
+        path = tmp_path / "usage.parquet"
+
+        assert export_usage_records(make_filters(), "Parquet", str(path), mock_database_manager) == 3
+
+        table = pq.read_table(path)
+        assert table.num_rows == 3
+        assert table.column("id").to_pylist() == [0, 1, 2]
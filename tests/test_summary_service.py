@@ -3,7 +3,13 @@ import queue
 import threading
 import pytest
 from unittest.mock import Mock, patch, MagicMock
+import anthropic
+import httpx
 import pytz
+from google.api_core import exceptions as google_exceptions
+from google.genai import errors as genai_errors
+
+from utils.hierarchy_manager import HierarchyIndex
 
 # テスト対象のモジュールをインポート
 from services.summary_service import (
@@ -18,7 +24,8 @@ from services.summary_service import (
     normalize_selection_params,
     determine_final_model,
     get_provider_and_model,
-    validate_api_credentials_for_provider
+    validate_api_credentials_for_provider,
+    failure_status
 )
 
 # テスト用定数
@@ -92,24 +99,24 @@ class TestValidateInputText:
 class TestNormalizeSelectionParams:
     """パラメータ正規化のテストクラス"""
 
-    @patch('services.summary_service.DEFAULT_DEPARTMENT', ['内科', '外科', 'default'])
-    @patch('services.summary_service.DOCUMENT_TYPES', ['診療録', 'サマリー'])
+    @pytest.fixture(autouse=True)
+    def hierarchy(self):
+        index = HierarchyIndex(1, ['default', '内科', '外科'], {}, ['診療録', 'サマリー'], {})
+        with patch('services.summary_service.get_hierarchy', return_value=index):
+            yield index
+
     def test_normalize_selection_params_valid(self):
         """正常なパラメータの正規化テスト"""
         dept, doc_type = normalize_selection_params('内科', '診療録')
         assert dept == '内科'
         assert doc_type == '診療録'
 
-    @patch('services.summary_service.DEFAULT_DEPARTMENT', ['内科', '外科', 'default'])
-    @patch('services.summary_service.DOCUMENT_TYPES', ['診療録', 'サマリー'])
     def test_normalize_selection_params_invalid_department(self):
         """無効な診療科の正規化テスト"""
         dept, doc_type = normalize_selection_params('無効な診療科', '診療録')
         assert dept == 'default'
         assert doc_type == '診療録'
 
-    @patch('services.summary_service.DEFAULT_DEPARTMENT', ['内科', '外科', 'default'])
-    @patch('services.summary_service.DOCUMENT_TYPES', ['診療録', 'サマリー'])
     def test_normalize_selection_params_invalid_document_type(self):
         """無効な文書タイプの正規化テスト"""
         dept, doc_type = normalize_selection_params('内科', '無効なタイプ')
@@ -302,6 +309,7 @@ class TestGenerateSummaryTask:
         assert result['model_detail'] == 'Claude'  # providerが'gemini'以外の場合はfinal_modelが使用される
         assert result['model_switched'] == False
         assert result['original_model'] == None
+        assert result['model_started_at'] <= result['finished_at']
 
     @patch('services.summary_service.normalize_selection_params')
     def test_generate_summary_task_exception(self, mock_normalize):
@@ -319,18 +327,53 @@ class TestGenerateSummaryTask:
 
         assert result['success'] == False
         assert isinstance(result['error'], str)
+        assert result['status'] == 'error'
+        assert result['model_detail'] is None
+        assert result['model_started_at'] is None
+        assert result['finished_at'] is not None
+
+    @pytest.mark.parametrize("error", [
+        TimeoutError(),
+        anthropic.APITimeoutError(request=httpx.Request("POST", "https://bedrock.example.com")),
+        httpx.ReadTimeout("The read operation timed out"),
+        google_exceptions.DeadlineExceeded("Deadline Exceeded"),
+        genai_errors.ServerError(504, {"error": {"code": 504, "status": "DEADLINE_EXCEEDED", "message": "期限切れ"}}),
+    ])
+    def test_failure_status_timeout(self, error):
+        """各プロバイダーの時間切れの例外を種類で判定するテスト"""
+        assert failure_status(error) == "timeout"
+
+    def test_failure_status_wrapped_timeout(self):
+        """APIError に包まれた時間切れも元の例外から判定するテスト"""
+        from utils.exceptions import APIError
+
+        try:
+            try:
+                raise httpx.ConnectTimeout("connect timeout")
+            except Exception as e:
+                raise APIError(f"ClaudeAPIClientでエラーが発生しました: {str(e)}")
+        except APIError as e:
+            assert failure_status(e) == "timeout"
+
+    def test_failure_status_error(self):
+        """時間切れ以外は文言に関わらずエラーとするテスト"""
+        from utils.exceptions import APIError
+
+        assert failure_status(APIError("認証エラー")) == "error"
+        assert failure_status(Exception("timeout の設定値が不正です")) == "error"
+        assert failure_status(genai_errors.ServerError(500, {"error": {"code": 500, "status": "INTERNAL"}})) == "error"
 
 
 
 class TestSaveUsageToDatabase:
     """データベース保存のテストクラス"""
 
-    @patch('services.summary_service.DatabaseManager')
-    @patch('streamlit.warning')
-    def test_save_usage_to_database_success(self, mock_warning, mock_db_manager):
-        """データベース保存成功のテスト"""
-        mock_db_instance = Mock()
-        mock_db_manager.get_instance.return_value = mock_db_instance
+    @patch('services.summary_service.get_usage_writer')
+    def test_save_usage_to_database_success(self, mock_get_writer):
+        """使用状況が書き込みキューに渡されるテスト"""
+        mock_writer = Mock()
+        mock_writer.submit.return_value = True
+        mock_get_writer.return_value = mock_writer
 
         result = {
             'model_detail': 'claude-3-sonnet',
@@ -347,14 +390,41 @@ class TestSaveUsageToDatabase:
 
         save_usage_to_database(result, session_params)
 
-        mock_db_instance.execute_query.assert_called_once()
-        mock_warning.assert_not_called()
+        mock_writer.submit.assert_called_once()
+        usage_data = mock_writer.submit.call_args[0][0]
+        assert usage_data['total_tokens'] == 300
+        assert usage_data['processing_time'] == 5.5
+        assert usage_data['started_at'] is None
+        assert usage_data['status'] == 'success'
+        assert usage_data['department'] == '内科'
+        assert usage_data['event_id']
+
+    @patch('services.summary_service.get_usage_writer')
+    def test_save_usage_to_database_failure(self, mock_get_writer):
+        """失敗した作成をトークンなしで記録するテスト"""
+        mock_writer = Mock()
+        mock_writer.submit.return_value = True
+        mock_get_writer.return_value = mock_writer
+
+        result = {'model_detail': 'Claude', 'status': 'timeout', 'processing_time': 60.25}
+        session_params = {
+            'selected_department': '内科',
+            'selected_document_type': '主治医意見書',
+            'selected_doctor': '田中医師'
+        }
 
-    @patch('services.summary_service.DatabaseManager')
+        save_usage_to_database(result, session_params)
+
+        usage_data = mock_writer.submit.call_args[0][0]
+        assert usage_data['status'] == 'timeout'
+        assert usage_data['input_tokens'] is None
+        assert usage_data['processing_time'] == 60.25
+
+    @patch('services.summary_service.get_usage_writer')
     @patch('streamlit.warning')
-    def test_save_usage_to_database_exception(self, mock_warning, mock_db_manager):
-        """データベース保存エラーのテスト"""
-        mock_db_manager.get_instance.side_effect = Exception("DB接続エラー")
+    def test_save_usage_to_database_exception(self, mock_warning, mock_get_writer):
+        """書き込みキューのエラーで画面の処理が止まらないテスト"""
+        mock_get_writer.side_effect = Exception("キューエラー")
 
         result = {
             'model_detail': 'claude-3-sonnet',
@@ -371,7 +441,7 @@ class TestSaveUsageToDatabase:
 
         save_usage_to_database(result, session_params)
 
-        mock_warning.assert_called_once()
+        mock_warning.assert_not_called()
 
 
 class TestHandleSuccessResult:
@@ -0,0 +1,126 @@
+from typing import NamedTuple
+from unittest.mock import Mock
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from database.unit_of_work import UnitOfWork, compile_statement
+from utils.exceptions import DatabaseError
+
+
+class Item(NamedTuple):
+    id: int
+    name: str
+
+
+class FakeDatabaseManager:
+    """主DB・レプリカのセッションを返す DatabaseManager の代わり"""
+
+    def __init__(self, primary, replica=None):
+        self.primary = primary
+        self.replica = replica
+        self.replica_healthy = replica is not None
+        self.execute_query = Mock(return_value=[])
+
+    def replica_available(self):
+        return self.replica_healthy
+
+    def get_session(self, replica=False):
+        return (self.replica if replica else self.primary)()
+
+    def mark_replica_unhealthy(self, error):
+        self.replica_healthy = False
+
+
+@pytest.fixture
+def primary(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'primary.db'}")
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT)")
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+def count_items(session_factory):
+    with UnitOfWork(FakeDatabaseManager(session_factory)) as uow:
+        return uow.scalar("SELECT COUNT(*) FROM items")
+
+
+class TestUnitOfWork:
+    """UnitOfWorkクラスのテスト"""
+
+    def test_commits_statements_together(self, primary):
+        """複数の文を1つのトランザクションで実行し、抜けるときにコミットするテスト"""
+        with UnitOfWork(FakeDatabaseManager(primary)) as uow:
+            uow.execute_query("INSERT INTO items (name) VALUES (:name)", {"name": "a"}, fetch=False)
+            uow.execute_in_transaction([("INSERT INTO items (name) VALUES (:name)", {"name": "b"})])
+            assert count_items(primary) == 0
+
+        assert count_items(primary) == 2
+
+    def test_rolls_back_on_error(self, primary):
+        """途中で失敗した場合はすべて取り消すテスト"""
+        with pytest.raises(DatabaseError, match="クエリ実行中にエラーが発生しました"):
+            with UnitOfWork(FakeDatabaseManager(primary)) as uow:
+                uow.execute_query("INSERT INTO items (name) VALUES ('a')", fetch=False)
+                uow.execute_query("INSERT INTO missing VALUES (1)", fetch=False)
+
+        assert count_items(primary) == 0
+
+    def test_typed_rows(self, primary):
+        """指定した型の行、または列名で触れる行を返すテスト"""
+        with UnitOfWork(FakeDatabaseManager(primary)) as uow:
+            uow.execute_query("INSERT INTO items (name) VALUES ('a'), ('b')", fetch=False)
+            items = uow.fetch("SELECT id, name FROM items ORDER BY id", row_type=Item)
+            rows = uow.fetch("SELECT id, name FROM items ORDER BY id")
+            frame = uow.query_frame("SELECT name FROM items ORDER BY id")
+
+        assert items == [Item(1, "a"), Item(2, "b")]
+        assert rows[1].name == "b"
+        assert frame["name"].tolist() == ["a", "b"]
+
+    def test_analytic_delegates_other_statements(self, primary):
+        """analytic の unit of work は analytic でない文を DatabaseManager に渡すテスト"""
+        db_manager = FakeDatabaseManager(primary)
+
+        with UnitOfWork(db_manager, analytic=True) as uow:
+            uow.execute_query("UPDATE app_metadata SET value = '1'", {"a": 1})
+            uow.execute_query("SELECT COUNT(*) AS count FROM items", analytic=True)
+
+        db_manager.execute_query.assert_called_once_with("UPDATE app_metadata SET value = '1'", {"a": 1}, True)
+
+    def test_falls_back_when_replica_unreachable(self, primary, tmp_path):
+        """レプリカに接続できない場合は主DBで開くテスト"""
+        unreachable = create_engine(f"sqlite:///{tmp_path / 'missing' / 'replica.db'}")
+        db_manager = FakeDatabaseManager(primary, sessionmaker(bind=unreachable))
+
+        with UnitOfWork(db_manager, analytic=True) as uow:
+            assert uow.scalar("SELECT COUNT(*) FROM items") == 0
+
+        assert not db_manager.replica_available()
+
+    def test_compile_statement_is_cached(self):
+        """同じSQL文字列の text() を使い回すテスト"""
+        assert compile_statement("SELECT 1") is compile_statement("SELECT 1")
+
+
+class TestStreamQuery:
+    """stream_query・stream_frames のテスト"""
+
+    def test_streams_in_batches(self, primary):
+        """結果を指定した件数ずつの行・DataFrame で返すテスト"""
+        with UnitOfWork(FakeDatabaseManager(primary)) as uow:
+            uow.execute_query("INSERT INTO items (name) VALUES ('a'), ('b'), ('c'), ('d'), ('e')", fetch=False)
+            batches = list(uow.stream_query("SELECT id, name FROM items ORDER BY id", batch_size=2))
+            frames = list(uow.stream_frames("SELECT name FROM items WHERE id > :id ORDER BY id", {"id": 1}, 3))
+
+        assert [len(batch) for batch in batches] == [2, 2, 1]
+        assert batches[0][1] == {"id": 2, "name": "b"}
+        assert [frame["name"].tolist() for frame in frames] == [["b", "c", "d"], ["e"]]
+
+    def test_stream_error(self, primary):
+        """実行に失敗した場合は DatabaseError にするテスト"""
+        with pytest.raises(DatabaseError, match="クエリ実行中にエラーが発生しました"):
+            with UnitOfWork(FakeDatabaseManager(primary)) as uow:
+                list(uow.stream_query("SELECT * FROM missing"))
@@ -0,0 +1,95 @@
+import datetime
+
+import pyarrow.parquet as pq
+
+from database.usage_archive import UsageArchive
+
+
+def make_row(i, model_detail="claude-3-sonnet", document_types="診療情報提供書"):
+    return {
+        "id": i,
+        "date": datetime.datetime(2024, 3, 1, 9, 0, tzinfo=datetime.timezone.utc) + datetime.timedelta(days=i),
+        "app_type": "app",
+        "document_types": document_types,
+        "model_detail": model_detail,
+        "department": "内科",
+        "doctor": "default",
+        "input_tokens": 100,
+        "output_tokens": 50,
+        "total_tokens": 150,
+        "processing_time": 3,
+        "event_id": None,
+    }
+
+
+class TestUsageArchive:
+    """UsageArchiveクラスのテスト"""
+
+    def test_write_and_read_partition(self, tmp_path):
+        """書き出した区画を期間で絞り込んで読めるテスト"""
+        archive = UsageArchive(str(tmp_path))
+        archive.write_partition("summary_usage_202403", [[make_row(i) for i in range(10)]])
+
+        assert archive.exists("summary_usage_202403")
+        table = archive.read(datetime.datetime(2024, 3, 3), datetime.datetime(2024, 3, 5, 23, 59))
+        assert table.num_rows == 3
+        assert not list(tmp_path.glob(".*"))
+
+    def test_write_partition_in_batches(self, tmp_path):
+        """行のまとまりごとに行グループとして書き出し、空の区画も書き出せるテスト"""
+        archive = UsageArchive(str(tmp_path))
+        archive.write_partition("summary_usage_202403", ([make_row(i) for i in range(j, j + 4)] for j in (0, 4, 8)))
+        archive.write_partition("summary_usage_202402", iter([]))
+
+        metadata = pq.read_metadata(archive.path_for("summary_usage_202403"))
+        assert metadata.num_row_groups == 3
+        assert metadata.num_rows == 12
+        assert pq.read_metadata(archive.path_for("summary_usage_202402")).num_rows == 0
+
+    def test_read_filters_like_statistics_query(self, tmp_path):
+        """モデルと文書名の絞り込みが統計画面のSQLと同じになるテスト"""
+        archive = UsageArchive(str(tmp_path))
+        archive.write_partition("summary_usage_202403", [[
+            make_row(1, "claude-3-sonnet"),
+            make_row(2, "gemini-2.5-pro"),
+            make_row(3, "Gemini-2.5-Flash"),
+            make_row(4, "gemini-2.5-pro", None),
+        ]])
+        start, end = datetime.datetime(2024, 1, 1), datetime.datetime(2024, 12, 31)
+
+        assert archive.read(start, end, "Claude").num_rows == 1
+        assert archive.read(start, end, "Gemini_Pro").num_rows == 2
+        assert archive.read(start, end, "Gemini_Flash").num_rows == 1
+        assert archive.read(start, end, None, "不明").num_rows == 1
+        assert archive.read(start, end, None, "診療情報提供書").num_rows == 3
+
+    def test_read_prefers_stored_model_family(self, tmp_path):
+        """model_family を持つ行は保存された分類で絞り込み、持たない行は model_detail から分類するテスト"""
+        archive = UsageArchive(str(tmp_path))
+        archive.write_partition("summary_usage_202403", [[
+            {**make_row(1, "custom-model"), "model_family": "Claude"},
+            make_row(2, "claude-3-sonnet"),
+        ]])
+        start, end = datetime.datetime(2024, 1, 1), datetime.datetime(2024, 12, 31)
+
+        table = archive.read(start, end, "Claude", columns=["id", "model_family"])
+
+        assert table.column("model_family").to_pylist() == ["Claude", "Claude"]
+        assert archive.read(start, end, "Gemini_Pro").num_rows == 0
+
+    def test_read_before_cursor(self, tmp_path):
+        """(date, id) の位置より古い行だけを読むテスト"""
+        archive = UsageArchive(str(tmp_path))
+        rows = [make_row(i) for i in range(5)]
+        rows.append({**make_row(10), "date": rows[2]["date"]})
+        archive.write_partition("summary_usage_202403", [rows])
+
+        table = archive.read(datetime.datetime(2024, 1, 1), datetime.datetime(2024, 12, 31),
+                             before=(rows[2]["date"], 10))
+
+        assert sorted(table.column("id").to_pylist()) == [0, 1, 2]
+
+    def test_read_without_archive(self, tmp_path):
+        """アーカイブがない場合は空の表を返すテスト"""
+        archive = UsageArchive(str(tmp_path / "missing"))
+        assert archive.read(datetime.datetime(2024, 1, 1), datetime.datetime(2024, 12, 31)).num_rows == 0
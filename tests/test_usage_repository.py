@@ -0,0 +1,52 @@
+from database.usage_repository import UsageRepository, USAGE_COLUMNS
+from database.usage_rollups import ROLLUP_THROUGH_KEY
+
+
+class TestUsageRepository:
+    """UsageRepositoryクラスのテスト"""
+
+    def test_insert_many_single_statement(self, mock_database_manager):
+        """複数行を列ごとの配列で渡し1文で登録するテスト"""
+        rows = [
+            {"date": None, "app_type": "app", "document_types": "診療情報提供書", "model_detail": "claude",
+             "department": "内科", "doctor": "default", "input_tokens": 10, "output_tokens": 20,
+             "total_tokens": 30, "processing_time": 2},
+            {"date": None, "app_type": "app", "document_types": "診療情報提供書", "model_detail": "gemini",
+             "department": "眼科", "doctor": "default", "input_tokens": 1, "output_tokens": 2,
+             "total_tokens": 3, "processing_time": 1},
+        ]
+
+        mock_database_manager.execute_query.return_value = [{"inserted": 2}]
+
+        assert UsageRepository(mock_database_manager).insert_many(rows) == 2
+
+        mock_database_manager.execute_query.assert_called_once()
+        query, params = mock_database_manager.execute_query.call_args[0]
+        assert "unnest" in query
+        assert "summary_usage_versions" in query
+        assert set(params) == {name for name, _ in USAGE_COLUMNS} | {"rollup_key"}
+        assert params["department"] == ["内科", "眼科"]
+        assert params["total_tokens"] == [30, 3]
+        assert params["model_family"] == ["Claude", "Gemini_Pro"]
+        assert params["status"] == ["success", "success"]
+        assert params["rollup_key"] == ROLLUP_THROUGH_KEY
+
+    def test_insert_many_returns_new_rows_only(self, mock_database_manager):
+        """登録済みの event_id を除いた件数を返すテスト"""
+        mock_database_manager.execute_query.return_value = [{"inserted": 0}]
+
+        assert UsageRepository(mock_database_manager).insert_many([{"event_id": "x"}]) == 0
+
+    def test_insert_many_empty(self, mock_database_manager):
+        """行がない場合はDBにアクセスしないテスト"""
+        assert UsageRepository(mock_database_manager).insert_many([]) == 0
+        mock_database_manager.execute_query.assert_not_called()
+
+    def test_range_version(self, mock_database_manager):
+        """期間内の日の更新番号の最大値を返すテスト"""
+        mock_database_manager.execute_query.return_value = [{"version": 42}]
+
+        assert UsageRepository(mock_database_manager).range_version("2025-06-01", "2025-06-07") == 42
+
+        _, params = mock_database_manager.execute_query.call_args[0]
+        assert params == {"start_day": "2025-06-01", "end_day": "2025-06-07"}
@@ -0,0 +1,118 @@
+import datetime
+from unittest.mock import Mock
+
+import pytest
+
+from database.usage_partitions import UsagePartitionRepository, partition_month, partition_start
+from utils.exceptions import DatabaseError
+from utils.usage_retention import archive_expired_partitions, retention_cutoff
+
+
+class TestUsagePartitions:
+    """区画名の扱いとUsagePartitionRepositoryのテスト"""
+
+    def test_partition_month(self):
+        """区画名から月を取り出すテスト"""
+        assert partition_month("summary_usage_202403") == datetime.date(2024, 3, 1)
+        assert partition_start("summary_usage_202403").isoformat() == "2024-03-01T00:00:00+09:00"
+
+    def test_rejects_other_names(self, mock_database_manager):
+        """区画名以外をSQLに埋め込まないテスト"""
+        with pytest.raises(ValueError):
+            UsagePartitionRepository(mock_database_manager).drop("summary_usage; DROP TABLE prompts")
+        mock_database_manager.execute_query.assert_not_called()
+
+    def test_hot_start_uses_oldest_attached(self, mock_database_manager):
+        """接続中の最も古い区画の月初を返すテスト"""
+        mock_database_manager.execute_query.return_value = [
+            {"name": "summary_usage_202401", "attached": False},
+            {"name": "summary_usage_202403", "attached": True},
+            {"name": "summary_usage_202404", "attached": True},
+        ]
+
+        hot_start = UsagePartitionRepository(mock_database_manager).hot_start()
+
+        assert hot_start.isoformat() == "2024-03-01T00:00:00+09:00"
+
+
+class TestArchiveExpiredPartitions:
+    """archive_expired_partitions関数のテスト"""
+
+    def test_retention_cutoff(self):
+        """今月と直前の指定月数を残すテスト"""
+        assert retention_cutoff(datetime.date(2025, 6, 15), 12) == datetime.date(2024, 6, 1)
+        assert retention_cutoff(datetime.date(2025, 1, 1), 1) == datetime.date(2024, 12, 1)
+        assert retention_cutoff(datetime.date(2025, 6, 15), 0) == datetime.date(2025, 6, 1)
+
+    def test_detaches_exports_then_drops(self):
+        """古い区画を切り離し、書き出してから削除するテスト"""
+        repository = Mock()
+        repository.list_partitions.return_value = [
+            ("summary_usage_202404", False),
+            ("summary_usage_202405", True),
+            ("summary_usage_202406", True),
+        ]
+        repository.fetch_rows.return_value = [[{"id": 1}]]
+        repository.late_row_ids.return_value = []
+        archive = Mock()
+        calls = Mock()
+        calls.attach_mock(repository.detach, "detach")
+        calls.attach_mock(archive.write_partition, "write_partition")
+        calls.attach_mock(repository.drop, "drop")
+
+        rollup_repository = Mock()
+        calls.attach_mock(rollup_repository.refresh, "refresh")
+        calls.attach_mock(rollup_repository.freeze, "freeze")
+
+        archived = archive_expired_partitions(12, today=datetime.date(2025, 6, 15), repository=repository,
+                                              archive=archive, rollup_repository=rollup_repository)
+
+        assert archived == ["summary_usage_202404", "summary_usage_202405"]
+        assert [call[0] for call in calls.mock_calls] == [
+            "refresh", "freeze", "write_partition", "drop", "detach", "write_partition", "drop"
+        ]
+        rollup_repository.freeze.assert_called_once_with(datetime.date(2024, 6, 1))
+
+    def test_failure_raises_database_error(self):
+        """書き出しに失敗したら区画を削除しないテスト"""
+        repository = Mock()
+        repository.list_partitions.return_value = [("summary_usage_202401", True)]
+        archive = Mock()
+        archive.write_partition.side_effect = OSError("disk full")
+
+        with pytest.raises(DatabaseError):
+            archive_expired_partitions(12, today=datetime.date(2025, 6, 15), repository=repository,
+                                       archive=archive, rollup_repository=Mock())
+
+        repository.drop.assert_not_called()
+
+    def test_archives_late_rows_in_default_partition(self):
+        """アーカイブした月に遅れて登録された行を書き出し、書き出した行だけを削除するテスト"""
+        repository = Mock()
+        repository.list_partitions.return_value = [("summary_usage_202406", True)]
+        repository.late_row_ids.return_value = [7, 9]
+        repository.fetch_late_rows.return_value = [[{"id": 7}, {"id": 9}]]
+        archive = Mock()
+
+        archived = archive_expired_partitions(12, today=datetime.date(2025, 6, 15), repository=repository,
+                                              archive=archive, rollup_repository=Mock())
+
+        assert archived == ["summary_usage_default_7"]
+        assert repository.late_row_ids.call_args[0][0].isoformat() == "2024-06-01T00:00:00+09:00"
+        repository.fetch_late_rows.assert_called_once_with([7, 9])
+        archive.write_partition.assert_called_once_with("summary_usage_default_7", [[{"id": 7}, {"id": 9}]])
+        repository.delete_late_rows.assert_called_once_with([7, 9])
+
+    def test_late_rows_kept_when_write_fails(self):
+        """遅れて登録された行の書き出しに失敗したら行を削除しないテスト"""
+        repository = Mock()
+        repository.list_partitions.return_value = []
+        repository.late_row_ids.return_value = [7]
+        archive = Mock()
+        archive.write_partition.side_effect = OSError("disk full")
+
+        with pytest.raises(DatabaseError):
+            archive_expired_partitions(12, today=datetime.date(2025, 6, 15), repository=repository,
+                                       archive=archive, rollup_repository=Mock())
+
+        repository.delete_late_rows.assert_not_called()
@@ -0,0 +1,65 @@
+import datetime
+
+from database.usage_rollups import UsageRollupRepository, ROLLUP_FROZEN_BEFORE_KEY, ROLLUP_THROUGH_KEY
+from services.statistics_service import build_rollup_filter
+
+
+class TestBuildRollupFilter:
+    """build_rollup_filter関数のテスト"""
+
+    def test_no_filter(self):
+        """絞り込みがない場合のテスト"""
+        assert build_rollup_filter("すべて", "すべて") == ("TRUE", {})
+
+    def test_model_and_document_type(self):
+        """モデル分類と文書名で絞り込むテスト"""
+        clause, params = build_rollup_filter("Gemini_Flash", "返書")
+
+        assert "model_family = :model_family" in clause
+        assert params == {"model_family": "Gemini_Flash", "rollup_doc_type": "返書"}
+
+    def test_unknown_document_type(self):
+        """文書名のない行は空文字で絞り込むテスト"""
+        _, params = build_rollup_filter("すべて", "不明")
+        assert params == {"rollup_doc_type": ""}
+
+
+class TestUsageRollupRepository:
+    """UsageRollupRepositoryクラスのテスト"""
+
+    def test_refresh_single_statement(self, mock_database_manager):
+        """集計と集計済みの日の更新を1文で行うテスト"""
+        mock_database_manager.execute_query.return_value = [{"rolled": 12, "through": datetime.date(2025, 6, 1)}]
+
+        assert UsageRollupRepository(mock_database_manager).refresh() == 12
+
+        mock_database_manager.execute_query.assert_called_once()
+        query, params = mock_database_manager.execute_query.call_args[0]
+        assert "summary_usage_daily" in query
+        assert params == {"rollup_key": ROLLUP_THROUGH_KEY, "frozen_key": ROLLUP_FROZEN_BEFORE_KEY}
+
+    def test_freeze_keeps_later_marker(self, mock_database_manager):
+        """確定させる日を記録し、前の日には戻さない文で行うテスト"""
+        UsageRollupRepository(mock_database_manager).freeze(datetime.date(2024, 6, 1))
+
+        query, params = mock_database_manager.execute_query.call_args[0]
+        assert "m.value::date < EXCLUDED.value::date" in query
+        assert params == {"frozen_key": ROLLUP_FROZEN_BEFORE_KEY, "before": "2024-06-01"}
+
+    def test_summarize_combines_rollup_and_raw(self, mock_database_manager):
+        """日次集計と当日分の行を1回のクエリで合わせるテスト"""
+        mock_database_manager.execute_query.return_value = [{"department": "内科", "count": 3}]
+
+        rows = UsageRollupRepository(mock_database_manager).summarize(
+            "date >= :start_date", "model_family = :model_family", {"start_date": None, "model_family": "Claude"}
+        )
+
+        assert rows == [{"department": "内科", "count": 3}]
+        query, params = mock_database_manager.execute_query.call_args[0]
+        assert "FROM summary_usage_daily" in query
+        assert "UNION ALL" in query
+        assert "date >= :start_date" in query
+        assert "model_family = :model_family" in query
+        assert "GROUPING SETS" in query
+        assert params["rollup_key"] == ROLLUP_THROUGH_KEY
+        assert params["frozen_key"] == ROLLUP_FROZEN_BEFORE_KEY
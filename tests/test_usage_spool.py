@@ -0,0 +1,76 @@
+import datetime
+from unittest.mock import Mock
+
+import pytest
+
+from database.usage_spool import UsageSpool, encode_row, decode_row
+
+
+def make_row(i):
+    return {
+        "date": datetime.datetime(2025, 6, 1, 9, 0, i, tzinfo=datetime.timezone.utc),
+        "started_at": datetime.datetime(2025, 6, 1, 8, 59, i, tzinfo=datetime.timezone.utc),
+        "model_started_at": None,
+        "department": "内科",
+        "input_tokens": i,
+        "event_id": f"00000000-0000-0000-0000-{i:012d}",
+    }
+
+
+class TestUsageSpool:
+    """UsageSpoolクラスのテスト"""
+
+    def test_encode_decode_roundtrip(self):
+        """日時を含む行を書き出して読み戻せるテスト"""
+        row = make_row(1)
+        assert decode_row(encode_row(row)) == row
+
+    def test_append_and_replay(self, tmp_path):
+        """追記した行をまとめて再送し、ファイルを消すテスト"""
+        spool = UsageSpool(str(tmp_path / "spool" / "usage.jsonl"))
+        spool.append([make_row(1), make_row(2)])
+        spool.append([make_row(3)], sync=False)
+        assert spool.has_pending()
+
+        repository = Mock()
+        repository.insert_many.side_effect = lambda rows: len(rows)
+
+        assert spool.replay(repository, batch_size=2) == 3
+        assert [call[0][0] for call in repository.insert_many.call_args_list] == [
+            [make_row(1), make_row(2)], [make_row(3)]
+        ]
+        assert not spool.has_pending()
+
+    def test_replay_failure_keeps_file(self, tmp_path):
+        """再送に失敗したらファイルを残し、次回もう一度送るテスト"""
+        spool = UsageSpool(str(tmp_path / "usage.jsonl"))
+        spool.append([make_row(1)])
+
+        repository = Mock()
+        repository.insert_many.side_effect = Exception("DB接続エラー")
+        with pytest.raises(Exception):
+            spool.replay(repository)
+        assert spool.has_pending()
+
+        spool.append([make_row(2)])
+        repository.insert_many.side_effect = lambda rows: len(rows)
+
+        assert spool.replay(repository) == 1
+        assert spool.replay(repository) == 1
+        assert not spool.has_pending()
+
+    def test_replay_skips_truncated_line(self, tmp_path):
+        """書き込み途中で切れた末尾の行を読み飛ばすテスト"""
+        path = tmp_path / "usage.jsonl"
+        path.write_text(encode_row(make_row(1)) + "\n" + '{"department": "内', encoding="utf-8")
+
+        repository = Mock()
+        repository.insert_many.side_effect = lambda rows: len(rows)
+
+        assert UsageSpool(str(path)).replay(repository) == 1
+
+    def test_replay_without_file(self, tmp_path):
+        """退避した行がない場合は何もしないテスト"""
+        repository = Mock()
+        assert UsageSpool(str(tmp_path / "usage.jsonl")).replay(repository) == 0
+        repository.insert_many.assert_not_called()
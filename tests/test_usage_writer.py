@@ -0,0 +1,131 @@
+from unittest.mock import Mock
+
+from database.usage_writer import UsageWriter
+
+
+def make_row(i):
+    return {"department": "内科", "input_tokens": i}
+
+
+class TestUsageWriter:
+    """UsageWriterクラスのテスト"""
+
+    def test_flushes_when_batch_is_full(self):
+        """件数がバッチサイズに達したらまとめて書き込むテスト"""
+        repository = Mock()
+        writer = UsageWriter(max_queue_size=10, batch_size=3, flush_interval_ms=60000, repository=repository)
+
+        for i in range(3):
+            assert writer.submit(make_row(i)) is True
+        writer.stop(timeout=5)
+
+        repository.insert_many.assert_called_once_with([make_row(0), make_row(1), make_row(2)])
+        metrics = writer.metrics()
+        assert metrics["written"] == 3
+        assert metrics["batches"] == 1
+        assert metrics["queue_depth"] == 0
+
+    def test_flushes_after_interval(self):
+        """バッチが満たなくても一定時間で書き込むテスト"""
+        repository = Mock()
+        writer = UsageWriter(max_queue_size=10, batch_size=100, flush_interval_ms=10, repository=repository)
+
+        writer.submit(make_row(1))
+        writer._thread.join(0.5)
+
+        repository.insert_many.assert_called_once_with([make_row(1)])
+        writer.stop(timeout=5)
+
+    def test_stop_drains_queue(self):
+        """終了時にキューに残った行を書き込むテスト"""
+        repository = Mock()
+        writer = UsageWriter(max_queue_size=100, batch_size=4, flush_interval_ms=60000, repository=repository)
+
+        for i in range(10):
+            writer.submit(make_row(i))
+        writer.stop(timeout=5)
+
+        written = [row for call in repository.insert_many.call_args_list for row in call[0][0]]
+        assert written == [make_row(i) for i in range(10)]
+        assert writer.metrics()["written"] == 10
+
+    def test_queue_full_spools_without_blocking(self):
+        """キューが満杯なら待たずに退避ファイルへ書き出すテスト"""
+        spool = Mock()
+        writer = UsageWriter(max_queue_size=1, batch_size=10, flush_interval_ms=60000, repository=Mock(), spool=spool)
+        writer.start = Mock()
+
+        assert writer.submit(make_row(1)) is True
+        assert writer.submit(make_row(2)) is True
+
+        spool.append.assert_called_once_with([make_row(2)], sync=False)
+        metrics = writer.metrics()
+        assert metrics["enqueued"] == 1
+        assert metrics["overflowed"] == 1
+        assert metrics["spooled"] == 1
+        assert metrics["max_queue_depth"] == 1
+
+    def test_queue_full_without_spool_is_lost(self):
+        """退避先がない場合は失われた件数を記録するテスト"""
+        writer = UsageWriter(max_queue_size=1, batch_size=10, flush_interval_ms=60000, repository=Mock())
+        writer.start = Mock()
+
+        writer.submit(make_row(1))
+        assert writer.submit(make_row(2)) is False
+        assert writer.metrics()["lost"] == 1
+
+    def test_flush_failure_is_spooled(self):
+        """書き込みに失敗した行を退避ファイルへ書き出すテスト"""
+        repository = Mock()
+        repository.insert_many.side_effect = Exception("DB接続エラー")
+        spool = Mock()
+        writer = UsageWriter(max_queue_size=10, batch_size=2, flush_interval_ms=60000,
+                             repository=repository, spool=spool)
+
+        writer.submit(make_row(1))
+        writer.submit(make_row(2))
+        writer.stop(timeout=5)
+
+        spool.append.assert_called_once_with([make_row(1), make_row(2)], sync=True)
+        metrics = writer.metrics()
+        assert metrics["failed"] == 2
+        assert metrics["spooled"] == 2
+        assert metrics["written"] == 0
+        assert "DB接続エラー" in metrics["last_error"]
+
+    def test_replays_spool_after_successful_flush(self):
+        """DBに書き込めたら退避した行を再送するテスト"""
+        repository = Mock()
+        spool = Mock()
+        spool.has_pending.return_value = True
+        spool.replay.return_value = 5
+        writer = UsageWriter(max_queue_size=10, batch_size=1, flush_interval_ms=60000,
+                             repository=repository, spool=spool)
+
+        writer.submit(make_row(1))
+        writer.stop(timeout=5)
+
+        spool.replay.assert_called_once_with(repository, batch_size=1)
+        assert writer.metrics()["replayed"] == 5
+
+    def test_replay_failure_keeps_running(self):
+        """再送に失敗しても書き込みを続けるテスト"""
+        spool = Mock()
+        spool.has_pending.return_value = True
+        spool.replay.side_effect = Exception("DB接続エラー")
+        writer = UsageWriter(repository=Mock(), spool=spool, replay_interval_ms=60000)
+
+        writer._replay()
+        writer._replay()
+
+        spool.replay.assert_called_once()
+        assert writer.metrics()["replayed"] == 0
+
+    def test_submit_after_stop_writes_directly(self):
+        """終了後に渡された行はその場で書き込むテスト"""
+        repository = Mock()
+        writer = UsageWriter(repository=repository)
+        writer.stop()
+
+        assert writer.submit(make_row(1)) is True
+        repository.insert_many.assert_called_once_with([make_row(1)])
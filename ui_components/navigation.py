@@ -2,8 +2,8 @@ import streamlit as st
 
 from database.db import DatabaseManager
 from utils.config import CLAUDE_API_KEY, GOOGLE_CREDENTIALS_JSON, GEMINI_MODEL, PROMPT_MANAGEMENT
-from utils.constants import APP_TYPE, DEFAULT_DEPARTMENT, DOCUMENT_TYPES, DEPARTMENT_DOCTORS_MAPPING, \
-    DEFAULT_DOCUMENT_TYPE, DOCUMENT_TYPE_TO_PURPOSE_MAPPING
+from utils.constants import APP_TYPE, DEFAULT_DOCUMENT_TYPE
+from utils.hierarchy_manager import get_hierarchy
 from utils.prompt_manager import get_prompt
 
 
@@ -19,7 +19,7 @@ def update_document_model():
     st.session_state.selected_document_type = new_doc_type
     st.session_state.model_explicitly_selected = False
 
-    default_purpose = DOCUMENT_TYPE_TO_PURPOSE_MAPPING.get(new_doc_type, "")
+    default_purpose = get_hierarchy().get_purpose(new_doc_type)
     st.session_state.referral_purpose = default_purpose
 
     prompt_data = get_prompt(selected_dept, new_doc_type, selected_doctor)
@@ -33,14 +33,15 @@ def update_document_model():
 
 
 def render_sidebar():
-    departments = ["default"] + [dept for dept in DEFAULT_DEPARTMENT if dept != "default"]
+    hierarchy = get_hierarchy()
+    departments = hierarchy.departments
     previous_dept = st.session_state.selected_department
     previous_model = getattr(st.session_state, "selected_model", None)
     previous_doctor = getattr(st.session_state, "selected_doctor", None)
 
-    try:
-        index = departments.index(st.session_state.selected_department)
-    except ValueError:
+    if hierarchy.has_department(st.session_state.selected_department):
+        index = hierarchy.department_index(st.session_state.selected_department)
+    else:
         index = 0
         st.session_state.selected_department = departments[0]
 
@@ -57,9 +58,10 @@ def render_sidebar():
         st.session_state.selected_department = departments[0]
         selected_dept = departments[0]
 
-    available_doctors = DEPARTMENT_DOCTORS_MAPPING.get(selected_dept, ["default"])
+    available_doctors = hierarchy.get_doctors(selected_dept)
 
-    if "selected_doctor" not in st.session_state or st.session_state.selected_doctor not in available_doctors:
+    if "selected_doctor" not in st.session_state or \
+            not hierarchy.has_doctor(selected_dept, st.session_state.selected_doctor):
         st.session_state.selected_doctor = available_doctors[0]
 
     if selected_dept != previous_dept:
@@ -75,7 +77,7 @@ def render_sidebar():
         selected_doctor = st.sidebar.selectbox(
             "医師名",
             available_doctors,
-            index=available_doctors.index(st.session_state.selected_doctor),
+            index=hierarchy.doctor_index(selected_dept, st.session_state.selected_doctor),
             format_func=lambda x: "医師共通" if x == "default" else x,
             key="doctor_selector"
         )
@@ -86,20 +88,18 @@ def render_sidebar():
         st.session_state.selected_doctor = available_doctors[0]
         selected_doctor = available_doctors[0]
 
-    document_types = DOCUMENT_TYPES
+    document_types = hierarchy.document_types
 
     if "selected_document_type" not in st.session_state:
         st.session_state.selected_document_type = document_types[0] if document_types else DEFAULT_DOCUMENT_TYPE
         if "referral_purpose" not in st.session_state:
-            st.session_state.referral_purpose = DOCUMENT_TYPE_TO_PURPOSE_MAPPING.get(
-                st.session_state.selected_document_type, "")
+            st.session_state.referral_purpose = hierarchy.get_purpose(st.session_state.selected_document_type)
 
     if len(document_types) > 1:
         selected_document_type = st.sidebar.selectbox(
             "文書名",
             document_types,
-            index=document_types.index(
-                st.session_state.selected_document_type) if st.session_state.selected_document_type in document_types else 0,
+            index=hierarchy.document_type_index(st.session_state.selected_document_type),
             key="document_type_selector",
             on_change=update_document_model
         )
@@ -161,8 +161,7 @@ def save_user_settings(department, model,
                        doctor="default",
                        document_type=DEFAULT_DOCUMENT_TYPE):
     try:
-        if department != "default" and department not in DEFAULT_DEPARTMENT:
-            department = "default"
+        department = get_hierarchy().normalize_department(department)
         db_manager = DatabaseManager.get_instance()
 
         setting_id = f"user_preferences_{APP_TYPE}"
@@ -175,7 +174,7 @@ def save_user_settings(department, model,
                         :department, :model,
                         :document_type, :doctor, 
                         CURRENT_TIMESTAMP) 
-                ON CONFLICT (setting_id) 
+                ON CONFLICT (setting_id, app_type)
                 DO UPDATE SET
                     app_type = EXCLUDED.app_type,
                     selected_department = EXCLUDED.selected_department,
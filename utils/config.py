@@ -30,19 +30,54 @@ def parse_database_url():
     return None
 
 
-db_config = parse_database_url()
+# DATABASE_URL がない場合も読み込みは続け、接続時に DatabaseManager が設定不足を知らせる
+db_config = parse_database_url() or {}
 
-POSTGRES_HOST = db_config["host"]
-POSTGRES_PORT = db_config["port"]
-POSTGRES_USER = db_config["user"]
-POSTGRES_PASSWORD = db_config["password"]
-POSTGRES_DB = db_config["database"]
+POSTGRES_HOST = db_config.get("host")
+POSTGRES_PORT = db_config.get("port")
+POSTGRES_USER = db_config.get("user")
+POSTGRES_PASSWORD = db_config.get("password")
+POSTGRES_DB = db_config.get("database")
 POSTGRES_SSL = "require"
 
 DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "5"))
 DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "10"))
 DB_POOL_TIMEOUT = int(os.environ.get("DB_POOL_TIMEOUT", "30"))
 DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", "3600"))
+# この秒数より長く使われていなかった接続だけ、チェックアウト時に生存を確認する
+DB_POOL_PING_IDLE_SECONDS = int(os.environ.get("DB_POOL_PING_IDLE_SECONDS", "60"))
+DB_POOL_SLOW_CHECKOUT_MS = int(os.environ.get("DB_POOL_SLOW_CHECKOUT_MS", "1000"))
+DB_STREAM_FETCH_SIZE = int(os.environ.get("DB_STREAM_FETCH_SIZE", "5000"))
+DB_SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("DB_SQLITE_BUSY_TIMEOUT_MS", "5000"))
+DB_SLOW_QUERY_MS = int(os.environ.get("DB_SLOW_QUERY_MS", "500"))
+DB_SLOW_QUERY_EXPLAIN_SAMPLE_RATE = float(os.environ.get("DB_SLOW_QUERY_EXPLAIN_SAMPLE_RATE", "0.1"))
+DB_SLOW_QUERY_EXPLAIN_INTERVAL = int(os.environ.get("DB_SLOW_QUERY_EXPLAIN_INTERVAL", "600"))
+DB_SLOW_QUERY_EXPLAIN_TIMEOUT_MS = int(os.environ.get("DB_SLOW_QUERY_EXPLAIN_TIMEOUT_MS", "10000"))
+DB_SLOW_QUERY_TOP_N = int(os.environ.get("DB_SLOW_QUERY_TOP_N", "20"))
+# 統計画面・出力の読み取りに使うレプリカ。未設定なら主DBで読み取る
+DATABASE_REPLICA_URL = os.environ.get("DATABASE_REPLICA_URL")
+DB_REPLICA_POOL_SIZE = int(os.environ.get("DB_REPLICA_POOL_SIZE", "2"))
+DB_REPLICA_MAX_OVERFLOW = int(os.environ.get("DB_REPLICA_MAX_OVERFLOW", "3"))
+DB_REPLICA_POOL_TIMEOUT = int(os.environ.get("DB_REPLICA_POOL_TIMEOUT", "10"))
+DB_REPLICA_RETRY_INTERVAL = int(os.environ.get("DB_REPLICA_RETRY_INTERVAL", "30"))
+DB_INIT_TIMEOUT_SECONDS = int(os.environ.get("DB_INIT_TIMEOUT_SECONDS", "60"))
+DB_NOTIFY_POLL_INTERVAL = int(os.environ.get("DB_NOTIFY_POLL_INTERVAL", "30"))
+
+USAGE_WRITER_QUEUE_SIZE = int(os.environ.get("USAGE_WRITER_QUEUE_SIZE", "1000"))
+USAGE_WRITER_BATCH_SIZE = int(os.environ.get("USAGE_WRITER_BATCH_SIZE", "100"))
+USAGE_WRITER_FLUSH_INTERVAL_MS = int(os.environ.get("USAGE_WRITER_FLUSH_INTERVAL_MS", "1000"))
+USAGE_SPOOL_PATH = os.environ.get("USAGE_SPOOL_PATH", os.path.join("spool", "usage.jsonl"))
+USAGE_SPOOL_FSYNC_INTERVAL_MS = int(os.environ.get("USAGE_SPOOL_FSYNC_INTERVAL_MS", "1000"))
+USAGE_SPOOL_REPLAY_INTERVAL_MS = int(os.environ.get("USAGE_SPOOL_REPLAY_INTERVAL_MS", "30000"))
+USAGE_PARTITION_MONTHS_AHEAD = int(os.environ.get("USAGE_PARTITION_MONTHS_AHEAD", "3"))
+USAGE_RETENTION_MONTHS = int(os.environ.get("USAGE_RETENTION_MONTHS", "12"))
+USAGE_ARCHIVE_DIR = os.environ.get("USAGE_ARCHIVE_DIR", os.path.join("archive", "summary_usage"))
+
+STATISTICS_PAGE_SIZE = int(os.environ.get("STATISTICS_PAGE_SIZE", "100"))
+STATISTICS_EXPORT_BATCH_SIZE = int(os.environ.get("STATISTICS_EXPORT_BATCH_SIZE", "5000"))
+STATISTICS_CACHE_MAX_ENTRIES = int(os.environ.get("STATISTICS_CACHE_MAX_ENTRIES", "128"))
+STATISTICS_CACHE_TTL_SECONDS = int(os.environ.get("STATISTICS_CACHE_TTL_SECONDS", "300"))
+STATISTICS_CACHE_HISTORICAL_TTL_SECONDS = int(os.environ.get("STATISTICS_CACHE_HISTORICAL_TTL_SECONDS", "86400"))
 
 GOOGLE_CREDENTIALS_JSON = os.environ.get("GOOGLE_CREDENTIALS_JSON")
 GEMINI_MODEL = os.environ.get("GEMINI_MODEL")
@@ -2,6 +2,7 @@ import os
 
 from utils.config import APP_TYPE
 
+# 診療科・医師・文書名の初期データ。運用中の追加は departments / doctors / document_types テーブルで行う
 DEFAULT_DEPARTMENT = ["default", "眼科"]
 DEFAULT_DOCTOR = ["default"]
 
@@ -12,7 +13,6 @@ DEPARTMENT_DOCTORS_MAPPING = {
 
 DEFAULT_DOCUMENT_TYPE = "診療情報提供書"
 DOCUMENT_TYPES = ["他院への紹介", "紹介元への逆紹介", "返書", "最終返書"]
-DOCUMENT_TYPE_OPTIONS = ["すべて", "他院への紹介", "紹介元への逆紹介", "返書", "最終返書"]
 
 DOCUMENT_TYPE_TO_PURPOSE_MAPPING = {
     "他院への紹介": "精査加療依頼",
@@ -21,6 +21,14 @@ DOCUMENT_TYPE_TO_PURPOSE_MAPPING = {
     "最終返書": "治療経過報告",
 }
 
+# 統計画面のAIモデルの分類。上から順に判定し、どれにも当てはまらない場合は DEFAULT_MODEL_FAMILY
+MODEL_MAPPING = {
+    "Gemini_Pro": {"pattern": "gemini", "exclude": "flash"},
+    "Gemini_Flash": {"pattern": "flash", "exclude": None},
+    "Claude": {"pattern": "claude", "exclude": None},
+}
+DEFAULT_MODEL_FAMILY = "Gemini_Pro"
+
 DEFAULT_SECTION_NAMES = [
     "【主病名】",
     "【紹介目的】",
@@ -0,0 +1,209 @@
+import hashlib
+import json
+import threading
+
+from database.db import DatabaseManager
+from database.hierarchy_repository import HierarchyRepository, HIERARCHY_CHANNEL
+from database.listener import get_notification_listener
+from utils.constants import DEFAULT_DEPARTMENT, DEFAULT_DOCTOR, DEPARTMENT_DOCTORS_MAPPING, DOCUMENT_TYPES, \
+    DEFAULT_DOCUMENT_TYPE, DOCUMENT_TYPE_TO_PURPOSE_MAPPING
+from utils.exceptions import DatabaseError, AppError
+
+_hierarchy_lock = threading.Lock()
+_hierarchy_cache = None
+_hierarchy_listener_started = False
+
+
+class HierarchyIndex:
+    def __init__(self, version, departments, doctors_by_department, document_types, purposes):
+        self.version = version
+        self.departments = departments
+        self.doctors_by_department = doctors_by_department
+        self.document_types = document_types
+        self.purposes = purposes
+
+        # 選択肢の存在確認と位置の取得を定数時間で行うための索引
+        self._department_positions = {name: i for i, name in enumerate(departments)}
+        self._doctor_positions = {
+            department: {name: i for i, name in enumerate(doctors)}
+            for department, doctors in doctors_by_department.items()
+        }
+        self._document_type_positions = {name: i for i, name in enumerate(document_types)}
+
+    def has_department(self, department):
+        return department in self._department_positions
+
+    def department_index(self, department):
+        return self._department_positions.get(department, 0)
+
+    def get_doctors(self, department):
+        return self.doctors_by_department.get(department, DEFAULT_DOCTOR)
+
+    def has_doctor(self, department, doctor):
+        positions = self._doctor_positions.get(department)
+        if positions is None:
+            return doctor in DEFAULT_DOCTOR
+        return doctor in positions
+
+    def doctor_index(self, department, doctor):
+        return self._doctor_positions.get(department, {}).get(doctor, 0)
+
+    def has_document_type(self, document_type):
+        return document_type in self._document_type_positions
+
+    def document_type_index(self, document_type):
+        return self._document_type_positions.get(document_type, 0)
+
+    def get_purpose(self, document_type):
+        return self.purposes.get(document_type, "")
+
+    def normalize_department(self, department):
+        return department if self.has_department(department) else "default"
+
+    def normalize_document_type(self, document_type):
+        if self.has_document_type(document_type):
+            return document_type
+        return self.document_types[0] if self.document_types else DEFAULT_DOCUMENT_TYPE
+
+
+def build_hierarchy_index(rows, version):
+    departments = []
+    doctors_by_department = {}
+    document_types = []
+    purposes = {}
+    for row in rows:
+        kind = row["kind"]
+        if kind == "department":
+            departments.append(row["name"])
+        elif kind == "doctor":
+            doctors_by_department.setdefault(row["department"], []).append(row["name"])
+        elif kind == "document_type":
+            document_types.append(row["name"])
+            if row.get("purpose"):
+                purposes[row["name"]] = row["purpose"]
+
+    return HierarchyIndex(version, departments, doctors_by_department, document_types, purposes)
+
+
+def build_hierarchy_seed():
+    doctors = [(department, doctor)
+               for department in DEFAULT_DEPARTMENT
+               for doctor in DEPARTMENT_DOCTORS_MAPPING.get(department, DEFAULT_DOCTOR)]
+    document_types = [(name, DOCUMENT_TYPE_TO_PURPOSE_MAPPING.get(name)) for name in DOCUMENT_TYPES]
+    return doctors, document_types
+
+
+def build_fallback_hierarchy():
+    # DBに接続できない間は初期データの階層で画面を表示する
+    doctors, document_types = build_hierarchy_seed()
+    rows = [{"kind": "department", "name": department} for department in DEFAULT_DEPARTMENT]
+    rows += [{"kind": "doctor", "department": department, "name": doctor} for department, doctor in doctors]
+    rows += [{"kind": "document_type", "name": name, "purpose": purpose} for name, purpose in document_types]
+    return build_hierarchy_index(rows, 0)
+
+
+def get_hierarchy_repository():
+    return HierarchyRepository(DatabaseManager.get_instance())
+
+
+def get_hierarchy():
+    global _hierarchy_cache
+    index = _hierarchy_cache
+    if index is not None:
+        return index
+
+    try:
+        with _hierarchy_lock:
+            if _hierarchy_cache is None:
+                version, rows = get_hierarchy_repository().load_all()
+                if not rows:
+                    return build_fallback_hierarchy()
+                _hierarchy_cache = build_hierarchy_index(rows, version)
+            return _hierarchy_cache
+    except Exception as e:
+        print(f"診療科・医師の読み込みに失敗しました: {str(e)}")
+        return build_fallback_hierarchy()
+
+
+def invalidate_hierarchy_cache():
+    global _hierarchy_cache
+    with _hierarchy_lock:
+        _hierarchy_cache = None
+
+
+def handle_hierarchy_notification(payload):
+    index = _hierarchy_cache
+    if index is None:
+        return
+
+    if int(payload) > index.version:
+        invalidate_hierarchy_cache()
+
+
+def check_hierarchy_version():
+    index = _hierarchy_cache
+    if index is None:
+        return
+
+    if get_hierarchy_repository().current_version() > index.version:
+        invalidate_hierarchy_cache()
+
+
+def start_hierarchy_listener():
+    global _hierarchy_listener_started
+    with _hierarchy_lock:
+        if _hierarchy_listener_started:
+            return
+        _hierarchy_listener_started = True
+
+    listener = get_notification_listener()
+    listener.subscribe(HIERARCHY_CHANNEL, handle_hierarchy_notification, version_check=check_hierarchy_version)
+    listener.start()
+
+
+def import_hierarchy(doctors=(), document_types=()):
+    try:
+        changed = get_hierarchy_repository().bulk_import(doctors, document_types)
+        if changed:
+            invalidate_hierarchy_cache()
+        return changed
+    except Exception as e:
+        raise DatabaseError(f"診療科・医師の登録に失敗しました: {str(e)}")
+
+
+def add_doctor(department, doctor):
+    try:
+        department = (department or "").strip()
+        doctor = (doctor or "").strip()
+        if not department or not doctor:
+            return False, "診療科と医師名を入力してください"
+
+        if import_hierarchy(doctors=[(department, doctor)]) == 0:
+            return False, "既に登録されています"
+        return True, "医師を登録しました"
+    except DatabaseError as e:
+        return False, str(e)
+    except Exception as e:
+        raise AppError(f"医師の登録中にエラーが発生しました: {str(e)}")
+
+
+def compute_hierarchy_seed_version(doctors, document_types):
+    payload = json.dumps([doctors, document_types], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def hierarchy_seed_version():
+    return compute_hierarchy_seed_version(*build_hierarchy_seed())
+
+
+def initialize_hierarchy():
+    # 初期データが変わったときだけ登録し、運用中に追加した診療科・医師はそのまま残す
+    doctors, document_types = build_hierarchy_seed()
+    seed_version = compute_hierarchy_seed_version(doctors, document_types)
+
+    repository = get_hierarchy_repository()
+    if repository.get_seed_version() == seed_version:
+        return
+
+    if repository.bulk_import(doctors, document_types, seed_version=seed_version):
+        invalidate_hierarchy_cache()
@@ -0,0 +1,23 @@
+from utils.constants import MODEL_MAPPING, DEFAULT_MODEL_FAMILY
+
+
+def classify_model(model_detail):
+    # MODEL_MAPPING の上から順に判定し、どれにも当てはまらない場合は既定の分類にする
+    model_detail = str(model_detail or "").lower()
+    for model_name, config in MODEL_MAPPING.items():
+        if config["pattern"] in model_detail:
+            if config["exclude"] and config["exclude"] in model_detail:
+                continue
+            return model_name
+    return DEFAULT_MODEL_FAMILY
+
+
+def model_family_sql(column):
+    # classify_model と同じ順序・条件で分類するSQL。既存の行の model_family を埋めるのに使う
+    cases = []
+    for name, config in MODEL_MAPPING.items():
+        condition = f"{column} ILIKE '%{config['pattern']}%'"
+        if config["exclude"]:
+            condition += f" AND {column} NOT ILIKE '%{config['exclude']}%'"
+        cases.append(f"WHEN {condition} THEN '{name}'")
+    return f"CASE {' '.join(cases)} ELSE '{DEFAULT_MODEL_FAMILY}' END"
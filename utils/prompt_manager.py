@@ -1,74 +1,137 @@
-import datetime
-
-from sqlalchemy import text
+import hashlib
+import json
+import threading
 
 from database.db import DatabaseManager
+from database.listener import get_notification_listener
+from database.prompt_repository import PromptRepository, PROMPT_CHANNEL, GLOBAL_DEFAULT_KEY, in_resolution_scope
 from utils.config import get_config
 from utils.constants import DEFAULT_DEPARTMENT, DOCUMENT_TYPES, DEPARTMENT_DOCTORS_MAPPING, DEFAULT_DOCUMENT_TYPE
 from utils.exceptions import DatabaseError, AppError
+from utils.hierarchy_manager import get_hierarchy, hierarchy_seed_version, initialize_hierarchy
 from database.schema import initialize_database as init_schema
 
+_prompt_cache_lock = threading.Lock()
+_prompt_cache = None
+_prompt_listener_started = False
+_database_initialization_started = False
 
-def get_prompt_collection():
-    try:
-        db_manager = DatabaseManager.get_instance()
-        return db_manager
-    except Exception as e:
-        raise DatabaseError(f"プロンプトコレクションの取得に失敗しました: {str(e)}")
 
+class PromptCacheSnapshot:
+    def __init__(self, version, prompts, default_prompt):
+        self.version = version
+        self.prompts = prompts
+        self.default_prompt = default_prompt
 
-def get_current_datetime():
-    return datetime.datetime.now()
+    def resolve(self, department, document_type, doctor):
+        # 医師 → 診療科 → 全科共通 → デフォルトプロンプトの順に解決する
+        prompts = self.prompts
+        return (prompts.get((department, document_type, doctor))
+                or prompts.get((department, document_type, "default"))
+                or prompts.get(("default", document_type, "default"))
+                or self.default_prompt)
 
+    def with_scope(self, department, document_type, doctor, rows, version):
+        # 変更されたキーと、そのキーを継承している行の解決結果を差し替える
+        prompts = {key: row for key, row in self.prompts.items()
+                   if not in_resolution_scope(key, department, document_type, doctor)}
+        for row in rows:
+            prompts[(row["department"], row["document_type"], row["doctor"])] = row
 
-def update_document(collection, query_dict, update_data):
-    try:
-        now = get_current_datetime()
-        update_data.update({"updated_at": now})
-
-        if "department" in query_dict:
-            query = """
-                    UPDATE prompts
-                    SET name       = :name,
-                        content    = :content,
-                        updated_at = :updated_at
-                    WHERE department = :department
-                    """
-            params = {
-                "name": update_data.get("name"),
-                "content": update_data.get("content"),
-                "updated_at": update_data["updated_at"],
-                "department": query_dict["department"]
-            }
-        elif "name" in query_dict:
-            set_clauses = []
-            params = {"name": query_dict["name"], "updated_at": update_data["updated_at"]}
-
-            if "default_model" in update_data:
-                set_clauses.append("default_model = :default_model")
-                params["default_model"] = update_data["default_model"]
-
-            if "order_index" in update_data:
-                set_clauses.append("order_index = :order_index")
-                params["order_index"] = update_data["order_index"]
-
-            query = f"""
-            UPDATE departments
-            SET {', '.join(set_clauses)}, updated_at = :updated_at
-            WHERE name = :name
-            """
-        else:
-            raise ValueError("不明な更新条件です")
-
-        collection.execute_query(query, params, fetch=False)
-        return True
+        default_prompt = prompts.get(GLOBAL_DEFAULT_KEY)
+        if default_prompt is not None and not default_prompt.get("is_default"):
+            default_prompt = None
+        return PromptCacheSnapshot(max(self.version, version), prompts, default_prompt)
+
+
+def build_prompt_snapshot(rows, version):
+    prompts = {}
+    default_prompt = None
+    for row in rows:
+        key = (row["department"], row["document_type"], row["doctor"])
+        prompts[key] = row
+        if key == GLOBAL_DEFAULT_KEY and row.get("is_default"):
+            default_prompt = row
+    return PromptCacheSnapshot(version, prompts, default_prompt)
+
+
+def get_prompt_repository():
+    return PromptRepository(get_prompt_collection())
+
+
+def get_prompt_snapshot():
+    global _prompt_cache
+    snapshot = _prompt_cache
+    if snapshot is not None:
+        return snapshot
+
+    with _prompt_cache_lock:
+        if _prompt_cache is None:
+            version, rows = get_prompt_repository().load_all()
+            _prompt_cache = build_prompt_snapshot(rows, version)
+        return _prompt_cache
+
+
+def invalidate_prompt_cache():
+    global _prompt_cache
+    with _prompt_cache_lock:
+        _prompt_cache = None
 
+
+def refresh_prompt_scope(department, document_type, doctor, version):
+    global _prompt_cache
+    rows = get_prompt_repository().load_scope(department, document_type, doctor)
+
+    with _prompt_cache_lock:
+        if _prompt_cache is not None:
+            _prompt_cache = _prompt_cache.with_scope(department, document_type, doctor, rows, version)
+
+
+def handle_prompt_notification(payload):
+    change = json.loads(payload)
+    if _prompt_cache is None:
+        return
+
+    key = (change.get("department"), change.get("document_type"), change.get("doctor"))
+    if key[0] is None or key == GLOBAL_DEFAULT_KEY:
+        invalidate_prompt_cache()
+        return
+
+    # 採番とコミットの間に読み込まれたスナップショットもあるため、範囲の再取得はバージョンに関わらず行う
+    refresh_prompt_scope(*key, change["version"])
+
+
+def check_prompt_version():
+    snapshot = _prompt_cache
+    if snapshot is None:
+        return
+
+    if get_prompt_repository().current_version() > snapshot.version:
+        invalidate_prompt_cache()
+
+
+def start_prompt_cache_listener():
+    global _prompt_listener_started
+    with _prompt_cache_lock:
+        if _prompt_listener_started:
+            return
+        _prompt_listener_started = True
+
+    listener = get_notification_listener()
+    listener.subscribe(PROMPT_CHANNEL, handle_prompt_notification, version_check=check_prompt_version)
+    listener.start()
+
+
+def get_prompt_collection():
+    try:
+        db_manager = DatabaseManager.get_instance()
+        return db_manager
     except Exception as e:
-        raise DatabaseError(f"ドキュメントの更新に失敗しました: {str(e)}")
+        raise DatabaseError(f"プロンプトコレクションの取得に失敗しました: {str(e)}")
 
 
 def get_all_departments():
-    return DEFAULT_DEPARTMENT
+    return get_hierarchy().departments
 
 
 def get_all_prompts():
@@ -88,42 +151,12 @@ def create_or_update_prompt(department,
         if not department or not document_type or not doctor or not content:
             return False, "すべての項目を入力してください"
 
-        prompt_collection = get_prompt_collection()
+        inserted = get_prompt_repository().upsert(department, document_type, doctor, content, selected_model)
+        invalidate_prompt_cache()
 
-        query = "SELECT * FROM prompts WHERE department = :department AND document_type = :document_type AND doctor = :doctor"
-        existing = prompt_collection.execute_query(query, {
-            "department": department,
-            "document_type": document_type,
-            "doctor": doctor
-        })
-
-        if existing:
-            update_query = """
-                           UPDATE prompts
-                           SET content       = :content,
-                               selected_model = :selected_model,
-                               updated_at = CURRENT_TIMESTAMP
-                           WHERE department = :department AND document_type = :document_type AND doctor = :doctor
-                           """
-
-            prompt_collection.execute_query(update_query, {
-                "department": department,
-                "document_type": document_type,
-                "doctor": doctor,
-                "content": content,
-                "selected_model": selected_model
-            }, fetch=False)
-            return True, "プロンプトを更新しました"
-        else:
-            insert_document(prompt_collection, {
-                "department": department,
-                "document_type": document_type,
-                "doctor": doctor,
-                "content": content,
-                "selected_model": selected_model,
-                "is_default": False
-            })
+        if inserted:
             return True, "プロンプトを新規作成しました"
+        return True, "プロンプトを更新しました"
     except DatabaseError as e:
         return False, str(e)
     except Exception as e:
@@ -135,29 +168,12 @@ def delete_prompt(department, document_type, doctor):
         if department == "default" and document_type == DEFAULT_DOCUMENT_TYPE and doctor == "default":
             return False, "デフォルトプロンプトは削除できません"
 
-        prompt_collection = get_prompt_collection()
+        deleted_count = get_prompt_repository().delete(department, document_type, doctor)
+        if deleted_count == 0:
+            return False, "プロンプトが見つかりません"
 
-        session = prompt_collection.get_session()
-        try:
-            prompt_query = "DELETE FROM prompts WHERE department = :department AND document_type = :document_type AND doctor = :doctor"
-            result = session.execute(text(prompt_query), {
-                "department": department,
-                "document_type": document_type,
-                "doctor": doctor
-            })
-            deleted_count = result.rowcount
-
-            if deleted_count == 0:
-                session.rollback()
-                return False, "プロンプトが見つかりません"
-
-            session.commit()
-            return True, "プロンプトを削除しました"
-        except Exception as e:
-            session.rollback()
-            raise e
-        finally:
-            session.close()
+        invalidate_prompt_cache()
+        return True, "プロンプトを削除しました"
 
     except DatabaseError as e:
         return False, str(e)
@@ -165,69 +181,13 @@ def delete_prompt(department, document_type, doctor):
         raise AppError(f"プロンプトの削除中にエラーが発生しました: {str(e)}")
 
 
-def insert_document(collection, document):
-    try:
-        now = get_current_datetime()
-        document.update({
-            "created_at": now,
-            "updated_at": now
-        })
-
-        if "name" in document and "order_index" in document:
-            query = """
-                    INSERT INTO departments (name, order_index, default_model, created_at, updated_at)
-                    VALUES (:name, :order_index, :default_model, :created_at, :updated_at) RETURNING id; \
-                    """
-            params = {
-                "name": document["name"],
-                "order_index": document["order_index"],
-                "default_model": document.get("default_model"),
-                "created_at": document["created_at"],
-                "updated_at": document["updated_at"]
-            }
-        elif "department" in document:
-            query = """
-                    INSERT INTO prompts (department, document_type, doctor, content, selected_model, is_default, created_at, updated_at)
-                    VALUES (:department, :document_type, :doctor, :content, :selected_model, :is_default, :created_at, :updated_at) RETURNING id; \
-                    """
-            params = {
-                "department": document["department"],
-                "document_type": document.get("document_type"),
-                "doctor": document["doctor"],
-                "content": document["content"],
-                "selected_model": document.get("selected_model"),
-                "is_default": document.get("is_default", False),
-                "created_at": document["created_at"],
-                "updated_at": document["updated_at"]
-            }
-        else:
-            raise ValueError("不明なドキュメント形式です")
-
-        result = collection.execute_query(query, params)
-        return result[0]["id"] if result else None
-
-    except Exception as e:
-        raise DatabaseError(f"ドキュメントの挿入に失敗しました: {str(e)}")
-
-
 def initialize_default_prompt():
     try:
-        prompt_collection = get_prompt_collection()
-
-        query = f"SELECT * FROM prompts WHERE department = 'default' AND document_type = '{DEFAULT_DOCUMENT_TYPE}' AND doctor = 'default' AND is_default = true"
-        default_prompt = prompt_collection.execute_query(query)
-
-        if not default_prompt:
-            config = get_config()
-            default_prompt_content = config['PROMPTS']['summary']
+        config = get_config()
+        default_prompt_content = config['PROMPTS']['summary']
 
-            insert_document(prompt_collection, {
-                "department": "default",
-                "document_type": DEFAULT_DOCUMENT_TYPE,
-                "doctor": "default",
-                "content": default_prompt_content,
-                "is_default": True
-            })
+        if get_prompt_repository().ensure_default(default_prompt_content):
+            invalidate_prompt_cache()
     except Exception as e:
         raise DatabaseError(f"デフォルトプロンプトの初期化に失敗しました: {str(e)}")
 
@@ -236,60 +196,69 @@ def get_prompt(department="default",
                document_type=DEFAULT_DOCUMENT_TYPE,
                doctor="default"):
     try:
-        prompt_collection = get_prompt_collection()
-        query = "SELECT * FROM prompts WHERE department = :department AND document_type = :document_type AND doctor = :doctor"
-        prompt = prompt_collection.execute_query(query, {
-            "department": department,
-            "document_type": document_type,
-            "doctor": doctor
-        })
-
-        if not prompt:
-            default_query = f"SELECT * FROM prompts WHERE department = 'default' AND document_type = '{DEFAULT_DOCUMENT_TYPE}' AND doctor = 'default' AND is_default = true"
-            prompt = prompt_collection.execute_query(default_query)
-
-        return prompt[0] if prompt else None
+        return get_prompt_snapshot().resolve(department, document_type, doctor)
     except Exception as e:
         raise DatabaseError(f"プロンプトの取得に失敗しました: {str(e)}")
 
 
+def build_prompt_seed_matrix():
+    departments = []
+    doctors = []
+    for dept in DEFAULT_DEPARTMENT:
+        for doctor in DEPARTMENT_DOCTORS_MAPPING.get(dept, ["default"]):
+            departments.append(dept)
+            doctors.append(doctor)
+    return departments, doctors
+
+
+def compute_prompt_seed_version(departments, doctors, document_types, content):
+    payload = json.dumps([departments, doctors, list(document_types), content], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
 def initialize_database():
+    # スキーマと初期データが最新かを1回の問い合わせで確かめ、違う場合だけ表の作成と初期データの登録を行う
     try:
-        init_schema()
-        initialize_default_prompt()
-
-        prompt_collection = get_prompt_collection()
         config = get_config()
         default_prompt_content = config['PROMPTS']['summary']
-        departments = DEFAULT_DEPARTMENT
-        document_types = DOCUMENT_TYPES
-
-        for dept in departments:
-            doctors = DEPARTMENT_DOCTORS_MAPPING.get(dept, ["default"])
-            for doctor in doctors:
-                for doc_type in document_types:
-                    check_query = """
-                                  SELECT *
-                                  FROM prompts
-                                  WHERE department = :department
-                                    AND document_type = :document_type
-                                    AND doctor = :doctor
-                                  """
-
-                    existing = prompt_collection.execute_query(check_query, {
-                        "department": dept,
-                        "document_type": doc_type,
-                        "doctor": doctor
-                    })
-
-                    if not existing:
-                        insert_document(prompt_collection, {
-                            "department": dept,
-                            "document_type": doc_type,
-                            "doctor": doctor,
-                            "content": default_prompt_content,
-                            "is_default": False
-                        })
+        departments, doctors = build_prompt_seed_matrix()
+        seed_version = compute_prompt_seed_version(departments, doctors, DOCUMENT_TYPES, default_prompt_content)
+
+        def seed():
+            initialize_hierarchy()
+
+            repository = get_prompt_repository()
+            if repository.get_seed_version() == seed_version:
+                return
+
+            initialize_default_prompt()
+            if repository.seed_matrix(departments, doctors, DOCUMENT_TYPES, seed_version):
+                invalidate_prompt_cache()
 
+        return init_schema(seed_versions={
+            "prompt_seed_version": seed_version,
+            "hierarchy_seed_version": hierarchy_seed_version()
+        }, seed=seed)
+
+    except DatabaseError:
+        raise
     except Exception as e:
         raise DatabaseError(f"データベースの初期化に失敗しました: {str(e)}")
+
+
+def run_database_initialization():
+    try:
+        initialize_database()
+    except Exception as e:
+        print(str(e))
+
+
+def start_database_initialization():
+    # 最初の画面の表示を待たせないよう、初期化は別スレッドで行う。プロセスごとに1回だけ
+    global _database_initialization_started
+    with _prompt_cache_lock:
+        if _database_initialization_started:
+            return
+        _database_initialization_started = True
+
+    threading.Thread(target=run_database_initialization, name="database-initialization", daemon=True).start()
@@ -0,0 +1,52 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class StatisticsCache:
+    """絞り込み条件ごとに統計画面のクエリ結果を保持する
+
+    結果は期間内の更新番号が変わるまで使い回す。過去の日にも再送や日付をまたいだ登録で行が入るため、
+    過去の期間だけの結果も番号は毎回確認し、有効期限だけを長くする。
+    """
+
+    def __init__(self, max_entries, ttl_seconds, historical_ttl_seconds, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.historical_ttl_seconds = historical_ttl_seconds
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, key, historical, load_version, compute):
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= now:
+                del self._entries[key]
+                entry = None
+
+        version = load_version()
+        if entry is not None and entry[0] == version:
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                self.hits += 1
+            return entry[2]
+
+        # 計算前に読んだ番号で保存し、計算中に登録された行は次回の確認で反映する
+        value = compute()
+        expires_at = now + (self.historical_ttl_seconds if historical else self.ttl_seconds)
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = (version, expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,64 @@
+import datetime
+
+import pytz
+
+from database.usage_archive import UsageArchive
+from database.usage_partitions import UsagePartitionRepository, partition_month
+from database.usage_rollups import UsageRollupRepository
+from utils.config import USAGE_ARCHIVE_DIR, USAGE_PARTITION_MONTHS_AHEAD, USAGE_RETENTION_MONTHS
+from utils.exceptions import DatabaseError
+
+JST = pytz.timezone('Asia/Tokyo')
+
+
+def retention_cutoff(today, retention_months):
+    # 今月と直前の retention_months か月分をDBに残し、それより前の月をアーカイブする
+    month_index = today.year * 12 + today.month - 1 - retention_months
+    return datetime.date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def ensure_usage_partitions(months_ahead=USAGE_PARTITION_MONTHS_AHEAD, repository=None):
+    repository = repository or UsagePartitionRepository()
+    return repository.ensure_partitions(months_ahead)
+
+
+def archive_expired_partitions(retention_months=USAGE_RETENTION_MONTHS, today=None, repository=None, archive=None,
+                               rollup_repository=None):
+    repository = repository or UsagePartitionRepository()
+    archive = archive or UsageArchive(USAGE_ARCHIVE_DIR)
+    rollup_repository = rollup_repository or UsageRollupRepository()
+    today = today or datetime.datetime.now(JST).date()
+    cutoff = retention_cutoff(today, retention_months)
+
+    # 統計画面の集計は日次集計から読むので、行を削除する前に集計を済ませておく
+    rollup_repository.refresh()
+    # 切り離した後に遅れて登録された行だけで、アーカイブした日の集計が作り直されないようにする
+    rollup_repository.freeze(cutoff)
+
+    # 切り離してから書き出すので、書き出し中に行が増えることはない
+    # 途中で止まった場合も、切り離したまま残った区画を次回の実行で書き出して削除する
+    archived = []
+    for name, attached in repository.list_partitions():
+        if partition_month(name) >= cutoff:
+            continue
+        try:
+            if attached:
+                repository.detach(name)
+            archive.write_partition(name, repository.fetch_rows(name))
+            repository.drop(name)
+        except Exception as e:
+            raise DatabaseError(f"{name} のアーカイブに失敗しました: {str(e)}")
+        archived.append(name)
+
+    # アーカイブした月に遅れて登録された行は既定の区画に残るので、別のファイルに書き出して削除する
+    # ファイル名は最も小さい id で決め、削除の前に止まった場合は次回の実行で同じファイルに書き直す
+    ids = repository.late_row_ids(JST.localize(datetime.datetime.combine(cutoff, datetime.time.min)))
+    if ids:
+        name = f"summary_usage_default_{ids[0]}"
+        try:
+            archive.write_partition(name, repository.fetch_late_rows(ids))
+            repository.delete_late_rows(ids)
+        except Exception as e:
+            raise DatabaseError(f"{name} のアーカイブに失敗しました: {str(e)}")
+        archived.append(name)
+    return archived
@@ -1,8 +1,9 @@
 import streamlit as st
 
 from services.summary_service import process_summary
-from utils.constants import MESSAGES, TAB_NAMES, DOCUMENT_TYPES, DOCUMENT_TYPE_TO_PURPOSE_MAPPING
+from utils.constants import MESSAGES, TAB_NAMES, DEFAULT_DOCUMENT_TYPE
 from utils.error_handlers import handle_error
+from utils.hierarchy_manager import get_hierarchy
 from ui_components.navigation import render_sidebar
 
 
@@ -14,8 +15,10 @@ def clear_inputs():
     st.session_state.parsed_summary = {}
     st.session_state.summary_generation_time = None
     st.session_state.clear_input = True
-    st.session_state.selected_document_type = DOCUMENT_TYPES[0]
-    st.session_state.referral_purpose = DOCUMENT_TYPE_TO_PURPOSE_MAPPING.get(DOCUMENT_TYPES[0], "")
+    hierarchy = get_hierarchy()
+    first_document_type = hierarchy.document_types[0] if hierarchy.document_types else DEFAULT_DOCUMENT_TYPE
+    st.session_state.selected_document_type = first_document_type
+    st.session_state.referral_purpose = hierarchy.get_purpose(first_document_type)
 
     for key in list(st.session_state.keys()):
         if key.startswith("input_text"):
@@ -1,9 +1,10 @@
 import streamlit as st
 
-from utils.constants import DEPARTMENT_DOCTORS_MAPPING, DOCUMENT_TYPES, DEFAULT_DOCUMENT_TYPE
+from utils.constants import DEFAULT_DOCUMENT_TYPE
 from utils.error_handlers import handle_error
 from utils.exceptions import AppError
-from utils.prompt_manager import get_all_departments, get_prompt, create_or_update_prompt, delete_prompt
+from utils.hierarchy_manager import get_hierarchy, add_doctor
+from utils.prompt_manager import get_prompt, create_or_update_prompt, delete_prompt
 from utils.config import get_config
 from ui_components.navigation import change_page
 
@@ -27,9 +28,10 @@ def update_document_type():
 def update_department():
     st.session_state.selected_dept_for_prompt = st.session_state.prompt_department_selector
 
-    available_doctors = DEPARTMENT_DOCTORS_MAPPING.get(st.session_state.selected_dept_for_prompt, ["default"])
-    if st.session_state.selected_doctor_for_prompt not in available_doctors:
-        st.session_state.selected_doctor_for_prompt = available_doctors[0]
+    hierarchy = get_hierarchy()
+    department = st.session_state.selected_dept_for_prompt
+    if not hierarchy.has_doctor(department, st.session_state.selected_doctor_for_prompt):
+        st.session_state.selected_doctor_for_prompt = hierarchy.get_doctors(department)[0]
 
     st.session_state.update_ui = True
 
@@ -61,8 +63,9 @@ def prompt_management_ui():
     if "selected_doctor_for_prompt" not in st.session_state:
         st.session_state.selected_doctor_for_prompt = "default"
 
-    departments = ["default"] + get_all_departments()
-    document_types = DOCUMENT_TYPES
+    hierarchy = get_hierarchy()
+    departments = hierarchy.departments
+    document_types = hierarchy.document_types
     if not document_types:
         document_types = [DEFAULT_DOCUMENT_TYPE]
 
@@ -76,8 +79,7 @@ def prompt_management_ui():
         selected_doc_type = st.selectbox(
             "文書名",
             document_types,
-            index=document_types.index(
-                st.session_state.selected_doc_type_for_prompt) if st.session_state.selected_doc_type_for_prompt in document_types else 0,
+            index=hierarchy.document_type_index(st.session_state.selected_doc_type_for_prompt),
             key="prompt_document_type_selector",
             on_change=update_document_type
         )
@@ -87,27 +89,31 @@ def prompt_management_ui():
         selected_dept = st.selectbox(
             "診療科",
             departments,
-            index=departments.index(
-                st.session_state.selected_dept_for_prompt) if st.session_state.selected_dept_for_prompt in departments else 0,
+            index=hierarchy.department_index(st.session_state.selected_dept_for_prompt),
             format_func=lambda x: "全科共通" if x == "default" else x,
             key="prompt_department_selector",
             on_change=update_department
         )
 
-    available_doctors = DEPARTMENT_DOCTORS_MAPPING.get(selected_dept, ["default"])
-    if st.session_state.selected_doctor_for_prompt not in available_doctors:
+    available_doctors = hierarchy.get_doctors(selected_dept)
+    if not hierarchy.has_doctor(selected_dept, st.session_state.selected_doctor_for_prompt):
         st.session_state.selected_doctor_for_prompt = available_doctors[0]
 
     with col4:
         selected_doctor = st.selectbox(
             "医師名",
             available_doctors,
-            index=available_doctors.index(st.session_state.selected_doctor_for_prompt),
+            index=hierarchy.doctor_index(selected_dept, st.session_state.selected_doctor_for_prompt),
             format_func=lambda x: "医師共通" if x == "default" else x,
             key="prompt_doctor_selector",
             on_change=update_doctor
         )
 
+    # 選択肢が空の場合 selectbox は None を返すので、全科共通・医師共通として扱う
+    selected_dept = selected_dept or "default"
+    selected_doctor = selected_doctor or "default"
+    selected_doc_type = selected_doc_type or DEFAULT_DOCUMENT_TYPE
+
     st.session_state.selected_dept_for_prompt = selected_dept
     st.session_state.selected_doc_type_for_prompt = selected_doc_type
     st.session_state.selected_doctor_for_prompt = selected_doctor
@@ -188,3 +194,15 @@ def prompt_management_ui():
                 st.rerun()
             else:
                 raise AppError(message)
+
+    with st.expander("診療科・医師の追加"):
+        with st.form(key="add_doctor_form"):
+            new_department = st.text_input("診療科")
+            new_doctor = st.text_input("医師名")
+            if st.form_submit_button("追加"):
+                success, message = add_doctor(new_department, new_doctor)
+                if success:
+                    st.session_state.success_message = message
+                    st.rerun()
+                else:
+                    raise AppError(message)
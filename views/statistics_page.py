@@ -1,23 +1,191 @@
 import datetime
-import pytz
+import os
+import tempfile
 
 import pandas as pd
 import streamlit as st
 
 from database.db import DatabaseManager
-from utils.constants import DOCUMENT_TYPE_OPTIONS, MESSAGES
+from database.usage_writer import get_usage_writer
+from services.capacity_service import format_capacity_summary, format_wait_times, load_capacity_report
+from services.statistics_service import (
+    EXPORT_FORMATS, TIMESERIES_BUCKETS, StatisticsFilter, concat_records, export_usage_records, fetch_records_page,
+    format_usage_metrics, format_usage_records, format_usage_summary, load_usage_metrics, load_usage_summary,
+    load_usage_timeseries, pivot_usage_timeseries
+)
+from utils.constants import MESSAGES
 from utils.error_handlers import handle_error
+from utils.hierarchy_manager import get_hierarchy
 from ui_components.navigation import change_page
 
-JST = pytz.timezone('Asia/Tokyo')
 
-MODEL_MAPPING = {
-    "Gemini_Pro": {"pattern": "gemini", "exclude": "flash"},
-    "Gemini_Flash": {"pattern": "flash", "exclude": None},
-    "Claude": {"pattern": "claude", "exclude": None},
+def reset_usage_records(filters):
+    st.session_state.usage_records_key = filters.key
+    st.session_state.usage_record_pages = []
+    st.session_state.usage_records_cursor = None
+    st.session_state.usage_records_has_more = True
+
+
+def load_more_usage_records(filters, db_manager):
+    records, cursor = fetch_records_page(filters, st.session_state.usage_records_cursor, db_manager=db_manager)
+    st.session_state.usage_record_pages.append(records)
+    st.session_state.usage_records_cursor = cursor
+    st.session_state.usage_records_has_more = cursor is not None
+
+
+def render_usage_metrics(filters, metrics, db_manager):
+    st.subheader("処理時間と失敗率")
+    if metrics.empty:
+        return
+    st.dataframe(format_usage_metrics(metrics), hide_index=True)
+
+    bucket_label = st.radio("集計単位", list(TIMESERIES_BUCKETS), index=1, horizontal=True,
+                            key="usage_timeseries_bucket")
+    timeseries = load_usage_timeseries(filters, TIMESERIES_BUCKETS[bucket_label], db_manager)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.caption("処理時間の中央値(秒)")
+        st.line_chart(pivot_usage_timeseries(timeseries, "p50"))
+    with col2:
+        st.caption("作成件数")
+        st.line_chart(pivot_usage_timeseries(timeseries, "count"))
+
+
+def render_capacity(filters, db_manager):
+    st.subheader("同時実行数と待ち時間")
+    capacity, hourly_peaks, hour_of_week, wait_times = load_capacity_report(filters, db_manager)
+    if hourly_peaks.empty:
+        return
+    st.dataframe(format_capacity_summary(capacity), hide_index=True)
+
+    st.caption("1時間ごとの最大同時実行数")
+    st.line_chart(hourly_peaks.rename("最大同時実行数"))
+    st.caption("曜日・時間帯ごとの最大同時実行数")
+    st.dataframe(hour_of_week)
+
+    if not wait_times.empty:
+        st.caption("モデル呼び出しまでの待ち時間とモデルの処理時間")
+        st.dataframe(format_wait_times(wait_times), hide_index=True)
+
+
+POOL_METRIC_LABELS = {
+    "pool_size": "プールの大きさ",
+    "checked_out": "使用中",
+    "overflow": "オーバーフロー使用中",
+    "checkouts": "チェックアウト数",
+    "timeouts": "空き待ちの時間切れ",
+    "wait_ms_avg": "平均待ち時間(ms)",
+    "wait_ms_max": "最大待ち時間(ms)",
+    "slow_checkouts": "待ち時間の長いチェックアウト",
+    "peak_checked_out": "最大使用数",
+    "overflow_checkouts": "オーバーフローでのチェックアウト",
+    "peak_overflow": "最大オーバーフロー",
+    "invalidations": "無効化された接続",
+    "pings": "生存確認",
+    "ping_failures": "生存確認の失敗",
+    "ping_ms_avg": "生存確認の平均時間(ms)",
+    "pings_skipped": "省略した生存確認",
+}
+
+
+def render_pool_metrics():
+    with st.expander("接続プールの状態"):
+        metrics = DatabaseManager.pool_metrics()
+        if not metrics:
+            return
+        rows = {name: {**{POOL_METRIC_LABELS[key]: snapshot[key] for key in POOL_METRIC_LABELS},
+                       **{f"待ち時間 {label}": count for label, count in snapshot["wait_buckets"].items()}}
+                for name, snapshot in metrics.items()}
+        table = pd.DataFrame(rows).rename(columns={"primary": "主DB", "replica": "レプリカ"})
+        st.dataframe(table.round(1))
+
+
+USAGE_WRITER_METRIC_LABELS = {
+    "queue_depth": "キューの行数",
+    "max_queue_depth": "キューの最大行数",
+    "enqueued": "受け付けた行",
+    "written": "書き込んだ行",
+    "batches": "書き込み回数",
+    "last_flush_ms": "最後の書き込み時間(ms)",
+    "overflowed": "キューが満杯で退避した行",
+    "failed": "書き込みに失敗した行",
+    "spooled": "退避した行",
+    "replayed": "再送した行",
+    "lost": "失われた行",
 }
 
 
+def render_usage_writer_metrics():
+    with st.expander("使用状況の書き込みの状態"):
+        metrics = get_usage_writer().metrics()
+        row = {label: metrics[key] for key, label in USAGE_WRITER_METRIC_LABELS.items()}
+        st.dataframe(pd.DataFrame([row]).round(1), hide_index=True)
+        if metrics["last_error"]:
+            st.caption(f"最後のエラー: {metrics['last_error']}")
+
+
+SLOW_QUERY_COLUMNS = {
+    "database": "接続先",
+    "statement": "SQL",
+    "calls": "実行回数",
+    "slow_calls": "遅かった回数",
+    "total_ms": "合計時間(ms)",
+    "mean_ms": "平均(ms)",
+    "p50_ms": "p50(ms)",
+    "p95_ms": "p95(ms)",
+    "max_ms": "最大(ms)",
+}
+
+
+def render_slow_queries():
+    with st.expander("時間のかかっているクエリ"):
+        slow_queries = DatabaseManager.slow_queries()
+        if not slow_queries:
+            return
+        table = pd.DataFrame(slow_queries, columns=pd.Index(list(SLOW_QUERY_COLUMNS)))
+        table = table.rename(columns=SLOW_QUERY_COLUMNS)
+        table["接続先"] = table["接続先"].replace({"primary": "主DB", "replica": "レプリカ"})
+        st.dataframe(table.round(1), hide_index=True)
+        st.caption("p50・p95 は実行時間の区切りからの概算です")
+        explained = [row for row in slow_queries if row["plan"]]
+        if explained:
+            index = st.selectbox("実行計画", range(len(explained)),
+                                 format_func=lambda i: explained[i]["statement"][:120])
+            st.caption(f"取得時の実行時間: {explained[index]['plan_ms']:.0f}ms")
+            st.code(explained[index]["plan"], language=None)
+
+
+def render_usage_export(filters, db_manager):
+    col1, col2 = st.columns(2)
+    with col1:
+        export_format = st.radio("出力形式", list(EXPORT_FORMATS), horizontal=True, key="usage_export_format")
+    with col2:
+        prepare = st.button("全件を出力", key="prepare_usage_export")
+
+    if not prepare:
+        return
+
+    # 一時ファイルに書き出してから渡し、全件をメモリ上の文字列にしない
+    extension = EXPORT_FORMATS[export_format]["extension"]
+    with tempfile.NamedTemporaryFile(suffix=f".{extension}", delete=False) as f:
+        path = f.name
+    try:
+        with st.spinner("出力しています..."):
+            export_usage_records(filters, export_format, path, db_manager)
+        with open(path, "rb") as data:
+            st.download_button(
+                "ダウンロード",
+                data=data,
+                file_name=f"summary_usage_{filters.start_date:%Y%m%d}_{filters.end_date:%Y%m%d}.{extension}",
+                mime=EXPORT_FORMATS[export_format]["mime"],
+                on_click="ignore",
+                key="download_usage_export",
+            )
+    finally:
+        os.remove(path)
+
+
 @handle_error
 def usage_statistics_ui():
     if st.button("作成画面に戻る", key="back_to_main_from_stats"):
@@ -42,134 +210,50 @@ def usage_statistics_ui():
         end_date = st.date_input("終了日", today)
 
     with col4:
-        selected_document_type = st.selectbox("文書名", DOCUMENT_TYPE_OPTIONS, index=0)
-
-    start_datetime = datetime.datetime.combine(start_date, datetime.time.min)
-    end_datetime = datetime.datetime.combine(end_date, datetime.time.max)
-
-    query_conditions = []
-    query_params = {
-        "start_date": start_datetime,
-        "end_date": end_datetime
-    }
-
-    query_conditions.append("date >= :start_date AND date <= :end_date")
-
-    if selected_model != "すべて":
-        model_config = MODEL_MAPPING.get(selected_model)
-        if model_config:
-            query_conditions.append("model_detail ILIKE :model_pattern")
-            query_params["model_pattern"] = f"%{model_config['pattern']}%"
-
-            if model_config["exclude"]:
-                query_conditions.append("model_detail NOT ILIKE :model_exclude")
-                query_params["model_exclude"] = f"%{model_config['exclude']}%"
-
-    if selected_document_type != "すべて":
-        if selected_document_type == "不明":
-            query_conditions.append("document_types IS NULL")
-        else:
-            query_conditions.append("document_types = :doc_type")
-            query_params["doc_type"] = selected_document_type
-
-    where_clause = " AND ".join(query_conditions)
-
-    total_query = f"""
-    SELECT
-        COUNT(*) as count,
-        SUM(input_tokens) as total_input_tokens,
-        SUM(output_tokens) as total_output_tokens,
-        SUM(total_tokens) as total_tokens
-    FROM summary_usage
-    WHERE {where_clause}
-    """
-
-    total_summary = db_manager.execute_query(total_query, query_params)
-
-    if not total_summary or total_summary[0]["count"] == 0:
+        document_type_options = ["すべて"] + get_hierarchy().document_types
+        selected_document_type = st.selectbox("文書名", document_type_options, index=0)
+
+    filters = StatisticsFilter(start_date, end_date, selected_model, selected_document_type)
+
+    # 集計・明細・処理時間の読み取りだけを1つの接続・1つのトランザクションにまとめ、
+    # 文ごとのチェックアウトとコミットを省く。表やグラフの描画と全件の出力の間は接続を持たない
+    with db_manager.unit_of_work(analytic=True) as uow:
+        total, dept_summary = load_usage_summary(filters, uow)
+        if st.session_state.get("usage_records_key") != filters.key:
+            reset_usage_records(filters)
+            load_more_usage_records(filters, uow)
+        metrics = load_usage_metrics(filters, uow)
+
+    render_usage_statistics(filters, db_manager, total, dept_summary, metrics)
+
+    render_pool_metrics()
+    render_usage_writer_metrics()
+    render_slow_queries()
+
+
+def render_usage_statistics(filters, db_manager, total, dept_summary, metrics):
+    records = concat_records(st.session_state.usage_record_pages)
+
+    if not total["count"] and records.empty:
         st.info(MESSAGES["NO_DATA_FOUND"])
         return
 
-    dept_query = f"""
-    SELECT
-        COALESCE(department, 'default') as department,
-        COALESCE(doctor, 'default') as doctor,
-        document_types,
-        COUNT(*) as count,
-        SUM(input_tokens) as input_tokens,
-        SUM(output_tokens) as output_tokens,
-        SUM(total_tokens) as total_tokens,
-        SUM(processing_time) as processing_time
-    FROM summary_usage
-    WHERE {where_clause}
-    GROUP BY department, doctor, document_types
-    ORDER BY count DESC
-    """
-
-    dept_summary = db_manager.execute_query(dept_query, query_params)
-
-    records_query = f"""
-    SELECT
-        date,
-        document_types,
-        model_detail,
-        department,
-        doctor,
-        input_tokens,
-        output_tokens,
-        processing_time
-    FROM summary_usage
-    WHERE {where_clause}
-    ORDER BY date DESC
-    """
-
-    records = db_manager.execute_query(records_query, query_params)
-
-    data = []
-    for stat in dept_summary:
-        dept_name = "全科共通" if stat["department"] == "default" else stat["department"]
-        doctor_name = "医師共通" if stat["doctor"] == "default" else stat["doctor"]
-        document_types = stat["document_types"] or "不明"
-        data.append({
-            "文書名": document_types,
-            "診療科": dept_name,
-            "医師名": doctor_name,
-            "作成件数": stat["count"],
-            "入力トークン": stat["input_tokens"],
-            "出力トークン": stat["output_tokens"],
-            "合計トークン": stat["total_tokens"],
-        })
-
-    df = pd.DataFrame(data)
-    st.dataframe(df, hide_index=True)
-
-    detail_data = []
-    for record in records:
-        model_detail = str(record.get("model_detail", "")).lower()
-        model_info = "Gemini_Pro"
-
-        for model_name, config in MODEL_MAPPING.items():
-            pattern = config["pattern"]
-            exclude = config["exclude"]
-
-            if pattern in model_detail:
-                if exclude and exclude in model_detail:
-                    continue
-                model_info = model_name
-                break
-
-        jst_date = record["date"].astimezone(JST) if record["date"].tzinfo else JST.localize(record["date"])
-
-        detail_data.append({
-            "作成日": jst_date.strftime("%Y/%m/%d"),
-            "文書名": record.get("document_types") or "不明",
-            "診療科": "全科共通" if record.get("department") == "default" else record.get("department"),
-            "医師名": "医師共通" if record.get("doctor") == "default" else record.get("doctor"),
-            "AIモデル": model_info,
-            "入力トークン": record["input_tokens"],
-            "出力トークン": record["output_tokens"],
-            "処理時間(秒)": round(record["processing_time"]),
-        })
-
-    detail_df = pd.DataFrame(detail_data)
-    st.dataframe(detail_df, hide_index=True)
+    if total["count"]:
+        st.caption(f"合計 {total['count']} 件 / 入力トークン {total['input_tokens']} / "
+                   f"出力トークン {total['output_tokens']} / 合計トークン {total['total_tokens']}")
+
+    st.dataframe(format_usage_summary(dept_summary), hide_index=True)
+    st.dataframe(format_usage_records(records), hide_index=True, column_config={
+        "作成日": st.column_config.DateColumn(format="YYYY/MM/DD"),
+    })
+
+    if st.session_state.usage_records_has_more:
+        st.button("さらに表示", key="load_more_usage_records",
+                  on_click=load_more_usage_records, args=(filters, db_manager))
+
+    render_usage_metrics(filters, metrics, db_manager)
+
+    render_capacity(filters, db_manager)
+
+    # 出力はサーバー側カーソルで読む間だけ接続を使う
+    render_usage_export(filters, db_manager)